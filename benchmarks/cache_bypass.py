@@ -0,0 +1,198 @@
+"""
+Measures hashing and copying in each I/O mode, and how much of the files
+are left in the page cache afterwards, as checked with mincore
+    python -m benchmarks.cache_bypass --size-mib 256 --directory /mnt/backup
+"""
+import argparse
+import ctypes
+import ctypes.util
+import mmap
+import os
+import os.path as os_path
+import shutil
+import sys
+import tempfile
+import time
+
+from logical_backup import utility
+
+__libc = {}
+
+
+def page_cache_residency(path: str) -> float:
+    """
+    Checks how much of a file is held in the page cache
+
+    Parameters
+    ----------
+    path : str
+        The file
+
+    Returns
+    -------
+    float
+        Fraction of the file's pages that are resident
+    """
+    size = os_path.getsize(path)
+    if not size:
+        return 0.0
+
+    if "mincore" not in __libc:
+        __libc["mincore"] = ctypes.CDLL(
+            ctypes.util.find_library("c"), use_errno=True
+        ).mincore
+        __libc["mincore"].argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_size_t,
+            ctypes.POINTER(ctypes.c_ubyte),
+        ]
+
+    pages = -(-size // mmap.PAGESIZE)
+    resident = (ctypes.c_ubyte * pages)()
+    with open(path, "rb") as measured_file:
+        # A private mapping is writable, so ctypes can take its address,
+        # and shares the cached pages until written to, which it never is
+        mapping = mmap.mmap(measured_file.fileno(), size, access=mmap.ACCESS_COPY)
+        try:
+            # Not kept, since the mapping cannot close while exported
+            address = ctypes.addressof(ctypes.c_char.from_buffer(mapping))
+            if __libc["mincore"](address, size, resident):
+                raise OSError(ctypes.get_errno(), "mincore failed")
+        finally:
+            mapping.close()
+
+    return sum(page & 1 for page in resident) / pages
+
+
+def evict(path: str) -> None:
+    """
+    Drops a file from the page cache, so it is next read from the device
+    """
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+        os.posix_fadvise(descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(descriptor)
+
+
+def measure_mode(mode: str, source: str, destination: str) -> dict:
+    """
+    Hashes then copies a file in an I/O mode, starting with neither cached
+
+    Parameters
+    ----------
+    mode : str
+        One of utility.IO_MODES
+    source : str
+        File to hash and copy
+    destination : str
+        Where to copy it to
+
+    Returns
+    -------
+    dict
+        MiB per second hashing and copying,
+        and fraction of the source and copy left cached
+    """
+    size_mib = os_path.getsize(source) / (1 << 20)
+    previous_mode = utility.get_io_mode()
+    utility.set_io_mode(mode)
+    try:
+        evict(source)
+        start = time.perf_counter()
+        utility.checksum_file(source)
+        hash_seconds = time.perf_counter() - start
+
+        evict(source)
+        start = time.perf_counter()
+        utility.copy_and_checksum(source, destination)
+        # Cached writes only count once they reach the device
+        descriptor = os.open(destination, os.O_RDONLY)
+        os.fsync(descriptor)
+        os.close(descriptor)
+        copy_seconds = time.perf_counter() - start
+    finally:
+        utility.set_io_mode(previous_mode)
+
+    return {
+        "hash_mib_per_second": size_mib / hash_seconds,
+        "copy_mib_per_second": size_mib / copy_seconds,
+        "source_cached": page_cache_residency(source),
+        "copy_cached": page_cache_residency(destination),
+    }
+
+
+def measure_modes(size_mib: int, directory: str = None) -> dict:
+    """
+    Measures every I/O mode on a file of random data
+
+    Parameters
+    ----------
+    size_mib : int
+        Size of the file
+    directory : str
+        Where to write the files, on the device to measure
+
+    Returns
+    -------
+    dict
+        Results of measure_mode, keyed by mode
+    """
+    workspace = tempfile.mkdtemp(dir=directory)
+    try:
+        source = os_path.join(workspace, "source")
+        with open(source, "wb") as source_file:
+            for _ in range(size_mib):
+                source_file.write(os.urandom(1 << 20))
+
+        return {
+            mode: measure_mode(mode, source, os_path.join(workspace, mode))
+            for mode in utility.IO_MODES
+        }
+    finally:
+        shutil.rmtree(workspace)
+
+
+def main(command_line_arguments: list = None) -> int:
+    """
+    Prints throughput and cache residency for each mode
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Injectable arguments
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    parser = argparse.ArgumentParser(description="Measure cache-bypassing I/O")
+    parser.add_argument("--size-mib", type=int, default=256, help="File size")
+    parser.add_argument("--directory", help="Where to write files", required=False)
+    arguments = parser.parse_args(
+        command_line_arguments if command_line_arguments is not None else sys.argv[1:]
+    )
+
+    results = measure_modes(arguments.size_mib, arguments.directory)
+    print(
+        "{0:<10}{1:>12}{2:>12}{3:>16}{4:>14}".format(
+            "mode", "hash MiB/s", "copy MiB/s", "source cached", "copy cached"
+        )
+    )
+    for mode, result in results.items():
+        print(
+            "{0:<10}{1:>12.1f}{2:>12.1f}{3:>16.0%}{4:>14.0%}".format(
+                mode,
+                result["hash_mib_per_second"],
+                result["copy_mib_per_second"],
+                result["source_cached"],
+                result["copy_cached"],
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Compares how long a CLI command takes, with and without the daemon running
+Uses the test catalog, so the real one is left alone
+    python -m benchmarks.daemon_latency --runs 20
+"""
+import argparse
+import os
+import os.path as os_path
+import signal
+import subprocess
+import sys
+import time
+
+from logical_backup import client
+
+ENTRY_SCRIPT = os_path.join(
+    os_path.dirname(os_path.dirname(os_path.abspath(__file__))),
+    "logical_backup_script.py",
+)
+COMMAND = ["list-devices"]
+
+
+def time_command(runs: int, environment: dict) -> float:
+    """
+    Runs the command through the CLI, as a script would
+
+    Parameters
+    ----------
+    runs : int
+        Times to run it
+    environment : dict
+        Environment to run it in
+
+    Returns
+    -------
+    float
+        Mean seconds per run
+    """
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run(
+            [sys.executable, ENTRY_SCRIPT] + COMMAND,
+            env=environment,
+            stdout=subprocess.DEVNULL,
+            check=False,
+        )
+
+    return (time.perf_counter() - start) / runs
+
+
+def measure_latency(runs: int) -> tuple:
+    """
+    Times the command, then starts a daemon and times it again
+
+    Parameters
+    ----------
+    runs : int
+        Times to run the command each way
+
+    Returns
+    -------
+    tuple
+        Mean seconds per command without, then with the daemon
+    """
+    environment = dict(os.environ, IS_TEST="1")
+    standalone_seconds = time_command(runs, environment)
+
+    daemon = subprocess.Popen(
+        [sys.executable, ENTRY_SCRIPT, "serve"],
+        env=environment,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while not os_path.exists(client.TEST_SOCKET_FILE):
+            if time.monotonic() > deadline or daemon.poll() is not None:
+                raise RuntimeError("Daemon did not start")
+            time.sleep(0.01)
+
+        daemon_seconds = time_command(runs, environment)
+    finally:
+        daemon.send_signal(signal.SIGINT)
+        daemon.wait()
+
+    return standalone_seconds, daemon_seconds
+
+
+def main(command_line_arguments: list = None) -> int:
+    """
+    Prints the time per command each way
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Injectable arguments
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    parser = argparse.ArgumentParser(description="Measure daemon command latency")
+    parser.add_argument("--runs", type=int, default=20, help="Commands to time")
+    arguments = parser.parse_args(
+        command_line_arguments if command_line_arguments is not None else sys.argv[1:]
+    )
+
+    standalone_seconds, daemon_seconds = measure_latency(arguments.runs)
+    print("{0:<12}{1:>10}".format("mode", "ms/command"))
+    print("{0:<12}{1:>10.1f}".format("standalone", standalone_seconds * 1000))
+    print("{0:<12}{1:>10.1f}".format("daemon", daemon_seconds * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Runs benchmarks in isolated processes, and compares them against a baseline
+"""
+from collections import namedtuple
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+BenchmarkResult = namedtuple(
+    "benchmark_result", "name seconds files bytes peak_rss_kib"
+)
+
+# Metrics compared against the baseline, and whether higher is better
+COMPARED_METRICS = {
+    "files_per_second": True,
+    "mb_per_second": True,
+    "peak_rss_mib": False,
+}
+
+
+def result_metrics(result: BenchmarkResult) -> dict:
+    """
+    Derives rate metrics for a result
+
+    Parameters
+    ----------
+    result : BenchmarkResult
+        The result to derive metrics for
+
+    Returns
+    -------
+    dict
+        Metrics, keyed by name
+    """
+    seconds = max(result.seconds, 1e-9)
+    return {
+        "seconds": round(result.seconds, 4),
+        "files": result.files,
+        "bytes": result.bytes,
+        "files_per_second": round(result.files / seconds, 2),
+        "mb_per_second": round(result.bytes / seconds / 1024 / 1024, 2),
+        "peak_rss_mib": round(result.peak_rss_kib / 1024, 2),
+    }
+
+
+def __run_child(connection, setup, run, context: dict) -> None:
+    """
+    Entry point for the benchmark process
+    Setup is excluded from the timing, output of the library is discarded
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if setup:
+            setup(context)
+
+        start = time.perf_counter()
+        files, byte_count = run(context)
+        seconds = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connection.send((seconds, files, byte_count, peak_rss))
+    connection.close()
+
+
+def run_isolated(name: str, setup, run, context: dict) -> BenchmarkResult:
+    """
+    Runs a benchmark in a fresh interpreter, so peak memory
+    is attributable to that benchmark alone
+
+    Parameters
+    ----------
+    name : str
+        Name of the benchmark
+    setup : callable
+        Optional, untimed preparation, taking the context
+    run : callable
+        The timed operation, taking the context
+        and returning a tuple of files and bytes processed
+    context : dict
+        Shared details of the benchmark environment
+
+    Returns
+    -------
+    BenchmarkResult
+        Measurements for the run
+    """
+    spawn = multiprocessing.get_context("spawn")
+    receiver, sender = spawn.Pipe(duplex=False)
+    process = spawn.Process(target=__run_child, args=(sender, setup, run, context))
+    process.start()
+    sender.close()
+
+    try:
+        seconds, files, byte_count, peak_rss = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(
+            "Benchmark {0} failed with exit code {1}".format(name, process.exitcode)
+        )
+
+    process.join()
+    return BenchmarkResult(name, seconds, files, byte_count, peak_rss)
+
+
+def load_baseline(path: str) -> dict:
+    """
+    Loads a saved baseline
+
+    Parameters
+    ----------
+    path : str
+        Path to the baseline file
+
+    Returns
+    -------
+    dict
+        With "config" and "results" keys, or None if there is no baseline
+    """
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path: str, config: dict, results: list) -> None:
+    """
+    Saves results as the new baseline
+
+    Parameters
+    ----------
+    path : str
+        Path to the baseline file
+    config : dict
+        Configuration the results were generated with
+    results : list
+        BenchmarkResult list
+    """
+    with open(path, "w") as baseline_file:
+        json.dump(
+            {
+                "config": config,
+                "results": {result.name: result_metrics(result) for result in results},
+            },
+            baseline_file,
+            indent=2,
+            sort_keys=True,
+        )
+        baseline_file.write("\n")
+
+
+def compare_to_baseline(results: list, baseline: dict, tolerance: float) -> list:
+    """
+    Finds metrics which regressed beyond the tolerance
+
+    Parameters
+    ----------
+    results : list
+        BenchmarkResult list
+    baseline : dict
+        Loaded baseline
+    tolerance : float
+        Allowed relative change, e.g. 0.1 for 10%
+
+    Returns
+    -------
+    list
+        Messages describing each regression
+    """
+    regressions = []
+    for result in results:
+        expected = baseline["results"].get(result.name)
+        if not expected:
+            continue
+
+        actual = result_metrics(result)
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if not expected.get(metric):
+                continue
+
+            change = (actual[metric] - expected[metric]) / expected[metric]
+            if (higher_is_better and change < -tolerance) or (
+                not higher_is_better and change > tolerance
+            ):
+                regressions.append(
+                    "{0}: {1} went from {2} to {3} ({4:+.1%})".format(
+                        result.name, metric, expected[metric], actual[metric], change
+                    )
+                )
+
+    return regressions
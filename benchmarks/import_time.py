@@ -0,0 +1,106 @@
+"""
+Checks CLI startup stays fast, using the interpreter's import timing
+
+The import graph is what "verify --file" pays for on every invocation
+    python -m benchmarks.import_time --budget-ms 80
+"""
+import argparse
+import subprocess
+import sys
+
+ENTRY_MODULE = "logical_backup.main"
+# Modules only some commands, or only tests, should ever load
+DEFERRED_MODULES = [
+    "pytest",
+    "psutil",
+    "texttable",
+    "cProfile",
+    "tracemalloc",
+    "numpy",
+    "ctypes",
+    "asyncio",
+]
+
+
+def measure_imports(module: str = ENTRY_MODULE) -> dict:
+    """
+    Imports a module in a fresh interpreter, recording every import
+
+    Parameters
+    ----------
+    module : str
+        The module to import
+
+    Returns
+    -------
+    dict
+        Cumulative microseconds, keyed by every module imported
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+
+    imports = {}
+    for line in process.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # The header line has column names rather than numbers
+        if cumulative.strip().isdigit():
+            imports[name.strip()] = int(cumulative)
+
+    return imports
+
+
+def main(command_line_arguments: list = None) -> int:
+    """
+    Runs the check
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Injectable arguments
+
+    Returns
+    -------
+    int
+        Exit code, non-zero if over budget or a deferred module was imported
+    """
+    parser = argparse.ArgumentParser(description="Check CLI import time")
+    parser.add_argument(
+        "--budget-ms",
+        dest="budget_ms",
+        type=float,
+        default=100,
+        help="Maximum milliseconds to import the CLI",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Runs to take the fastest of"
+    )
+    arguments = parser.parse_args(
+        command_line_arguments if command_line_arguments is not None else sys.argv[1:]
+    )
+
+    runs = [measure_imports() for _ in range(arguments.runs)]
+    fastest = min(run[ENTRY_MODULE] for run in runs) / 1000
+    print("{0} imported in {1:.1f}ms".format(ENTRY_MODULE, fastest))
+
+    exit_code = 0
+    if fastest > arguments.budget_ms:
+        print("REGRESSION over budget of {0}ms".format(arguments.budget_ms))
+        exit_code = 1
+
+    for module in DEFERRED_MODULES:
+        if module in runs[0]:
+            print("REGRESSION {0} is imported at startup".format(module))
+            exit_code = 1
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Measures the memory each catalog record takes once loaded
+    python -m benchmarks.object_memory --records 100000
+"""
+import argparse
+import sys
+import tracemalloc
+
+from logical_backup.objects.device import Device
+from logical_backup.objects.file import File
+from logical_backup.objects.folder import Folder
+
+
+def make_file(index: int, device: Device) -> File:
+    """
+    Makes a file, with every property set as loading from the catalog would
+    """
+    file_obj = File()
+    file_obj.device = device
+    file_obj.device_name = device.device_name
+    file_obj.set_properties(
+        "{0:064x}_file_{0}.dat".format(index),
+        "/home/user/folder_{0}/file_{1}.dat".format(index % 1000, index),
+        "{0:032x}".format(index),
+    )
+    file_obj.set_security("644", "user", "group")
+    file_obj.size = index
+    return file_obj
+
+
+def make_folder(index: int, device: Device) -> Folder:
+    """
+    Makes a folder, with every property set
+    """
+    folder = Folder()
+    folder.set("/home/user/folder_{0}".format(index), "755", "user", "group")
+    return folder
+
+
+def make_device(index: int, device: Device) -> Device:
+    """
+    Makes a device, with every property set
+    """
+    new_device = Device()
+    new_device.set(
+        "device-{0}".format(index),
+        "/mnt/device-{0}".format(index),
+        "Device Serial",
+        "serial-{0}".format(index),
+        2,
+    )
+    return new_device
+
+
+RECORD_TYPES = {"File": make_file, "Folder": make_folder, "Device": make_device}
+
+
+def __copy_record(record):
+    """
+    Makes a new record with the same property values
+    """
+    copy = type(record)()
+    for name, value in vars(type(record)).items():
+        if isinstance(value, property):
+            setattr(copy, name, getattr(record, name))
+
+    return copy
+
+
+def measure_record_bytes(make_record, count: int) -> float:
+    """
+    Measures the memory taken per record, excluding the values it holds
+    Those would be loaded from the catalog whatever the record looked like
+
+    Parameters
+    ----------
+    make_record : callable
+        Makes a record from an index and a shared device
+    count : int
+        Number of records to make
+
+    Returns
+    -------
+    float
+        Bytes per record
+    """
+    device = make_device(0, None)
+    templates = [make_record(index, device) for index in range(count)]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    records = [__copy_record(template) for template in templates]
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    # The list holding them is not part of each record
+    return (used - sys.getsizeof(records)) / len(records)
+
+
+def main(command_line_arguments: list = None) -> int:
+    """
+    Prints bytes per record for each record type
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Injectable arguments
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    parser = argparse.ArgumentParser(description="Measure catalog record memory")
+    parser.add_argument(
+        "--records", type=int, default=100000, help="Records of each type to make"
+    )
+    arguments = parser.parse_args(
+        command_line_arguments if command_line_arguments is not None else sys.argv[1:]
+    )
+
+    print("{0:<10}{1:>18}".format("record", "bytes_per_record"))
+    for name, make_record in RECORD_TYPES.items():
+        print(
+            "{0:<10}{1:>18.1f}".format(
+                name, measure_record_bytes(make_record, arguments.records)
+            )
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
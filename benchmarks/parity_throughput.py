@@ -0,0 +1,113 @@
+"""
+Measures erasure coding throughput on one core, for each backend installed
+    python -m benchmarks.parity_throughput --data-blocks 4 --parity-blocks 2
+"""
+import argparse
+import os
+import sys
+import time
+
+from logical_backup import parity
+
+
+def measure_throughput(
+    data_count: int, parity_count: int, block_size: int, rounds: int
+) -> tuple:
+    """
+    Codes random blocks, then rebuilds as many data blocks as there is parity
+
+    Parameters
+    ----------
+    data_count : int
+        Data blocks in a group
+    parity_count : int
+        Parity blocks in a group
+    block_size : int
+        Bytes in each block
+    rounds : int
+        Times to code the group
+
+    Returns
+    -------
+    tuple
+        Encoding and decoding speed, in MB of data per second
+    """
+    blocks = [os.urandom(block_size) for _ in range(data_count)]
+    megabytes = data_count * block_size * rounds / (1 << 20)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parity_blocks = parity.encode(blocks, parity_count)
+    encode_seconds = time.perf_counter() - start
+
+    # The worst case, every parity block standing in for a lost data block
+    available = dict(enumerate(blocks[parity_count:] + parity_blocks, parity_count))
+    lost = range(min(parity_count, data_count))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for index in lost:
+            parity.decode(available, data_count, parity_count, index)
+    decode_seconds = time.perf_counter() - start
+
+    return megabytes / encode_seconds, megabytes / decode_seconds
+
+
+def main(command_line_arguments: list = None) -> int:
+    """
+    Prints throughput for each backend
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Injectable arguments
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    parser = argparse.ArgumentParser(description="Measure erasure coding speed")
+    parser.add_argument(
+        "--data-blocks", dest="data_blocks", type=int, default=4, help="Group size"
+    )
+    parser.add_argument(
+        "--parity-blocks",
+        dest="parity_blocks",
+        type=int,
+        default=2,
+        help="Parity blocks per group",
+    )
+    parser.add_argument(
+        "--block-size",
+        dest="block_size",
+        type=int,
+        default=parity.CHUNK_SIZE,
+        help="Bytes in each block",
+    )
+    parser.add_argument("--rounds", type=int, default=20, help="Groups to code")
+    arguments = parser.parse_args(
+        command_line_arguments if command_line_arguments is not None else sys.argv[1:]
+    )
+
+    print("{0:<10}{1:>14}{2:>14}".format("backend", "encode_MB/s", "decode_MB/s"))
+    for backend in parity.BACKENDS:
+        try:
+            parity.set_backend(backend)
+        except ImportError:
+            print("{0:<10}{1:>28}".format(backend, "not installed"))
+            continue
+
+        encode_speed, decode_speed = measure_throughput(
+            arguments.data_blocks,
+            arguments.parity_blocks,
+            arguments.block_size,
+            arguments.rounds,
+        )
+        print("{0:<10}{1:>14.1f}{2:>14.1f}".format(backend, encode_speed, decode_speed))
+
+    parity.set_backend()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
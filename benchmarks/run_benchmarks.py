@@ -0,0 +1,193 @@
+"""
+Benchmarks the hot paths of the library against a synthetic tree
+
+Runs entirely offline, using tmpfs-backed directories as fake devices
+    python -m benchmarks.run_benchmarks --files 5000 --baseline baseline.json
+"""
+import argparse
+import os.path as os_path
+import shutil
+import sys
+import tempfile
+
+from benchmarks import harness
+from benchmarks import scenarios
+from benchmarks import synthetic
+
+
+def __parse_arguments(command_line_arguments: list) -> dict:
+    """
+    Parses command line arguments
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Command line arguments, in list form
+
+    Returns
+    -------
+    dict
+        arguments
+    """
+    parser = argparse.ArgumentParser(description="Benchmark logical backup")
+    parser.add_argument("--files", type=int, default=2000, help="Files in the tree")
+    parser.add_argument(
+        "--mean-size",
+        dest="mean_size",
+        type=int,
+        default=16 * 1024,
+        help="Mean file size, in bytes",
+    )
+    parser.add_argument(
+        "--distribution",
+        choices=synthetic.SIZE_DISTRIBUTIONS,
+        default="lognormal",
+        help="Distribution of file sizes",
+    )
+    parser.add_argument(
+        "--fan-out", dest="fan_out", type=int, default=4, help="Folders per folder"
+    )
+    parser.add_argument("--depth", type=int, default=3, help="Depth of the tree")
+    parser.add_argument("--devices", type=int, default=2, help="Fake devices")
+    parser.add_argument(
+        "--modified-fraction",
+        dest="modified_fraction",
+        type=float,
+        default=0.1,
+        help="Portion of files changed before updating",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument(
+        "--root",
+        default=synthetic.get_tmpfs_root(),
+        help="Directory to build the tree and devices in",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=[name for name, _, _ in scenarios.SCENARIOS],
+        help="Only report these benchmarks, may be repeated",
+    )
+    parser.add_argument("--baseline", help="Baseline file to compare against")
+    parser.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        action="store_true",
+        help="Save results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative regression allowed before failing",
+    )
+    return vars(parser.parse_args(command_line_arguments))
+
+
+def __print_results(results: list) -> None:
+    """
+    Prints a table of results
+    """
+    columns = ["files_per_second", "mb_per_second", "peak_rss_mib", "seconds"]
+    print(
+        "{0:<32}".format("benchmark")
+        + "".join("{0:>18}".format(column) for column in columns)
+    )
+    for result in results:
+        metrics = harness.result_metrics(result)
+        print(
+            "{0:<32}".format(result.name)
+            + "".join("{0:>18}".format(metrics[column]) for column in columns)
+        )
+
+
+def main(command_line_arguments: list = None) -> int:
+    """
+    Runs the benchmarks
+
+    Parameters
+    ----------
+    command_line_arguments : list
+        Injectable arguments
+
+    Returns
+    -------
+    int
+        Exit code, non-zero if any metric regressed
+    """
+    arguments = __parse_arguments(
+        command_line_arguments if command_line_arguments is not None else sys.argv[1:]
+    )
+    config = {
+        key: arguments[key]
+        for key in [
+            "files",
+            "mean_size",
+            "distribution",
+            "fan_out",
+            "depth",
+            "devices",
+            "modified_fraction",
+            "seed",
+        ]
+    }
+    spec = synthetic.TreeSpec(
+        arguments["files"],
+        arguments["mean_size"],
+        arguments["distribution"],
+        arguments["fan_out"],
+        arguments["depth"],
+        arguments["seed"],
+    )
+
+    workspace = tempfile.mkdtemp(prefix="logical_backup_bench_", dir=arguments["root"])
+    try:
+        tree = synthetic.generate_tree(os_path.join(workspace, "tree"), spec)
+        context = {
+            "db_file": os_path.join(workspace, "files.db"),
+            "devices": synthetic.make_fake_devices(
+                os_path.join(workspace, "devices"), arguments["devices"]
+            ),
+            "tree_root": tree.root,
+            "moved_root": os_path.join(workspace, "moved"),
+            "files": tree.files,
+            "file_count": len(tree.files),
+            "folder_count": len(tree.folders) + 1,
+            "total_bytes": tree.total_bytes,
+            "modified_fraction": arguments["modified_fraction"],
+            "seed": arguments["seed"],
+        }
+
+        results = []
+        for name, setup, run in scenarios.SCENARIOS:
+            result = harness.run_isolated(name, setup, run, context)
+            if not arguments["only"] or name in arguments["only"]:
+                results.append(result)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    __print_results(results)
+
+    exit_code = 0
+    baseline = (
+        harness.load_baseline(arguments["baseline"]) if arguments["baseline"] else None
+    )
+    if baseline:
+        if baseline["config"] != config:
+            print("Baseline was generated with a different configuration!")
+
+        regressions = harness.compare_to_baseline(
+            results, baseline, arguments["tolerance"]
+        )
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        exit_code = 1 if regressions else 0
+
+    if arguments["save_baseline"] and arguments["baseline"]:
+        harness.save_baseline(arguments["baseline"], config, results)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
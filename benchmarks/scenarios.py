@@ -0,0 +1,162 @@
+"""
+Benchmarked operations, run in order against a shared catalog
+
+Each scenario has an untimed setup and a timed run, both taking the context
+Runs return a tuple of files and bytes processed
+"""
+import os.path as os_path
+
+from benchmarks import synthetic
+from logical_backup import db
+from logical_backup import library
+from logical_backup.objects.device import Device
+
+
+def __use_context(context: dict) -> None:
+    """
+    Points the library at the benchmark catalog and fake devices
+    """
+    db.DB_FILE = context["db_file"]
+    devices = set(context["devices"])
+    is_mount = os_path.ismount
+    os_path.ismount = lambda path: path in devices or is_mount(path)
+
+
+def setup_add_directory(context: dict) -> None:
+    """
+    Creates the catalog and registers the fake devices
+    """
+    __use_context(context)
+    db.initialize_database()
+    for index, device_path in enumerate(context["devices"]):
+        device = Device()
+        device.set(
+            "bench-{0}".format(index),
+            device_path,
+            "User Specified",
+            "bench-identifier-{0}".format(index),
+        )
+        db.add_device(device)
+
+
+def run_add_directory(context: dict) -> tuple:
+    """
+    Backs up the whole synthetic tree
+    """
+    if not library.add_directory(context["tree_root"]):
+        raise RuntimeError("Adding the synthetic tree failed")
+
+    return context["file_count"], context["total_bytes"]
+
+
+def run_get_unique_folders(context: dict) -> tuple:
+    """
+    Reduces the backed-up folders to the top-level ones
+    """
+    __use_context(context)
+    library.__get_unique_folders()
+    return context["folder_count"], 0
+
+
+def run_get_files_outside_directories(context: dict) -> tuple:
+    """
+    Finds backed-up files not covered by a backed-up folder
+    """
+    __use_context(context)
+    library.__get_files_outside_directories()
+    return context["file_count"], 0
+
+
+def run_verify_all(context: dict) -> tuple:
+    """
+    Checks every backed-up file against the catalog
+    """
+    __use_context(context)
+    library.verify_all(False)
+    return context["file_count"], context["total_bytes"]
+
+
+def setup_update_folder(context: dict) -> None:
+    """
+    Changes a portion of the tree, so it needs updating
+    """
+    __use_context(context)
+    tree = synthetic.SyntheticTree(
+        context["tree_root"], context["files"], [], context["total_bytes"]
+    )
+    synthetic.modify_files(tree, context["modified_fraction"], context["seed"])
+
+
+def run_update_folder(context: dict) -> tuple:
+    """
+    Brings the catalog in line with the changed tree
+    """
+    if not library.update_folder(context["tree_root"]):
+        raise RuntimeError("Updating the synthetic tree failed")
+
+    return context["file_count"], context["total_bytes"]
+
+
+def run_move_directory_local(context: dict) -> tuple:
+    """
+    Rehomes the whole tree in the catalog
+    """
+    __use_context(context)
+    if not library.move_directory_local(context["tree_root"], context["moved_root"]):
+        raise RuntimeError("Moving the synthetic tree failed")
+
+    return context["file_count"] + context["folder_count"], 0
+
+
+def run_restore_all(context: dict) -> tuple:
+    """
+    Restores everything, into the moved location
+    """
+    __use_context(context)
+    if not library.restore_all():
+        raise RuntimeError("Restoring the synthetic tree failed")
+
+    return context["file_count"], context["total_bytes"]
+
+
+def setup_move_directory_device(context: dict) -> None:
+    """
+    Finds the files not yet on the last device, so they can be counted
+    """
+    __use_context(context)
+    target = context["devices"][-1]
+    moving = [
+        file_obj
+        for file_obj in db.get_files_by_location(folder_path=context["moved_root"])
+        if file_obj.device.device_path != target
+    ]
+    context["moving_files"] = len(moving)
+    context["moving_bytes"] = sum(
+        os_path.getsize(os_path.join(file_obj.device.device_path, file_obj.file_name))
+        for file_obj in moving
+    )
+
+
+def run_move_directory_device(context: dict) -> tuple:
+    """
+    Moves the whole tree onto the last device
+    """
+    if not library.move_directory_device(
+        context["moved_root"], context["devices"][-1]
+    ):
+        raise RuntimeError("Moving the synthetic tree between devices failed")
+
+    return context["moving_files"], context["moving_bytes"]
+
+
+# Ordered, since each scenario relies on the state left by the previous ones
+SCENARIOS = [
+    ("add_directory", setup_add_directory, run_add_directory),
+    ("get_unique_folders", None, run_get_unique_folders),
+    ("get_files_outside_directories", None, run_get_files_outside_directories),
+    ("verify_all", None, run_verify_all),
+    ("update_folder", setup_update_folder, run_update_folder),
+    ("move_directory_local", None, run_move_directory_local),
+    ("restore_all", None, run_restore_all),
+    ("move_directory_device", setup_move_directory_device, run_move_directory_device),
+]
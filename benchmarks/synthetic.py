@@ -0,0 +1,200 @@
+"""
+Generates synthetic directory trees and fake devices for benchmarking
+"""
+from collections import namedtuple
+import os
+import os.path as os_path
+import random
+import tempfile
+
+TMPFS_ROOT = "/dev/shm"
+SIZE_DISTRIBUTIONS = ["fixed", "uniform", "lognormal"]
+# Random data is sliced out of a shared pool, rather than generated per file,
+# so tree creation is not the slowest part of a benchmark run
+DATA_POOL_SIZE = 4 * 1024 * 1024
+
+TreeSpec = namedtuple(
+    "tree_spec", "file_count mean_size distribution fan_out depth seed"
+)
+SyntheticTree = namedtuple("synthetic_tree", "root files folders total_bytes")
+
+
+def get_tmpfs_root() -> str:
+    """
+    Returns a memory-backed directory to build trees and devices in,
+    falling back to the system temporary directory if tmpfs is unavailable
+
+    Returns
+    -------
+    str
+        Directory path
+    """
+    if os_path.isdir(TMPFS_ROOT) and os.access(TMPFS_ROOT, os.W_OK):
+        return TMPFS_ROOT
+
+    return tempfile.gettempdir()
+
+
+def get_file_sizes(spec: TreeSpec) -> list:
+    """
+    Generates the size of each file in a tree
+
+    Parameters
+    ----------
+    spec : TreeSpec
+        Specification of the tree
+
+    Returns
+    -------
+    list
+        Size, in bytes, of every file
+    """
+    if spec.distribution not in SIZE_DISTRIBUTIONS:
+        raise ValueError("Unknown size distribution: " + spec.distribution)
+
+    generator = random.Random(spec.seed)
+    sizes = []
+    for _ in range(spec.file_count):
+        if spec.distribution == "fixed":
+            size = spec.mean_size
+        elif spec.distribution == "uniform":
+            size = generator.randint(0, 2 * spec.mean_size)
+        else:
+            # Sigma of 1 gives a long tail of a few large files,
+            # with the median well below the mean, like most home directories
+            size = int(generator.lognormvariate(0, 1) * spec.mean_size / 1.6487)
+
+        sizes.append(max(size, 1))
+
+    return sizes
+
+
+def get_folder_layout(root: str, spec: TreeSpec) -> list:
+    """
+    Lists the folders to create in a tree, in creation order
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the tree
+    spec : TreeSpec
+        Specification of the tree
+
+    Returns
+    -------
+    list
+        Folder paths, parents before children
+    """
+    folders = []
+    level = [root]
+    for depth in range(spec.depth):
+        next_level = []
+        for parent in level:
+            for index in range(spec.fan_out):
+                next_level.append(
+                    os_path.join(parent, "dir_{0}_{1}".format(depth, index))
+                )
+
+        folders.extend(next_level)
+        level = next_level
+
+    return folders
+
+
+def generate_tree(root: str, spec: TreeSpec) -> SyntheticTree:
+    """
+    Creates a synthetic tree of files on disk
+
+    Parameters
+    ----------
+    root : str
+        Directory to create the tree in, must not exist yet
+    spec : TreeSpec
+        Specification of the tree
+
+    Returns
+    -------
+    SyntheticTree
+        Description of what was created
+    """
+    generator = random.Random(spec.seed)
+    pool = generator.getrandbits(DATA_POOL_SIZE * 8).to_bytes(DATA_POOL_SIZE, "little")
+
+    os.makedirs(root)
+    folders = get_folder_layout(root, spec)
+    for folder in folders:
+        os.makedirs(folder)
+
+    parents = [root] + folders
+    files = []
+    total_bytes = 0
+    for index, size in enumerate(get_file_sizes(spec)):
+        file_path = os_path.join(
+            generator.choice(parents), "file_{0}.dat".format(index)
+        )
+        # Prefix the index so every file has a distinct checksum
+        data = str(index).encode() + b"\n"
+        while len(data) < size:
+            offset = generator.randrange(DATA_POOL_SIZE)
+            data += pool[offset : offset + size - len(data)]
+
+        with open(file_path, "wb") as file_handle:
+            file_handle.write(data[:size])
+
+        files.append(file_path)
+        total_bytes += size
+
+    return SyntheticTree(root, files, folders, total_bytes)
+
+
+def modify_files(tree: SyntheticTree, fraction: float, seed: int) -> list:
+    """
+    Rewrites a deterministic subset of files in a tree, so they need updating
+
+    Parameters
+    ----------
+    tree : SyntheticTree
+        The tree to modify
+    fraction : float
+        Portion of files to rewrite, between 0 and 1
+    seed : int
+        Seed for choosing files
+
+    Returns
+    -------
+    list
+        Paths of the modified files
+    """
+    generator = random.Random(seed)
+    count = int(len(tree.files) * fraction)
+    modified = generator.sample(tree.files, count)
+    for file_path in modified:
+        with open(file_path, "ab") as file_handle:
+            file_handle.write(b"modified\n")
+
+    return modified
+
+
+def make_fake_devices(root: str, count: int) -> list:
+    """
+    Creates directories to act as backup devices
+
+    Parameters
+    ----------
+    root : str
+        Directory to create the devices in
+    count : int
+        Number of devices
+
+    Returns
+    -------
+    list
+        Device mount paths
+    """
+    devices = []
+    for index in range(count):
+        device_path = os_path.join(root, "device_{0}".format(index))
+        os.makedirs(device_path)
+        devices.append(device_path)
+
+    return devices
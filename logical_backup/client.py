@@ -0,0 +1,86 @@
+"""
+Hands commands to a running daemon, to skip startup, imports and setup
+Imports nothing else from the package, since that is what it saves loading
+"""
+import json
+import os
+import os.path as os_path
+import socket
+import sys
+
+# Beside the catalog the daemon serves, as db.get_database_file picks it
+SOCKET_FILE = os_path.join(os_path.dirname(__file__), "../files.db.sock")
+TEST_SOCKET_FILE = os_path.join(os_path.dirname(__file__), "../files.db.test.sock")
+# Long-running actions, which would keep the daemon from taking other commands
+LOCAL_ACTIONS = ["serve", "watch"]
+
+
+def get_socket_path() -> str:
+    """
+    Returns where the daemon for the catalog in use listens
+    """
+    return TEST_SOCKET_FILE if os.getenv("IS_TEST") else SOCKET_FILE
+
+
+def send_message(stream, message: dict) -> None:
+    """
+    Writes one message to a socket stream, as a line of JSON
+
+    Parameters
+    ----------
+    stream : file
+        Binary stream of the socket
+    message : dict
+        The message
+    """
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+
+def send_command(arguments: list, socket_path: str = None) -> int:
+    """
+    Runs a command in the daemon, relaying its output and any prompts
+
+    Parameters
+    ----------
+    arguments : list
+        Command line arguments
+    socket_path : str
+        Socket the daemon listens on, by default the one for the catalog in use
+
+    Returns
+    -------
+    int
+        Exit code of the command,
+        or None if it should run in this process, with no daemon listening
+    """
+    if not arguments or any(argument in LOCAL_ACTIONS for argument in arguments):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path or get_socket_path())
+    except OSError:
+        connection.close()
+        return None
+
+    # The daemon may swap these for its own while running the command
+    output, errors, prompts = sys.stdout, sys.stderr, sys.stdin
+    with connection, connection.makefile("rwb") as stream:
+        send_message(
+            stream,
+            {"arguments": arguments, "cwd": os.getcwd(), "tty": output.isatty()},
+        )
+        for line in stream:
+            message = json.loads(line)
+            if "output" in message:
+                target = errors if message.get("error") else output
+                target.write(message["output"])
+                target.flush()
+            elif "input" in message:
+                send_message(stream, {"input": prompts.readline()})
+            elif "exit" in message:
+                return message["exit"]
+
+    errors.write("Lost connection to the daemon!\n")
+    return 1
@@ -3,8 +3,10 @@ Database interactions for the utility
 """
 
 from enum import Enum
-from os.path import dirname, join
+from os.path import basename, dirname, join
+import re
 import sqlite3
+import threading
 
 from logical_backup.objects.device import Device
 from logical_backup.objects.file import File
@@ -12,10 +14,30 @@ from logical_backup.objects.folder import Folder
 
 
 from logical_backup.utility import is_test, DirectoryEntries
+from logical_backup.device_profile import DeviceProfile
+from logical_backup.parity import ParityGroup, ParityMember
 
 DB_FILE = join(dirname(__file__), "../files.db")
-print(DB_FILE)
 DEV_FILE = join(dirname(__file__), "../files.db.test")
+SEARCH_TABLE = "tblFileSearch"
+# Rows fetched at a time when streaming files
+FETCH_BATCH_SIZE = 1000
+# Columns for each File property that can be loaded
+FILE_COLUMNS = {
+    "file_name": "f.FileName",
+    "file_path": "f.FilePath",
+    "permissions": "f.FilePermissions",
+    "owner": "f.FileOwnerName",
+    "group": "f.FileGroupName",
+    "checksum": "f.FileChecksum",
+    "size": "f.FileSize",
+}
+SEARCH_INSERT_TRIGGER = (
+    "CREATE TRIGGER trFileSearchInsert AFTER INSERT ON tblFile BEGIN"
+    "  INSERT INTO {0} (rowid, FilePath) VALUES (new.FileID, new.FilePath);"
+    "END;".format(SEARCH_TABLE)
+)
+SEARCH_MODES = ["substring", "glob", "regex"]
 
 
 def __row_to_dict(row: list, column_names: list) -> dict:
@@ -65,6 +87,47 @@ class DatabaseError(Enum):
         return self == self.SUCCESS
 
 
+def get_database_file() -> str:
+    """
+    Returns the path of the catalog in use
+    """
+    return DEV_FILE if is_test() else DB_FILE
+
+
+# Kept open by long-running processes, for every cursor to use
+# Not name-mangled, since the cursor class reads it
+_shared = {"connection": None, "lock": threading.RLock()}
+
+
+def open_shared_connection() -> bool:
+    """
+    Keeps one connection open for every cursor until closed,
+    saving a reconnect and schema load per query
+
+    Returns
+    -------
+    bool
+        False if it was already open
+    """
+    if _shared["connection"]:
+        return False
+
+    _shared["connection"] = sqlite3.connect(
+        get_database_file(), check_same_thread=False
+    )
+    return True
+
+
+def close_shared_connection() -> None:
+    """
+    Closes the shared connection, so cursors connect for themselves again
+    """
+    with _shared["lock"]:
+        if _shared["connection"]:
+            _shared["connection"].close()
+            _shared["connection"] = None
+
+
 class SQLiteCursor(sqlite3.Cursor):
     """
     A wrapper around the SQLite cursor
@@ -82,14 +145,19 @@ class SQLiteCursor(sqlite3.Cursor):
         super()
         self.__connection = None
         self.__commit_on_close = commit_on_close
-        self.__db_file = DEV_FILE if is_test() else DB_FILE
+        self.__db_file = get_database_file()
         self.__cursor = None
 
     def __enter__(self):
         """
         .
         """
-        self.__connection = sqlite3.connect(self.__db_file)
+        _shared["lock"].acquire()
+        self.__connection = _shared["connection"]
+        if not self.__connection:
+            _shared["lock"].release()
+            self.__connection = sqlite3.connect(self.__db_file)
+
         self.__cursor = self.__connection.cursor()
         return self
 
@@ -97,10 +165,20 @@ class SQLiteCursor(sqlite3.Cursor):
         """
         .
         """
-        if self.__commit_on_close:
+        shared = self.__connection is _shared["connection"]
+        # Anything raised mid-way must not leave partial changes behind
+        if exc_type:
+            self.__connection.rollback()
+        elif self.__commit_on_close:
             self.__connection.commit()
+        elif shared:
+            # As closing would, since the connection outlives this cursor
+            self.__connection.rollback()
 
-        self.__connection.close()
+        if shared:
+            _shared["lock"].release()
+        else:
+            self.__connection.close()
 
     def execute(self, *args, **kwargs):
         """
@@ -108,12 +186,30 @@ class SQLiteCursor(sqlite3.Cursor):
         """
         return self.__cursor.execute(*args, **kwargs)
 
+    def create_function(self, *args, **kwargs):
+        """
+        Wrapper for sqlite create_function, on the open connection
+        """
+        return self.__connection.create_function(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        """
+        Wrapper for sqlite executemany
+        """
+        return self.__cursor.executemany(*args, **kwargs)
+
     def fetchone(self):
         """
         Wrapper for sqlite fetchone
         """
         return self.__cursor.fetchone()
 
+    def fetchmany(self, *args, **kwargs):
+        """
+        Wrapper for sqlite fetchmany
+        """
+        return self.__cursor.fetchmany(*args, **kwargs)
+
     def fetchall(self):
         """
         Wrapper for sqlite fetchall
@@ -134,6 +230,176 @@ class SQLiteCursor(sqlite3.Cursor):
         """
         return self.__cursor.description
 
+    @property
+    def lastrowid(self) -> int:
+        """
+        Wrapper for sqlite cursor lastrowid
+        """
+        return self.__cursor.lastrowid
+
+
+def __get_directory_id(cursor: SQLiteCursor, directory_path: str, create: bool) -> int:
+    """
+    Resolves a directory path to its node in the directory tree
+    Costs one indexed lookup per path component
+
+    Parameters
+    ----------
+    cursor : SQLiteCursor
+        Cursor to query with, so creation shares the caller's transaction
+    directory_path : str
+        Absolute path of the directory
+    create : bool
+        Whether to create missing nodes along the path
+
+    Returns
+    -------
+    int
+        ID of the directory, or None if it does not exist and create is False
+    """
+    cursor.execute(
+        """
+        SELECT DirectoryID
+        FROM   tblDirectory
+        WHERE  DirectoryParentID IS NULL
+        """
+    )
+    directory_id = cursor.fetchone()[0]
+
+    for name in [part for part in directory_path.split("/") if part]:
+        cursor.execute(
+            """
+            SELECT DirectoryID
+            FROM   tblDirectory
+            WHERE  DirectoryParentID = ?
+            AND    DirectoryName = ?
+            """,
+            (directory_id, name),
+        )
+        row = cursor.fetchone()
+        if row:
+            directory_id = row[0]
+        elif create:
+            cursor.execute(
+                """
+                INSERT INTO tblDirectory (DirectoryParentID, DirectoryName)
+                VALUES (?, ?)
+                """,
+                (directory_id, name),
+            )
+            directory_id = cursor.lastrowid
+        else:
+            return None
+
+    return directory_id
+
+
+def __link_directories(cursor: SQLiteCursor, table: str, get_directory) -> None:
+    """
+    Populates the directory of every row in a table, for catalogs
+    created before the directory tree existed
+
+    Parameters
+    ----------
+    cursor : SQLiteCursor
+        Cursor to query with
+    table : str
+        Either tblFile or tblFolder
+    get_directory : callable
+        Maps a row's path to the path of its directory
+    """
+    prefix = table[3:]
+    cursor.execute(
+        "SELECT {0}ID, {0}Path FROM {1} WHERE {0}DirectoryID IS NULL".format(
+            prefix, table
+        )
+    )
+    rows = cursor.fetchall()
+
+    directory_ids = {}
+    updates = []
+    for row_id, path in rows:
+        directory = get_directory(path)
+        if directory not in directory_ids:
+            directory_ids[directory] = __get_directory_id(cursor, directory, True)
+        updates.append((directory_ids[directory], row_id))
+
+    cursor.executemany(
+        "UPDATE {1} SET {0}DirectoryID = ? WHERE {0}ID = ?".format(prefix, table),
+        updates,
+    )
+
+
+def __add_directory_columns(cursor: SQLiteCursor) -> None:
+    """
+    Links files and folders in an existing catalog into the directory tree
+    """
+    for table, get_directory in [
+        ("tblFile", dirname),
+        ("tblFolder", lambda path: path),
+    ]:
+        cursor.execute("PRAGMA table_info({0})".format(table))
+        columns = [column[1] for column in cursor.fetchall()]
+        column = table[3:] + "DirectoryID"
+        if column not in columns:
+            cursor.execute(
+                "ALTER TABLE {0} ADD COLUMN {1} INT "
+                "REFERENCES tblDirectory (DirectoryID)".format(table, column)
+            )
+            __link_directories(cursor, table, get_directory)
+
+
+def __add_file_size_column(cursor: SQLiteCursor) -> None:
+    """
+    Adds file sizes to catalogs created before they were recorded
+    Sizes of existing files stay unknown until they are next added
+    """
+    cursor.execute("PRAGMA table_info(tblFile)")
+    if "FileSize" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE tblFile ADD COLUMN FileSize INT")
+
+
+def __create_search_index(cursor: SQLiteCursor) -> None:
+    """
+    Creates a trigram index over file paths, kept current by triggers
+    Older SQLite builds without FTS5 trigrams fall back to scanning for searches
+    """
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (SEARCH_TABLE,),
+    )
+    if cursor.fetchone():
+        return
+
+    try:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE {0} USING fts5("
+            "  FilePath,"
+            "  content='tblFile',"
+            "  content_rowid='FileID',"
+            "  tokenize='trigram'"
+            ");".format(SEARCH_TABLE)
+        )
+    except sqlite3.OperationalError:
+        return
+
+    cursor.execute(SEARCH_INSERT_TRIGGER)
+    cursor.execute(
+        "CREATE TRIGGER trFileSearchDelete AFTER DELETE ON tblFile BEGIN"
+        "  INSERT INTO {0} ({0}, rowid, FilePath)"
+        "  VALUES ('delete', old.FileID, old.FilePath);"
+        "END;".format(SEARCH_TABLE)
+    )
+    cursor.execute(
+        "CREATE TRIGGER trFileSearchUpdate AFTER UPDATE OF FilePath ON tblFile BEGIN"
+        "  INSERT INTO {0} ({0}, rowid, FilePath)"
+        "  VALUES ('delete', old.FileID, old.FilePath);"
+        "  INSERT INTO {0} (rowid, FilePath) VALUES (new.FileID, new.FilePath);"
+        "END;".format(SEARCH_TABLE)
+    )
+    # Index anything already in the catalog
+    cursor.execute("INSERT INTO {0} ({0}) VALUES ('rebuild');".format(SEARCH_TABLE))
+
 
 def initialize_database():
     """
@@ -178,6 +444,28 @@ def initialize_database():
             ");"
         )
 
+        # Tree of every directory containing a backed-up file or folder
+        # The root has no parent, and every other node is named relative to it
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblDirectory ("
+            "  DirectoryID       INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  DirectoryParentID INT,"
+            "  DirectoryName     TEXT NOT NULL,"
+            "  UNIQUE (DirectoryParentID, DirectoryName),"
+            "  FOREIGN KEY (DirectoryParentID) REFERENCES tblDirectory (DirectoryID)"
+            ");"
+        )
+
+        cursor.execute(
+            "INSERT INTO tblDirectory (DirectoryParentID, DirectoryName) "
+            "SELECT NULL, '' "
+            "WHERE NOT EXISTS ("
+            "  SELECT *"
+            "  FROM   tblDirectory"
+            "  WHERE  DirectoryParentID IS NULL"
+            ");"
+        )
+
         cursor.execute(
             "CREATE TABLE IF NOT EXISTS tblFile ("
             "  FileID          INTEGER PRIMARY KEY AUTOINCREMENT,"
@@ -188,7 +476,10 @@ def initialize_database():
             "  FileGroupName   TEXT NOT NULL,"
             "  FileChecksum    TEXT NOT NULL,"
             "  FileDeviceID    INT  NOT NULL,"
-            "  FOREIGN KEY (FileDeviceID) REFERENCES tblDevice (DeviceID)"
+            "  FileDirectoryID INT,"
+            "  FileSize        INT,"
+            "  FOREIGN KEY (FileDeviceID) REFERENCES tblDevice (DeviceID),"
+            "  FOREIGN KEY (FileDirectoryID) REFERENCES tblDirectory (DirectoryID)"
             ");"
         )
 
@@ -198,7 +489,111 @@ def initialize_database():
             "  FolderPath        TEXT NOT NULL UNIQUE,"
             "  FolderPermissions TEXT NOT NULL,"
             "  FolderOwnerName   TEXT NOT NULL,"
-            "  FolderGroupName   TEXT NOT NULL"
+            "  FolderGroupName   TEXT NOT NULL,"
+            "  FolderDirectoryID INT,"
+            "  FOREIGN KEY (FolderDirectoryID) REFERENCES tblDirectory (DirectoryID)"
+            ");"
+        )
+
+        __add_directory_columns(cursor)
+        __add_file_size_column(cursor)
+
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ixFileDirectory ON tblFile (FileDirectoryID);"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ixFolderDirectory "
+            "ON tblFolder (FolderDirectoryID);"
+        )
+
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ixFileChecksum ON tblFile (FileChecksum);"
+        )
+
+        __create_search_index(cursor)
+
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblDeviceProfile ("
+            "  DeviceID                   INTEGER PRIMARY KEY,"
+            "  ProfileReadBytesPerSecond  REAL NOT NULL,"
+            "  ProfileWriteBytesPerSecond REAL NOT NULL,"
+            "  ProfileFilesPerSecond      REAL NOT NULL,"
+            "  ProfileTime                TEXT NOT NULL,"
+            "  FOREIGN KEY (DeviceID) REFERENCES tblDevice (DeviceID)"
+            ");"
+        )
+
+        # Further copies of a file, on devices other than its own
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblFileReplica ("
+            "  FileID   INT NOT NULL,"
+            "  DeviceID INT NOT NULL,"
+            "  PRIMARY KEY (FileID, DeviceID),"
+            "  FOREIGN KEY (FileID) REFERENCES tblFile (FileID),"
+            "  FOREIGN KEY (DeviceID) REFERENCES tblDevice (DeviceID)"
+            ");"
+        )
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS trFileReplicaDelete "
+            "AFTER DELETE ON tblFile BEGIN"
+            "  DELETE FROM tblFileReplica WHERE FileID = old.FileID;"
+            "END;"
+        )
+
+        # Files coded together, then the parity blocks for them
+        # Data members are found through their file, parity through their device
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblParityGroup ("
+            "  ParityGroupID        INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  ParityGroupDataCount INT NOT NULL"
+            ");"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblParityMember ("
+            "  ParityGroupID        INT  NOT NULL,"
+            "  ParityMemberIndex    INT  NOT NULL,"
+            "  FileID               INT  UNIQUE,"
+            "  DeviceID             INT,"
+            "  ParityMemberName     TEXT,"
+            "  ParityMemberChecksum TEXT,"
+            "  ParityMemberSize     INT  NOT NULL,"
+            "  PRIMARY KEY (ParityGroupID, ParityMemberIndex),"
+            "  FOREIGN KEY (ParityGroupID) REFERENCES tblParityGroup (ParityGroupID),"
+            "  FOREIGN KEY (FileID) REFERENCES tblFile (FileID),"
+            "  FOREIGN KEY (DeviceID) REFERENCES tblDevice (DeviceID)"
+            ");"
+        )
+        # The parity no longer matches once any file in the group is gone
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS trParityMemberDelete "
+            "AFTER DELETE ON tblFile "
+            "WHEN EXISTS (SELECT * FROM tblParityMember WHERE FileID = old.FileID) "
+            "BEGIN"
+            "  DELETE FROM tblParityGroup WHERE ParityGroupID = ("
+            "    SELECT ParityGroupID FROM tblParityMember WHERE FileID = old.FileID"
+            "  );"
+            "  DELETE FROM tblParityMember WHERE ParityGroupID NOT IN ("
+            "    SELECT ParityGroupID FROM tblParityGroup"
+            "  );"
+            "END;"
+        )
+
+        # Paths changed under watched folders, since those were last updated
+        # A recursive entry stands for everything beneath the path as well
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblDirtyPath ("
+            "  DirtyPathID        INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  DirtyPath          TEXT NOT NULL,"
+            "  DirtyPathRecursive INT  NOT NULL"
+            ");"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ixDirtyPath ON tblDirtyPath (DirtyPath);"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS tblWatchedFolder ("
+            "  WatchedFolderPath      TEXT PRIMARY KEY,"
+            "  WatchedFolderProcessID INT  NOT NULL"
             ");"
         )
 
@@ -328,7 +723,9 @@ def add_file(file_obj: File) -> DatabaseError:
                 "  FileOwnerName, "
                 "  FileGroupName, "
                 "  FileChecksum, "
-                "  FileDeviceID "
+                "  FileDeviceID, "
+                "  FileDirectoryID, "
+                "  FileSize "
                 ")"
                 "SELECT ?, "
                 "       ?, "
@@ -336,7 +733,9 @@ def add_file(file_obj: File) -> DatabaseError:
                 "       ?, "
                 "       ?, "
                 "       ?, "
-                "       d.DeviceID "
+                "       d.DeviceID, "
+                "       ?, "
+                "       ? "
                 "FROM   tblDevice d "
                 "WHERE  d.DeviceName = ?",
                 (
@@ -346,6 +745,8 @@ def add_file(file_obj: File) -> DatabaseError:
                     file_obj.owner,
                     file_obj.group,
                     file_obj.checksum,
+                    __get_directory_id(cursor, dirname(file_obj.file_path), True),
+                    file_obj.size,
                     file_obj.device_name,
                 ),
             )
@@ -358,159 +759,576 @@ def add_file(file_obj: File) -> DatabaseError:
             return DatabaseError.FILE_EXISTS
 
 
-def get_files(path: str = None) -> list:
+def bulk_add_files(files: list) -> int:
     """
-    .
+    Adds many files in one transaction, e.g. when rebuilding the catalog
+    Files already backed up, or on unknown devices, are skipped
+
+    Parameters
+    ----------
+    files : list
+        File objects, with device names set
+
+    Returns
+    -------
+    int
+        Number of files added
     """
     with SQLiteCursor() as cursor:
-        query = (
-            "SELECT     FileName, "
-            "           FilePath, "
-            "           FilePermissions, "
-            "           FileOwnerName, "
-            "           FileGroupName, "
-            "           FileChecksum, "
-            "           DeviceName, "
-            "           DevicePath, "
-            "           DeviceIdentifier, "
-            "           IdentifierID, "
-            "           IdentifierName "
-            "FROM       tblFile f "
-            "INNER JOIN tblDevice d "
-            "ON         f.FileDeviceID = d.DeviceID "
-            "INNER JOIN tblplDeviceIdentifier i "
-            "ON         i.IdentifierID = d.DeviceIdentifierID"
-        )
+        directory_ids = {}
+        rows = []
+        for file_obj in files:
+            directory = dirname(file_obj.file_path)
+            if directory not in directory_ids:
+                directory_ids[directory] = __get_directory_id(cursor, directory, True)
+            rows.append(
+                (
+                    file_obj.file_name,
+                    file_obj.file_path,
+                    file_obj.permissions,
+                    file_obj.owner,
+                    file_obj.group,
+                    file_obj.checksum,
+                    directory_ids[directory],
+                    file_obj.size,
+                    file_obj.device_name,
+                )
+            )
 
-        if path:
-            query += " WHERE f.FilePath = ?"
-            cursor.execute(query, (path,))
-        else:
-            cursor.execute(query)
+        # Indexing everything at once is far quicker than a row at a time
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+            ("trFileSearchInsert",),
+        )
+        indexed = bool(cursor.fetchone())
+        if indexed:
+            cursor.execute("DROP TRIGGER trFileSearchInsert")
 
-        results = cursor.fetchall()
-        files = []
-        for result in results:
-            row = __row_to_dict(result, cursor.description)
-            device = Device()
-            device.set(
-                row["DeviceName"],
-                row["DevicePath"],
-                row["DeviceIdentifier"],
-                row["IdentifierName"],
-                row["IdentifierID"],
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO tblFile (
+                FileName,
+                FilePath,
+                FilePermissions,
+                FileOwnerName,
+                FileGroupName,
+                FileChecksum,
+                FileDeviceID,
+                FileDirectoryID,
+                FileSize
             )
+            SELECT ?, ?, ?, ?, ?, ?, d.DeviceID, ?, ?
+            FROM   tblDevice d
+            WHERE  d.DeviceName = ?
+            """,
+            rows,
+        )
+        added = cursor.rowcount
 
-            file_obj = File()
-            file_obj.device = device
-            file_obj.device_name = device.device_name
-            file_obj.set_properties(
-                row["FileName"], row["FilePath"], row["FileChecksum"]
-            )
-            file_obj.set_security(
-                row["FilePermissions"], row["FileOwnerName"], row["FileGroupName"]
+        if indexed:
+            cursor.execute(
+                "INSERT INTO {0} ({0}) VALUES ('rebuild');".format(SEARCH_TABLE)
             )
+            cursor.execute(SEARCH_INSERT_TRIGGER)
 
-            files.append(file_obj)
+        return added
 
-        return files
 
-
-def remove_file(path: str) -> bool:
+# pylint: disable=too-many-arguments,too-many-locals
+def __iter_files(
+    condition: str = None,
+    parameters: tuple = (),
+    limit: int = None,
+    functions: dict = None,
+    columns: list = None,
+    batch_size: int = FETCH_BATCH_SIZE,
+):
     """
-    Removes a file
+    Streams files, along with the device each is on
+    Rows are fetched in batches, and each device is only created once
 
     Parameters
     ----------
-    path : str
-        Path to remove
+    condition : str
+        Optional WHERE clause to filter files by
+    parameters : tuple
+        Values for the condition
+    limit : int
+        Optional maximum number of files to select
+    functions : dict
+        Optional functions the condition uses, keyed by SQL name
+    columns : list
+        Optional File properties to load, from FILE_COLUMNS or "device"
+        Everything is loaded if not given
+    batch_size : int
+        Rows to fetch at a time
 
     Returns
     -------
-    bool
-        True if removed, false if failed or doesn't exist
+    generator
+        Of File objects
     """
-    with SQLiteCursor() as cursor:
-        cursor.execute("DELETE FROM tblFile WHERE FilePath = ? ", (path,))
-        return (
-            DatabaseError.SUCCESS
-            if cursor.rowcount > 0
-            else DatabaseError.NONEXISTENT_FILE
+    properties = [
+        attribute for attribute in FILE_COLUMNS if not columns or attribute in columns
+    ]
+    with_device = not columns or "device" in columns
+    unknown = set(columns or []) - set(FILE_COLUMNS) - {"device"}
+    if unknown:
+        raise ValueError("Unknown file columns: " + ", ".join(sorted(unknown)))
+
+    query = "SELECT " + ", ".join(
+        [FILE_COLUMNS[attribute] for attribute in properties]
+        + (
+            [
+                "d.DeviceID",
+                "d.DeviceName",
+                "d.DevicePath",
+                "d.DeviceIdentifier",
+                "i.IdentifierID",
+                "i.IdentifierName",
+            ]
+            if with_device
+            else []
         )
+    )
+    query += (
+        " FROM       tblFile f"
+        " INNER JOIN tblDevice d"
+        " ON         f.FileDeviceID = d.DeviceID"
+        " INNER JOIN tblplDeviceIdentifier i"
+        " ON         i.IdentifierID = d.DeviceIdentifierID"
+    )
+    if condition:
+        query += " WHERE " + condition
+    if limit:
+        query += " LIMIT {0:d}".format(limit)
+
+    devices = {}
+    with SQLiteCursor() as cursor:
+        for name, function in (functions or {}).items():
+            cursor.create_function(name, 2, function, deterministic=True)
+
+        cursor.execute(query, parameters)
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            for row in rows:
+                file_obj = File()
+                for attribute, value in zip(properties, row):
+                    setattr(file_obj, attribute, value)
+
+                if with_device:
+                    device_row = row[len(properties) :]
+                    device = devices.get(device_row[0])
+                    if not device:
+                        device = Device()
+                        device.set(
+                            device_row[1],
+                            device_row[2],
+                            device_row[5],
+                            device_row[3],
+                            device_row[4],
+                        )
+                        devices[device_row[0]] = device
+
+                    file_obj.device = device
+                    file_obj.device_name = device.device_name
+
+                yield file_obj
+
+            rows = cursor.fetchmany(batch_size)
+
+
+def __select_files(
+    condition: str = None,
+    parameters: tuple = (),
+    limit: int = None,
+    functions: dict = None,
+) -> list:
+    """
+    Selects files, along with the device each is on
+    See __iter_files
 
+    Returns
+    -------
+    list
+        Of File objects
+    """
+    return list(__iter_files(condition, parameters, limit, functions))
 
-def add_folder(folder: Folder) -> bool:
+
+def iter_files(
+    path: str = None, columns: list = None, batch_size: int = FETCH_BATCH_SIZE
+):
     """
-    Adds a folder to the DB
+    Streams every file, or a single file path, without loading all at once
+    See __iter_files
 
     Parameters
     ----------
-    folder : Folder
-        Folder to add
+    path : str
+        Optional single file path to get
+    columns : list
+        Optional File properties to load, from FILE_COLUMNS or "device"
+    batch_size : int
+        Rows to fetch at a time
 
     Returns
     -------
-    bool
-        True if added False otherwise
+    generator
+        Of File objects
+    """
+    if path:
+        return __iter_files(
+            "f.FilePath = ?", (path,), columns=columns, batch_size=batch_size
+        )
+
+    return __iter_files(columns=columns, batch_size=batch_size)
+
+
+def get_files(path: str = None) -> list:
+    """
+    .
+    """
+    if path:
+        return __select_files("f.FilePath = ?", (path,))
+
+    return __select_files()
+
+
+def get_file_totals() -> dict:
+    """
+    Counts backed up files and bytes on each device
+
+    Returns
+    -------
+    dict
+        Tuple of file count and bytes, keyed by device mount point
+        Files without a recorded size count as empty
     """
     with SQLiteCursor() as cursor:
         cursor.execute(
             """
-            INSERT INTO tblFolder (
-              FolderPath,
-              FolderPermissions,
-              FolderOwnerName,
-              FolderGroupName
-            )
-            SELECT ?,
-                   ?,
-                   ?,
-                   ?
-            """,
-            (
-                folder.folder_path,
-                folder.folder_permissions,
-                folder.folder_owner,
-                folder.folder_group,
-            ),
+            SELECT     d.DevicePath, COUNT(*), COALESCE(SUM(f.FileSize), 0)
+            FROM       tblFile f
+            INNER JOIN tblDevice d
+            ON         d.DeviceID = f.FileDeviceID
+            GROUP BY   d.DevicePath
+            """
         )
 
-        return (
-            DatabaseError.SUCCESS
-            if cursor.rowcount > 0
-            else DatabaseError.UNKNOWN_ERROR
-        )
-        # TODO: try/catch error handling
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
 
 
-def get_folders(folder_path: str = None) -> list:
+def get_files_by_location(folder_path: str = None, device_path: str = None) -> list:
     """
-    Gets folders from the DB
+    Gets every file under a folder and/or on a device, in one query
 
     Parameters
     ----------
     folder_path : str
-        Optionally, folder path to look for
+        Optional folder to get files under, at any depth
+    device_path : str
+        Optional mount point of the device the files are on
 
     Returns
     -------
     list
-        of folders
+        Of File objects
     """
-    with SQLiteCursor() as cursor:
-        query = """
-            SELECT FolderPath,
-                   FolderPermissions,
-                   FolderOwnerName,
-                   FolderGroupName
-            FROM   tblFolder
-            """
+    conditions = []
+    parameters = ()
+    if folder_path:
+        conditions.append("f.FilePath >= ? AND f.FilePath < ?")
+        parameters += __get_subtree_range(folder_path)
+    if device_path:
+        conditions.append("d.DevicePath = ?")
+        parameters += (device_path,)
 
-        if folder_path:
-            query += " WHERE FolderPath = ?"
-            cursor.execute(query, (folder_path,))
-        else:
-            cursor.execute(query)
+    return __select_files(" AND ".join(conditions), parameters)
+
+
+def __get_required_literal(pattern: str) -> str:
+    """
+    Finds the longest run of plain text every match of a regex must contain
+    Used to narrow down regex searches with the trigram index
+
+    Parameters
+    ----------
+    pattern : str
+        The regular expression
+
+    Returns
+    -------
+    str
+        Text every match contains, or None if there is none worth using
+    """
+    # Any branch could match, so no text is guaranteed
+    if "|" in pattern:
+        return None
+
+    runs = [""]
+    depth = 0
+    index = 0
+    while index < len(pattern):
+        character = pattern[index]
+        if character == "\\":
+            runs.append("")
+            index += 2
+            continue
+
+        if character == "[":
+            # Skip the class, including a leading ] which is literal
+            index = pattern.find("]", index + 2)
+            index = len(pattern) if index == -1 else index
+            runs.append("")
+        elif character in "*?{" and depth == 0:
+            # The character before a quantifier may not appear at all
+            runs[-1] = runs[-1][:-1]
+            runs.append("")
+            if character == "{":
+                index = pattern.find("}", index)
+                index = len(pattern) if index == -1 else index
+        elif character == "(":
+            depth += 1
+            runs.append("")
+        elif character == ")":
+            depth -= 1
+            runs.append("")
+        elif character in ".^$+*?{}":
+            runs.append("")
+        elif depth == 0:
+            runs[-1] += character
+
+        index += 1
+
+    literal = max(runs, key=len)
+    return literal if len(literal) >= 3 else None
+
+
+def __search_condition(pattern: str, mode: str) -> tuple:
+    """
+    Builds the condition matching file paths for a search
+
+    Parameters
+    ----------
+    pattern : str
+        What to search for
+    mode : str
+        One of SEARCH_MODES
+
+    Returns
+    -------
+    tuple
+        Conditions list, parameters tuple, and functions dict
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (SEARCH_TABLE,),
+        )
+        indexed = bool(cursor.fetchone())
+
+    def in_index(condition: str) -> str:
+        """
+        Matches files through the search index
+        """
+        return "f.FileID IN (SELECT rowid FROM {0} WHERE {1})".format(
+            SEARCH_TABLE, condition
+        )
+
+    def quote(text: str) -> str:
+        """
+        Makes text into a phrase, so it matches as a substring
+        """
+        return '"' + text.replace('"', '""') + '"'
+
+    conditions = []
+    parameters = ()
+    functions = {}
+    if mode == "substring":
+        if indexed and len(pattern) >= 3:
+            conditions.append(in_index("{0} MATCH ?".format(SEARCH_TABLE)))
+            parameters += (quote(pattern),)
+        else:
+            conditions.append("instr(lower(f.FilePath), lower(?)) > 0")
+            parameters += (pattern,)
+    elif mode == "glob":
+        conditions.append(
+            in_index("FilePath GLOB ?") if indexed else "f.FilePath GLOB ?"
+        )
+        parameters += (pattern,)
+    else:
+        literal = __get_required_literal(pattern)
+        if indexed and literal:
+            conditions.append(in_index("{0} MATCH ?".format(SEARCH_TABLE)))
+            parameters += (quote(literal),)
+
+        expression = re.compile(pattern)
+        functions["regexp"] = lambda _, path: bool(expression.search(path))
+        conditions.append("f.FilePath REGEXP ?")
+        parameters += (pattern,)
+
+    return conditions, parameters, functions
+
+
+# pylint: disable=too-many-arguments
+def search_files(
+    pattern: str = None,
+    mode: str = "substring",
+    min_size: int = None,
+    max_size: int = None,
+    owner: str = None,
+    device_path: str = None,
+    checksum: str = None,
+    limit: int = None,
+) -> list:
+    """
+    Searches backed-up files
+    Paths are matched with the trigram index where possible, never in Python
+    unless a regex is needed to confirm a match
+
+    Parameters
+    ----------
+    pattern : str
+        Optional text, glob or regex to match paths against
+    mode : str
+        How to match the pattern, one of SEARCH_MODES
+    min_size : int
+        Optional smallest size in bytes, excluding files of unknown size
+    max_size : int
+        Optional largest size in bytes, excluding files of unknown size
+    owner : str
+        Optional owning user
+    device_path : str
+        Optional mount point of the device files are on
+    checksum : str
+        Optional exact checksum
+    limit : int
+        Optional maximum number of files to return
+
+    Returns
+    -------
+    list
+        Matching File objects
+    """
+    conditions = []
+    parameters = ()
+    functions = {}
+    if pattern:
+        conditions, parameters, functions = __search_condition(pattern, mode)
+
+    for condition, value in [
+        ("f.FileSize >= ?", min_size),
+        ("f.FileSize <= ?", max_size),
+        ("f.FileOwnerName = ?", owner),
+        ("d.DevicePath = ?", device_path),
+        ("f.FileChecksum = ?", checksum),
+    ]:
+        if value is not None:
+            conditions.append(condition)
+            parameters += (value,)
+
+    return __select_files(" AND ".join(conditions), parameters, limit, functions)
+
+
+def remove_file(path: str) -> bool:
+    """
+    Removes a file
+
+    Parameters
+    ----------
+    path : str
+        Path to remove
+
+    Returns
+    -------
+    bool
+        True if removed, false if failed or doesn't exist
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute("DELETE FROM tblFile WHERE FilePath = ? ", (path,))
+        return (
+            DatabaseError.SUCCESS
+            if cursor.rowcount > 0
+            else DatabaseError.NONEXISTENT_FILE
+        )
+
+
+def add_folder(folder: Folder) -> bool:
+    """
+    Adds a folder to the DB
+
+    Parameters
+    ----------
+    folder : Folder
+        Folder to add
+
+    Returns
+    -------
+    bool
+        True if added False otherwise
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO tblFolder (
+              FolderPath,
+              FolderPermissions,
+              FolderOwnerName,
+              FolderGroupName,
+              FolderDirectoryID
+            )
+            SELECT ?,
+                   ?,
+                   ?,
+                   ?,
+                   ?
+            """,
+            (
+                folder.folder_path,
+                folder.folder_permissions,
+                folder.folder_owner,
+                folder.folder_group,
+                __get_directory_id(cursor, folder.folder_path, True),
+            ),
+        )
+
+        return (
+            DatabaseError.SUCCESS
+            if cursor.rowcount > 0
+            else DatabaseError.UNKNOWN_ERROR
+        )
+        # TODO: try/catch error handling
+
+
+def get_folders(folder_path: str = None) -> list:
+    """
+    Gets folders from the DB
+
+    Parameters
+    ----------
+    folder_path : str
+        Optionally, folder path to look for
+
+    Returns
+    -------
+    list
+        of folders
+    """
+    with SQLiteCursor() as cursor:
+        query = """
+            SELECT FolderPath,
+                   FolderPermissions,
+                   FolderOwnerName,
+                   FolderGroupName
+            FROM   tblFolder
+            """
+
+        if folder_path:
+            query += " WHERE FolderPath = ?"
+            cursor.execute(query, (folder_path,))
+        else:
+            cursor.execute(query)
 
         results = cursor.fetchall()
         folders = []
@@ -545,13 +1363,30 @@ def get_entries_for_folder(folder_path: str) -> DirectoryEntries:
 
     entries = DirectoryEntries([], [])
     with SQLiteCursor() as cursor:
-        cursor.execute(
+        directory_id = __get_directory_id(cursor, folder_path, False)
+        if directory_id is None:
+            return entries
+
+        # Both queries walk the same subtree of the directory tree
+        subtree = """
+            WITH RECURSIVE subtree (DirectoryID) AS (
+                SELECT ?
+                UNION ALL
+                SELECT     d.DirectoryID
+                FROM       tblDirectory d
+                INNER JOIN subtree s
+                ON         d.DirectoryParentID = s.DirectoryID
+            )
             """
+
+        cursor.execute(
+            subtree
+            + """
             SELECT FolderPath
             FROM   tblFolder
-            WHERE  FolderPath LIKE ? || '%'
+            WHERE  FolderDirectoryID IN subtree
             """,
-            (folder_path,),
+            (directory_id,),
         )
 
         results = cursor.fetchall()
@@ -559,12 +1394,13 @@ def get_entries_for_folder(folder_path: str) -> DirectoryEntries:
             entries.folders.append(result[0])
 
         cursor.execute(
-            """
+            subtree
+            + """
             SELECT FilePath
             FROM   tblFile
-            WHERE  FilePath LIKE ? || '%'
+            WHERE  FileDirectoryID IN subtree
             """,
-            (folder_path,),
+            (directory_id,),
         )
 
         results = cursor.fetchall()
@@ -624,10 +1460,15 @@ def update_file_path(current_path: str, new_path: str) -> DatabaseError:
             cursor.execute(
                 """
                 UPDATE tblFile
-                SET    FilePath = ?
+                SET    FilePath = ?,
+                       FileDirectoryID = ?
                 WHERE  FilePath = ?
                 """,
-                (new_path, current_path,),
+                (
+                    new_path,
+                    __get_directory_id(cursor, dirname(new_path), True),
+                    current_path,
+                ),
             )
             return (
                 DatabaseError.SUCCESS
@@ -659,10 +1500,15 @@ def update_folder_path(current_path: str, new_path: str) -> DatabaseError:
             cursor.execute(
                 """
                 UPDATE tblFolder
-                SET    FolderPath = ?
+                SET    FolderPath = ?,
+                       FolderDirectoryID = ?
                 WHERE  FolderPath = ?
                 """,
-                (new_path, current_path,),
+                (
+                    new_path,
+                    __get_directory_id(cursor, new_path, True),
+                    current_path,
+                ),
             )
             return (
                 DatabaseError.SUCCESS
@@ -673,6 +1519,192 @@ def update_folder_path(current_path: str, new_path: str) -> DatabaseError:
         return DatabaseError.FOLDER_EXISTS
 
 
+def __get_subtree_range(folder_path: str) -> tuple:
+    """
+    Gets bounds for paths strictly inside a folder
+    Since "0" sorts directly after "/", every path under the folder falls
+    between the two, so comparisons can use the unique path indices
+
+    Parameters
+    ----------
+    folder_path : str
+        Absolute path of the folder
+
+    Returns
+    -------
+    tuple
+        Inclusive lower and exclusive upper bound
+    """
+    prefix = folder_path.rstrip("/")
+    return prefix + "/", prefix + "0"
+
+
+def __merge_directory(cursor: SQLiteCursor, source_id: int, target_id: int) -> None:
+    """
+    Moves everything in one directory node into another, recursively,
+    then removes the emptied node
+
+    Parameters
+    ----------
+    cursor : SQLiteCursor
+        Cursor to query with
+    source_id : int
+        The directory being merged away
+    target_id : int
+        The directory to merge into
+    """
+    cursor.execute(
+        "UPDATE tblFile SET FileDirectoryID = ? WHERE FileDirectoryID = ?",
+        (target_id, source_id),
+    )
+    cursor.execute(
+        "UPDATE tblFolder SET FolderDirectoryID = ? WHERE FolderDirectoryID = ?",
+        (target_id, source_id),
+    )
+
+    cursor.execute(
+        """
+        SELECT     s.DirectoryID,
+                   t.DirectoryID
+        FROM       tblDirectory s
+        LEFT JOIN  tblDirectory t
+        ON         t.DirectoryParentID = ?
+        AND        t.DirectoryName = s.DirectoryName
+        WHERE      s.DirectoryParentID = ?
+        """,
+        (target_id, source_id),
+    )
+    for child_id, existing_id in cursor.fetchall():
+        if existing_id:
+            __merge_directory(cursor, child_id, existing_id)
+        else:
+            cursor.execute(
+                "UPDATE tblDirectory SET DirectoryParentID = ? WHERE DirectoryID = ?",
+                (target_id, child_id),
+            )
+
+    cursor.execute("DELETE FROM tblDirectory WHERE DirectoryID = ?", (source_id,))
+
+
+def __move_directory(cursor: SQLiteCursor, current_path: str, new_path: str) -> None:
+    """
+    Moves a node of the directory tree, merging it if the destination exists
+
+    Parameters
+    ----------
+    cursor : SQLiteCursor
+        Cursor to query with
+    current_path : str
+        Current path of the directory
+    new_path : str
+        New path of the directory
+    """
+    source_id = __get_directory_id(cursor, current_path, False)
+    if source_id is None:
+        return
+
+    parent_id = __get_directory_id(cursor, dirname(new_path), True)
+    name = basename(new_path)
+    cursor.execute(
+        """
+        SELECT DirectoryID
+        FROM   tblDirectory
+        WHERE  DirectoryParentID = ?
+        AND    DirectoryName = ?
+        """,
+        (parent_id, name),
+    )
+    existing = cursor.fetchone()
+
+    if existing:
+        __merge_directory(cursor, source_id, existing[0])
+    else:
+        cursor.execute(
+            """
+            UPDATE tblDirectory
+            SET    DirectoryParentID = ?,
+                   DirectoryName = ?
+            WHERE  DirectoryID = ?
+            """,
+            (parent_id, name, source_id),
+        )
+
+
+def move_folder_path(current_path: str, new_path: str) -> DatabaseError:
+    """
+    Moves a folder, and every file and folder under it, in one transaction
+    The destination must not be inside the folder being moved
+
+    Parameters
+    ----------
+    current_path : string
+        Current folder path
+    new_path :  string
+        New folder path (including name)
+
+    Returns
+    -------
+    DatabaseError
+        Database result code
+    """
+    lower, upper = __get_subtree_range(current_path)
+    # Prefix length, so substr from here on keeps the separator
+    offset = len(current_path.rstrip("/")) + 1
+    new_prefix = new_path.rstrip("/")
+    tables = [
+        ("tblFile", "File", DatabaseError.FILE_EXISTS),
+        ("tblFolder", "Folder", DatabaseError.FOLDER_EXISTS),
+    ]
+
+    def in_subtree(alias: str, prefix: str) -> str:
+        """
+        Condition for a path being the folder, or inside it
+        """
+        return "({0}.{1}Path = ? OR ({0}.{1}Path >= ? AND {0}.{1}Path < ?))".format(
+            alias, prefix
+        )
+
+    result = DatabaseError.SUCCESS
+    try:
+        with SQLiteCursor() as cursor:
+            # Check every table before changing anything
+            for table, prefix, collision in tables:
+                cursor.execute(
+                    "SELECT     1 "
+                    "FROM       {0} s "
+                    "INNER JOIN {0} t "
+                    "ON         t.{1}Path = ? || substr(s.{1}Path, ?) "
+                    "WHERE      {2} "
+                    "AND        NOT {3} "
+                    "LIMIT      1".format(
+                        table, prefix, in_subtree("s", prefix), in_subtree("t", prefix)
+                    ),
+                    (new_prefix, offset) + (current_path, lower, upper) * 2,
+                )
+                if cursor.fetchone():
+                    return collision
+
+            moved_count = 0
+            for table, prefix, _ in tables:
+                cursor.execute(
+                    "UPDATE {0} "
+                    "SET    {1}Path = ? || substr({1}Path, ?) "
+                    "WHERE  {2}".format(table, prefix, in_subtree(table, prefix)),
+                    (new_prefix, offset, current_path, lower, upper),
+                )
+                moved_count += cursor.rowcount
+
+            if moved_count:
+                __move_directory(cursor, current_path, new_prefix)
+            else:
+                result = DatabaseError.NONEXISTENT_FOLDER
+    except sqlite3.IntegrityError:
+        # Only possible if paths within the moved folder collide mid-update
+        result = DatabaseError.FOLDER_EXISTS
+
+    return result
+
+
 def update_file_device(file_path: str, device_mount_path: str) -> DatabaseError:
     """
     Updates the device a given file path is backed up on
@@ -703,11 +1735,643 @@ def update_file_device(file_path: str, device_mount_path: str) -> DatabaseError:
                 """,
                 (device_mount_path, file_path,),
             )
+            if cursor.rowcount == 0:
+                return DatabaseError.NONEXISTENT_FILE
 
-            return (
-                DatabaseError.SUCCESS
-                if cursor.rowcount > 0
-                else DatabaseError.NONEXISTENT_FILE
+            # A copy already on the device is now the file's own
+            cursor.execute(
+                """
+                DELETE FROM tblFileReplica
+                WHERE       (FileID, DeviceID) IN (
+                    SELECT FileID, FileDeviceID
+                    FROM   tblFile
+                    WHERE  FilePath = ?
+                )
+                """,
+                (file_path,),
             )
+            return DatabaseError.SUCCESS
     except sqlite3.IntegrityError:
         return DatabaseError.NONEXISTENT_DEVICE
+
+
+def add_file_replicas(file_path: str, device_mount_paths: list) -> DatabaseError:
+    """
+    Records further copies of a file, on other devices
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the backed up file
+    device_mount_paths : list
+        Mount paths of the devices holding a copy
+
+    Returns
+    -------
+    DatabaseError
+        Result
+    """
+    try:
+        with SQLiteCursor() as cursor:
+            for device_mount_path in device_mount_paths:
+                cursor.execute(
+                    """
+                    INSERT INTO tblFileReplica (FileID, DeviceID)
+                    SELECT f.FileID, d.DeviceID
+                    FROM   tblFile f, tblDevice d
+                    WHERE  f.FilePath = ?
+                      AND  d.DevicePath = ?
+                      AND  d.DeviceID <> f.FileDeviceID
+                    """,
+                    (file_path, device_mount_path),
+                )
+                if cursor.rowcount == 0:
+                    # Rolls back any recorded already
+                    raise LookupError(device_mount_path)
+    except LookupError:
+        return (
+            DatabaseError.NONEXISTENT_DEVICE
+            if file_exists(file_path)
+            else DatabaseError.NONEXISTENT_FILE
+        )
+    except sqlite3.IntegrityError:
+        return DatabaseError.FILE_EXISTS
+
+    return DatabaseError.SUCCESS
+
+
+def bulk_add_file_replicas(replicas: list) -> int:
+    """
+    Records many further copies of files in one transaction,
+    e.g. when rebuilding the catalog
+    Copies of unknown files, or on unknown devices, are skipped
+
+    Parameters
+    ----------
+    replicas : list
+        Tuples of each file's path, and the mount path of a device with a copy
+
+    Returns
+    -------
+    int
+        Number of copies added
+    """
+    with SQLiteCursor() as cursor:
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO tblFileReplica (FileID, DeviceID)
+            SELECT f.FileID, d.DeviceID
+            FROM   tblFile f, tblDevice d
+            WHERE  f.FilePath = ?
+              AND  d.DevicePath = ?
+              AND  d.DeviceID <> f.FileDeviceID
+            """,
+            replicas,
+        )
+        return cursor.rowcount
+
+
+def get_file_replicas(file_path: str) -> list:
+    """
+    Lists the devices holding further copies of a file
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the backed up file
+
+    Returns
+    -------
+    list
+        Mount paths of the devices
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            SELECT d.DevicePath
+            FROM   tblFile f
+                   INNER JOIN tblFileReplica r
+                     ON r.FileID = f.FileID
+                   INNER JOIN tblDevice d
+                     ON d.DeviceID = r.DeviceID
+            WHERE  f.FilePath = ?
+            ORDER BY d.DevicePath
+            """,
+            (file_path,),
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_replica_locations(file_path: str = None) -> list:
+    """
+    Lists where further copies of files are kept
+
+    Parameters
+    ----------
+    file_path : str
+        Optional path of the only file to list copies of
+
+    Returns
+    -------
+    list
+        Tuples of each file's path, and the mount path of a device with a copy
+    """
+    with SQLiteCursor() as cursor:
+        query = (
+            "SELECT     f.FilePath, "
+            "           d.DevicePath "
+            "FROM       tblFileReplica r "
+            "INNER JOIN tblFile f "
+            "ON         f.FileID = r.FileID "
+            "INNER JOIN tblDevice d "
+            "ON         d.DeviceID = r.DeviceID"
+        )
+
+        if file_path:
+            query += " WHERE f.FilePath = ?"
+            cursor.execute(query, (file_path,))
+        else:
+            cursor.execute(query)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def get_parity_locations(file_path: str = None) -> list:
+    """
+    Lists the devices holding each parity group's files and parity blocks,
+    for every file in a group
+
+    Parameters
+    ----------
+    file_path : str
+        Optional path of the only file to list its group for
+
+    Returns
+    -------
+    list
+        Tuples of each file's path, its group's ID,
+        and the mount path of a device with a file or parity block of the group
+    """
+    with SQLiteCursor() as cursor:
+        query = (
+            "SELECT     o_f.FilePath, "
+            "           o.ParityGroupID, "
+            "           d.DevicePath "
+            "FROM       tblParityMember o "
+            "INNER JOIN tblFile o_f "
+            "ON         o_f.FileID = o.FileID "
+            "INNER JOIN tblParityMember m "
+            "ON         m.ParityGroupID = o.ParityGroupID "
+            "LEFT JOIN  tblFile f "
+            "ON         f.FileID = m.FileID "
+            "INNER JOIN tblDevice d "
+            "ON         d.DeviceID = COALESCE(f.FileDeviceID, m.DeviceID)"
+        )
+
+        if file_path:
+            query += " WHERE o_f.FilePath = ?"
+            cursor.execute(query, (file_path,))
+        else:
+            cursor.execute(query)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def get_unprotected_files() -> list:
+    """
+    Lists files with neither copies on other devices nor parity
+
+    Returns
+    -------
+    list
+        Of File objects
+    """
+    return __select_files(
+        "NOT EXISTS ("
+        "  SELECT * FROM tblFileReplica r WHERE r.FileID = f.FileID"
+        ") AND NOT EXISTS ("
+        "  SELECT * FROM tblParityMember m WHERE m.FileID = f.FileID"
+        ")"
+    )
+
+
+def add_parity_group(files: list, sizes: list, parity_members: list) -> DatabaseError:
+    """
+    Records a group of files coded together, and their parity blocks
+
+    Parameters
+    ----------
+    files : list
+        Paths of the files, in the order they were coded
+    sizes : list
+        Size of each file when coded
+    parity_members : list
+        ParityMember for each parity block, in order
+
+    Returns
+    -------
+    DatabaseError
+        Result
+    """
+    try:
+        with SQLiteCursor() as cursor:
+            cursor.execute(
+                "INSERT INTO tblParityGroup (ParityGroupDataCount) VALUES (?)",
+                (len(files),),
+            )
+            group_id = cursor.lastrowid
+            for index, (file_path, size) in enumerate(zip(files, sizes)):
+                cursor.execute(
+                    """
+                    INSERT INTO tblParityMember (
+                        ParityGroupID,
+                        ParityMemberIndex,
+                        FileID,
+                        ParityMemberSize
+                    )
+                    SELECT ?, ?, FileID, ?
+                    FROM   tblFile
+                    WHERE  FilePath = ?
+                    """,
+                    (group_id, index, size, file_path),
+                )
+                if cursor.rowcount == 0:
+                    # Rolls back the group
+                    raise LookupError(file_path)
+
+            for index, member in enumerate(parity_members, len(files)):
+                cursor.execute(
+                    """
+                    INSERT INTO tblParityMember (
+                        ParityGroupID,
+                        ParityMemberIndex,
+                        DeviceID,
+                        ParityMemberName,
+                        ParityMemberChecksum,
+                        ParityMemberSize
+                    )
+                    SELECT ?, ?, DeviceID, ?, ?, ?
+                    FROM   tblDevice
+                    WHERE  DevicePath = ?
+                    """,
+                    (
+                        group_id,
+                        index,
+                        member.name,
+                        member.checksum,
+                        member.size,
+                        member.device_path,
+                    ),
+                )
+                if cursor.rowcount == 0:
+                    raise LookupError(member.device_path)
+    except LookupError:
+        return DatabaseError.NONEXISTENT_DEVICE
+    except sqlite3.IntegrityError:
+        return DatabaseError.FILE_EXISTS
+
+    return DatabaseError.SUCCESS
+
+
+def get_parity_group(file_path: str) -> ParityGroup:
+    """
+    Gets the group of files a file was coded with
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the backed up file
+
+    Returns
+    -------
+    ParityGroup
+        The group, or None if the file is not in one
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            SELECT   g.ParityGroupID,
+                     g.ParityGroupDataCount,
+                     d.DevicePath,
+                     COALESCE(f.FileName, m.ParityMemberName),
+                     COALESCE(f.FileChecksum, m.ParityMemberChecksum),
+                     m.ParityMemberSize
+            FROM     tblParityMember o
+                     INNER JOIN tblFile o_f
+                       ON o_f.FileID = o.FileID
+                     INNER JOIN tblParityGroup g
+                       ON g.ParityGroupID = o.ParityGroupID
+                     INNER JOIN tblParityMember m
+                       ON m.ParityGroupID = g.ParityGroupID
+                     LEFT JOIN tblFile f
+                       ON f.FileID = m.FileID
+                     INNER JOIN tblDevice d
+                       ON d.DeviceID = COALESCE(f.FileDeviceID, m.DeviceID)
+            WHERE    o_f.FilePath = ?
+            ORDER BY m.ParityMemberIndex
+            """,
+            (file_path,),
+        )
+        rows = cursor.fetchall()
+
+    if not rows:
+        return None
+
+    return ParityGroup(
+        rows[0][0], rows[0][1], [ParityMember(*row[2:]) for row in rows]
+    )
+
+
+def update_file_devices(file_paths: list, device_mount_path: str) -> list:
+    """
+    Updates the device for a batch of files, committing them together
+
+    Parameters
+    ----------
+    file_paths : list
+        Paths of the files to update device for
+    device_mount_path : str
+        Mount path of the device to use for these files
+
+    Returns
+    -------
+    list
+        The file paths updated, empty if the device does not exist
+    """
+    updated = []
+    try:
+        with SQLiteCursor() as cursor:
+            cursor.execute(
+                "SELECT DeviceID FROM tblDevice WHERE DevicePath = ?",
+                (device_mount_path,),
+            )
+            device = cursor.fetchone()
+            if not device:
+                return updated
+
+            for file_path in file_paths:
+                cursor.execute(
+                    "UPDATE tblFile SET FileDeviceID = ? WHERE FilePath = ?",
+                    (device[0], file_path),
+                )
+                if cursor.rowcount > 0:
+                    updated.append(file_path)
+                    cursor.execute(
+                        "DELETE FROM tblFileReplica WHERE DeviceID = ? AND FileID = ("
+                        "  SELECT FileID FROM tblFile WHERE FilePath = ?"
+                        ")",
+                        (device[0], file_path),
+                    )
+    except sqlite3.Error:
+        return []
+
+    return updated
+
+
+def save_device_profile(device_path: str, profile: DeviceProfile) -> DatabaseError:
+    """
+    Records the measured throughput of a device, replacing any previous one
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+    profile : DeviceProfile
+        Measured throughput
+
+    Returns
+    -------
+    DatabaseError
+        Result
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO tblDeviceProfile (
+                DeviceID,
+                ProfileReadBytesPerSecond,
+                ProfileWriteBytesPerSecond,
+                ProfileFilesPerSecond,
+                ProfileTime
+            )
+            SELECT DeviceID, ?, ?, ?, datetime('now')
+            FROM   tblDevice
+            WHERE  DevicePath = ?
+            """,
+            (
+                profile.read_bytes_per_second,
+                profile.write_bytes_per_second,
+                profile.files_per_second,
+                device_path,
+            ),
+        )
+
+        return (
+            DatabaseError.SUCCESS
+            if cursor.rowcount > 0
+            else DatabaseError.NONEXISTENT_DEVICE
+        )
+
+
+def get_device_profiles() -> dict:
+    """
+    Gets the measured throughput of every profiled device
+
+    Returns
+    -------
+    dict
+        DeviceProfile, keyed by device mount point
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            SELECT     d.DevicePath,
+                       p.ProfileReadBytesPerSecond,
+                       p.ProfileWriteBytesPerSecond,
+                       p.ProfileFilesPerSecond
+            FROM       tblDeviceProfile p
+            INNER JOIN tblDevice d
+            ON         d.DeviceID = p.DeviceID
+            """
+        )
+
+        return {row[0]: DeviceProfile(*row[1:]) for row in cursor.fetchall()}
+
+
+def get_security_names(folder_path: str = None) -> tuple:
+    """
+    Gets the distinct owner and group names of backed up files and folders
+
+    Parameters
+    ----------
+    folder_path : str
+        Optional folder to limit to, including the folder itself
+
+    Returns
+    -------
+    tuple
+        Set of owner names, and set of group names
+    """
+    file_condition = ""
+    folder_condition = ""
+    parameters = ()
+    if folder_path:
+        lower, upper = __get_subtree_range(folder_path)
+        file_condition = "WHERE FilePath >= ? AND FilePath < ?"
+        folder_condition = (
+            "WHERE FolderPath = ? OR (FolderPath >= ? AND FolderPath < ?)"
+        )
+        parameters = (lower, upper, folder_path, lower, upper)
+
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            SELECT FileOwnerName, FileGroupName
+            FROM   tblFile
+            {0}
+            UNION
+            SELECT FolderOwnerName, FolderGroupName
+            FROM   tblFolder
+            {1}
+            """.format(
+                file_condition, folder_condition
+            ),
+            parameters,
+        )
+        rows = cursor.fetchall()
+
+    return {row[0] for row in rows}, {row[1] for row in rows}
+
+
+def add_dirty_paths(paths: dict) -> None:
+    """
+    Journals paths changed on disk, to be checked by the next update
+
+    Parameters
+    ----------
+    paths : dict
+        Whether everything beneath each path may have changed too, keyed by path
+    """
+    with SQLiteCursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO tblDirtyPath (DirtyPath, DirtyPathRecursive) VALUES (?, ?)",
+            [(dirty_path, int(recursive)) for dirty_path, recursive in paths.items()],
+        )
+
+
+def get_dirty_paths(folder_path: str) -> tuple:
+    """
+    Gets the paths journaled as changed in a folder, including the folder itself
+    A folder containing it journaled as recursive, as a watched folder is when
+    watching starts or events are dropped, makes the whole folder recursive
+
+    Parameters
+    ----------
+    folder_path : str
+        Absolute path of the folder
+
+    Returns
+    -------
+    tuple
+        ID of the latest journal entry read, or None if there were none,
+        and whether everything beneath each path may have changed, keyed by path
+    """
+    lower, upper = __get_subtree_range(folder_path)
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            SELECT   DirtyPath, MAX(DirtyPathRecursive), MAX(DirtyPathID)
+            FROM     tblDirtyPath
+            WHERE    DirtyPath = ? OR (DirtyPath >= ? AND DirtyPath < ?)
+            GROUP BY DirtyPath
+            """,
+            (folder_path, lower, upper),
+        )
+        rows = cursor.fetchall()
+
+        ancestors = []
+        parent_path = folder_path
+        while dirname(parent_path) != parent_path:
+            parent_path = dirname(parent_path)
+            ancestors.append(parent_path)
+        # Left for updates of the folders they were journaled for to clear
+        cursor.execute(
+            """
+            SELECT MAX(DirtyPathID)
+            FROM   tblDirtyPath
+            WHERE  DirtyPathRecursive = 1
+                   AND DirtyPath IN ({0})
+            """.format(", ".join("?" * len(ancestors))),
+            ancestors,
+        )
+        ancestor_id = cursor.fetchone()[0]
+
+    dirty = {row[0]: bool(row[1]) for row in rows}
+    row_ids = [row[2] for row in rows]
+    if ancestor_id is not None:
+        dirty[folder_path] = True
+        row_ids.append(ancestor_id)
+    return max(row_ids, default=None), dirty
+
+
+def clear_dirty_paths(folder_path: str, last_id: int) -> None:
+    """
+    Removes journal entries for a folder once it has been updated
+    Entries added since it was read are kept, for the next update
+
+    Parameters
+    ----------
+    folder_path : str
+        Absolute path of the folder
+    last_id : int
+        ID of the latest journal entry the update read
+    """
+    lower, upper = __get_subtree_range(folder_path)
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM tblDirtyPath
+            WHERE       DirtyPathID <= ?
+                        AND (DirtyPath = ? OR (DirtyPath >= ? AND DirtyPath < ?))
+            """,
+            (last_id, folder_path, lower, upper),
+        )
+
+
+def set_watched_folder(folder_path: str, process_id: int = None) -> None:
+    """
+    Records the process journaling changes to a folder
+
+    Parameters
+    ----------
+    folder_path : str
+        Absolute path of the folder
+    process_id : int
+        ID of the watching process, or None once it stops watching
+    """
+    with SQLiteCursor() as cursor:
+        if process_id is None:
+            cursor.execute(
+                "DELETE FROM tblWatchedFolder WHERE WatchedFolderPath = ?",
+                (folder_path,),
+            )
+        else:
+            cursor.execute(
+                "INSERT OR REPLACE INTO tblWatchedFolder "
+                "(WatchedFolderPath, WatchedFolderProcessID) VALUES (?, ?)",
+                (folder_path, process_id),
+            )
+
+
+def get_watched_folders() -> dict:
+    """
+    Gets every folder being watched for changes
+
+    Returns
+    -------
+    dict
+        ID of the watching process, keyed by folder path
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            "SELECT WatchedFolderPath, WatchedFolderProcessID FROM tblWatchedFolder"
+        )
+        return dict(cursor.fetchall())
@@ -0,0 +1,171 @@
+"""
+Measures how fast each backup device is, to guide placement and estimates
+"""
+from collections import namedtuple
+import os
+import os.path as os_path
+import shutil
+import time
+
+DeviceProfile = namedtuple(
+    "device_profile", "read_bytes_per_second write_bytes_per_second files_per_second"
+)
+
+PROFILE_DIRECTORY = ".logical_backup_profile"
+CHUNK_SIZE = 1 << 20
+
+
+def __drop_cache(descriptor: int) -> None:
+    """
+    Asks the kernel to forget cached pages of a file, so reads hit the disk
+    Not every platform supports this, so it is best effort
+
+    Parameters
+    ----------
+    descriptor : int
+        Open file descriptor
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def __time_sequential(path: str, size: int) -> tuple:
+    """
+    Writes then reads back one large file
+
+    Parameters
+    ----------
+    path : str
+        File to write
+    size : int
+        Bytes to write
+
+    Returns
+    -------
+    tuple
+        Seconds to write, and seconds to read
+    """
+    chunk = os.urandom(CHUNK_SIZE)
+    start = time.perf_counter()
+    with open(path, "wb") as profile_file:
+        written = 0
+        while written < size:
+            written += profile_file.write(chunk[: size - written])
+        profile_file.flush()
+        os.fsync(profile_file.fileno())
+        __drop_cache(profile_file.fileno())
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(path, "rb") as profile_file:
+        while profile_file.read(CHUNK_SIZE):
+            pass
+    read_seconds = time.perf_counter() - start
+
+    return write_seconds, read_seconds
+
+
+def __time_small_files(directory: str, count: int, size: int) -> float:
+    """
+    Writes many small files, syncing each as a backup would
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write files in
+    count : int
+        Number of files
+    size : int
+        Bytes in each file
+
+    Returns
+    -------
+    float
+        Seconds taken
+    """
+    data = os.urandom(size)
+    start = time.perf_counter()
+    for index in range(count):
+        with open(os_path.join(directory, str(index)), "wb") as profile_file:
+            profile_file.write(data)
+            profile_file.flush()
+            os.fsync(profile_file.fileno())
+
+    return time.perf_counter() - start
+
+
+def profile_device(
+    mount_point: str,
+    sequential_size: int = 64 * CHUNK_SIZE,
+    small_file_count: int = 200,
+    small_file_size: int = 4096,
+) -> DeviceProfile:
+    """
+    Measures sequential and small-file throughput of a device
+    Test files are written to a scratch directory, removed afterwards
+
+    Parameters
+    ----------
+    mount_point : str
+        The device to measure
+    sequential_size : int
+        Bytes to write and read sequentially
+    small_file_count : int
+        Number of small files to write
+    small_file_size : int
+        Bytes in each small file
+
+    Returns
+    -------
+    DeviceProfile
+        Measured throughput
+    """
+    directory = os_path.join(mount_point, PROFILE_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    try:
+        write_seconds, read_seconds = __time_sequential(
+            os_path.join(directory, "sequential"), sequential_size
+        )
+        small_seconds = __time_small_files(directory, small_file_count, small_file_size)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # Guard against timers too coarse to see very fast devices
+    return DeviceProfile(
+        sequential_size / max(read_seconds, 1e-9),
+        sequential_size / max(write_seconds, 1e-9),
+        small_file_count / max(small_seconds, 1e-9),
+    )
+
+
+def estimate_seconds(bytes_by_device: dict, profiles: dict, for_write: bool) -> float:
+    """
+    Predicts how long moving data on or off devices will take, one at a time
+
+    Parameters
+    ----------
+    bytes_by_device : dict
+        Bytes to transfer, keyed by device mount point
+    profiles : dict
+        DeviceProfile, keyed by device mount point
+    for_write : bool
+        Whether the data is written to the devices, rather than read
+
+    Returns
+    -------
+    float
+        Seconds, or None if any device involved has not been profiled
+    """
+    seconds = 0
+    for device_path, size in bytes_by_device.items():
+        profile = profiles.get(device_path)
+        if not profile:
+            return None
+
+        seconds += size / (
+            profile.write_bytes_per_second
+            if for_write
+            else profile.read_bytes_per_second
+        )
+
+    return seconds
@@ -0,0 +1,198 @@
+"""
+Structured events, for tools consuming output rather than people reading it
+Each event is written as one line of JSON
+"""
+from enum import Enum
+import functools
+import json
+import sys
+import threading
+import time
+
+OUTPUT_FORMATS = ["text", "ndjson"]
+
+# Events are written out in blocks of this many, rather than one at a time
+BUFFER_SIZE = 1000
+
+__events = {
+    "stream": None,
+    "buffer": [],
+    "operations": [],
+    "lock": threading.Lock(),
+}
+
+
+def configure(output_format: str, stream=None) -> None:
+    """
+    Sets how output is written
+    Anything buffered for the previous stream is written out first
+
+    Parameters
+    ----------
+    output_format : str
+        One of OUTPUT_FORMATS
+    stream : file
+        Where to write events, standard output by default
+    """
+    flush()
+    __events["stream"] = (stream or sys.stdout) if output_format == "ndjson" else None
+
+
+def is_enabled() -> bool:
+    """
+    Returns whether events are written, in place of text output
+    """
+    return __events["stream"] is not None
+
+
+# pylint: disable=bad-continuation,too-many-arguments
+def emit(
+    event: str,
+    path: str = None,
+    device: str = None,
+    size: int = None,
+    duration: float = None,
+    result: bool = None,
+    error=None,
+    **details
+) -> None:
+    """
+    Writes an event, if enabled
+    Every event has the same fields, with null for any that do not apply
+
+    Parameters
+    ----------
+    event : str
+        What happened, e.g. the library operation
+    path : str
+        The file or folder operated on
+    device : str
+        Mount point of the device involved
+    size : int
+        Bytes involved
+    duration : float
+        Seconds taken
+    result : bool
+        Whether it succeeded
+    error : DatabaseError or str
+        Code for why it failed
+    details
+        Any extra fields for this kind of event
+    """
+    if not is_enabled():
+        return
+
+    fields = {
+        "event": event,
+        "time": time.time(),
+        "path": path,
+        "device": device,
+        "bytes": size,
+        "duration": duration,
+        "result": result,
+        "error": error.name if isinstance(error, Enum) else error,
+    }
+    fields.update(details)
+    line = json.dumps(fields, separators=(",", ":"), default=str) + "\n"
+
+    # Moves copy in worker threads, which time their phases too
+    with __events["lock"]:
+        __events["buffer"].append(line)
+        full = len(__events["buffer"]) >= BUFFER_SIZE
+    if full:
+        flush()
+
+
+def flush() -> None:
+    """
+    Writes out any buffered events
+    """
+    with __events["lock"]:
+        lines = __events["buffer"]
+        __events["buffer"] = []
+
+    if lines and __events["stream"]:
+        __events["stream"].write("".join(lines))
+        __events["stream"].flush()
+
+
+def record(device: str, size: int) -> None:
+    """
+    Notes the device and bytes involved in the operation being run
+
+    Parameters
+    ----------
+    device : str
+        Mount point of the device
+    size : int
+        Bytes read or written
+    """
+    if __events["operations"]:
+        details = __events["operations"][-1]
+        details["device"] = device
+        details["size"] = (details["size"] or 0) + size
+
+
+def record_error(message: str) -> None:
+    """
+    Notes an error, against the operation being run if there is one
+
+    Parameters
+    ----------
+    message : str
+        Description of the error
+    """
+    if __events["operations"]:
+        __events["operations"][-1]["message"] = message
+    else:
+        emit("error", result=False, message=message)
+
+
+def operation(event: str):
+    """
+    Emits an event for every call of a per-file library operation
+    The path is its first argument, and it succeeded if what it returns is truthy
+    A DatabaseError returned becomes the error code
+
+    Parameters
+    ----------
+    event : str
+        Name of the event
+    """
+
+    def decorator(function):
+        """
+        .
+        """
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            """
+            .
+            """
+            if not is_enabled():
+                return function(*args, **kwargs)
+
+            details = {"device": None, "size": None, "message": None}
+            __events["operations"].append(details)
+            start = time.perf_counter()
+            result = False
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                __events["operations"].pop()
+                emit(
+                    event,
+                    path=args[0] if args else next(iter(kwargs.values()), None),
+                    device=details["device"],
+                    size=details["size"],
+                    duration=time.perf_counter() - start,
+                    result=bool(result),
+                    error=result if isinstance(result, Enum) and not result else None,
+                    message=details["message"],
+                )
+
+        return wrapper
+
+    return decorator
@@ -2,28 +2,55 @@
 """
 Library files for adding, moving, verifying files ,etc
 """
-import grp
+from contextlib import ExitStack
+from datetime import timedelta
 import os
 import os.path as os_path
-import pwd
-import shutil
-from texttable import Texttable
+import re
+import threading
+import time
+import uuid
 
 from logical_backup.objects.device import Device
 from logical_backup.objects.file import File
 from logical_backup.objects.folder import Folder
 from logical_backup.db import DatabaseError
 from logical_backup import db
+from logical_backup import device_profile
+from logical_backup import events
+from logical_backup import manifest
+from logical_backup import parity
+from logical_backup import replication
 from logical_backup import utility
+from logical_backup.profiling import timed
 from logical_backup.pretty_print import (
     Color,
     readable_bytes,
+    record_progress,
     PrettyStatusPrinter,
+    ProgressDisplay,
     print_error,
 )
 
+# Copies to run at once when moving many files between devices
+COPY_THREADS = 4
+# Files whose device is updated in each database commit
+MOVE_BATCH_SIZE = 100
+# What rebalancing evens out across devices
+REBALANCE_STRATEGIES = ["space", "count", "throughput"]
 
-def add_directory(folder_path: str, mount_point: str = None) -> bool:
+# Files worked on at once in each stage of adding a folder, beyond one at a time
+# for picking devices and writing the catalog
+ADD_STAGE_WORKERS = {"check": 4, "checksum": 2, "copy": 2, "verify": 2}
+
+# Bytes read from each device so far, to spread reads across copies of files
+__device_reads = {}
+
+# Held to change bytes reserved on devices, which copies release as they finish
+__reserving = threading.Lock()
+
+
+def add_directory(folder_path: str, mount_point: str = None, copies: int = 1) -> bool:
     """
     Adds a directory to the backup
     See add_file
@@ -41,7 +68,7 @@ def add_directory(folder_path: str, mount_point: str = None) -> bool:
         if mount_point
         else True
     )
-    sufficient_space = folder_size <= total_available_space
+    sufficient_space = folder_size * copies <= total_available_space
 
     # If the given mount point is too small for the folder,
     # but there is enough space across all drives to fit the folder
@@ -62,7 +89,7 @@ def add_directory(folder_path: str, mount_point: str = None) -> bool:
         print_error(
             "Sum of available devices' space is insufficient, "
             "need {0} additional space! Exiting".format(
-                readable_bytes(folder_size - total_available_space)
+                readable_bytes(folder_size * copies - total_available_space)
             )
         )
         return False
@@ -86,12 +113,88 @@ def add_directory(folder_path: str, mount_point: str = None) -> bool:
             folder_details["group"],
         )
         all_success = all_success and db.add_folder(folder)
-    for file_path in entries.files:
-        all_success = all_success and add_file(file_path, mount_point)
+    with ProgressDisplay("Adding", len(entries.files), folder_size) as progress:
+        # Events are emitted per call of add_file, so it is called for each file
+        if all_success and events.is_enabled():
+            for file_path in entries.files:
+                all_success = add_file(file_path, mount_point, copies=copies)
+                progress.file_done(bool(all_success))
+                if not all_success:
+                    break
+        elif all_success:
+            all_success = __add_files(entries.files, mount_point, copies, progress)
 
     return all_success
 
 
+# pylint: disable=bad-continuation
+def __add_files(
+    file_paths: list, mount_point: str, copies: int, progress: ProgressDisplay
+) -> bool:
+    """
+    Adds many files at once, each stage of adding one overlapping the others
+    Stops taking new files once any fails, as adding them one by one would
+    See add_file
+
+    Returns
+    -------
+    bool
+        True if every file was added
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since asyncio is slow to import and only folder additions use it
+    from logical_backup import pipeline
+
+    reserved = {}
+
+    def finished(addition: dict, succeeded: bool) -> None:
+        """
+        .
+        """
+        if succeeded:
+            for device_path in addition["device_paths"]:
+                record_progress(device_path, addition["size"])
+        progress.file_done(succeeded)
+
+    stages = [
+        pipeline.Stage("check", __check_addition, ADD_STAGE_WORKERS["check"]),
+        pipeline.Stage("checksum", __hash_addition, ADD_STAGE_WORKERS["checksum"]),
+        pipeline.Stage(
+            "place",
+            lambda addition: __place_addition(
+                addition, mount_point, False, copies, reserved
+            ),
+            # Picks devices one file at a time, each seeing what others reserved
+            1,
+        ),
+        pipeline.Stage(
+            "copy",
+            lambda addition: __copy_addition(addition, reserved),
+            ADD_STAGE_WORKERS["copy"],
+        ),
+        pipeline.Stage("verify", __verify_addition, ADD_STAGE_WORKERS["verify"]),
+        # The only stage writing to the catalog, so writes never contend
+        pipeline.Stage(
+            "record",
+            lambda addition: addition if __record_addition(addition) else None,
+            1,
+        ),
+    ]
+
+    opened = db.open_shared_connection()
+    try:
+        return pipeline.run(
+            [{"file_path": file_path} for file_path in file_paths],
+            stages,
+            finished,
+            lambda addition: addition["file_path"],
+            stop_on_failure=True,
+        )
+    finally:
+        if opened:
+            db.close_shared_connection()
+
+
 def remove_directory(folder_path: str) -> bool:
     """
     Removes a directory from the backup
@@ -135,10 +238,7 @@ def move_directory_local(current_path: str, new_path: str) -> bool:
     Moves a directory in the backup
     See move_file_local
     """
-    entries = db.get_entries_for_folder(current_path)
-
-    all_success = True
-    absolute_new_path = new_path
+    absolute_new_path = os_path.abspath(new_path)
     # If new path already exists, add name of current path to it
     if os_path.isdir(new_path):
         absolute_new_path = os_path.join(
@@ -148,23 +248,29 @@ def move_directory_local(current_path: str, new_path: str) -> bool:
         print_error("Cannot move folder over existing file!")
         return False
 
-    # Should include base folder as well
-    for folder in entries.folders:
-        new_folder = folder.replace(current_path, absolute_new_path)
-        result = db.update_folder_path(folder, new_folder)
-        if result == DatabaseError.FOLDER_EXISTS:
-            print_error("Folder already backed up at path '{0}'!".format(new_folder))
-            all_success = False
-        elif result == DatabaseError.NONEXISTENT_FOLDER:
-            print_error("Specified folder not backed up: '{0}'!".format(new_folder))
-            all_success = False
+    if current_path == os_path.dirname(current_path) or (
+        os_path.commonpath([current_path, absolute_new_path]) == current_path
+    ):
+        print_error("Cannot move folder into itself!")
+        return False
 
-    for file_path in entries.files:
-        new_file = file_path.replace(current_path, absolute_new_path)
-        if not move_file_local(file_path, new_file):
-            all_success = False
+    # Moves the folder itself, and everything under it
+    result = db.move_folder_path(current_path, absolute_new_path)
+    if result == DatabaseError.FOLDER_EXISTS:
+        print_error(
+            "Folder already backed up at path '{0}'!".format(absolute_new_path)
+        )
+    elif result == DatabaseError.FILE_EXISTS:
+        print_error(
+            "File already backed up under path '{0}'!".format(absolute_new_path)
+        )
+    elif result == DatabaseError.NONEXISTENT_FOLDER:
+        print_error("Specified folder not backed up: '{0}'!".format(current_path))
+    else:
+        for file_obj in db.get_files_by_location(folder_path=absolute_new_path):
+            manifest.record_added(file_obj.device.device_path, file_obj)
 
-    return all_success
+    return bool(result)
 
 
 def move_directory_device(current_path: str, device: str) -> bool:
@@ -172,15 +278,702 @@ def move_directory_device(current_path: str, device: str) -> bool:
     Moves a directory in the backup
     See move_file_device
     """
-    entries = db.get_entries_for_folder(current_path)
-    total_file_size = utility.sum_file_size(entries.files)
-    device_space = utility.get_device_space(device)
+    files = db.get_files_by_location(folder_path=current_path)
+    if not files:
+        print_error("Specified folder not backed up: '{0}'!".format(current_path))
+        return False
+
+    return __move_files_to_device(files, device)
+
+
+def move_device(from_device: str, device: str) -> bool:
+    """
+    Moves everything backed up on one device onto another
+    Intended for emptying a failing drive
+
+    Parameters
+    ----------
+    from_device : str
+        Mount point of the device to empty
+    device : str
+        Mount point of the device to move files onto
+
+    Returns
+    -------
+    bool
+        True if every file was moved
+    """
+    if from_device == device:
+        print_error("Cannot move files onto the device they are already on!")
+        return False
+
+    return __move_files_to_device(
+        db.get_files_by_location(device_path=from_device), device
+    )
+
+
+def __copy_backup(file_obj: File, device: str, throttle: float = None) -> tuple:
+    """
+    Copies a backed-up file to a new device, verifying the copy's checksum
+    Run in worker threads, so must not print, other than status hidden by
+    the progress shown
+
+    Parameters
+    ----------
+    file_obj : File
+        The file to copy
+    device : str
+        Mount point of the device to copy onto
+    throttle : float
+        Optional bytes per second to limit the copy to
+
+    Returns
+    -------
+    tuple
+        The file, the path copied to, and whether the copy is valid
+    """
+    current_path = os_path.join(file_obj.device.device_path, file_obj.file_name)
+    new_path = os_path.join(device, file_obj.file_name)
+    start = time.monotonic()
+    try:
+        checksum = utility.copy_and_checksum(current_path, new_path)
+        utility.copy_file_metadata(current_path, new_path)
+        # That only shows what was read, so the copy is synced, dropped from
+        # the cache and read back from the device before the original goes
+        descriptor = os.open(new_path, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+            os.posix_fadvise(descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(descriptor)
+        if checksum == file_obj.checksum:
+            checksum = utility.checksum_file(new_path)
+    except OSError:
+        checksum = None
+
+    if throttle:
+        # Wait out however long the copy should have taken at this rate
+        time.sleep(
+            max(
+                0,
+                utility.get_file_size(current_path) / throttle
+                - (time.monotonic() - start),
+            )
+        )
+
+    return file_obj, new_path, checksum == file_obj.checksum
+
 
-    if total_file_size >= device_space:
+def __commit_moved_files(copied: list, device: str) -> bool:
+    """
+    Points a batch of copied files at their new device
+    Old copies are only removed once the database change is committed
+
+    Parameters
+    ----------
+    copied : list
+        Tuples of each file and the path it was copied to
+    device : str
+        Mount point of the device the files were copied onto
+
+    Returns
+    -------
+    bool
+        True if every file in the batch was updated
+    """
+    with timed("db", device):
+        updated = set(
+            db.update_file_devices(
+                [file_obj.file_path for file_obj, _ in copied], device
+            )
+        )
+
+    for file_obj, new_path in copied:
+        if file_obj.file_path in updated:
+            os.remove(
+                os_path.join(file_obj.device.device_path, file_obj.file_name)
+            )
+            manifest.record_removed(file_obj.device.device_path, file_obj.file_name)
+            manifest.record_added(device, file_obj)
+        else:
+            print_error(
+                "Failed to update device for file in database: {0}".format(
+                    file_obj.file_path
+                )
+            )
+            os.remove(new_path)
+
+    return len(updated) == len(copied)
+
+
+def __move_files_to_device(files: list, device: str, throttle: float = None) -> bool:
+    """
+    Moves backed-up files onto a device
+    Space and source devices are checked once up front, then files are
+    copied in parallel, with database updates committed in batches
+
+    Parameters
+    ----------
+    files : list
+        File objects to move
+    device : str
+        Mount point of the device to move them onto
+    throttle : float
+        Optional bytes per second to limit copying to, copying one at a time
+
+    Returns
+    -------
+    bool
+        True if every file was moved
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since only moves between devices copy in parallel
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = [file_obj for file_obj in files if file_obj.device.device_path != device]
+    excluded = __excluded_devices()
+    conflicts = []
+    for file_obj in files:
+        file_excluded = excluded.get(file_obj.file_path, set())
+        if device in file_excluded:
+            conflicts.append(file_obj.file_path)
+        # Other files of its parity group cannot join it there
+        file_excluded.add(device)
+    if conflicts:
+        print_error(
+            "Device already holds another copy, or parity group member, "
+            "of backed-up files: {0}".format(", ".join(sorted(conflicts)))
+        )
+        return False
+
+    source_devices = {file_obj.device.device_path for file_obj in files}
+    missing_devices = [
+        device_path
+        for device_path in source_devices
+        if not os_path.ismount(device_path)
+    ]
+    if missing_devices:
+        print_error(
+            "Device for backed-up files is not attached: {0}".format(
+                ", ".join(sorted(missing_devices))
+            )
+        )
+        return False
+
+    total_size = 0
+    bytes_by_device = {}
+    sizes = {}
+    for file_obj in files:
+        backup_size = __get_backup_size(file_obj)
+        if backup_size is None:
+            print_error("Cannot find back up of file: {0}".format(file_obj.file_path))
+            return False
+        total_size += backup_size
+        sizes[file_obj.file_path] = backup_size
+        bytes_by_device[file_obj.device.device_path] = (
+            bytes_by_device.get(file_obj.device.device_path, 0) + backup_size
+        )
+
+    if total_size >= utility.get_device_space(device):
         print_error("Selected device cannot fit all the requested files!")
         return False
 
-    return all([move_file_device(file_path, device) for file_path in entries.files])
+    # Reads and writes overlap, so the slower side sets the pace
+    profiles = db.get_device_profiles()
+    read_seconds = device_profile.estimate_seconds(bytes_by_device, profiles, False)
+    write_seconds = device_profile.estimate_seconds(
+        {device: total_size}, profiles, True
+    )
+    if read_seconds is not None and write_seconds is not None:
+        __print_estimate(max(read_seconds, write_seconds))
+
+    all_moved = True
+    batch = []
+    progress_display = ProgressDisplay(
+        "Moving to " + device, len(files), total_size, bytes_by_device
+    )
+    with ThreadPoolExecutor(
+        max_workers=1 if throttle else COPY_THREADS
+    ) as executor, progress_display as progress:
+        for file_obj, new_path, valid in executor.map(
+            lambda file_obj: __copy_backup(file_obj, device, throttle), files
+        ):
+            progress.add_bytes(file_obj.device.device_path, sizes[file_obj.file_path])
+            progress.file_done(valid)
+            events.emit(
+                "move-device",
+                path=file_obj.file_path,
+                device=device,
+                size=sizes[file_obj.file_path],
+                result=valid,
+            )
+            if not valid:
+                print_error(
+                    "Checksum verification mismatch: {0}".format(file_obj.file_path)
+                )
+                if os_path.isfile(new_path):
+                    os.remove(new_path)
+                all_moved = False
+                continue
+
+            batch.append((file_obj, new_path))
+            if len(batch) >= MOVE_BATCH_SIZE:
+                all_moved = __commit_moved_files(batch, device) and all_moved
+                batch = []
+
+    if batch:
+        all_moved = __commit_moved_files(batch, device) and all_moved
+
+    return all_moved
+
+
+def __excluded_devices(file_path: str = None) -> dict:
+    """
+    Finds the devices files cannot be moved onto, as those already hold
+    another copy of them, which moving there would overwrite,
+    or another file or parity block of their parity group,
+    which moving there would leave unable to survive losing that device
+
+    Parameters
+    ----------
+    file_path : str
+        Optional path of the only file to check
+
+    Returns
+    -------
+    dict
+        Sets of mount points, keyed by file path
+        Files of a parity group share one set, so once one is planned to move
+        onto a device, adding it rules that device out for the rest
+    """
+    excluded = {}
+    groups = {}
+    for excluded_path, group_id, device_path in db.get_parity_locations(file_path):
+        excluded[excluded_path] = groups.setdefault(group_id, set())
+        excluded[excluded_path].add(device_path)
+    for excluded_path, device_path in db.get_replica_locations(file_path):
+        excluded.setdefault(excluded_path, set()).add(device_path)
+    return excluded
+
+
+def __get_backup_size(file_obj: File) -> int:
+    """
+    Gets the size of the backed-up copy of a file
+
+    Parameters
+    ----------
+    file_obj : File
+        The file to check
+
+    Returns
+    -------
+    int
+        Bytes, or None if the copy is missing
+    """
+    return utility.get_file_size(
+        os_path.join(file_obj.device.device_path, file_obj.file_name)
+    )
+
+
+def __plan_rebalance(
+    device_files: dict,
+    free_space: dict,
+    strategy: str,
+    profiles: dict = None,
+    excluded: dict = None,
+) -> dict:
+    """
+    Works out which files to move so devices end up balanced
+    Only the excess over each device's target is taken off it, so as few
+    bytes as possible are moved
+
+    Parameters
+    ----------
+    device_files : dict
+        Lists of files, keyed by the mount point of the device they are on
+    free_space : dict
+        Bytes available, keyed by device mount point
+    strategy : str
+        One of REBALANCE_STRATEGIES
+    profiles : dict
+        DeviceProfile keyed by mount point, needed for the throughput strategy
+    excluded : dict
+        Sets of mount points each file cannot move onto, keyed by file path,
+        to which the receiver of each planned move is added
+
+    Returns
+    -------
+    dict
+        Lists of files to move, keyed by the mount point to move them onto
+    """
+    excluded = excluded or {}
+    sizes = {}
+    for files in device_files.values():
+        for file_obj in files:
+            sizes[file_obj.file_path] = __get_backup_size(file_obj) or 0
+
+    def weight(file_obj: File) -> int:
+        """
+        How much moving a file shifts the balance
+        """
+        return sizes[file_obj.file_path] if strategy != "count" else 1
+
+    # Higher is fuller, for every strategy
+    if strategy == "space":
+        load = {device_path: -free_space[device_path] for device_path in device_files}
+    elif strategy == "count":
+        load = {
+            device_path: len(files) for device_path, files in device_files.items()
+        }
+    else:
+        load = {
+            device_path: sum(sizes[file_obj.file_path] for file_obj in files)
+            for device_path, files in device_files.items()
+        }
+
+    if strategy == "throughput":
+        # Share out backed-up bytes by read speed, so reading everything back
+        # takes each device about the same time
+        speeds = {
+            device_path: profiles[device_path].read_bytes_per_second
+            for device_path in device_files
+        }
+        targets = {
+            device_path: sum(load.values()) * speed / sum(speeds.values())
+            for device_path, speed in speeds.items()
+        }
+    else:
+        average = sum(load.values()) / len(load)
+        targets = {device_path: average for device_path in device_files}
+
+    room = {
+        device_path: targets[device_path] - device_load
+        for device_path, device_load in load.items()
+        if device_load < targets[device_path]
+    }
+    available = dict(free_space)
+
+    plan = {}
+    for device_path, device_load in load.items():
+        excess = device_load - targets[device_path]
+        if excess <= 0:
+            continue
+
+        # Large files shed excess bytes with the fewest moves,
+        # and small ones shed excess files with the fewest bytes
+        candidates = sorted(
+            device_files[device_path],
+            key=lambda file_obj: sizes[file_obj.file_path],
+            reverse=strategy != "count",
+        )
+        for file_obj in candidates:
+            file_weight = weight(file_obj)
+            if file_weight > excess:
+                continue
+
+            receivers = [
+                receiver
+                for receiver in room
+                if room[receiver] >= file_weight
+                and available[receiver] > sizes[file_obj.file_path]
+                and receiver not in excluded.get(file_obj.file_path, ())
+            ]
+            if not receivers:
+                continue
+
+            receiver = max(receivers, key=lambda receiver: room[receiver])
+            # Other files of its parity group cannot join it there
+            excluded.get(file_obj.file_path, set()).add(receiver)
+            room[receiver] -= file_weight
+            available[receiver] -= sizes[file_obj.file_path]
+            excess -= file_weight
+            plan.setdefault(receiver, []).append(file_obj)
+
+    return plan
+
+
+def rebalance(strategy: str = "space", throttle: float = None) -> bool:
+    """
+    Moves backed-up files between devices, to even them out
+    Uses the same checksum verification as moving to a specific device
+
+    Parameters
+    ----------
+    strategy : str
+        One of REBALANCE_STRATEGIES
+    throttle : float
+        Optional bytes per second to limit copying to
+
+    Returns
+    -------
+    bool
+        True if every planned move succeeded
+    """
+    profiles = db.get_device_profiles()
+    device_files = {}
+    free_space = {}
+    for device in db.get_devices():
+        if not os_path.ismount(device.device_path):
+            print_error(
+                "Skipping device that is not attached: {0}".format(device.device_name)
+            )
+            continue
+
+        device_files[device.device_path] = db.get_files_by_location(
+            device_path=device.device_path
+        )
+        free_space[device.device_path] = utility.get_device_space(device.device_path)
+
+    if len(device_files) < 2:
+        print_error("At least two attached devices are needed to rebalance!")
+        return False
+
+    if strategy == "throughput" and [
+        device_path for device_path in device_files if device_path not in profiles
+    ]:
+        print_error("Every attached device must be profiled first!")
+        return False
+
+    plan = __plan_rebalance(
+        device_files, free_space, strategy, profiles, __excluded_devices()
+    )
+    if not plan:
+        PrettyStatusPrinter("Devices are already balanced").print_message()
+        return True
+
+    return all(
+        [
+            __move_files_to_device(files, device_path, throttle)
+            for device_path, files in plan.items()
+        ]
+    )
+
+
+def protect(data_count: int, parity_count: int) -> bool:
+    """
+    Codes backed up files in groups, each file of a group on a different device,
+    writing parity for each group to yet other devices
+    Any parity_count files of a group can then be lost and rebuilt
+    Files already kept on several devices are left as they are
+
+    Parameters
+    ----------
+    data_count : int
+        Files in each group
+    parity_count : int
+        Parity blocks for each group
+
+    Returns
+    -------
+    bool
+        True if every group was written
+    """
+    mounted = [
+        device.device_path
+        for device in db.get_devices()
+        if os_path.ismount(device.device_path)
+    ]
+    if len(mounted) < data_count + parity_count:
+        print_error(
+            "Need {0} attached devices to protect files!".format(
+                data_count + parity_count
+            )
+        )
+        return False
+
+    device_files = {device_path: [] for device_path in mounted}
+    for file_obj in db.get_unprotected_files():
+        if file_obj.device.device_path in device_files:
+            device_files[file_obj.device.device_path].append(file_obj)
+    # Files of similar size are grouped, so little parity is padding
+    for files in device_files.values():
+        files.sort(key=__get_backup_size)
+
+    all_protected = True
+    with ProgressDisplay(
+        "Protecting", sum(len(files) for files in device_files.values())
+    ) as progress:
+        while True:
+            # Devices with the most files left take them, the others the parity
+            device_paths = sorted(
+                mounted, key=lambda device_path: -len(device_files[device_path])
+            )
+            data_paths = device_paths[:data_count]
+            if not device_files[data_paths[-1]]:
+                break
+
+            files = [device_files[device_path].pop() for device_path in data_paths]
+            parity_points = sorted(
+                device_paths[data_count:], key=utility.get_device_space, reverse=True
+            )[:parity_count]
+            protected = __write_parity_group(files, parity_points)
+            for _ in files:
+                progress.file_done(protected)
+            all_protected = all_protected and protected
+
+    left = sum(len(files) for files in device_files.values())
+    if left:
+        PrettyStatusPrinter(
+            "{0} files left unprotected, too few devices hold others".format(left)
+        ).with_specific_color(Color.YELLOW).print_message()
+
+    return all_protected
+
+
+def __write_parity_group(files: list, parity_points: list) -> bool:
+    """
+    Writes parity for a group of files, and records it
+
+    Parameters
+    ----------
+    files : list
+        File objects to code together, each on a different device
+    parity_points : list
+        Mount points of the devices to write each parity block to
+
+    Returns
+    -------
+    bool
+        True if written
+    """
+    data_paths = [
+        os_path.join(file_obj.device.device_path, file_obj.file_name)
+        for file_obj in files
+    ]
+    sizes = [os_path.getsize(data_path) for data_path in data_paths]
+    if [
+        device_path
+        for device_path in parity_points
+        if utility.get_device_space(device_path) <= max(sizes)
+    ]:
+        print_error("No device with space for parity!")
+        return False
+
+    parity_names = ["parity_" + uuid.uuid4().hex for _ in parity_points]
+    parity_paths = [
+        os_path.join(device_path, name)
+        for device_path, name in zip(parity_points, parity_names)
+    ]
+    with timed("parity", data_paths[0]):
+        checksums = parity.write_parity(
+            data_paths, [file_obj.checksum for file_obj in files], parity_paths
+        )
+    if not checksums:
+        print_error(
+            "Checksum mismatch in a group of files, "
+            "verify them before protecting: {0}".format(
+                ", ".join(file_obj.file_path for file_obj in files)
+            )
+        )
+        return False
+
+    added = db.add_parity_group(
+        [file_obj.file_path for file_obj in files],
+        sizes,
+        [
+            parity.ParityMember(device_path, name, checksum, max(sizes))
+            for device_path, name, checksum in zip(
+                parity_points, parity_names, checksums
+            )
+        ],
+    )
+    if not added:
+        print_error("Failed to record parity!")
+        for parity_path in parity_paths:
+            os.remove(parity_path)
+
+    return bool(added)
+
+
+def __rebuild_from_parity(
+    file_obj: File, group: parity.ParityGroup, destination_file
+) -> bool:
+    """
+    Rebuilds a backed up file from the rest of its parity group
+
+    Parameters
+    ----------
+    file_obj : File
+        The file to rebuild
+    group : ParityGroup
+        The group it was coded in
+    destination_file : file
+        Binary file to write the rebuilt file to
+
+    Returns
+    -------
+    bool
+        True if rebuilt, and matching the file's checksum
+    """
+    message = PrettyStatusPrinter(
+        "Rebuilding {0} from parity".format(file_obj.file_path)
+    ).with_message_postfix_for_result(False, "Failed!")
+    message.print_start()
+
+    index = [member.name for member in group.members].index(file_obj.file_name)
+    with timed("parity", file_obj.file_path):
+        checksum = parity.rebuild(group, index, destination_file)
+    message.print_complete(checksum == file_obj.checksum)
+    return checksum == file_obj.checksum
+
+
+def __print_estimate(seconds: float) -> None:
+    """
+    Prints how long an operation is expected to take
+
+    Parameters
+    ----------
+    seconds : float
+        The predicted duration
+    """
+    PrettyStatusPrinter(
+        "Estimated time: {0}".format(timedelta(seconds=round(seconds)))
+    ).print_message()
+
+
+def profile_devices() -> bool:
+    """
+    Measures the throughput of every attached device, saving the results
+    These guide device selection, rebalancing and time estimates
+
+    Returns
+    -------
+    bool
+        True if every attached device was profiled
+    """
+    devices = [
+        device for device in db.get_devices() if os_path.ismount(device.device_path)
+    ]
+    if not devices:
+        print_error("No attached devices to profile!")
+        return False
+
+    all_profiled = True
+    for device in devices:
+        message = PrettyStatusPrinter(
+            "Profiling " + device.device_name
+        ).with_message_postfix_for_result(False, "Failed!")
+        message.print_start()
+
+        try:
+            profile = device_profile.profile_device(device.device_path)
+        except OSError:
+            message.print_complete(False)
+            all_profiled = False
+            continue
+
+        saved = db.save_device_profile(device.device_path, profile)
+        message.with_message_postfix_for_result(
+            True,
+            "read {0}/s, write {1}/s, {2:.0f} small files/s".format(
+                readable_bytes(profile.read_bytes_per_second),
+                readable_bytes(profile.write_bytes_per_second),
+                profile.files_per_second,
+            ),
+        ).print_complete(bool(saved))
+        all_profiled = all_profiled and bool(saved)
+
+    return all_profiled
 
 
 def __get_total_device_space() -> int:
@@ -203,7 +996,10 @@ def __get_total_device_space() -> int:
 
 # pylint: disable=bad-continuation
 def __get_device_with_space(
-    file_size: int, mount_point: str = None, size_checked: bool = False
+    file_size: int,
+    mount_point: str = None,
+    size_checked: bool = False,
+    reserved: dict = None,
 ) -> tuple:
     """
     Finds a device with given amount of space
@@ -218,12 +1014,15 @@ def __get_device_with_space(
         Used for folder addition to specific device
         True if the size of the specified device has already been checked
         for required capacity of file/s
+    reserved : dict
+        Bytes already promised to files not yet copied, keyed by mount point
 
     Returns
     -------
     tuple
         Name of the device to use, and mount point
     """
+    reserved = reserved or {}
     if mount_point and not size_checked:
         space_message = PrettyStatusPrinter(
             "Checking drive space"
@@ -231,7 +1030,7 @@ def __get_device_with_space(
         space_message.print_start()
 
         drive_space = utility.get_device_space(mount_point)
-        if file_size >= drive_space:
+        if file_size >= drive_space - reserved.get(mount_point, 0):
             space_message.print_complete(False)
             confirm = input("Switch drive? (Y/n, n exits) ")
             if confirm != "n":
@@ -249,10 +1048,17 @@ def __get_device_with_space(
         ).with_message_postfix_for_result(False, "None found!")
         auto_select_device.print_start()
 
-        devices = db.get_devices()
+        # Prefer the fastest devices, leaving unprofiled ones in their usual order
+        profiles = db.get_device_profiles()
+        devices = sorted(
+            db.get_devices(),
+            key=lambda device: -profiles[device.device_path].write_bytes_per_second
+            if device.device_path in profiles
+            else 0,
+        )
         for device in devices:
             space = utility.get_device_space(device.device_path)
-            if space > file_size:
+            if space - reserved.get(device.device_path, 0) > file_size:
                 auto_select_device.with_message_postfix_for_result(
                     True, "Selected " + device.device_name
                 ).print_complete()
@@ -274,6 +1080,48 @@ def __get_device_with_space(
     return device_name, mount_point
 
 
+# pylint: disable=bad-continuation
+def __get_replica_devices(
+    file_size: int, mount_point: str, count: int, reserved: dict = None
+) -> list:
+    """
+    Finds further devices to keep copies of a file on
+
+    Parameters
+    ----------
+    file_size : int
+        Size of the file
+    mount_point : str
+        Mount point of the device already holding the file
+    count : int
+        Number of devices wanted
+    reserved : dict
+        Bytes already promised to files not yet copied, keyed by mount point
+
+    Returns
+    -------
+    list
+        Mount points of up to count devices, the fastest first
+    """
+    reserved = reserved or {}
+    profiles = db.get_device_profiles()
+    devices = sorted(
+        db.get_devices(),
+        key=lambda device: -profiles[device.device_path].write_bytes_per_second
+        if device.device_path in profiles
+        else 0,
+    )
+    return [
+        device.device_path
+        for device in devices
+        if device.device_path != mount_point
+        and os_path.ismount(device.device_path)
+        and utility.get_device_space(device.device_path)
+        - reserved.get(device.device_path, 0)
+        > file_size
+    ][:count]
+
+
 def __remove_missing_database_entries(entries: utility.DirectoryEntries) -> bool:
     """
     Checks a given list of files and folders for existence on the file system
@@ -330,84 +1178,244 @@ def __remove_missing_database_entries(entries: utility.DirectoryEntries) -> bool
     return success
 
 
-# pylint: disable=bad-continuation
-def add_file(
-    file_path: str, mount_point: str = None, size_checked: bool = False
-) -> bool:
+def __check_addition(addition: dict) -> dict:
     """
-    Will add a file to the backup archive
+    Reads the security of a file to add, if it is not already backed up
 
     Parameters
     ----------
-    file_path : str
-        The file path to add
-    mount_point : str
-        Optionally, the mount point to prefer
-    size_checked : bool
-        Used for folder addition to specific device
-        True if the size of the specified device has already been checked
-        for required capacity of file/s
+    addition : dict
+        The file path to add, and details found so far
 
     Returns
     -------
-    bool
-        True if added, False otherwise
-          - due to database failure, hard drive failure, etc
-          - or if it already exists
+    dict
+        The addition, or None if the file is already backed up
     """
-    if db.file_exists(file_path):
+    if db.file_exists(addition["file_path"]):
         print_error("File is already backed up!")
-        return False
+        return None
+
+    addition["security"] = utility.get_file_security(addition["file_path"])
+    return addition
 
-    security_details = utility.get_file_security(file_path)
-    checksum = utility.checksum_file(file_path)
-    if not checksum:
+
+def __hash_addition(addition: dict) -> dict:
+    """
+    Checksums a file to add
+    See __check_addition
+    """
+    addition["checksum"] = utility.checksum_file(addition["file_path"])
+    if not addition["checksum"]:
         print_error("Failed to get checksum!")
-        return False
+        return None
+
+    return addition
+
+
+# pylint: disable=bad-continuation
+def __place_addition(
+    addition: dict,
+    mount_point: str,
+    size_checked: bool,
+    copies: int,
+    reserved: dict = None,
+) -> dict:
+    """
+    Reads the size of a file to add, and picks the devices to copy it to
+    See add_file for the other parameters
 
+    Parameters
+    ----------
+    addition : dict
+        The file to add, and details found so far
+    reserved : dict
+        Bytes of copies not yet written, keyed by device mount point,
+        to which the file's copies are added
+
+    Returns
+    -------
+    dict
+        The addition, or None if too few devices have space
+    """
+    reserved = {} if reserved is None else reserved
     file_size_message = PrettyStatusPrinter("Getting file size")
     file_size_message.print_start()
-
-    file_size = utility.get_file_size(file_path)
+    addition["size"] = utility.get_file_size(addition["file_path"])
     file_size_message.with_message_postfix_for_result(
-        True, "Read. File is " + readable_bytes(file_size)
+        True, "Read. File is " + readable_bytes(addition["size"])
     ).print_complete()
 
-    device_name, mount_point = __get_device_with_space(
-        file_size, mount_point, size_checked
+    device_name, mount_point = __get_device_with_space(
+        addition["size"], mount_point, size_checked, reserved
+    )
+    if not device_name:
+        print_error("No device with space available!")
+        return None
+
+    replica_points = []
+    if copies > 1:
+        replica_points = __get_replica_devices(
+            addition["size"], mount_point, copies - 1, reserved
+        )
+        if len(replica_points) < copies - 1:
+            print_error(
+                "Only {0} devices with space for {1} copies!".format(
+                    len(replica_points) + 1, copies
+                )
+            )
+            return None
+
+    backup_name = utility.create_backup_name(addition["file_path"])
+    addition["device_name"] = device_name
+    addition["backup_name"] = backup_name
+    addition["device_paths"] = [mount_point] + replica_points
+    addition["backup_paths"] = [
+        os_path.join(device_path, backup_name)
+        for device_path in addition["device_paths"]
+    ]
+    with __reserving:
+        for device_path in addition["device_paths"]:
+            reserved[device_path] = reserved.get(device_path, 0) + addition["size"]
+
+    return addition
+
+
+def __copy_addition(addition: dict, reserved: dict = None) -> dict:
+    """
+    Copies a file to add onto each of its devices
+    See __place_addition
+    """
+    file_path = addition["file_path"]
+    copied = False
+    try:
+        with timed("copy", file_path):
+            if len(addition["backup_paths"]) > 1:
+                utility.copy_to_all(file_path, addition["backup_paths"])
+            else:
+                utility.copy_file(file_path, addition["backup_paths"][0])
+            for backup_path in addition["backup_paths"]:
+                utility.copy_file_metadata(file_path, backup_path)
+        copied = True
+    finally:
+        # Nothing records a failed copy, so whatever was written is removed
+        # before its space is counted as free again
+        for backup_path in addition["backup_paths"] if not copied else []:
+            if os_path.exists(backup_path):
+                os.remove(backup_path)
+        # Written now, so free space on each device accounts for it
+        with __reserving:
+            for device_path in addition["device_paths"] if reserved else []:
+                reserved[device_path] -= addition["size"]
+
+    return addition
+
+
+def __verify_addition(addition: dict) -> dict:
+    """
+    Checks every copy of a file to add matches it, removing them if not
+    See __check_addition
+    """
+    if any(
+        utility.checksum_file(backup_path) != addition["checksum"]
+        for backup_path in addition["backup_paths"]
+    ):
+        print_error("Checksum mismatch after copy!")
+        for backup_path in addition["backup_paths"]:
+            os.remove(backup_path)
+        return None
+
+    return addition
+
+
+def __record_addition(addition: dict) -> DatabaseError:
+    """
+    Records a copied file in the catalog and device manifests,
+    removing the copies if it cannot be
+
+    Parameters
+    ----------
+    addition : dict
+        The copied file
+
+    Returns
+    -------
+    DatabaseError
+        Result of recording it
+    """
+    file_path = addition["file_path"]
+    replica_points = addition["device_paths"][1:]
+    file_obj = File()
+    file_obj.device_name = addition["device_name"]
+    file_obj.set_properties(addition["backup_name"], file_path, addition["checksum"])
+    file_obj.set_security(**addition["security"])
+    file_obj.size = addition["size"]
+
+    db_save = PrettyStatusPrinter("Saving file record to DB").print_start()
+
+    with timed("db", file_path):
+        succeeded = db.add_file(file_obj)
+        if succeeded == DatabaseError.SUCCESS and replica_points:
+            succeeded = db.add_file_replicas(file_path, replica_points)
+            if succeeded != DatabaseError.SUCCESS:
+                db.remove_file(file_path)
+    if succeeded == DatabaseError.SUCCESS:
+        for device_path in addition["device_paths"]:
+            manifest.record_added(device_path, file_obj)
+        db_save.print_complete()
+    else:
+        db_save.print_complete(False)
+        for backup_path in addition["backup_paths"]:
+            os.remove(backup_path)
+
+    return succeeded
+
+
+# pylint: disable=bad-continuation
+@events.operation("add")
+def add_file(
+    file_path: str, mount_point: str = None, size_checked: bool = False, copies: int = 1
+) -> bool:
+    """
+    Will add a file to the backup archive
+
+    Parameters
+    ----------
+    file_path : str
+        The file path to add
+    mount_point : str
+        Optionally, the mount point to prefer
+    size_checked : bool
+        Used for folder addition to specific device
+        True if the size of the specified device has already been checked
+        for required capacity of file/s
+    copies : int
+        Number of devices to keep a copy on
+
+    Returns
+    -------
+    bool
+        True if added, False otherwise
+          - due to database failure, hard drive failure, etc
+          - or if it already exists
+    """
+    addition = __check_addition({"file_path": file_path})
+    addition = addition and __hash_addition(addition)
+    addition = addition and __place_addition(
+        addition, mount_point, size_checked, copies
     )
-    if not device_name:
-        print_error("No device with space available!")
-        return False
-
-    backup_name = utility.create_backup_name(file_path)
-    backup_path = os_path.join(mount_point, backup_name)
-    shutil.copyfile(file_path, backup_path)
-
-    checksum2 = utility.checksum_file(backup_path)
-
-    if checksum != checksum2:
-        print_error("Checksum mismatch after copy!")
-        os.remove(backup_path)
+    if not addition:
         return False
 
-    file_obj = File()
-    file_obj.device_name = device_name
-    file_obj.set_properties(backup_name, file_path, checksum)
-    file_obj.set_security(**security_details)
-
-    db_save = PrettyStatusPrinter("Saving file record to DB").print_start()
-
-    succeeded = db.add_file(file_obj)
-    if succeeded == DatabaseError.SUCCESS:
-        db_save.print_complete()
-    else:
-        db_save.print_complete(False)
-        os.remove(backup_path)
+    __copy_addition(addition)
+    for device_path in addition["device_paths"]:
+        record_progress(device_path, addition["size"])
 
-    return succeeded
+    addition = __verify_addition(addition)
+    return __record_addition(addition) if addition else False
 
 
+@events.operation("remove")
 def remove_file(file_path: str) -> bool:
     """
     Will remove a file in the backup archive
@@ -456,11 +1464,28 @@ def remove_file(file_path: str) -> bool:
     valid = bool(file_entry) and bool(device) and os_path.exists(path_on_device)
 
     db_entry_removed = False
+    replica_points = []
+    group = None
     if valid:
-        db_entry_removed = db.remove_file(file_path)
+        with timed("db", file_path):
+            replica_points = db.get_file_replicas(file_path)
+            group = db.get_parity_group(file_path)
+            db_entry_removed = db.remove_file(file_path)
 
     if db_entry_removed:
         os.remove(path_on_device)
+        manifest.record_removed(device.device_path, file_entry.file_name)
+        # Copies on devices not attached are left behind, no longer catalogued
+        for device_path in replica_points:
+            replica_path = os_path.join(device_path, file_entry.file_name)
+            if os_path.exists(replica_path):
+                os.remove(replica_path)
+                manifest.record_removed(device_path, file_entry.file_name)
+        # The rest of its group is left unprotected, until protected again
+        for member in group.members[group.data_count :] if group else []:
+            parity_path = os_path.join(member.device_path, member.name)
+            if os_path.exists(parity_path):
+                os.remove(parity_path)
         validate_message.print_complete()
     elif not file_entry:
         validate_message.print_complete(2)
@@ -474,6 +1499,7 @@ def remove_file(file_path: str) -> bool:
     return db_entry_removed
 
 
+@events.operation("move-local")
 def move_file_local(original_path: str, new_path: str) -> bool:
     """
     Will move a file in the archive to a new path
@@ -500,10 +1526,14 @@ def move_file_local(original_path: str, new_path: str) -> bool:
         print_error("File path not backed up!")
     elif result == DatabaseError.FILE_EXISTS:
         print_error("File already backed up at new location!")
+    else:
+        for file_obj in db.get_files(new_path):
+            manifest.record_added(file_obj.device.device_path, file_obj)
 
     return bool(result)
 
 
+@events.operation("move-device")
 def move_file_device(original_path: str, device: str) -> bool:
     """
     Will move a file in the archive to a specified device
@@ -533,6 +1563,13 @@ def move_file_device(original_path: str, device: str) -> bool:
         print_error("Selected path does not exist in back up!")
         return False
 
+    if device in __excluded_devices(original_path).get(original_path, ()):
+        print_error(
+            "Device selected already holds another copy, "
+            "or parity group member, of the file!"
+        )
+        return False
+
     backup_name = file_result[0].file_name
     current_path = os_path.join(file_result[0].device.device_path, backup_name)
 
@@ -549,7 +1586,10 @@ def move_file_device(original_path: str, device: str) -> bool:
 
     copy_printer = PrettyStatusPrinter("Copying file to new device").print_start()
     new_path = os_path.join(device, backup_name)
-    shutil.copyfile(current_path, new_path)
+    with timed("copy", original_path):
+        utility.copy_file(current_path, new_path)
+        utility.copy_file_metadata(current_path, new_path)
+    record_progress(device, file_size)
     copy_printer.print_complete()
 
     new_checksum = utility.checksum_file(new_path)
@@ -558,7 +1598,8 @@ def move_file_device(original_path: str, device: str) -> bool:
 
     checksum_match = file_result[0].checksum == new_checksum
     if checksum_match:
-        device_updated = db.update_file_device(original_path, device)
+        with timed("db", original_path):
+            device_updated = db.update_file_device(original_path, device)
     else:
         print_error("Checksum verification mismatch!")
 
@@ -566,6 +1607,8 @@ def move_file_device(original_path: str, device: str) -> bool:
         print_error("Failed to update device for file in database!")
     else:
         os.remove(current_path)
+        manifest.record_removed(file_result[0].device.device_path, backup_name)
+        manifest.record_added(device, file_result[0])
 
     if not checksum_match or not device_updated:
         os.remove(new_path)
@@ -628,6 +1671,7 @@ def add_device(mount_point: str) -> bool:
     result = db.add_device(device)
 
     if result == DatabaseError.SUCCESS:
+        manifest.record_device(device)
         save_message.print_complete()
     elif result == DatabaseError.INVALID_IDENTIFIER_TYPE:
         save_message.print_complete(2)
@@ -645,14 +1689,127 @@ def add_device(mount_point: str) -> bool:
     return result == DatabaseError.SUCCESS
 
 
+def rebuild_catalog(device: str = None) -> bool:
+    """
+    Rebuilds a lost catalog from the manifests kept on each device
+    Folders are not in the manifests, so only files are restored
+
+    Parameters
+    ----------
+    device : str
+        Optional mount point of the only device to read,
+        otherwise every mounted device with a manifest is read
+
+    Returns
+    -------
+    bool
+        True if the catalog was rebuilt
+    """
+    if db.get_devices():
+        print_error("Catalog already has devices, move it aside to rebuild it!")
+        return False
+
+    mount_points = [
+        mount_point
+        for mount_point in ([device] if device else utility.get_mount_points())
+        if os_path.isfile(os_path.join(mount_point, manifest.MANIFEST_NAME))
+    ]
+    if not mount_points:
+        print_error("No device manifests found!")
+        return False
+
+    message = PrettyStatusPrinter(
+        "Reading {0} device manifests".format(len(mount_points))
+    ).print_start()
+    devices, files, replicas, unnamed = manifest.read_manifests(mount_points)
+    message.print_complete(not unnamed)
+    if unnamed:
+        # Its files cannot be placed on a device, so the rebuild would lose them
+        for mount_point in unnamed:
+            print_error(
+                "Manifest on {0} does not say which device it is!".format(mount_point)
+            )
+        return False
+
+    all_added = True
+    for found_device in devices:
+        if not db.add_device(found_device):
+            print_error(
+                "Failed to add device {0}!".format(found_device.device_name)
+            )
+            all_added = False
+
+    message = PrettyStatusPrinter("Loading {0} files".format(len(files))).print_start()
+    added = db.bulk_add_files(files)
+    message.with_message_postfix_for_result(
+        False, "Only {0} added!".format(added)
+    ).print_complete(added == len(files))
+
+    message = PrettyStatusPrinter(
+        "Loading {0} further copies".format(len(replicas))
+    ).print_start()
+    replicas_added = db.bulk_add_file_replicas(replicas)
+    message.with_message_postfix_for_result(
+        False, "Only {0} added!".format(replicas_added)
+    ).print_complete(replicas_added == len(replicas))
+
+    return all_added and added == len(files) and replicas_added == len(replicas)
+
+
+def replicate_catalog() -> bool:
+    """
+    Brings the copy of the catalog on every mounted device up to date
+
+    Returns
+    -------
+    bool
+        True if every copy was updated
+    """
+    all_replicated = True
+    for device in db.get_devices():
+        if not os_path.ismount(device.device_path):
+            continue
+
+        try:
+            written = replication.replicate_catalog(device.device_path)
+        except OSError as error:
+            print_error(
+                "Failed to replicate catalog to {0}: {1}".format(
+                    device.device_name, error.strerror
+                )
+            )
+            all_replicated = False
+            continue
+
+        # Runs after every command, so is silent unless it did something,
+        # keeping output of those only reading the catalog as it was
+        if written:
+            PrettyStatusPrinter(
+                "Replicated catalog to {0}, {1} pages written".format(
+                    device.device_name, written
+                )
+            ).print_message()
+
+    return all_replicated
+
+
 def verify_all(for_restore: bool) -> bool:
     """
     Verify all findable files on drives
     """
-    files = db.get_files()
+    totals = db.get_file_totals()
     all_verified = True
-    for file_path in files:
-        all_verified = all_verified and verify_file(file_path, for_restore)
+    with ProgressDisplay(
+        "Verifying",
+        sum(files for files, _ in totals.values()),
+        sum(size for _, size in totals.values()),
+        {device_path: size for device_path, (_, size) in totals.items()},
+    ) as progress:
+        for file_obj in db.iter_files(columns=["file_path"]):
+            all_verified = verify_file(file_obj.file_path, for_restore)
+            progress.file_done(all_verified)
+            if not all_verified:
+                break
 
     return all_verified
 
@@ -664,13 +1821,75 @@ def verify_folder(folder_path: str, for_restore: bool) -> bool:
     """
     entries = db.get_entries_for_folder(folder_path)
     all_verified = True
-    for file_path in entries.files:
-        all_verified = all_verified and verify_file(file_path, for_restore)
+    with ProgressDisplay("Verifying", len(entries.files)) as progress:
+        for file_path in entries.files:
+            all_verified = verify_file(file_path, for_restore)
+            progress.file_done(all_verified)
+            if not all_verified:
+                break
 
     return all_verified
 
 
-def verify_file(file_path: str, for_restore: bool) -> bool:
+def __order_copies(file_obj: File) -> list:
+    """
+    Orders the attached devices with a copy of a file by which to read first
+    Prefers whichever would be done soonest, given what was already read from each
+
+    Parameters
+    ----------
+    file_obj : File
+        The backed up file
+
+    Returns
+    -------
+    list
+        Mount points of the devices,
+        or just the file's own device if none are attached
+    """
+    replica_points = db.get_file_replicas(file_obj.file_path)
+    if not replica_points:
+        return [file_obj.device.device_path]
+
+    device_paths = [
+        device_path
+        for device_path in [file_obj.device.device_path] + replica_points
+        if os_path.ismount(device_path)
+    ] or [file_obj.device.device_path]
+
+    # Without every device profiled, spreading the bytes evenly is the best guess
+    profiles = db.get_device_profiles()
+    profiled = all(device_path in profiles for device_path in device_paths)
+
+    def finish(device_path: str) -> float:
+        """
+        .
+        """
+        reads = __device_reads.get(device_path, 0) + (file_obj.size or 0)
+        return (
+            reads / profiles[device_path].read_bytes_per_second if profiled else reads
+        )
+
+    return sorted(device_paths, key=finish)
+
+
+def __record_read(device_path: str, size: int) -> None:
+    """
+    Notes bytes read from a device, for choosing copies to read later
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+    size : int
+        Bytes read
+    """
+    __device_reads[device_path] = __device_reads.get(device_path, 0) + size
+    record_progress(device_path, size)
+
+
+@events.operation("verify")
+def verify_file(file_path: str, for_restore: bool, device_path: str = None) -> bool:
     """
     Check a file path for consistency
 
@@ -681,6 +1900,10 @@ def verify_file(file_path: str, for_restore: bool) -> bool:
     for_restore : bool
         If verification is for restoration
         If True, checks device path, otherwise checks system
+    device_path : str
+        When for restoration, mount point of the only copy to check,
+        otherwise each attached copy is checked, quickest to read first,
+        until one matches
 
     Returns
     -------
@@ -695,16 +1918,95 @@ def verify_file(file_path: str, for_restore: bool) -> bool:
 
     file_obj = file_result[0]
 
-    path_to_check = (
-        os_path.join(file_obj.device.device_path, file_obj.file_name)
-        if for_restore
-        else file_path
-    )
-    actual_checksum = utility.checksum_file(path_to_check)
-    if actual_checksum != file_obj.checksum:
-        print_error("Checksum mismatch for " + file_path)
+    if for_restore:
+        device_paths = [device_path] if device_path else __order_copies(file_obj)
+    else:
+        device_paths = [file_obj.device.device_path]
+    for copy_path in device_paths:
+        path_to_check = (
+            os_path.join(copy_path, file_obj.file_name) if for_restore else file_path
+        )
+        actual_checksum = utility.checksum_file(path_to_check)
+        __record_read(copy_path, file_obj.size or 0)
+        if actual_checksum == file_obj.checksum:
+            return True
+
+        print_error(
+            "Checksum mismatch for {0}{1}".format(
+                file_path, " on " + copy_path if for_restore else ""
+            )
+        )
+
+    # Repaired in place where possible, so it need not be rebuilt again
+    group = db.get_parity_group(file_path) if for_restore else None
+    if group and os_path.ismount(device_paths[0]):
+        return __repair_from_parity(
+            file_obj, group, os_path.join(device_paths[0], file_obj.file_name)
+        )
+
+    return False
+
+
+def __repair_from_parity(
+    file_obj: File, group: parity.ParityGroup, backup_path: str
+) -> bool:
+    """
+    Replaces a missing or corrupt backed up file, rebuilding it from parity
+
+    Parameters
+    ----------
+    file_obj : File
+        The file to repair
+    group : ParityGroup
+        The group it was coded in
+    backup_path : str
+        Where the backed up file belongs
+
+    Returns
+    -------
+    bool
+        True if repaired
+    """
+    rebuilt_path = backup_path + ".rebuilt"
+    with open(rebuilt_path, "wb") as rebuilt_file:
+        repaired = __rebuild_from_parity(file_obj, group, rebuilt_file)
+        if repaired:
+            os.fsync(rebuilt_file.fileno())
+
+    if repaired:
+        os.replace(rebuilt_path, backup_path)
+    else:
+        os.remove(rebuilt_path)
+
+    return repaired
+
+
+def __has_ancestor_in(path: str, folders: set) -> bool:
+    """
+    Checks whether any parent directory of a path is in a set of folders
+    Walks up the path, so cost is the depth of the path, not the number of folders
+
+    Parameters
+    ----------
+    path : str
+        The path to check
+    folders : set
+        Folder paths to look for
+
+    Returns
+    -------
+    bool
+        True if some parent of the path is one of the folders
+    """
+    child = path
+    parent = os_path.dirname(path)
+    # The root is its own parent, so this stops once it has been checked
+    while parent != child:
+        if parent in folders:
+            return True
+        child, parent = parent, os_path.dirname(parent)
 
-    return actual_checksum == file_obj.checksum
+    return False
 
 
 def __get_unique_folders() -> list:
@@ -714,29 +2016,8 @@ def __get_unique_folders() -> list:
     will also include all the subdirectories as well
     """
     folders = [folder_obj.folder_path for folder_obj in db.get_folders()]
-    deduplicated_folders = []
-    for folder in folders:
-        other_folder_found = False
-        for other_folder in folders:
-            if other_folder == folder:
-                continue
-
-            try:
-                folder_index = folder.index(other_folder)
-                next_char_slash = (
-                    folder[len(other_folder)] == "/" or other_folder[-1] == "/"
-                )
-                if folder_index == 0 and next_char_slash:
-                    other_folder_found = True
-                    break
-            # Okay if this doesn't exist
-            except ValueError:
-                continue
-
-        if not other_folder_found:
-            deduplicated_folders.append(folder)
-
-    return deduplicated_folders
+    folder_set = set(folders)
+    return [folder for folder in folders if not __has_ancestor_in(folder, folder_set)]
 
 
 def __get_files_outside_directories() -> list:
@@ -744,43 +2025,125 @@ def __get_files_outside_directories() -> list:
     Since restoring a directory will also restore all files in that directory,
     need to have a way to only get files outside backed-up directories
     """
-    folders = __get_unique_folders()
-    all_files = [file_obj.file_path for file_obj in db.get_files()]
-    external_files = []
+    folders = set(__get_unique_folders())
+    return [
+        file_obj.file_path
+        for file_obj in db.iter_files(columns=["file_path"])
+        if not __has_ancestor_in(file_obj.file_path, folders)
+    ]
 
-    for file_path in all_files:
-        folder_matched = False
-        for folder in folders:
-            next_char_slash = file_path[len(folder)] == "/" or folder == "/"
-            if file_path.startswith(folder) and next_char_slash:
-                folder_matched = True
-                break
 
-        if not folder_matched:
-            external_files.append(file_path)
+def __check_security_names(owners: set, groups: set) -> bool:
+    """
+    Checks every owner and group to restore exists on this system
+    Done before copying anything, rather than failing part way through
+
+    Parameters
+    ----------
+    owners : set
+        Owner names to restore
+    groups : set
+        Group names to restore
+
+    Returns
+    -------
+    bool
+        True if all of them exist
+    """
+    missing_owners = sorted(
+        owner for owner in owners if utility.get_user_id(owner) is None
+    )
+    missing_groups = sorted(
+        group for group in groups if utility.get_group_id(group) is None
+    )
+    if missing_owners:
+        print_error("Unknown owners on this system: " + ", ".join(missing_owners))
+    if missing_groups:
+        print_error("Unknown groups on this system: " + ", ".join(missing_groups))
+
+    return not missing_owners and not missing_groups
+
 
-    return external_files
+def __set_security(descriptor: int, permissions: str, owner: str, group: str) -> bool:
+    """
+    Sets permissions and ownership through an open file or folder
+    Verified against a stat of the same descriptor, rather than looking
+    the names back up
+
+    Parameters
+    ----------
+    descriptor : int
+        Open descriptor of the file or folder
+    permissions : str
+        Octal permissions to set
+    owner : str
+        Name of the owner to set
+    group : str
+        Name of the group to set
+
+    Returns
+    -------
+    bool
+        True if the permissions and ownership took
+    """
+    # Using names so can persist across sytem recreations where IDs may change
+    uid = utility.get_user_id(owner)
+    gid = utility.get_group_id(group)
+    os.fchmod(descriptor, int(permissions, 8))
+    os.fchown(descriptor, uid, gid)
+
+    stats = os.fstat(descriptor)
+    return (
+        oct(stats.st_mode)[-3:] == permissions
+        and stats.st_uid == uid
+        and stats.st_gid == gid
+    )
 
 
-def restore_all() -> bool:
+def restore_all(preserve_metadata: bool = False) -> bool:
     """
     Restore all files
     See restore_files
     """
+    if not __check_security_names(*db.get_security_names()):
+        return False
+
     directories = __get_unique_folders()
     files = __get_files_outside_directories()
 
-    all_success = True
-    for directory in directories:
-        all_success = all_success and restore_folder(directory)
+    bytes_by_device = {}
+    file_count = 0
+    for file_obj in db.iter_files(columns=["file_name", "size", "device"]):
+        file_count += 1
+        size = file_obj.size
+        if size is None:
+            size = __get_backup_size(file_obj) or 0
+        bytes_by_device[file_obj.device.device_path] = (
+            bytes_by_device.get(file_obj.device.device_path, 0) + size
+        )
+    seconds = device_profile.estimate_seconds(
+        bytes_by_device, db.get_device_profiles(), False
+    )
+    if bytes_by_device and seconds is not None:
+        __print_estimate(seconds)
 
-    for file_path in files:
-        all_success = all_success and restore_file(file_path)
+    all_success = True
+    with ProgressDisplay(
+        "Restoring", file_count, sum(bytes_by_device.values()), bytes_by_device
+    ) as progress:
+        for directory in directories:
+            all_success = all_success and restore_folder(directory, preserve_metadata)
+
+        for file_path in files:
+            if not all_success:
+                break
+            all_success = restore_file(file_path, preserve_metadata)
+            progress.file_done(all_success)
 
     return all_success
 
 
-def restore_folder(folder_path: str) -> bool:
+def restore_folder(folder_path: str, preserve_metadata: bool = False) -> bool:
     """
     Restores a specific folder
     See restore_files
@@ -790,6 +2153,9 @@ def restore_folder(folder_path: str) -> bool:
         print_error("Folder not backed up!")
         return False
 
+    if not __check_security_names(*db.get_security_names(folder_path)):
+        return False
+
     # Sort folders by length, so can create folders in order
     ordered_folders = entries.folders
     ordered_folders.sort(key=len)
@@ -801,9 +2167,11 @@ def restore_folder(folder_path: str) -> bool:
             return False
 
     files_created = True
-    for file_path in entries.files:
-        if not restore_file(file_path):
-            files_created = False
+    with ProgressDisplay("Restoring", len(entries.files)) as progress:
+        for file_path in entries.files:
+            restored = restore_file(file_path, preserve_metadata)
+            progress.file_done(restored)
+            files_created = files_created and restored
 
     # Only set permissions if all files restored, since otherwise
     # can't retry file restoration, given missing permissions
@@ -814,17 +2182,18 @@ def restore_folder(folder_path: str) -> bool:
         ordered_folders.reverse()
         for subfolder in ordered_folders:
             folder = db.get_folders(subfolder)[0]
-            uid = pwd.getpwnam(folder.folder_owner).pw_uid
-            gid = grp.getgrnam(folder.folder_group).gr_gid
-
-            os.chmod(subfolder, int(folder.folder_permissions, 8))
-            os.chown(subfolder, uid, gid)
+            descriptor = os.open(subfolder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                folder_secured = __set_security(
+                    descriptor,
+                    folder.folder_permissions,
+                    folder.folder_owner,
+                    folder.folder_group,
+                )
+            finally:
+                os.close(descriptor)
 
-            if utility.get_file_security(subfolder) != {
-                "permissions": folder.folder_permissions,
-                "owner": folder.folder_owner,
-                "group": folder.folder_group,
-            }:
+            if not folder_secured:
                 print_error(
                     "Failed to set folder security options for {0}!".format(subfolder)
                 )
@@ -833,7 +2202,8 @@ def restore_folder(folder_path: str) -> bool:
     return files_created and security_set
 
 
-def restore_file(file_path: str) -> bool:
+@events.operation("restore")
+def restore_file(file_path: str, preserve_metadata: bool = False) -> bool:
     """
     Restore a file from backup
     Will perform a verification of the device first
@@ -843,6 +2213,9 @@ def restore_file(file_path: str) -> bool:
     ----------
     file_path : str
         The file path to restore
+    preserve_metadata : bool
+        Whether to also restore access/modification times and extended
+        attributes, as kept on the backed up copy
 
     Returns
     -------
@@ -858,43 +2231,76 @@ def restore_file(file_path: str) -> bool:
         print_error("Path to restore already exists!")
         return True  # Not an error, since just means no action needed
 
-    if not verify_file(file_path, True):
-        print_error("Backed-up file has mismatched checksum!")
-        return False
-
     file_result = db.get_files(file_path)
     if not file_result:
         print_error("Requested path was not backed up!")
         return False
 
     file_obj = file_result[0]
+    # Any intact copy will do, trying the quickest to read first
+    device_paths = __order_copies(file_obj)
+    device_path = next(
+        (
+            device_path
+            for device_path in device_paths
+            if verify_file(file_path, True, device_path)
+        ),
+        None,
+    )
+    group = None
+    if not device_path:
+        # Files on a lost device can still be rebuilt straight into place
+        if not os_path.ismount(device_paths[0]):
+            group = db.get_parity_group(file_path)
+        if not group:
+            print_error("Backed-up file has mismatched checksum!")
+            return False
+        device_path = device_paths[0]
+
+    if not __check_security_names({file_obj.owner}, {file_obj.group}):
+        return False
+
+    # Copy the file, then set its security while it is still open
+    backup_path = os_path.join(device_path, file_obj.file_name)
+    security_verified = False
+    with timed("copy", file_path):
+        with ExitStack() as stack:
+            # Rebuilding seeks back to retry, so needs an ordinary file
+            restored_file = stack.enter_context(
+                open(file_path, "wb") if group else utility.open_file(file_path, True)
+            )
+            if group:
+                checksum_matched = __rebuild_from_parity(
+                    file_obj, group, restored_file
+                )
+            else:
+                backup_file = stack.enter_context(utility.open_file(backup_path))
+                checksum_matched = (
+                    utility.checksum_copy(backup_file, restored_file)
+                    == file_obj.checksum
+                )
+            if checksum_matched:
+                security_verified = __set_security(
+                    restored_file.fileno(),
+                    file_obj.permissions,
+                    file_obj.owner,
+                    file_obj.group,
+                )
+            # Times and attributes are only kept on the backed up copy
+            if checksum_matched and preserve_metadata and not group:
+                utility.copy_file_metadata(backup_file.fileno(), restored_file.fileno())
 
-    # Copy the file
-    backup_path = os_path.join(file_obj.device.device_path, file_obj.file_name)
-    shutil.copyfile(backup_path, file_path)
+    if not group:
+        __record_read(device_path, file_obj.size or 0)
 
     # Verify it copied successfully
-    if utility.checksum_file(file_path) != file_obj.checksum:
+    if not checksum_matched:
         print_error("Restored file has mismatched checksum!")
         # Can remove file here because we just created it
         # MAy not be true after this, once we restore file permissions and ownership
         os.remove(file_path)
         return False
 
-    # Get security details to set
-    # Using names so can persist across sytem recreations where IDs may change
-    os.chmod(file_path, int(file_obj.permissions, 8))
-    uid = pwd.getpwnam(file_obj.owner).pw_uid
-    gid = grp.getgrnam(file_obj.group).gr_gid
-    os.chown(file_path, uid, gid)
-
-    security_verification = utility.get_file_security(file_path)
-    security_verified = security_verification == {
-        "permissions": file_obj.permissions,
-        "owner": file_obj.owner,
-        "group": file_obj.group,
-    }
-
     if not security_verified:
         try:
             os.remove(file_path)
@@ -907,6 +2313,7 @@ def restore_file(file_path: str) -> bool:
     return security_verified
 
 
+@events.operation("update")
 def update_file(file_path: str) -> bool:
     """
     Checks if a file has changed, and if it has, replaces the backed-up file
@@ -932,6 +2339,7 @@ def update_file(file_path: str) -> bool:
     checksum_match = file_registered
     file_removed = True
     file_added = True
+    copies = 1
 
     # Only need to compare checksums if the file is registered
     # Otherwise will simply add it
@@ -943,6 +2351,8 @@ def update_file(file_path: str) -> bool:
     #   - The file is registered already
     #   - and the checksum has changed
     if file_registered and not checksum_match:
+        # Kept on as many devices as before
+        copies += len(db.get_file_replicas(file_obj.file_path))
         file_removed = remove_file(file_obj.file_path)
         if not file_removed:
             print_error("Failed to remove file, so cannot update!")
@@ -951,7 +2361,7 @@ def update_file(file_path: str) -> bool:
     #   - file is NOT already registered
     #   - file did not match and was removed
     if not file_registered or (not checksum_match and file_removed):
-        file_added = add_file(file_path)
+        file_added = add_file(file_path, copies=copies)
         if not file_added:
             print_error("Failed to add file during update!")
 
@@ -965,12 +2375,103 @@ def update_file(file_path: str) -> bool:
     return (file_added and file_removed) or checksum_match
 
 
-def update_folder(folder: str) -> bool:
+def __is_watched(folder_path: str) -> bool:
+    """
+    Checks whether a running watcher is journaling changes to a folder
+
+    Parameters
+    ----------
+    folder_path : str
+        The folder to check
+
+    Returns
+    -------
+    bool
+        True if the folder, or one containing it, is watched
+    """
+    for watched_path, process_id in db.get_watched_folders().items():
+        if folder_path != watched_path and not __has_ancestor_in(
+            folder_path, {watched_path}
+        ):
+            continue
+
+        try:
+            os.kill(process_id, 0)
+        except ProcessLookupError:
+            # Stopped without clearing its record, so changes may have been missed
+            continue
+        except PermissionError:
+            pass
+        return True
+
+    return False
+
+
+def __get_changed_entries(dirty: dict) -> tuple:
+    """
+    Finds the entries to check for paths journaled as changed
+
+    Parameters
+    ----------
+    dirty : dict
+        Whether everything beneath each path may have changed too, keyed by path
+
+    Returns
+    -------
+    tuple
+        DirectoryEntries registered, and DirectoryEntries on disk
+    """
+    registered_files = utility.DirectoryEntries([], [])
+    disk_files = utility.DirectoryEntries([], [])
+    recursive_paths = {path for path, recursive in dirty.items() if recursive}
+    for dirty_path, recursive in sorted(dirty.items()):
+        # Already covered by the walk of a folder containing it
+        if __has_ancestor_in(dirty_path, recursive_paths):
+            continue
+
+        if recursive:
+            for entries, listing in [
+                (registered_files, db.get_entries_for_folder(dirty_path)),
+                (disk_files, utility.list_entries_in_directory(dirty_path)),
+            ]:
+                entries.files.extend(listing.files)
+                entries.folders.extend(listing.folders)
+
+        if db.file_exists(dirty_path):
+            registered_files.files.append(dirty_path)
+        elif db.get_folders(dirty_path) and dirty_path not in registered_files.folders:
+            registered_files.folders.append(dirty_path)
+
+        if os_path.isfile(dirty_path):
+            disk_files.files.append(dirty_path)
+        elif os_path.isdir(dirty_path):
+            disk_files.folders.append(dirty_path)
+
+    return registered_files, disk_files
+
+
+def update_folder(folder: str, changed_only: bool = False) -> bool:
     """
     Updates a folder to match what is currently on disk
+
+    Parameters
+    ----------
+    folder : str
+        The folder to update
+    changed_only : bool
+        Only check paths a watcher journaled as changed, if one is running
     """
-    registered_files = db.get_entries_for_folder(folder)
-    disk_files = utility.list_entries_in_directory(folder)
+    last_dirty_id = None
+    if changed_only and __is_watched(folder):
+        last_dirty_id, dirty = db.get_dirty_paths(folder)
+        registered_files, disk_files = __get_changed_entries(dirty)
+    else:
+        if changed_only:
+            PrettyStatusPrinter(
+                "No watcher running for {0}, checking every file".format(folder)
+            ).with_specific_color(Color.YELLOW).print_message()
+        registered_files = db.get_entries_for_folder(folder)
+        disk_files = utility.list_entries_in_directory(folder)
 
     # Too many conditions, so add explicit success flag here
     all_success = __remove_missing_database_entries(registered_files)
@@ -978,9 +2479,9 @@ def update_folder(folder: str) -> bool:
     # An existing folder just need to be purged from the DB to be added back
     # No recursive file checks or anything, since the listing already handled that
     for folder_path in disk_files.folders:
-        folder = Folder()
+        folder_obj = Folder()
         folder_details = utility.get_file_security(folder_path)
-        folder.set(
+        folder_obj.set(
             folder_path,
             folder_details["permissions"],
             folder_details["owner"],
@@ -990,7 +2491,7 @@ def update_folder(folder: str) -> bool:
         if folder_path in registered_files.folders:
             db_folder = db.get_folders(folder_path)
             # If folders are equivalent, do nothing
-            if db_folder[0] == folder:
+            if db_folder[0] == folder_obj:
                 continue
 
             if not db.remove_folder(folder_path):
@@ -1000,7 +2501,7 @@ def update_folder(folder: str) -> bool:
                 all_success = False
                 continue
 
-        if not db.add_folder(folder):
+        if not db.add_folder(folder_obj):
             print_error(
                 "Failed to add folder {0} back to database!".format(folder_path)
             )
@@ -1009,15 +2510,124 @@ def update_folder(folder: str) -> bool:
     for file_path in disk_files.files:
         all_success = all_success and update_file(file_path)
 
+    # Failed paths stay journaled, to be tried again
+    if all_success and last_dirty_id is not None:
+        db.clear_dirty_paths(folder, last_dirty_id)
+
     return all_success
 
 
+def serve() -> bool:
+    """
+    Takes commands over a socket until interrupted
+
+    Returns
+    -------
+    bool
+        True if the daemon ran
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since the server runs commands through main, which imports this
+    from logical_backup import server
+
+    return server.serve()
+
+
+def watch_folder(folder_path: str) -> bool:
+    """
+    Journals changes under a folder until interrupted,
+    for updates of only the changed paths
+
+    Parameters
+    ----------
+    folder_path : str
+        The folder to watch
+
+    Returns
+    -------
+    bool
+        True if watching stopped as asked
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since ctypes is slow to import and only watching needs it
+    from logical_backup import watcher
+
+    PrettyStatusPrinter(
+        "Watching {0} for changes, until interrupted".format(folder_path)
+    ).print_message()
+    return watcher.watch(folder_path)
+
+
+# pylint: disable=too-many-arguments
+def search(
+    pattern: str = None,
+    mode: str = "substring",
+    min_size: int = None,
+    max_size: int = None,
+    owner: str = None,
+    device_path: str = None,
+    checksum: str = None,
+    limit: int = None,
+) -> list:
+    """
+    Finds backed-up files, printing each with the device it is on
+    See db.search_files
+
+    Returns
+    -------
+    list
+        Matching File objects
+    """
+    try:
+        files = db.search_files(
+            pattern, mode, min_size, max_size, owner, device_path, checksum, limit
+        )
+    except re.error as error:
+        print_error("Invalid regular expression: {0}".format(error))
+        return []
+
+    for file_obj in files:
+        if events.is_enabled():
+            events.emit(
+                "search-result",
+                path=file_obj.file_path,
+                device=file_obj.device.device_path,
+                size=file_obj.size,
+                result=True,
+            )
+            continue
+
+        print(
+            "{0}\t{1}\t{2}".format(
+                file_obj.file_path,
+                file_obj.device_name,
+                readable_bytes(file_obj.size) if file_obj.size is not None else "?",
+            )
+        )
+
+    PrettyStatusPrinter(
+        "Found {0} file{1}".format(len(files), "" if len(files) == 1 else "s")
+    ).print_message()
+    return files
+
+
 def list_devices():
     """
     List all the devices registered
     """
     devices = db.get_devices()
-    if devices:
+    if devices and events.is_enabled():
+        for device in devices:
+            events.emit(
+                "device",
+                device=device.device_path,
+                result=True,
+                name=device.device_name,
+            )
+    elif devices:
+        # pylint: disable=import-outside-toplevel
+        # Deferred, since no other command needs it
+        from texttable import Texttable
 
         table = Texttable()
         headers = devices[0].keys()
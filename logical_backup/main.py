@@ -9,14 +9,42 @@ are maintained
 """
 
 import argparse
+from contextlib import redirect_stderr
+import io
 import os.path as path
 from os.path import isfile, isdir
+import shlex
 import sys
 
 from logical_backup import db
+from logical_backup import events
 from logical_backup import library
+from logical_backup import manifest
+from logical_backup import profiling
 from logical_backup import utility
-from logical_backup.pretty_print import PrettyStatusPrinter, Color, print_error
+from logical_backup.pretty_print import (
+    PrettyStatusPrinter,
+    Color,
+    is_quiet,
+    print_error,
+    set_quiet,
+)
+
+# Operations a batch can contain
+BATCH_ACTIONS = ["add", "move", "remove", "update", "verify", "restore"]
+# Files verified at once, when a batch verifies several in a row
+BATCH_THREADS = 4
+# Options applying to the whole process, so given for a batch, not each line
+PROCESS_OPTIONS = [
+    "io_mode",
+    "output",
+    "preload_names",
+    "profile",
+    "profile_dir",
+    "quiet",
+    "slow_log",
+    "slow_threshold",
+]
 
 
 def __prepare():
@@ -54,11 +82,29 @@ def __parse_arguments(command_line_arguments: list) -> tuple:
             "(this will NOT check the local filesystem copy, "
             "as that is assumed to be correct)\n"
             "list-devices: list all the registered backup devices\n"
+            "      search: find backed-up files by path, size, owner, device "
+            "or checksum\n"
+            "   rebalance: move files between devices to even out free space, "
+            "file counts or read time\n"
+            "profile-devices: measure the speed of each device, "
+            "to prefer faster ones\n"
+            "rebuild-catalog: recreate a lost catalog from the manifests "
+            "kept on each device\n"
+            "     protect: write parity for files across devices, "
+            "so lost or corrupt ones can be rebuilt\n"
+            "       watch: journal changes under a folder until interrupted, "
+            "so updates need only check those\n"
+            "       serve: take commands over a socket until interrupted, "
+            "so each skips startup\n"
+            "       batch: run many operations, one command line each, "
+            "from a file or standard input\n"
             "Example uses:\n"
             "  # Will add a new device\n"
             "  add --device /mnt/dev1\n"
             "  # Will add this file to the backup set\n"
             "  add --file /home/user/foo.txt\n"
+            "  # Will back up the photos folder, keeping copies on two devices\n"
+            "  add --folder /home/user/photos --copies 2\n"
             "  # Will remove the /etc folder recursively from backup\n"
             "  remove --folder /etc\n"
             "  # Will check all backed up files for integrity\n"
@@ -71,6 +117,23 @@ def __parse_arguments(command_line_arguments: list) -> tuple:
             "  # Will move the backed up folder from its current drive to another, "
             "if one particular drive is too full to take a needed operation\n"
             "  move --file /backups --device dev2\n"
+            "  # Will move everything off a failing drive onto another\n"
+            "  move --all --from-device /mnt/dev1 --device /mnt/dev2\n"
+            "  # Will find which device has a photo\n"
+            "  search --pattern '*/IMG_1234.jpg' --match glob\n"
+            "  # Will even out free space, copying at most 20MB/s\n"
+            "  rebalance --strategy space --throttle 20\n"
+            "  # Will recreate the catalog from every attached device\n"
+            "  rebuild-catalog\n"
+            "  # Will let any two of every six files, on different devices, be lost\n"
+            "  protect --data-blocks 4 --parity-blocks 2\n"
+            "  # Will update only what changed in the folder since it was watched\n"
+            "  watch --folder /home/user/photos\n"
+            "  update --folder /home/user/photos --changed-only\n"
+            "  # Will run later commands in this process, until interrupted\n"
+            "  serve\n"
+            "  # Will run every operation listed, reporting on them all at the end\n"
+            "  batch --file operations.txt\n"
         ),
         formatter_class=argparse.RawTextHelpFormatter,
     )
@@ -86,6 +149,13 @@ def __parse_arguments(command_line_arguments: list) -> tuple:
             "restore",
             "list-devices",
             "search",
+            "rebalance",
+            "profile-devices",
+            "rebuild-catalog",
+            "protect",
+            "watch",
+            "serve",
+            "batch",
         ],
     )
     parser.add_argument("--file", help="The file to take action on", required=False)
@@ -109,11 +179,149 @@ def __parse_arguments(command_line_arguments: list) -> tuple:
         help="Target for move operation",
         required=False,
     )
+    parser.add_argument(
+        "--pattern", help="Text, glob or regex to search paths for", required=False
+    )
+    parser.add_argument(
+        "--match",
+        help="How to match the search pattern against paths",
+        choices=db.SEARCH_MODES,
+        default="substring",
+        required=False,
+    )
+    parser.add_argument(
+        "--min-size",
+        dest="min_size",
+        help="Only find files of at least this many bytes",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--max-size",
+        dest="max_size",
+        help="Only find files of at most this many bytes",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--owner", help="Only find files owned by this user", required=False
+    )
+    parser.add_argument(
+        "--checksum", help="Only find files with this checksum", required=False
+    )
+    parser.add_argument(
+        "--limit", help="Find at most this many files", type=int, required=False
+    )
+    parser.add_argument(
+        "--strategy",
+        help="What to even out across devices when rebalancing",
+        choices=library.REBALANCE_STRATEGIES,
+        default="space",
+        required=False,
+    )
+    parser.add_argument(
+        "--throttle",
+        help="Limit copying between devices to this many MB per second",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--copies",
+        help="When adding, keep a copy of each file on this many devices",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--data-blocks",
+        dest="data_blocks",
+        help="When protecting, files coded together, each on its own device",
+        type=int,
+        default=4,
+        required=False,
+    )
+    parser.add_argument(
+        "--parity-blocks",
+        dest="parity_blocks",
+        help="When protecting, parity blocks for each group of files, "
+        "which is how many of them can be lost",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--changed-only",
+        dest="changed_only",
+        help="When updating a folder, only check paths a running watch saw change",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the command, writing a pstats dump and/or memory snapshot",
+        choices=profiling.PROFILE_MODES,
+        required=False,
+    )
+    parser.add_argument(
+        "--profile-dir",
+        dest="profile_dir",
+        help="Directory to write profiles to",
+        default=".",
+        required=False,
+    )
+    parser.add_argument(
+        "--slow-threshold",
+        dest="slow_threshold",
+        help="Log any single file hash, copy or DB operation taking over this "
+        "many seconds",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--slow-log",
+        dest="slow_log",
+        help="File to log slow operations to",
+        default="slow_operations.log",
+        required=False,
+    )
+    parser.add_argument(
+        "--output",
+        help="Print text for people, or one JSON event per line for other tools",
+        choices=events.OUTPUT_FORMATS,
+        default="text",
+        required=False,
+    )
+    parser.add_argument(
+        "--quiet",
+        help="Only print errors and summaries, without status or progress",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--preserve-metadata",
+        dest="preserve_metadata",
+        help="When restoring, also restore file times and extended attributes",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--io-mode",
+        dest="io_mode",
+        help="Hash and copy through the page cache, dropping pages as they are "
+        "done with, or skipping the cache with O_DIRECT",
+        choices=utility.IO_MODES,
+        default="cached",
+        required=False,
+    )
+    parser.add_argument(
+        "--preload-names",
+        dest="preload_names",
+        help="Look up every user and group once up front, rather than as needed",
+        action="store_true",
+    )
     args = parser.parse_args(command_line_arguments)
     arguments = vars(args)
     arguments["file"] = utility.get_abs_path(arguments["file"])
     arguments["folder"] = utility.get_abs_path(arguments["folder"])
     arguments["device"] = utility.get_abs_path(arguments["device"])
+    arguments["from_device"] = utility.get_abs_path(arguments["from_device"])
     return arguments
 
 
@@ -141,7 +349,16 @@ def __validate_arguments(arguments: dict) -> bool:
         "restore": [["file", "folder", "all"]],
         "verify": [["file", "folder", "all"]],
         "update": [["file", "folder"]],
+        "watch": [["folder"]],
     }
+    # Moving all files empties one device onto another, instead of a file/folder
+    if (
+        arguments["action"] == "move"
+        and arguments["all"]
+        and not arguments["file"]
+        and not arguments["folder"]
+    ):
+        required_parameter_set_by_action["move"] = [["from_device"], ["device"]]
 
     command_valid = True
     path_exists = True
@@ -171,9 +388,52 @@ def __validate_arguments(arguments: dict) -> bool:
     if arguments["device"] or arguments["from_device"]:
         devices = db.get_devices()
 
-    if arguments["device"]:
+    # Searching only reads the catalog, so needs at least one thing to look for
+    if arguments["action"] == "search":
+        command_valid = command_valid and any(
+            arguments[search_filter] is not None
+            for search_filter in [
+                "pattern",
+                "min_size",
+                "max_size",
+                "owner",
+                "device",
+                "checksum",
+            ]
+        )
+
+    # Only files being added can be copied, each to a different device
+    if arguments["copies"] != 1:
+        command_valid = (
+            command_valid
+            and arguments["action"] == "add"
+            and bool(arguments["file"] or arguments["folder"])
+            and 1 < arguments["copies"] <= len(db.get_devices())
+        )
+
+    # Every file and parity block of a group is on a different device
+    if arguments["action"] == "protect":
+        command_valid = (
+            command_valid
+            and arguments["data_blocks"] >= 1
+            and arguments["parity_blocks"] >= 1
+            and arguments["data_blocks"] + arguments["parity_blocks"]
+            <= min(len(db.get_devices()), 256)
+        )
+
+    # Only folders being updated have changes journaled to check
+    if arguments["changed_only"]:
+        command_valid = (
+            command_valid
+            and arguments["action"] == "update"
+            and bool(arguments["folder"])
+        )
+
+    # Searches can find files on devices that are not attached
+    if arguments["device"] and arguments["action"] != "search":
         path_exists = path_exists and path.ismount(arguments["device"])
-        if arguments["action"] != "add":
+        # Devices are only registered once added, or their catalog rebuilt
+        if arguments["action"] not in ["add", "rebuild-catalog"]:
             path_exists = path_exists and [
                 device
                 for device in devices
@@ -274,140 +534,418 @@ def __dispatch_command(arguments: dict) -> str:
     str
         The command being called
     """
+    return __run_command(arguments)[0]
+
+
+def __run_command(arguments: dict) -> tuple:
+    """
+    Runs the library function for a command
+
+    Parameters
+    ----------
+    arguments : dict
+        The command-line arguments
+
+    Returns
+    -------
+    tuple
+        The command being called, and what the library function returned
+    """
     command = ""
+    result = False
     if arguments["action"] == "add":
-        command = __dispatch_add_command(arguments)
+        command, result = __dispatch_add_command(arguments)
     elif arguments["action"] == "move":
-        command = __dispatch_move_command(arguments)
+        command, result = __dispatch_move_command(arguments)
     elif arguments["action"] == "remove":
-        command = __dispatch_remove_command(arguments)
+        command, result = __dispatch_remove_command(arguments)
     elif arguments["action"] == "update":
-        command = __dispatch_update_command(arguments)
+        command, result = __dispatch_update_command(arguments)
     elif arguments["action"] == "restore":
-        command = __dispatch_restore_command(arguments)
+        command, result = __dispatch_restore_command(arguments)
     elif arguments["action"] == "verify":
-        command = __dispatch_verify_command(arguments)
+        command, result = __dispatch_verify_command(arguments)
     elif arguments["action"] == "list-devices":
         command = "list-devices"
-        library.list_devices()
-
-    return command
-
-
-def __dispatch_add_command(arguments: dict) -> str:
+        result = library.list_devices()
+    elif arguments["action"] == "search":
+        command = "search"
+        result = library.search(
+            arguments["pattern"],
+            arguments["match"],
+            arguments["min_size"],
+            arguments["max_size"],
+            arguments["owner"],
+            arguments["device"],
+            arguments["checksum"],
+            arguments["limit"],
+        )
+    elif arguments["action"] == "profile-devices":
+        command = "profile-devices"
+        result = library.profile_devices()
+    elif arguments["action"] == "rebuild-catalog":
+        command = "rebuild-catalog"
+        result = library.rebuild_catalog(arguments["device"])
+    elif arguments["action"] == "protect":
+        command = "protect"
+        result = library.protect(arguments["data_blocks"], arguments["parity_blocks"])
+    elif arguments["action"] == "watch":
+        command = "watch"
+        result = library.watch_folder(arguments["folder"])
+    elif arguments["action"] == "serve":
+        command = "serve"
+        result = library.serve()
+    elif arguments["action"] == "batch":
+        command = "batch"
+        result = __run_batch(arguments)
+    elif arguments["action"] == "rebalance":
+        command = "rebalance"
+        result = library.rebalance(
+            arguments["strategy"],
+            arguments["throttle"] * 1024 * 1024 if arguments["throttle"] else None,
+        )
+
+    return command, result
+
+
+def __dispatch_add_command(arguments: dict) -> tuple:
     """
     Dispatches a command to add something
-    Returns command run
+    Returns command run, and its result
     """
     command = ""
+    result = False
     if arguments["file"]:
         command = "add-file"
-        library.add_file(arguments["file"], arguments["device"])
+        result = library.add_file(
+            arguments["file"], arguments["device"], copies=arguments["copies"]
+        )
     elif arguments["folder"]:
         command = "add-folder"
-        library.add_directory(arguments["folder"], arguments["device"])
+        result = library.add_directory(
+            arguments["folder"], arguments["device"], copies=arguments["copies"]
+        )
     elif arguments["device"]:
         command = "add-device"
-        library.add_device(arguments["device"])
+        result = library.add_device(arguments["device"])
 
-    return command
+    return command, result
 
 
-def __dispatch_move_command(arguments: list) -> str:
+def __dispatch_move_command(arguments: list) -> tuple:
     """
     Dispatches command to move file/folder or between devices
-    Returns command that was run
+    Returns command that was run, and its result
     """
     command = ""
+    result = False
     if arguments["file"]:
         if arguments["move_path"]:
             command = "move-file"
-            library.move_file_local(arguments["file"], arguments["move_path"])
+            result = library.move_file_local(arguments["file"], arguments["move_path"])
         else:
             command = "move-file-to-device"
-            library.move_file_device(arguments["file"], arguments["device"])
+            result = library.move_file_device(arguments["file"], arguments["device"])
     elif arguments["folder"]:
         if arguments["move_path"]:
             command = "move-folder"
-            library.move_directory_local(arguments["folder"], arguments["move_path"])
+            result = library.move_directory_local(
+                arguments["folder"], arguments["move_path"]
+            )
         else:
             command = "move-folder-to-device"
-            library.move_directory_device(arguments["folder"], arguments["device"])
+            result = library.move_directory_device(
+                arguments["folder"], arguments["device"]
+            )
+    elif arguments["all"]:
+        command = "move-all-to-device"
+        result = library.move_device(arguments["from_device"], arguments["device"])
 
-    return command
+    return command, result
 
 
-def __dispatch_remove_command(arguments: list) -> str:
+def __dispatch_remove_command(arguments: list) -> tuple:
     """
     Dispatches command to remove file/folder
-    Returns command that was run
+    Returns command that was run, and its result
     """
     command = ""
+    result = False
     if arguments["file"]:
         command = "remove-file"
-        library.remove_file(arguments["file"])
+        result = library.remove_file(arguments["file"])
     elif arguments["folder"]:
         command = "remove-folder"
-        library.remove_directory(arguments["folder"])
+        result = library.remove_directory(arguments["folder"])
 
-    return command
+    return command, result
 
 
-def __dispatch_update_command(arguments: list) -> str:
+def __dispatch_update_command(arguments: list) -> tuple:
     """
     Dispatches command to update a file or folder
-    Returns command that was run
+    Returns command that was run, and its result
     """
     command = ""
+    result = False
     if arguments["file"]:
         command = "update-file"
-        library.update_file(arguments["file"])
+        result = library.update_file(arguments["file"])
     elif arguments["folder"]:
         command = "update-folder"
-        library.update_folder(arguments["folder"])
+        result = library.update_folder(arguments["folder"], arguments["changed_only"])
 
-    return command
+    return command, result
 
 
-def __dispatch_restore_command(arguments: list) -> str:
+def __dispatch_restore_command(arguments: list) -> tuple:
     """
     Dispatches command to restore a file, folder, or everything
-    Returns command that was run
+    Returns command that was run, and its result
     """
     command = ""
+    result = False
     if arguments["file"]:
         command = "restore-file"
-        library.restore_file(arguments["file"])
+        result = library.restore_file(arguments["file"], arguments["preserve_metadata"])
     elif arguments["folder"]:
         command = "restore-folder"
-        library.restore_folder(arguments["folder"])
+        result = library.restore_folder(
+            arguments["folder"], arguments["preserve_metadata"]
+        )
     elif arguments["all"]:
         command = "restore-all"
-        library.restore_all()
+        result = library.restore_all(arguments["preserve_metadata"])
 
-    return command
+    return command, result
 
 
-def __dispatch_verify_command(arguments: list) -> str:
+def __dispatch_verify_command(arguments: list) -> tuple:
     """
     Dispatches command to verify a file, folder, or everything
-    Returns command that was run
+    Returns command that was run, and its result
     """
     command = ""
+    result = False
     if arguments["file"]:
         command = "verify-file"
-        library.verify_file(arguments["file"], False)
+        result = library.verify_file(arguments["file"], False)
     elif arguments["folder"]:
         command = "verify-folder"
-        library.verify_folder(arguments["folder"], False)
+        result = library.verify_folder(arguments["folder"], False)
     elif arguments["all"]:
         command = "verify-all"
-        library.verify_all(False)
+        result = library.verify_all(False)
+
+    return command, result
 
-    return command
 
+def __parse_batch(lines: list) -> tuple:
+    """
+    Parses a batch of operations, one command line each
+    Repeats of an operation are dropped, unless its path changed in between
+    Operations are validated as they run, since they may need earlier ones,
+    but lines setting options for the whole process are invalid
+
+    Parameters
+    ----------
+    lines : list
+        Lines of the batch, where blank lines and # comments are skipped
 
-def process(arguments: list = None) -> str:
+    Returns
+    -------
+    tuple
+        List of the line number, line and arguments of each operation to run,
+        list of the line number, line and error for each invalid line,
+        and how many repeats were dropped
+    """
+    operations = []
+    invalid = []
+    repeats = 0
+    last_by_path = {}
+    defaults = __parse_arguments(["batch"])
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        errors = io.StringIO()
+        try:
+            with redirect_stderr(errors):
+                arguments = __parse_arguments(shlex.split(line))
+        except (SystemExit, ValueError) as error:
+            message = errors.getvalue().strip().splitlines() or [str(error)]
+            invalid.append((line_number, line, message[-1]))
+            continue
+
+        if arguments["action"] not in BATCH_ACTIONS:
+            invalid.append((line_number, line, "Cannot be batched"))
+            continue
+
+        process_options = [
+            "--" + option.replace("_", "-")
+            for option in PROCESS_OPTIONS
+            if arguments[option] != defaults[option]
+        ]
+        if process_options:
+            invalid.append(
+                (
+                    line_number,
+                    line,
+                    "Only set for the whole batch: " + ", ".join(process_options),
+                )
+            )
+            continue
+
+        operation = tuple(sorted(arguments.items()))
+        target = arguments["file"] or arguments["folder"]
+        if last_by_path.get(target) == operation:
+            repeats += 1
+            continue
+
+        last_by_path[target] = operation
+        operations.append((line_number, line, arguments))
+
+    return operations, invalid, repeats
+
+
+def __run_operations(operations: list) -> list:
+    """
+    Runs operations in order, validating each just before it runs,
+    verifying files in parallel where several are verified in a row
+
+    Parameters
+    ----------
+    operations : list
+        Line number, line and arguments of each operation
+
+    Returns
+    -------
+    list
+        The command and result of each operation,
+        with no command for those not valid once their turn came
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since only batches run commands in parallel
+    from concurrent.futures import ThreadPoolExecutor
+
+    def is_parallel(arguments: dict) -> bool:
+        """
+        .
+        """
+        # Events are attributed to the one operation running
+        return (
+            arguments["action"] == "verify"
+            and bool(arguments["file"])
+            and not events.is_enabled()
+        )
+
+    def run(arguments: dict) -> tuple:
+        """
+        .
+        """
+        if not __validate_arguments(arguments):
+            return None, False
+
+        return __run_command(arguments)
+
+    results = []
+    start = 0
+    with ThreadPoolExecutor(max_workers=BATCH_THREADS) as executor:
+        while start < len(operations):
+            end = start + 1
+            while (
+                is_parallel(operations[start][2])
+                and end < len(operations)
+                and is_parallel(operations[end][2])
+            ):
+                end += 1
+
+            results.extend(
+                executor.map(
+                    lambda operation: run(operation[2]),
+                    operations[start:end],
+                )
+            )
+            start = end
+
+    return results
+
+
+def __run_batch(arguments: dict) -> bool:
+    """
+    Runs a batch of operations on one catalog connection,
+    then reports on them all
+
+    Parameters
+    ----------
+    arguments : dict
+        The command-line arguments, with the file listing the operations,
+        or none to read them from standard input
+
+    Returns
+    -------
+    bool
+        True if every operation was valid and succeeded
+    """
+    if arguments["file"]:
+        with open(arguments["file"], encoding="utf-8") as batch_file:
+            lines = batch_file.readlines()
+    else:
+        lines = sys.stdin.readlines()
+
+    opened = db.open_shared_connection()
+    quiet = is_quiet()
+    try:
+        operations, invalid, repeats = __parse_batch(lines)
+        # The report stands in for the status of each file
+        set_quiet(True)
+        results = __run_operations(operations)
+    finally:
+        set_quiet(quiet)
+        if opened:
+            db.close_shared_connection()
+
+    counts = {}
+    failed = []
+    ran = 0
+    for (line_number, line, _), (command, result) in zip(operations, results):
+        if command is None:
+            invalid.append((line_number, line, "Argument combination not valid"))
+            continue
+        ran += 1
+        counts.setdefault(command, [0, 0])[0 if result else 1] += 1
+        if not result:
+            failed.append((line_number, line))
+
+    for command, (succeeded, failures) in sorted(counts.items()):
+        PrettyStatusPrinter(
+            "{0}: {1} succeeded, {2} failed".format(command, succeeded, failures)
+        ).with_specific_color(
+            Color.YELLOW if failures else Color.GREEN
+        ).with_always_shown().print_message()
+    for line_number, line in failed:
+        print_error("Line {0} failed: {1}".format(line_number, line))
+    for line_number, line, error in sorted(invalid):
+        print_error("Line {0} invalid: {1} ({2})".format(line_number, line, error))
+
+    PrettyStatusPrinter(
+        "Ran {0} operations, skipping {1} repeats and {2} invalid lines".format(
+            ran, repeats, len(invalid)
+        )
+    ).with_always_shown().print_message()
+    events.emit(
+        "batch",
+        result=not failed and not invalid,
+        operations=ran,
+        failed=len(failed),
+        invalid=len(invalid),
+        repeats=repeats,
+    )
+    return not failed and not invalid
+
+
+def process(arguments: list = None, prepared: bool = False) -> str:
     """
     Run the process
 
@@ -415,6 +953,8 @@ def process(arguments: list = None) -> str:
     ----------
     arguments : list
         Injectable arguments to execute
+    prepared : bool
+        Whether the database is already set up, as in a running daemon
 
     Returns
     -------
@@ -423,11 +963,37 @@ def process(arguments: list = None) -> str:
     """
     if not arguments:
         arguments = []
-    __prepare()
+    if not prepared:
+        __prepare()
     args = __parse_arguments(arguments if arguments else sys.argv[1:])
-    if not __validate_arguments(args):
-        print_error("Argument combination not valid!")
-        sys.exit(1)
-
-    __check_devices(args)
-    return __dispatch_command(args)
+    set_quiet(args["quiet"])
+    events.configure(args["output"])
+    try:
+        if not __validate_arguments(args):
+            print_error("Argument combination not valid!")
+            sys.exit(1)
+
+        # Rebuilding starts from an empty catalog, with no devices to check,
+        # and the daemon checks them for each command it takes instead
+        if args["action"] not in ["rebuild-catalog", "serve"]:
+            __check_devices(args)
+
+        profiling.configure_slow_log(args["slow_threshold"], args["slow_log"])
+        utility.set_io_mode(args["io_mode"])
+        if args["preload_names"]:
+            utility.preload_security_names()
+        if args["profile"]:
+            command = profiling.run_profiled(
+                lambda: __dispatch_command(args), args["profile"], args["profile_dir"]
+            )
+        else:
+            command = __dispatch_command(args)
+
+        # Keeps a copy of the catalog on the devices, should the host disk be lost
+        library.replicate_catalog()
+        return command
+    finally:
+        # Events and manifest records are buffered,
+        # so anything left must be written before exiting
+        manifest.flush()
+        events.flush()
@@ -0,0 +1,306 @@
+"""
+Append-only manifests kept on each device, describing the files backed up on it
+Enough to rebuild the catalog from the devices alone, should it be lost
+"""
+import json
+import os
+import os.path as os_path
+import time
+
+from logical_backup import db
+from logical_backup.objects.device import Device
+from logical_backup.objects.file import File
+from logical_backup.pretty_print import print_error
+
+MANIFEST_NAME = ".logical_backup_manifest"
+
+# Records are appended to each device in batches of this many,
+# or sooner once the oldest has waited this many seconds
+BATCH_SIZE = 500
+BATCH_SECONDS = 5
+
+__pending = {}
+# When the oldest queued record for each device was queued
+__queued_since = {}
+# Devices whose manifest is known to start with a header, naming the device
+__headed = set()
+
+
+def __device_record(device: Device) -> list:
+    """
+    .
+    """
+    return [
+        "device",
+        device.device_name,
+        device.identifier_type,
+        device.identifier,
+        time.time(),
+    ]
+
+
+def __missing_header(device_path: str) -> list:
+    """
+    Finds the header a device's manifest lacks, from the catalog
+    Manifests started before headers were written get one put at their start
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+
+    Returns
+    -------
+    list
+        The header line to write before the queued records,
+        if the manifest has yet to be started
+    """
+    __headed.add(device_path)
+    manifest_path = os_path.join(device_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            first_line = manifest_file.readline()
+    except FileNotFoundError:
+        first_line = ""
+    except OSError:
+        # Writing fails too, and reports it
+        return []
+
+    if first_line.startswith('["device"'):
+        return []
+
+    devices = [
+        device for device in db.get_devices() if device.device_path == device_path
+    ]
+    if not devices:
+        return []
+
+    header = json.dumps(__device_record(devices[0]), separators=(",", ":"))
+    if not first_line:
+        return [header]
+
+    try:
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            records = manifest_file.read()
+        # Replaced whole, so a crash leaves either the old or new manifest
+        with open(manifest_path + ".new", "w", encoding="utf-8") as new_file:
+            new_file.write(header + "\n" + records)
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        os.replace(manifest_path + ".new", manifest_path)
+    except OSError:
+        print_error(
+            "Failed to add header to manifest on device {0}!".format(device_path)
+        )
+    return []
+
+
+def __append(device_path: str, record: list) -> None:
+    """
+    Queues a record for a device's manifest, writing the batch once full or old
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+    record : list
+        The record to append
+    """
+    lines = __pending.setdefault(device_path, [])
+    lines.append(json.dumps(record, separators=(",", ":")))
+    queued_since = __queued_since.setdefault(device_path, time.monotonic())
+    if len(lines) >= BATCH_SIZE or time.monotonic() - queued_since >= BATCH_SECONDS:
+        __write(device_path)
+
+
+def __write(device_path: str) -> None:
+    """
+    Appends queued records to a device's manifest, and syncs it
+    The catalog still has them, so failing to write is reported, not raised
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+    """
+    lines = __pending.pop(device_path, [])
+    __queued_since.pop(device_path, None)
+    if not lines:
+        return
+    if device_path not in __headed:
+        lines = __missing_header(device_path) + lines
+
+    try:
+        with open(
+            os_path.join(device_path, MANIFEST_NAME), "a", encoding="utf-8"
+        ) as manifest_file:
+            manifest_file.write("\n".join(lines) + "\n")
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+    except OSError:
+        print_error("Failed to write manifest on device {0}!".format(device_path))
+
+
+def flush() -> None:
+    """
+    Writes out every queued record
+    """
+    for device_path in list(__pending):
+        __write(device_path)
+
+
+def record_device(device: Device) -> None:
+    """
+    Records which device a manifest belongs to, written out straight away
+
+    Parameters
+    ----------
+    device : Device
+        The device, at its mount point
+    """
+    __headed.add(device.device_path)
+    __append(device.device_path, __device_record(device))
+    __write(device.device_path)
+
+
+def record_added(device_path: str, file_obj: File) -> None:
+    """
+    Records a file backed up on a device, or its latest details
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+    file_obj : File
+        The file
+    """
+    __append(
+        device_path,
+        [
+            "+",
+            file_obj.file_name,
+            file_obj.file_path,
+            file_obj.checksum,
+            file_obj.size,
+            file_obj.permissions,
+            file_obj.owner,
+            file_obj.group,
+            time.time(),
+        ],
+    )
+
+
+def record_removed(device_path: str, file_name: str) -> None:
+    """
+    Records a file no longer backed up on a device
+
+    Parameters
+    ----------
+    device_path : str
+        Mount point of the device
+    file_name : str
+        Name of the backed up copy
+    """
+    __append(device_path, ["-", file_name, time.time()])
+
+
+def read_manifest(mount_point: str) -> tuple:
+    """
+    Replays a device's manifest
+
+    Parameters
+    ----------
+    mount_point : str
+        Where the device is mounted
+
+    Returns
+    -------
+    tuple
+        The Device, or None if the manifest does not say,
+        and a dictionary of when each file was last recorded, and the File,
+        keyed by the name of its backed up copy
+    """
+    device = None
+    files = {}
+    with open(
+        os_path.join(mount_point, MANIFEST_NAME), encoding="utf-8"
+    ) as manifest_file:
+        for line in manifest_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Only the last line can be torn, by a crash while appending
+                continue
+
+            if record[0] == "device":
+                device = Device()
+                device.set(record[1], mount_point, record[2], record[3])
+            elif record[0] == "+":
+                file_obj = File()
+                file_obj.set_properties(record[1], record[2], record[3])
+                file_obj.size = record[4]
+                file_obj.set_security(record[5], record[6], record[7])
+                files[record[1]] = (record[8], file_obj)
+            elif record[0] == "-":
+                files.pop(record[1], None)
+
+    return device, files
+
+
+def read_manifests(mount_points: list) -> tuple:
+    """
+    Reads several devices' manifests in parallel, merging them
+    Where a path is recorded on more than one device, the latest record wins,
+    and other devices recording the same copy of it hold its further copies
+
+    Parameters
+    ----------
+    mount_points : list
+        Where the devices are mounted
+
+    Returns
+    -------
+    tuple
+        List of Devices, list of Files on them,
+        list of tuples of the path and mount point of each further copy,
+        and mount points whose manifests have files but do not name the device
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since only rebuilding reads manifests
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max(len(mount_points), 1)) as executor:
+        manifests = list(executor.map(read_manifest, mount_points))
+
+    devices = []
+    unnamed = []
+    recorded_copies = {}
+    for mount_point, (device, files) in zip(mount_points, manifests):
+        if not device:
+            if files:
+                unnamed.append(mount_point)
+            continue
+
+        devices.append(device)
+        for recorded, file_obj in files.values():
+            file_obj.device_name = device.device_name
+            recorded_copies.setdefault(file_obj.file_path, []).append(
+                (recorded, mount_point, file_obj)
+            )
+
+    latest_files = []
+    replicas = []
+    for path_copies in recorded_copies.values():
+        _, latest_point, latest = max(path_copies, key=lambda copy: copy[0])
+        latest_files.append(latest)
+        # Others differing were replaced since, or moved without the removal
+        # being written
+        replicas.extend(
+            (latest.file_path, mount_point)
+            for _, mount_point, file_obj in path_copies
+            if mount_point != latest_point
+            and file_obj.file_name == latest.file_name
+            and file_obj.checksum == latest.checksum
+        )
+
+    return devices, latest_files, replicas, unnamed
@@ -8,6 +8,15 @@ class Device:
     Represents a backup device
     """
 
+    # Fixed attributes, so catalogs of millions of records stay small
+    __slots__ = (
+        "__device_name",
+        "__device_path",
+        "__identifier_type_id",
+        "__identifier_type",
+        "__identifier",
+    )
+
     def __init__(self):
         """
         .
@@ -10,6 +10,19 @@ class File:
     Represents a backup file
     """
 
+    # Fixed attributes, so catalogs of millions of records stay small
+    __slots__ = (
+        "__file_name",
+        "__file_path",
+        "__permissions",
+        "__owner",
+        "__group",
+        "__checksum",
+        "__device_name",
+        "__device",
+        "__size",
+    )
+
     def __init__(self):
         """
         .
@@ -22,6 +35,7 @@ class File:
         self.__checksum = None
         self.__device_name = None
         self.__device = None
+        self.__size = None
 
     @property
     def file_name(self) -> str:
@@ -135,6 +149,20 @@ class File:
         """
         self.__device = device
 
+    @property
+    def size(self) -> int:
+        """
+        File size in bytes, if known
+        """
+        return self.__size
+
+    @size.setter
+    def size(self, size: int) -> None:
+        """
+        .
+        """
+        self.__size = size
+
     def set_properties(self, name: str, path: str, checksum: str) -> None:
         """
         Set properties about the file
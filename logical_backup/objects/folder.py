@@ -8,6 +8,14 @@ class Folder:
     A backup folder
     """
 
+    # Fixed attributes, so catalogs of millions of records stay small
+    __slots__ = (
+        "__folder_path",
+        "__folder_permissions",
+        "__folder_owner",
+        "__folder_group",
+    )
+
     def __init__(self):
         """
         .
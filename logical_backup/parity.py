@@ -0,0 +1,430 @@
+"""
+Erasure coding across groups of backed up files, each on a different device
+Parity blocks on further devices let any file in a group be rebuilt,
+for far less space than keeping whole copies of every file
+
+Blocks are combined with Reed-Solomon arithmetic over GF(256),
+multiplying through bytes.translate tables,
+and adding with NumPy if it is installed, or large integers otherwise
+"""
+from collections import namedtuple
+from contextlib import ExitStack
+import functools
+import hashlib
+import os
+import os.path as os_path
+
+ParityMember = namedtuple("parity_member", "device_path name checksum size")
+# Members are the data files in order, then the parity blocks
+ParityGroup = namedtuple("parity_group", "group_id data_count members")
+
+BACKENDS = ["numpy", "python"]
+CHUNK_SIZE = 1 << 20
+# Bit pattern of the polynomial the field is built from
+FIELD_POLYNOMIAL = 0x11D
+
+__codec = {"backend": None, "numpy": None}
+
+
+def set_backend(backend: str = None) -> str:
+    """
+    Chooses how blocks are combined
+
+    Parameters
+    ----------
+    backend : str
+        One of BACKENDS, by default NumPy if it can be imported
+
+    Returns
+    -------
+    str
+        The backend in use
+    """
+    numpy = None
+    if backend != "python":
+        try:
+            # pylint: disable=import-outside-toplevel
+            # Optional, and slow to import, so only loaded once coding
+            import numpy
+        except ImportError:
+            if backend == "numpy":
+                raise
+
+    __codec["numpy"] = numpy
+    __codec["backend"] = "numpy" if numpy else "python"
+    return __codec["backend"]
+
+
+@functools.lru_cache(maxsize=None)
+def __field_tables() -> tuple:
+    """
+    Builds exponent and logarithm tables for GF(256)
+
+    Returns
+    -------
+    tuple
+        Powers of the generator, twice over to skip a modulo,
+        and the logarithm of each non-zero value
+    """
+    exponents = [0] * 510
+    logarithms = [0] * 256
+    value = 1
+    for power in range(255):
+        exponents[power] = exponents[power + 255] = value
+        logarithms[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= FIELD_POLYNOMIAL
+
+    return exponents, logarithms
+
+
+def __multiply(first: int, second: int) -> int:
+    """
+    Multiplies two field values
+    """
+    if not first or not second:
+        return 0
+
+    exponents, logarithms = __field_tables()
+    return exponents[logarithms[first] + logarithms[second]]
+
+
+def __inverse(value: int) -> int:
+    """
+    Inverts a non-zero field value
+    """
+    exponents, logarithms = __field_tables()
+    return exponents[255 - logarithms[value]]
+
+
+@functools.lru_cache(maxsize=256)
+def __multiply_table(coefficient: int) -> bytes:
+    """
+    Products of a coefficient with every byte value, for bytes.translate
+    """
+    return bytes(__multiply(coefficient, value) for value in range(256))
+
+
+@functools.lru_cache(maxsize=None)
+def coding_matrix(data_count: int, parity_count: int) -> tuple:
+    """
+    Coefficients of each data block in each parity block
+    A Cauchy matrix, so any data_count of the blocks can rebuild the rest,
+    scaled so the first parity block is a plain XOR
+
+    Parameters
+    ----------
+    data_count : int
+        Data blocks in a group
+    parity_count : int
+        Parity blocks in a group
+
+    Returns
+    -------
+    tuple
+        A row of coefficients for each parity block
+    """
+    if data_count + parity_count > 256:
+        raise ValueError("At most 256 blocks fit in a group")
+
+    rows = [
+        [__inverse(row ^ (parity_count + column)) for column in range(data_count)]
+        for row in range(parity_count)
+    ]
+    scale = [__inverse(coefficient) for coefficient in rows[0]]
+    return tuple(
+        tuple(
+            __multiply(coefficient, factor) for coefficient, factor in zip(row, scale)
+        )
+        for row in rows
+    )
+
+
+def __generator_row(index: int, data_count: int, parity_count: int) -> list:
+    """
+    Coefficients of each data block in the block at an index of the group
+    """
+    if index < data_count:
+        return [int(column == index) for column in range(data_count)]
+
+    return list(coding_matrix(data_count, parity_count)[index - data_count])
+
+
+def __invert(matrix: list) -> list:
+    """
+    Inverts a square matrix of field values, by Gauss-Jordan elimination
+
+    Parameters
+    ----------
+    matrix : list
+        Rows of the matrix, which must be invertible
+
+    Returns
+    -------
+    list
+        Rows of the inverse
+    """
+    size = len(matrix)
+    rows = [
+        list(row) + [int(column == index) for column in range(size)]
+        for index, row in enumerate(matrix)
+    ]
+    for column in range(size):
+        pivot = next(index for index in range(column, size) if rows[index][column])
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        factor = __inverse(rows[column][column])
+        rows[column] = [__multiply(value, factor) for value in rows[column]]
+        for index in range(size):
+            if index != column and rows[index][column]:
+                factor = rows[index][column]
+                rows[index] = [
+                    value ^ __multiply(factor, pivot_value)
+                    for value, pivot_value in zip(rows[index], rows[column])
+                ]
+
+    return [row[size:] for row in rows]
+
+
+def __combine(coefficients: list, blocks: list) -> bytes:
+    """
+    Sums blocks of equal length, each multiplied by its coefficient
+
+    Parameters
+    ----------
+    coefficients : list
+        Field value to multiply each block by
+    blocks : list
+        Bytes of each block
+
+    Returns
+    -------
+    bytes
+        The combined block
+    """
+    if not __codec["backend"]:
+        set_backend()
+
+    numpy = __codec["numpy"]
+    if numpy:
+        combined = numpy.zeros(len(blocks[0]), dtype=numpy.uint8)
+        for coefficient, block in zip(coefficients, blocks):
+            if not coefficient:
+                continue
+            # Table lookups are quicker through translate than NumPy indexing
+            if coefficient != 1:
+                block = block.translate(__multiply_table(coefficient))
+            numpy.bitwise_xor(
+                combined, numpy.frombuffer(block, dtype=numpy.uint8), out=combined
+            )
+
+        return combined.tobytes()
+
+    # Arbitrarily large integers XOR whole blocks at once
+    combined = 0
+    for coefficient, block in zip(coefficients, blocks):
+        if not coefficient:
+            continue
+        if coefficient != 1:
+            block = block.translate(__multiply_table(coefficient))
+        combined ^= int.from_bytes(block, "little")
+
+    return combined.to_bytes(len(blocks[0]), "little")
+
+
+def encode(blocks: list, parity_count: int) -> list:
+    """
+    Computes parity blocks
+
+    Parameters
+    ----------
+    blocks : list
+        Data blocks, all the same length
+    parity_count : int
+        Parity blocks to compute
+
+    Returns
+    -------
+    list
+        The parity blocks
+    """
+    return [__combine(row, blocks) for row in coding_matrix(len(blocks), parity_count)]
+
+
+def decode(blocks: dict, data_count: int, parity_count: int, index: int) -> bytes:
+    """
+    Rebuilds a data block from any data_count others of its group
+
+    Parameters
+    ----------
+    blocks : dict
+        Blocks of the group available, keyed by index
+    data_count : int
+        Data blocks in the group
+    parity_count : int
+        Parity blocks in the group
+    index : int
+        Index of the data block to rebuild
+
+    Returns
+    -------
+    bytes
+        The data block
+    """
+    used = sorted(blocks)[:data_count]
+    return __combine(
+        __decoding_row(tuple(used), data_count, parity_count, index),
+        [blocks[member] for member in used],
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def __decoding_row(used: tuple, data_count: int, parity_count: int, index: int):
+    """
+    Coefficients of each of the used blocks in a data block
+    """
+    return __invert(
+        [__generator_row(member, data_count, parity_count) for member in used]
+    )[index]
+
+
+def __member_path(member: ParityMember) -> str:
+    """
+    Where a member of a group is stored
+    """
+    return os_path.join(member.device_path, member.name)
+
+
+def write_parity(
+    data_paths: list, checksums: list, parity_paths: list, chunk_size: int = CHUNK_SIZE
+) -> list:
+    """
+    Writes parity blocks for a group of files, reading each file once
+    Each file is checked against its checksum as it is read,
+    so a corrupt file never makes it into the parity
+
+    Parameters
+    ----------
+    data_paths : list
+        The backed up files in the group
+    checksums : list
+        MD5 checksum each file should have
+    parity_paths : list
+        Where to write each parity block, on devices holding none of the files
+    chunk_size : int
+        Bytes of each file to code at a time
+
+    Returns
+    -------
+    list
+        MD5 checksum of each parity block,
+        or None if a file did not match its checksum, leaving no parity behind
+    """
+    block_size = max(os_path.getsize(data_path) for data_path in data_paths)
+    data_digests = [hashlib.md5() for _ in data_paths]
+    parity_digests = [hashlib.md5() for _ in parity_paths]
+    with ExitStack() as stack:
+        data_files = [stack.enter_context(open(path, "rb")) for path in data_paths]
+        parity_files = [stack.enter_context(open(path, "wb")) for path in parity_paths]
+        for offset in range(0, block_size, chunk_size):
+            length = min(chunk_size, block_size - offset)
+            blocks = []
+            for data_file, digest in zip(data_files, data_digests):
+                chunk = data_file.read(length)
+                digest.update(chunk)
+                blocks.append(chunk.ljust(length, b"\0"))
+
+            for parity_file, digest, block in zip(
+                parity_files, parity_digests, encode(blocks, len(parity_paths))
+            ):
+                digest.update(block)
+                parity_file.write(block)
+
+        for parity_file in parity_files:
+            parity_file.flush()
+            os.fsync(parity_file.fileno())
+
+    if any(
+        digest.hexdigest() != checksum
+        for digest, checksum in zip(data_digests, checksums)
+    ):
+        for parity_path in parity_paths:
+            os.remove(parity_path)
+        return None
+
+    return [digest.hexdigest() for digest in parity_digests]
+
+
+def rebuild(
+    group: ParityGroup, index: int, destination_file, chunk_size: int = CHUNK_SIZE
+) -> str:
+    """
+    Rebuilds a file of a group from the other members on attached devices
+    Members found corrupt once read are left out, and the rebuild tried again
+
+    Parameters
+    ----------
+    group : ParityGroup
+        The group the file is in
+    index : int
+        Position of the file in the group
+    destination_file : file
+        Binary file to write the rebuilt file to, from the start
+    chunk_size : int
+        Bytes of each member to decode at a time
+
+    Returns
+    -------
+    str
+        MD5 checksum of the data written,
+        or None if too few intact members could be found
+    """
+    parity_count = len(group.members) - group.data_count
+    block_size = max(member.size for member in group.members)
+    size = group.members[index].size
+    # Data files come first, and need no arithmetic to read back
+    usable = [
+        member_index
+        for member_index, member in enumerate(group.members)
+        if member_index != index and os_path.isfile(__member_path(member))
+    ]
+
+    while len(usable) >= group.data_count:
+        used = usable[: group.data_count]
+        coefficients = __decoding_row(
+            tuple(used), group.data_count, parity_count, index
+        )
+        member_digests = [hashlib.md5() for _ in used]
+        digest = hashlib.md5()
+        destination_file.seek(0)
+        destination_file.truncate()
+
+        with ExitStack() as stack:
+            member_files = [
+                stack.enter_context(open(__member_path(group.members[member]), "rb"))
+                for member in used
+            ]
+            for offset in range(0, block_size, chunk_size):
+                length = min(chunk_size, block_size - offset)
+                blocks = []
+                for member_file, member_digest in zip(member_files, member_digests):
+                    chunk = member_file.read(length)
+                    member_digest.update(chunk)
+                    blocks.append(chunk.ljust(length, b"\0"))
+
+                chunk = __combine(coefficients, blocks)[: max(size - offset, 0)]
+                digest.update(chunk)
+                destination_file.write(chunk)
+
+        corrupt = [
+            member
+            for member, member_digest in zip(used, member_digests)
+            if member_digest.hexdigest() != group.members[member].checksum
+        ]
+        if not corrupt:
+            destination_file.flush()
+            return digest.hexdigest()
+
+        usable = [member for member in usable if member not in corrupt]
+
+    return None
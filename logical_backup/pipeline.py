@@ -0,0 +1,160 @@
+"""
+Runs work on many files as a pipeline of stages, each with its own workers
+One file can be hashed while another is copied and a third recorded,
+so time taken is bounded by the slowest stage, not the sum of all of them
+"""
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from logical_backup.pretty_print import print_error
+
+# Items waiting between each pair of stages, bounding how many are in flight
+QUEUE_SIZE = 16
+
+# A step of the pipeline, with the blocking function run on each item,
+# which returns the item for the next stage, or None if it failed
+# A stage with one worker sees items one at a time, e.g. to write the catalog
+Stage = namedtuple("stage", "name function workers")
+
+# Tells a worker there are no more items
+__DONE = object()
+
+
+async def __run_stage(
+    stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue, state: dict
+) -> None:
+    """
+    Passes items through a stage, from its queue to the next stage's
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage
+    inbox : asyncio.Queue
+        Items for this stage
+    outbox : asyncio.Queue
+        Items for the next stage, or None if this is the last
+    state : dict
+        Callbacks for finished items and naming them, and whether any failed
+    """
+    loop = asyncio.get_running_loop()
+
+    async def work(executor: ThreadPoolExecutor) -> None:
+        """
+        .
+        """
+        while True:
+            item = await inbox.get()
+            if item is __DONE:
+                return
+
+            try:
+                result = await loop.run_in_executor(executor, stage.function, item)
+            # One file failing must not stop the others already in flight
+            # pylint: disable=broad-except
+            except Exception as error:
+                print_error(
+                    "Failed to {0} {1}: {2}".format(
+                        stage.name, state["describe"](item), error
+                    )
+                )
+                result = None
+
+            if result is None:
+                state["failed"] = True
+                state["on_done"](item, False)
+            elif outbox is None:
+                state["on_done"](result, True)
+            else:
+                await outbox.put(result)
+
+    with ThreadPoolExecutor(max_workers=stage.workers) as executor:
+        await asyncio.gather(*(work(executor) for _ in range(stage.workers)))
+
+
+# pylint: disable=bad-continuation
+async def __run_pipeline(
+    items: list, stages: list, on_done, describe, stop_on_failure: bool
+) -> bool:
+    """
+    Feeds items into the first stage, and waits for every stage to finish
+
+    Returns
+    -------
+    bool
+        True if every item made it through every stage
+    """
+    state = {"on_done": on_done, "describe": describe, "failed": False}
+    queues = [asyncio.Queue(maxsize=QUEUE_SIZE) for _ in stages]
+
+    async def finish(stage_index: int) -> None:
+        """
+        .
+        """
+        # Each stage is done once the one before it is, and its queue drained
+        await __run_stage(
+            stages[stage_index],
+            queues[stage_index],
+            queues[stage_index + 1] if stage_index + 1 < len(stages) else None,
+            state,
+        )
+        if stage_index + 1 < len(stages):
+            for _ in range(stages[stage_index + 1].workers):
+                await queues[stage_index + 1].put(__DONE)
+
+    async def feed() -> None:
+        """
+        .
+        """
+        for item in items:
+            if state["failed"] and stop_on_failure:
+                break
+            await queues[0].put(item)
+        for _ in range(stages[0].workers):
+            await queues[0].put(__DONE)
+
+    await asyncio.gather(feed(), *(finish(index) for index in range(len(stages))))
+    return not state["failed"]
+
+
+# pylint: disable=bad-continuation
+def run(
+    items: list,
+    stages: list,
+    on_done=None,
+    describe=str,
+    stop_on_failure: bool = False,
+) -> bool:
+    """
+    Runs items through every stage, blocking until all are finished
+
+    Parameters
+    ----------
+    items : list
+        Items for the first stage
+    stages : list
+        Stages to run, in order
+    on_done : callable
+        Called with each item as it finishes, or fails, and whether it succeeded
+        Always called from the thread running the pipeline
+    describe : callable
+        Names an item in error messages
+    stop_on_failure : bool
+        Whether to stop taking new items once any fails,
+        still finishing those already in flight
+
+    Returns
+    -------
+    bool
+        True if every item made it through every stage
+    """
+    return asyncio.run(
+        __run_pipeline(
+            items,
+            stages,
+            on_done or (lambda item, succeeded: None),
+            describe,
+            stop_on_failure,
+        )
+    )
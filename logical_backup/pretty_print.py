@@ -3,11 +3,35 @@ Some pretty-printing stuff
 """
 from __future__ import annotations
 
+from datetime import timedelta
 from enum import Enum
+import sys
+import time
+
+from logical_backup import events
 
 CHECK_UNICODE = "\u2714"
 CROSS_UNICODE = "\u274c"
 
+# Progress is redrawn at most this many times a second
+REDRAWS_PER_SECOND = 4
+
+__output = {"quiet": False}
+
+
+def set_quiet(quiet: bool) -> None:
+    """
+    Sets whether to print only errors and summaries
+    """
+    __output["quiet"] = quiet
+
+
+def is_quiet() -> bool:
+    """
+    Returns whether only errors and summaries are printed
+    """
+    return __output["quiet"]
+
 
 class Color(Enum):
     """
@@ -74,7 +98,13 @@ def print_error(message: str) -> None:
     """
     Prints an error message
     """
-    PrettyStatusPrinter(message).with_specific_color(Color.ERROR).print_message()
+    if events.is_enabled():
+        events.record_error(message)
+        return
+
+    PrettyStatusPrinter(message).with_specific_color(
+        Color.ERROR
+    ).with_always_shown().print_message()
 
 
 # pylint: disable=too-many-instance-attributes
@@ -97,6 +127,7 @@ class PrettyStatusPrinter:
         self.__message = message
         self.__line_ending = "\n"
         self.__started = False
+        self.__always_shown = False
 
     def __get_styled_message(self, result=None) -> str:
         """
@@ -189,6 +220,13 @@ class PrettyStatusPrinter:
         self.__line_ending = line_ending
         return self
 
+    def with_always_shown(self, shown: bool = True) -> PrettyStatusPrinter:
+        """
+        Print even when quiet, or while progress is shown instead of status
+        """
+        self.__always_shown = shown
+        return self
+
     def with_styles(self, styles: list) -> PrettyStatusPrinter:
         """
         Sets styles to print the message with
@@ -202,6 +240,12 @@ class PrettyStatusPrinter:
         If to overwrite, will use a carriage return instead of newline
         Succeeded can also be specified, to pass through for formatting
         """
+        if events.is_enabled() or (
+            not self.__always_shown and (is_quiet() or ProgressDisplay.is_active())
+        ):
+            return
+
+        ProgressDisplay.clear()
         line_ending = "\r" if to_overwrite else self.__line_ending
         print(self.__get_styled_message(result), end=line_ending, flush=True)
 
@@ -220,6 +264,247 @@ class PrettyStatusPrinter:
         self.print_message(result=succeeded)
 
 
+def record_progress(device: str, size: int) -> None:
+    """
+    Records bytes handled on a device, for any progress being shown,
+    and for the event of the operation being run
+
+    Parameters
+    ----------
+    device : str
+        Mount point of the device
+    size : int
+        Bytes read or written
+    """
+    events.record(device, size)
+    if ProgressDisplay.is_active():
+        ProgressDisplay.active().add_bytes(device, size)
+
+
+# pylint: disable=too-many-instance-attributes
+class ProgressDisplay:
+    """
+    Shows progress over many files as a few lines, in place of per-file status
+    Nested displays hand over to the outermost, so it covers the whole operation
+    Without a terminal, or if quiet, only a summary is printed at the end
+    """
+
+    __active = []
+    __drawn_lines = [0]
+
+    # pylint: disable=bad-continuation
+    def __init__(
+        self,
+        action: str,
+        total_files: int,
+        total_bytes: int = None,
+        device_bytes: dict = None,
+    ):
+        """
+        .
+        """
+        self.__action = action
+        self.__total_files = total_files
+        self.__total_bytes = total_bytes
+        self.__device_bytes = device_bytes or {}
+        self.__files = 0
+        self.__failures = 0
+        self.__bytes = 0
+        self.__devices = {}
+        self.__start = None
+        self.__last_draw = None
+        self.__interactive = False
+
+    @staticmethod
+    def is_active() -> bool:
+        """
+        Returns whether progress is being shown
+        """
+        return bool(ProgressDisplay.__active)
+
+    @staticmethod
+    def active() -> ProgressDisplay:
+        """
+        Returns the display progress is being shown on
+        """
+        return ProgressDisplay.__active[0]
+
+    @staticmethod
+    def clear() -> None:
+        """
+        Erases drawn progress, so other output does not get drawn over
+        """
+        if ProgressDisplay.__drawn_lines[0]:
+            print(
+                "\033[{0}F\033[J".format(ProgressDisplay.__drawn_lines[0]),
+                end="",
+                flush=True,
+            )
+            ProgressDisplay.__drawn_lines[0] = 0
+
+    def __enter__(self) -> ProgressDisplay:
+        """
+        .
+        """
+        if ProgressDisplay.__active:
+            return ProgressDisplay.active()
+
+        ProgressDisplay.__active.append(self)
+        self.__start = time.monotonic()
+        self.__interactive = (
+            sys.stdout.isatty() and not is_quiet() and not events.is_enabled()
+        )
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        """
+        .
+        """
+        if not ProgressDisplay.__active or ProgressDisplay.active() is not self:
+            return
+
+        ProgressDisplay.__active.clear()
+        ProgressDisplay.clear()
+        if events.is_enabled():
+            events.emit(
+                "summary",
+                size=self.__bytes,
+                duration=time.monotonic() - self.__start,
+                result=not self.__failures,
+                action=self.__action,
+                files=self.__files,
+                failures=self.__failures,
+            )
+            return
+
+        summary = (
+            PrettyStatusPrinter(self.summary())
+            .with_always_shown()
+            .with_message_postfix_for_result(True, "")
+            .with_message_postfix_for_result(False, "")
+        )
+        summary.print_message(result=not self.__failures)
+
+    def add_bytes(self, device: str, size: int) -> None:
+        """
+        Records bytes handled on a device
+
+        Parameters
+        ----------
+        device : str
+            Mount point of the device
+        size : int
+            Bytes read or written
+        """
+        self.__bytes += size
+        self.__devices[device] = self.__devices.get(device, 0) + size
+        self.__draw()
+
+    def file_done(self, succeeded: bool = True) -> None:
+        """
+        Records a file as finished
+
+        Parameters
+        ----------
+        succeeded : bool
+            Whether it was handled successfully
+        """
+        self.__files += 1
+        if not succeeded:
+            self.__failures += 1
+        self.__draw()
+
+    @staticmethod
+    def __format_eta(remaining: float, rate: float) -> str:
+        """
+        Formats time left at a given rate
+        """
+        if not rate:
+            return "?"
+        return str(timedelta(seconds=round(max(remaining, 0) / rate)))
+
+    def lines(self) -> list:
+        """
+        Gets the lines describing progress so far
+
+        Returns
+        -------
+        list
+            Overall progress, then progress per device
+        """
+        elapsed = max(time.monotonic() - self.__start, 1e-9)
+        rate = self.__bytes / elapsed
+        if self.__total_bytes:
+            sizes = "{0}/{1}".format(
+                readable_bytes(self.__bytes), readable_bytes(self.__total_bytes)
+            )
+            eta = self.__format_eta(self.__total_bytes - self.__bytes, rate)
+        else:
+            sizes = readable_bytes(self.__bytes)
+            eta = self.__format_eta(
+                self.__total_files - self.__files, self.__files / elapsed
+            )
+
+        lines = [
+            "{0}: {1}/{2} files, {3}, {4}/s, ETA {5}".format(
+                self.__action,
+                self.__files,
+                self.__total_files,
+                sizes,
+                readable_bytes(rate),
+                eta,
+            )
+        ]
+        for device, size in sorted(self.__devices.items()):
+            device_rate = size / elapsed
+            line = "  {0}: {1}, {2}/s".format(
+                device, readable_bytes(size), readable_bytes(device_rate)
+            )
+            if device in self.__device_bytes:
+                line += ", ETA " + self.__format_eta(
+                    self.__device_bytes[device] - size, device_rate
+                )
+            lines.append(line)
+
+        return lines
+
+    def summary(self) -> str:
+        """
+        Gets a one line summary of everything done
+
+        Returns
+        -------
+        str
+            The summary
+        """
+        elapsed = time.monotonic() - self.__start
+        return "{0}: {1} files{2}, {3} in {4}, {5}/s".format(
+            self.__action,
+            self.__files,
+            " ({0} failed)".format(self.__failures) if self.__failures else "",
+            readable_bytes(self.__bytes),
+            timedelta(seconds=round(elapsed)),
+            readable_bytes(self.__bytes / max(elapsed, 1e-9)),
+        )
+
+    def __draw(self) -> None:
+        """
+        Redraws progress in place, if due
+        """
+        now = time.monotonic()
+        if not self.__interactive or (
+            self.__last_draw is not None
+            and now - self.__last_draw < 1 / REDRAWS_PER_SECOND
+        ):
+            return
+
+        self.__last_draw = now
+        lines = self.lines()
+        ProgressDisplay.clear()
+        print("".join(line + "\033[K\n" for line in lines), end="", flush=True)
+        ProgressDisplay.__drawn_lines[0] = len(lines)
+
+
 def readable_bytes(size: int, suffix: str = "B") -> str:
     """
     Prints size of file
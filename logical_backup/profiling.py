@@ -0,0 +1,129 @@
+"""
+Opt-in profiling of commands, and logging of slow per-file operations
+"""
+from contextlib import contextmanager
+import os.path as os_path
+import time
+
+from logical_backup import events
+
+PROFILE_MODES = ["cpu", "mem", "both"]
+PHASES = ["hash", "copy", "db", "parity"]
+
+__slow_log = {"threshold": None, "path": None}
+
+
+def configure_slow_log(threshold: float, log_path: str) -> None:
+    """
+    Sets up logging of slow operations
+    Passing a threshold of None disables it
+
+    Parameters
+    ----------
+    threshold : float
+        Seconds a single operation can take before being logged
+    log_path : str
+        File to append slow operations to
+    """
+    __slow_log["threshold"] = threshold
+    __slow_log["path"] = log_path
+
+
+@contextmanager
+def timed(phase: str, path: str):
+    """
+    Times an operation on a single file, logging it if over the threshold
+    and emitting it as an event, if events are enabled
+
+    Parameters
+    ----------
+    phase : str
+        The phase of work, one of PHASES
+    path : str
+        The file being operated on
+    """
+    threshold = __slow_log["threshold"]
+    if threshold is None and not events.is_enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        elapsed = time.perf_counter() - start
+        events.emit(
+            "phase", path=path, duration=elapsed, result=succeeded, phase=phase
+        )
+        if threshold is not None and elapsed > threshold:
+            with open(__slow_log["path"], "a", encoding="utf-8") as log_file:
+                log_file.write(
+                    "{0}\t{1}\t{2:.3f}\t{3}\n".format(
+                        time.strftime("%Y-%m-%dT%H:%M:%S"), phase, elapsed, path
+                    )
+                )
+
+
+def run_profiled(function, mode: str, output_dir: str, top_count: int = 25) -> str:
+    """
+    Runs a command under the requested profilers
+    Results are written to files named after the command that ran
+
+    Parameters
+    ----------
+    function : callable
+        Runs the command, returning its name
+    mode : str
+        One of PROFILE_MODES
+    output_dir : str
+        Directory to write profiles to
+    top_count : int
+        Number of allocation sites to include in the memory snapshot
+
+    Returns
+    -------
+    str
+        The command that was run
+    """
+    # pylint: disable=import-outside-toplevel
+    # Only pay for loading the profilers when asked to profile
+    import cProfile
+    import tracemalloc
+
+    profile_cpu = mode in ["cpu", "both"]
+    profile_memory = mode in ["mem", "both"]
+
+    profiler = cProfile.Profile() if profile_cpu else None
+    if profile_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+
+    try:
+        command = function()
+    finally:
+        if profiler:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot() if profile_memory else None
+        current, peak = tracemalloc.get_traced_memory() if profile_memory else (0, 0)
+        if profile_memory:
+            tracemalloc.stop()
+
+    name = command or "command"
+    if profiler:
+        profiler.dump_stats(os_path.join(output_dir, name + ".pstats"))
+
+    if snapshot:
+        with open(
+            os_path.join(output_dir, name + ".tracemalloc.txt"), "w", encoding="utf-8"
+        ) as snapshot_file:
+            snapshot_file.write(
+                "Current: {0} bytes, peak: {1} bytes\n".format(current, peak)
+            )
+            snapshot_file.write("Top {0} allocation sites:\n".format(top_count))
+            for statistic in snapshot.statistics("lineno")[:top_count]:
+                snapshot_file.write(str(statistic) + "\n")
+
+    return command
@@ -0,0 +1,151 @@
+"""
+Copies of the catalog kept on each device, so losing the host disk loses nothing
+Only the database pages changed since the last copy are written
+"""
+import hashlib
+import os
+import os.path as os_path
+import sqlite3
+import struct
+
+from logical_backup import db
+
+REPLICA_NAME = ".logical_backup_catalog.db"
+# Digests of the pages last written to the replica, to find the changed ones
+DIGEST_SUFFIX = ".pages"
+DIGEST_SIZE = 8
+
+# Change counter and size of the catalog when last replicated
+__DIGEST_HEADER = struct.Struct(">IQ")
+# Page size, then change counter, from the SQLite file header
+__PAGE_SIZE = struct.Struct(">H")
+__CHANGE_COUNTER = struct.Struct(">I")
+
+
+def __read_digests(digest_path: str) -> tuple:
+    """
+    Reads the digests recorded for a replica
+
+    Parameters
+    ----------
+    digest_path : str
+        Path of the digest file
+
+    Returns
+    -------
+    tuple
+        Change counter and size of the catalog replicated, and list of page digests,
+        or None if there is no usable record
+    """
+    try:
+        with open(digest_path, "rb") as digest_file:
+            data = digest_file.read()
+    except OSError:
+        return None
+
+    if len(data) < __DIGEST_HEADER.size:
+        return None
+
+    counter, size = __DIGEST_HEADER.unpack_from(data)
+    pages = data[__DIGEST_HEADER.size :]
+    return (
+        counter,
+        size,
+        [
+            pages[start : start + DIGEST_SIZE]
+            for start in range(0, len(pages), DIGEST_SIZE)
+        ],
+    )
+
+
+def __write_digests(digest_path: str, counter: int, size: int, digests: list) -> None:
+    """
+    Records the digests of a replica, replacing the previous record whole
+
+    Parameters
+    ----------
+    digest_path : str
+        Path of the digest file
+    counter : int
+        Change counter of the catalog replicated
+    size : int
+        Size of the catalog replicated
+    digests : list
+        Digest of each page
+    """
+    temporary_path = digest_path + ".tmp"
+    with open(temporary_path, "wb") as digest_file:
+        digest_file.write(__DIGEST_HEADER.pack(counter, size) + b"".join(digests))
+        digest_file.flush()
+        os.fsync(digest_file.fileno())
+    os.replace(temporary_path, digest_path)
+
+
+def replicate_catalog(mount_point: str) -> int:
+    """
+    Brings the replica of the catalog on a device up to date
+
+    Parameters
+    ----------
+    mount_point : str
+        Where the device is mounted
+
+    Returns
+    -------
+    int
+        Number of pages written
+    """
+    catalog_path = db.get_database_file()
+    replica_path = os_path.join(mount_point, REPLICA_NAME)
+    digest_path = replica_path + DIGEST_SUFFIX
+    previous = __read_digests(digest_path) if os_path.isfile(replica_path) else None
+
+    # A read transaction keeps writers out, so the file is consistent while read
+    connection = sqlite3.connect(catalog_path, isolation_level=None)
+    try:
+        connection.execute("BEGIN")
+        connection.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        with open(catalog_path, "rb") as catalog:
+            header = catalog.read(100)
+            size = os.fstat(catalog.fileno()).st_size
+            # Every committed change increments the counter, so nothing changed
+            counter = __CHANGE_COUNTER.unpack_from(header, 24)[0]
+            if previous is not None and previous[:2] == (counter, size):
+                return 0
+
+            page_size = __PAGE_SIZE.unpack_from(header, 16)[0]
+            # Stored as 1 when it is too large for the field
+            page_size = 65536 if page_size == 1 else page_size
+            old_digests = previous[2] if previous is not None else []
+
+            # Removed first, so a copy interrupted part-way is rewritten in full
+            if os_path.exists(digest_path):
+                os.remove(digest_path)
+
+            descriptor = os.open(replica_path, os.O_WRONLY | os.O_CREAT, 0o600)
+            try:
+                digests = []
+                written = 0
+                catalog.seek(0)
+                for offset in range(0, size, page_size):
+                    page = catalog.read(page_size)
+                    digest = hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+                    index = len(digests)
+                    digests.append(digest)
+                    if index < len(old_digests) and old_digests[index] == digest:
+                        continue
+
+                    os.pwrite(descriptor, page, offset)
+                    written += 1
+
+                os.ftruncate(descriptor, size)
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+    finally:
+        connection.rollback()
+        connection.close()
+
+    __write_digests(digest_path, counter, size, digests)
+    return written
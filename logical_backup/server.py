@@ -0,0 +1,236 @@
+"""
+A long-running daemon taking commands over a Unix socket
+Commands skip interpreter startup, imports and catalog setup,
+and share one catalog connection and the owner and group names found
+"""
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+import os.path as os_path
+import socket
+import socketserver
+import sys
+import traceback
+
+from logical_backup import client
+from logical_backup import db
+from logical_backup import main
+from logical_backup import utility
+from logical_backup.pretty_print import PrettyStatusPrinter, print_error
+
+
+class ClientStream(io.TextIOBase):
+    """
+    Standard input and output of a command, relayed to the client running it
+    """
+
+    def __init__(self, stream, tty: bool, error: bool = False):
+        """
+        Initialize the object
+
+        Parameters
+        ----------
+        stream : file
+            Binary stream of the client's socket
+        tty : bool
+            Whether the client's output is a terminal
+        error : bool
+            Whether this is standard error
+        """
+        super().__init__()
+        self.__stream = stream
+        self.__tty = tty
+        self.__error = error
+        self.__unread = ""
+
+    def write(self, text: str) -> int:
+        """
+        Sends output to the client
+        """
+        client.send_message(self.__stream, {"output": text, "error": self.__error})
+        return len(text)
+
+    def readline(self, size: int = -1) -> str:
+        """
+        Asks the client for a line of input, once any left unread is used up
+        """
+        if not self.__unread:
+            client.send_message(self.__stream, {"input": True})
+            line = self.__stream.readline()
+            self.__unread = json.loads(line)["input"] if line else ""
+
+        end = size if size >= 0 else len(self.__unread)
+        line, self.__unread = self.__unread[:end], self.__unread[end:]
+        return line
+
+    def isatty(self) -> bool:
+        """
+        .
+        """
+        return self.__tty
+
+    def readable(self) -> bool:
+        """
+        .
+        """
+        return True
+
+    def writable(self) -> bool:
+        """
+        .
+        """
+        return True
+
+
+def run_command(arguments: list, working_directory: str, stream, tty: bool) -> int:
+    """
+    Runs a command as the CLI would, with input and output through a client
+
+    Parameters
+    ----------
+    arguments : list
+        Command line arguments
+    working_directory : str
+        Directory the client ran from, for relative paths
+    stream : file
+        Binary stream of the client's socket
+    tty : bool
+        Whether the client's output is a terminal
+
+    Returns
+    -------
+    int
+        Exit code of the command
+    """
+    # Names found stay valid, but users and groups may be created between commands
+    utility.clear_security_names(True)
+    output = ClientStream(stream, tty)
+    previous_directory = os.getcwd()
+    previous_input = sys.stdin
+    exit_code = 0
+    try:
+        os.chdir(working_directory)
+        sys.stdin = output
+        with redirect_stdout(output), redirect_stderr(ClientStream(stream, tty, True)):
+            try:
+                main.process(arguments, prepared=True)
+            except SystemExit as exit_error:
+                exit_code = (
+                    exit_error.code
+                    if isinstance(exit_error.code, int)
+                    else int(exit_error.code is not None)
+                )
+            # The daemon must outlive any one command failing
+            # pylint: disable=broad-except
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+    finally:
+        sys.stdin = previous_input
+        os.chdir(previous_directory)
+
+    return exit_code
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Runs the command sent over a connection
+    """
+
+    def handle(self):
+        """
+        .
+        """
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        request = json.loads(line)
+        exit_code = run_command(
+            request["arguments"], request["cwd"], self.rwfile, request["tty"]
+        )
+        client.send_message(self.rwfile, {"exit": exit_code})
+
+    def setup(self):
+        """
+        .
+        """
+        super().setup()
+        # Prompts read replies part-way through a command, from the same stream
+        self.rwfile = self.connection.makefile("rwb")
+
+    def finish(self):
+        """
+        .
+        """
+        self.rwfile.close()
+        super().finish()
+
+
+def create_server(socket_path: str) -> socketserver.UnixStreamServer:
+    """
+    Listens for commands on a socket, only accessible to the current user
+
+    Parameters
+    ----------
+    socket_path : str
+        Where to listen
+
+    Returns
+    -------
+    UnixStreamServer
+        The server, or None if another daemon is already listening there
+    """
+    if os_path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            print_error("A daemon is already listening on {0}!".format(socket_path))
+            return None
+        except OSError:
+            # Left behind by a daemon that did not stop cleanly
+            os.remove(socket_path)
+        finally:
+            probe.close()
+
+    previous_mask = os.umask(0o177)
+    try:
+        return socketserver.UnixStreamServer(socket_path, CommandHandler)
+    finally:
+        os.umask(previous_mask)
+
+
+def serve(socket_path: str = None) -> bool:
+    """
+    Takes commands until interrupted, one at a time
+
+    Parameters
+    ----------
+    socket_path : str
+        Where to listen, by default beside the catalog in use
+
+    Returns
+    -------
+    bool
+        True if the daemon ran
+    """
+    socket_path = socket_path or client.get_socket_path()
+    server = create_server(socket_path)
+    if not server:
+        return False
+
+    db.open_shared_connection()
+    PrettyStatusPrinter(
+        "Taking commands on {0}, until interrupted".format(socket_path)
+    ).print_message()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        db.close_shared_connection()
+
+    return True
@@ -2,24 +2,43 @@
 Some helper functions
 """
 from collections import namedtuple
+import errno
+import fcntl
 import grp
 import hashlib
+import mmap
 from os import getenv, environ
 import os
 import os.path as os_path
 import pwd
+import shutil
 from subprocess import run, Popen, PIPE
 from time import time
 
-from pytest import fixture
-import psutil
-
 from logical_backup.pretty_print import PrettyStatusPrinter
+from logical_backup.profiling import timed
 
 TEST_VARIABLE = "IS_TEST"
 
 DirectoryEntries = namedtuple("directory_entries", "files folders")
 
+# How file contents are read and written when hashing and copying
+# Cached goes through the page cache as usual, fadvise drops what was read
+# or written from it as it goes, and direct skips it with O_DIRECT
+IO_MODES = ["cached", "fadvise", "direct"]
+# Bytes read or written at a time without the cache,
+# and written between syncing and dropping them from it
+SYNC_SIZE = 8 << 20
+# O_DIRECT buffers, offsets and lengths must be multiples of this
+DIRECT_ALIGNMENT = 4096
+
+__io = {"mode": "cached"}
+
+# Owner and group names resolved during this run, in both directions
+# Misses are kept as None too, since on NSS/LDAP hosts every lookup may be
+# a network round trip
+__security_names = {"user_name": {}, "group_name": {}, "uid": {}, "gid": {}}
+
 
 def is_test() -> bool:
     """
@@ -94,16 +113,6 @@ def run_piped_command(commands: list) -> dict:
     return {"exit_code": previous.returncode, "stdout": out, "stderr": err}
 
 
-@fixture(autouse=True)
-def auto_set_testing():
-    """
-    Will automatically set environment to testing
-    """
-    set_testing()
-    yield "test"
-    remove_testing()
-
-
 def __get_device_path(mount_point: str) -> str:
     """
     Resolve the /dev/ path for a given mounted device
@@ -113,11 +122,31 @@ def __get_device_path(mount_point: str) -> str:
     mount_point : str
         The mount point for the drive
     """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since only device commands need it
+    import psutil
+
     partitions = psutil.disk_partitions()
     partition = [part for part in partitions if part.mountpoint == mount_point]
     return partition[0].device if partition else None
 
 
+def get_mount_points() -> list:
+    """
+    Lists where every filesystem is mounted
+
+    Returns
+    -------
+    list
+        Mount points
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since only device commands need it
+    import psutil
+
+    return [partition.mountpoint for partition in psutil.disk_partitions(all=True)]
+
+
 def get_device_serial(mount_point: str) -> str:
     """
     Get the serial ID for a device
@@ -202,6 +231,9 @@ def get_device_space(mount_point: str) -> int:
     float
         Bytes of available space
     """
+    # pylint: disable=import-outside-toplevel
+    import psutil
+
     available = psutil.disk_usage(mount_point)
     return available.free
 
@@ -235,6 +267,300 @@ def get_abs_path(path: str) -> str:
     return os_path.abspath(path) if path else None
 
 
+def set_io_mode(mode: str) -> str:
+    """
+    Chooses how file contents are read and written when hashing and copying
+    Without posix_fadvise or O_DIRECT, files are read and written as usual
+
+    Parameters
+    ----------
+    mode : str
+        One of IO_MODES
+
+    Returns
+    -------
+    str
+        The mode in use
+    """
+    if mode != "cached" and not hasattr(os, "posix_fadvise"):
+        mode = "cached"
+    elif mode == "direct" and not hasattr(os, "O_DIRECT"):
+        mode = "fadvise"
+
+    __io["mode"] = mode
+    return mode
+
+
+def get_io_mode() -> str:
+    """
+    .
+    """
+    return __io["mode"]
+
+
+class UncachedFile:
+    """
+    A binary file read or written sequentially, keeping the page cache clear
+    Pages are dropped once read, or once written and synced,
+    even those cached before the file was opened
+
+    With O_DIRECT, the cache is skipped entirely, in aligned blocks,
+    falling back to dropping pages on file systems without it
+    """
+
+    def __init__(self, path: str, writing: bool = False, direct: bool = False):
+        """
+        Opens the file, truncating it if writing
+
+        Parameters
+        ----------
+        path : str
+            The file
+        writing : bool
+            Whether to write the file, rather than read it
+        direct : bool
+            Whether to use O_DIRECT
+        """
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC if writing else os.O_RDONLY
+        self.__descriptor = None
+        if direct:
+            try:
+                self.__descriptor = os.open(path, flags | os.O_DIRECT, 0o666)
+            except OSError as error:
+                if error.errno != errno.EINVAL:
+                    raise
+        self.__direct = self.__descriptor is not None
+        if not self.__direct:
+            self.__descriptor = os.open(path, flags, 0o666)
+            os.posix_fadvise(self.__descriptor, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        self.__writing = writing
+        self.__offset = 0
+        self.__synced = 0
+        # Anonymous maps are page aligned, as O_DIRECT needs
+        self.__buffer = mmap.mmap(-1, SYNC_SIZE) if self.__direct else None
+        self.__buffered = 0
+        # Read in whole blocks, beyond what was asked for
+        self.__pending = b""
+
+    def fileno(self) -> int:
+        """
+        .
+        """
+        return self.__descriptor
+
+    def read(self, size: int = SYNC_SIZE) -> bytes:
+        """
+        Reads the next chunk of the file
+
+        Parameters
+        ----------
+        size : int
+            Most bytes to read
+
+        Returns
+        -------
+        bytes
+            The chunk, empty at the end of the file
+        """
+        if self.__direct:
+            chunk = self.__pending
+            if len(chunk) < size:
+                blocks = -(-(size - len(chunk)) // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+                with memoryview(self.__buffer) as view:
+                    length = os.preadv(
+                        self.__descriptor,
+                        [view[: min(blocks, len(view))]],
+                        self.__offset,
+                    )
+                    chunk += view[:length]
+                self.__offset += length
+            chunk, self.__pending = chunk[:size], chunk[size:]
+            return chunk
+
+        chunk = os.pread(self.__descriptor, size, self.__offset)
+        self.__offset += len(chunk)
+        # Pages still being read ahead are not dropped, so each range is
+        # dropped again a chunk later, once that has finished
+        os.posix_fadvise(
+            self.__descriptor,
+            self.__synced,
+            self.__offset - self.__synced,
+            os.POSIX_FADV_DONTNEED,
+        )
+        self.__synced = self.__offset - len(chunk)
+        return chunk
+
+    def write(self, chunk: bytes) -> int:
+        """
+        Writes a chunk after those before
+
+        Parameters
+        ----------
+        chunk : bytes
+            The data
+
+        Returns
+        -------
+        int
+            Bytes written
+        """
+        if not self.__direct:
+            self.__write_all(chunk)
+            if self.__offset - self.__synced >= SYNC_SIZE:
+                self.__sync()
+            return len(chunk)
+
+        written = 0
+        while written < len(chunk):
+            length = min(len(chunk) - written, len(self.__buffer) - self.__buffered)
+            self.__buffer[self.__buffered : self.__buffered + length] = chunk[
+                written : written + length
+            ]
+            self.__buffered += length
+            written += length
+            if self.__buffered == len(self.__buffer):
+                self.__write_buffer()
+
+        return written
+
+    def flush(self) -> None:
+        """
+        Writes out anything buffered, then syncs it and drops it from the cache
+        Once flushed, a direct file only takes ordinary writes,
+        since its end may no longer fall on a block
+        """
+        if self.__direct and self.__buffered:
+            self.__write_buffer()
+        if self.__direct and self.__buffered:
+            fcntl.fcntl(
+                self.__descriptor,
+                fcntl.F_SETFL,
+                fcntl.fcntl(self.__descriptor, fcntl.F_GETFL) & ~os.O_DIRECT,
+            )
+            self.__direct = False
+            self.__write_all(self.__buffer[: self.__buffered])
+            self.__buffered = 0
+        if self.__offset > self.__synced:
+            self.__sync()
+
+    def close(self) -> None:
+        """
+        Flushes and closes the file
+        """
+        if self.__descriptor is None:
+            return
+
+        try:
+            if self.__writing:
+                self.flush()
+            elif not self.__direct:
+                os.posix_fadvise(self.__descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(self.__descriptor)
+            self.__descriptor = None
+            if self.__buffer:
+                self.__buffer.close()
+
+    def __write_all(self, data) -> None:
+        """
+        Writes data at the current offset, however many calls that takes
+        """
+        with memoryview(data) as view:
+            written = 0
+            while written < len(view):
+                written += os.pwrite(
+                    self.__descriptor, view[written:], self.__offset + written
+                )
+        self.__offset += written
+
+    def __write_buffer(self) -> None:
+        """
+        Writes the whole blocks in the direct buffer, keeping any partial one
+        """
+        length = self.__buffered - self.__buffered % DIRECT_ALIGNMENT
+        if not length:
+            return
+
+        with memoryview(self.__buffer) as view:
+            os.pwritev(self.__descriptor, [view[:length]], self.__offset)
+        self.__offset += length
+        self.__buffer.move(0, length, self.__buffered - length)
+        self.__buffered -= length
+
+    def __sync(self) -> None:
+        """
+        Syncs what was written, so its pages can be dropped from the cache
+        """
+        os.fdatasync(self.__descriptor)
+        if not self.__direct:
+            os.posix_fadvise(
+                self.__descriptor,
+                self.__synced,
+                self.__offset - self.__synced,
+                os.POSIX_FADV_DONTNEED,
+            )
+        self.__synced = self.__offset
+
+    def __enter__(self):
+        """
+        .
+        """
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        """
+        .
+        """
+        self.close()
+
+
+def open_file(path: str, writing: bool = False):
+    """
+    Opens a binary file to hash or copy, in the I/O mode set
+
+    Parameters
+    ----------
+    path : str
+        The file
+    writing : bool
+        Whether to write the file, truncating it, rather than read it
+
+    Returns
+    -------
+    file
+        The open file, with read or write, flush and close
+    """
+    if __io["mode"] == "cached":
+        return open(path, "wb" if writing else "rb")
+
+    return UncachedFile(path, writing, __io["mode"] == "direct")
+
+
+def copy_file(source: str, destination: str) -> None:
+    """
+    Copies a file's contents, in the I/O mode set
+
+    Parameters
+    ----------
+    source : str
+        The file to copy
+    destination : str
+        Where to copy it to
+    """
+    if __io["mode"] == "cached":
+        shutil.copyfile(source, destination)
+        return
+
+    with open_file(source) as source_file, open_file(
+        destination, True
+    ) as destination_file:
+        chunk = source_file.read(SYNC_SIZE)
+        while chunk:
+            destination_file.write(chunk)
+            chunk = source_file.read(SYNC_SIZE)
+
+
 def checksum_file(path: str) -> str:
     """
     Gets the checksum of a file
@@ -250,19 +576,179 @@ def checksum_file(path: str) -> str:
         Checksum
     """
     message = PrettyStatusPrinter("Getting MD5 hash of " + path).print_start()
-    result = run_piped_command([["md5sum", path], ["awk", "{ print $1 }"]])
-    if result["exit_code"]:
+    failure = None
+    with timed("hash", path):
+        if __io["mode"] == "cached":
+            result = run_piped_command([["md5sum", path], ["awk", "{ print $1 }"]])
+            checksum = result["stdout"].strip().decode()
+            if result["exit_code"]:
+                failure = "Exit code: {0}".format(result["exit_code"])
+        else:
+            # Read here, since md5sum would leave the file in the page cache
+            digest = hashlib.md5()
+            try:
+                with open_file(path) as source_file:
+                    chunk = source_file.read(SYNC_SIZE)
+                    while chunk:
+                        digest.update(chunk)
+                        chunk = source_file.read(SYNC_SIZE)
+                checksum = digest.hexdigest()
+            except OSError as error:
+                failure = error.strerror
+    if failure:
         message.with_message_postfix_for_result(
-            False, "Failed! Exit code: {0}".format(result["exit_code"])
+            False, "Failed! " + failure
         ).print_complete(False)
         checksum = None
     else:
         message.print_complete()
-        checksum = result["stdout"].strip().decode()
 
     return checksum
 
 
+def copy_and_checksum(source: str, destination: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Copies a file, hashing it in the same pass
+    Saves reading the copy back in again to verify it
+
+    Parameters
+    ----------
+    source : str
+        The file to copy
+    destination : str
+        Where to copy it to
+    chunk_size : int
+        Bytes to read at a time
+
+    Returns
+    -------
+    str
+        MD5 checksum of the data written
+    """
+    with timed("copy", source):
+        with open_file(source) as source_file, open_file(
+            destination, True
+        ) as destination_file:
+            return checksum_copy(source_file, destination_file, chunk_size)
+
+
+def checksum_copy(source_file, destination_file, chunk_size: int = 1 << 20) -> str:
+    """
+    Copies between open files, hashing in the same pass
+    Leaves both open, so the copy can be worked on further
+
+    Parameters
+    ----------
+    source_file : file
+        Binary file to read from
+    destination_file : file
+        Binary file to write to, flushed once done
+    chunk_size : int
+        Bytes to read at a time
+
+    Returns
+    -------
+    str
+        MD5 checksum of the data written
+    """
+    digest = hashlib.md5()
+    chunk = source_file.read(chunk_size)
+    while chunk:
+        digest.update(chunk)
+        destination_file.write(chunk)
+        chunk = source_file.read(chunk_size)
+    destination_file.flush()
+
+    return digest.hexdigest()
+
+
+def copy_to_all(source: str, destinations: list, chunk_size: int = 1 << 20) -> str:
+    """
+    Copies a file to several places from a single read, hashing in the same pass
+    Each destination is written by its own thread, while the next chunk is read
+
+    Parameters
+    ----------
+    source : str
+        The file to copy
+    destinations : list
+        Where to copy it to, ideally each on a different device
+    chunk_size : int
+        Bytes to read at a time
+
+    Returns
+    -------
+    str
+        MD5 checksum of the data written
+    """
+    # pylint: disable=import-outside-toplevel
+    # Deferred, since only files kept on several devices need it
+    from concurrent.futures import ThreadPoolExecutor
+
+    digest = hashlib.md5()
+    destination_files = []
+    try:
+        with open_file(source) as source_file, ThreadPoolExecutor(
+            max_workers=len(destinations)
+        ) as executor:
+            for destination in destinations:
+                destination_files.append(open_file(destination, True))
+
+            writes = []
+            chunk = source_file.read(chunk_size)
+            while chunk:
+                for write in writes:
+                    write.result()
+                writes = [
+                    executor.submit(destination_file.write, chunk)
+                    for destination_file in destination_files
+                ]
+                digest.update(chunk)
+                chunk = source_file.read(chunk_size)
+
+            for write in writes:
+                write.result()
+    finally:
+        for destination_file in destination_files:
+            destination_file.close()
+
+    return digest.hexdigest()
+
+
+def copy_file_metadata(source, destination, xattrs: bool = True) -> None:
+    """
+    Copies access and modification times, and optionally extended attributes
+    Attributes the destination cannot hold, or we may not set, are skipped
+
+    Parameters
+    ----------
+    source : str or int
+        Path or open descriptor to copy from
+    destination : str or int
+        Path or open descriptor to copy to, with any writes already flushed
+    xattrs : bool
+        Whether to copy extended attributes too
+    """
+    if xattrs and hasattr(os, "listxattr"):
+        try:
+            names = os.listxattr(source)
+        except OSError as error:
+            if error.errno != errno.ENOTSUP:
+                raise
+            names = []
+
+        for name in names:
+            try:
+                os.setxattr(destination, name, os.getxattr(source, name))
+            except OSError as error:
+                if error.errno not in (errno.ENOTSUP, errno.EPERM):
+                    raise
+
+    # Last, since setting anything else could touch the times
+    stats = os.stat(source)
+    os.utime(destination, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+
+
 def create_backup_name(path: str) -> str:
     """
     Creates a unique name to back up a file to
@@ -283,6 +769,161 @@ def create_backup_name(path: str) -> str:
     return path_hash.hexdigest() + "_" + file_name
 
 
+def __resolve_security_name(cache: str, key, lookup):
+    """
+    Looks up a user or group, remembering the answer, even if not found
+
+    Parameters
+    ----------
+    cache : str
+        Which of the security name caches to use
+    key : int or str
+        The ID or name to look up
+    lookup : callable
+        Resolves the key, raising KeyError if it does not exist
+
+    Returns
+    -------
+    int or str
+        The resolved ID or name, or None if there is none
+    """
+    resolved = __security_names[cache]
+    if key not in resolved:
+        try:
+            resolved[key] = lookup(key)
+        except KeyError:
+            resolved[key] = None
+
+    return resolved[key]
+
+
+def __get_id_for_name(name: str, lookup) -> int:
+    """
+    Looks up an ID by name, accepting numeric names for IDs without one
+    """
+    try:
+        return lookup(name)
+    except KeyError:
+        if name.isdigit():
+            return int(name)
+        raise
+
+
+def get_user_name(uid: int) -> str:
+    """
+    Gets the name of a user
+
+    Parameters
+    ----------
+    uid : int
+        The user ID
+
+    Returns
+    -------
+    str
+        The name, or None if the user does not exist
+    """
+    return __resolve_security_name(
+        "user_name", uid, lambda key: pwd.getpwuid(key).pw_name
+    )
+
+
+def get_group_name(gid: int) -> str:
+    """
+    Gets the name of a group
+
+    Parameters
+    ----------
+    gid : int
+        The group ID
+
+    Returns
+    -------
+    str
+        The name, or None if the group does not exist
+    """
+    return __resolve_security_name(
+        "group_name", gid, lambda key: grp.getgrgid(key).gr_name
+    )
+
+
+def get_user_id(name: str) -> int:
+    """
+    Gets the ID of a user
+
+    Parameters
+    ----------
+    name : str
+        The user name
+
+    Returns
+    -------
+    int
+        The ID, or None if the user does not exist
+    """
+    return __resolve_security_name(
+        "uid",
+        name,
+        lambda key: __get_id_for_name(key, lambda user: pwd.getpwnam(user).pw_uid),
+    )
+
+
+def get_group_id(name: str) -> int:
+    """
+    Gets the ID of a group
+
+    Parameters
+    ----------
+    name : str
+        The group name
+
+    Returns
+    -------
+    int
+        The ID, or None if the group does not exist
+    """
+    return __resolve_security_name(
+        "gid",
+        name,
+        lambda key: __get_id_for_name(key, lambda group: grp.getgrnam(group).gr_gid),
+    )
+
+
+def preload_security_names() -> None:
+    """
+    Resolves every user and group up front, in one enumeration each
+    Cheaper than single lookups when most users own files, though some
+    directory services will not enumerate, leaving those to single lookups
+    """
+    message = PrettyStatusPrinter("Loading users and groups").print_start()
+    # Like getpwnam and getgrnam, the first entry for a name or ID wins
+    for user in pwd.getpwall():
+        __security_names["user_name"].setdefault(user.pw_uid, user.pw_name)
+        __security_names["uid"].setdefault(user.pw_name, user.pw_uid)
+    for group in grp.getgrall():
+        __security_names["group_name"].setdefault(group.gr_gid, group.gr_name)
+        __security_names["gid"].setdefault(group.gr_name, group.gr_gid)
+    message.print_complete()
+
+
+def clear_security_names(misses_only: bool = False) -> None:
+    """
+    Forgets every resolved user and group, e.g. if they changed
+
+    Parameters
+    ----------
+    misses_only : bool
+        Whether to only forget users and groups not found,
+        in case they have since been created
+    """
+    for resolved in __security_names.values():
+        if misses_only:
+            for key in [key for key, value in resolved.items() if value is None]:
+                del resolved[key]
+        else:
+            resolved.clear()
+
+
 def get_file_security(path: str) -> dict:
     """
     Get security details for a file
@@ -300,8 +941,9 @@ def get_file_security(path: str) -> dict:
     message = PrettyStatusPrinter("Checking file permissions").print_start()
     file_stats = os.stat(path)
     permission_mask = oct(file_stats.st_mode)[-3:]
-    owner = pwd.getpwuid(file_stats.st_uid).pw_name
-    group = grp.getgrgid(file_stats.st_gid).gr_name
+    # IDs without a name on this system are kept as the number itself
+    owner = get_user_name(file_stats.st_uid) or str(file_stats.st_uid)
+    group = get_group_name(file_stats.st_gid) or str(file_stats.st_gid)
     message.print_complete()
 
     return {"permissions": permission_mask, "owner": owner, "group": group}
@@ -0,0 +1,251 @@
+"""
+Journals changes under a folder as they happen, through Linux inotify
+Updates then only need to check the paths changed, instead of the whole tree
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path as os_path
+import select
+import struct
+import time
+
+from logical_backup import db
+from logical_backup.pretty_print import print_error
+
+# Seconds between journal writes, so bursts of changes share a transaction
+FLUSH_INTERVAL = 1.0
+READ_SIZE = 65536
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x80000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+# Directories appearing or vanishing take everything beneath them along
+RECURSIVE_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Watch descriptor, mask, cookie and name length, before each event's name
+__EVENT = struct.Struct("iIII")
+
+__inotify = {}
+
+
+def __load_inotify() -> bool:
+    """
+    Looks up the inotify calls in the C library
+
+    Returns
+    -------
+    bool
+        True if inotify is available
+    """
+    if not __inotify:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            __inotify["init"] = libc.inotify_init1
+            __inotify["add_watch"] = libc.inotify_add_watch
+            __inotify["remove_watch"] = libc.inotify_rm_watch
+        except AttributeError:
+            return False
+
+        __inotify["add_watch"].argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        __inotify["remove_watch"].argtypes = [ctypes.c_int, ctypes.c_int]
+
+    return True
+
+
+def __add_watches(descriptor: int, directory_path: str, watches: dict) -> bool:
+    """
+    Watches a directory and every directory beneath it
+
+    Parameters
+    ----------
+    descriptor : int
+        The inotify instance
+    directory_path : str
+        Top directory to watch
+    watches : dict
+        Path of each watched directory, keyed by watch descriptor
+
+    Returns
+    -------
+    bool
+        False if the system limit on watches was reached
+    """
+    for parent_path, _, _ in os.walk(directory_path):
+        watch_id = __inotify["add_watch"](
+            descriptor, os.fsencode(parent_path), WATCH_MASK
+        )
+        if watch_id >= 0:
+            watches[watch_id] = parent_path
+        elif ctypes.get_errno() == errno.ENOSPC:
+            print_error(
+                "Too many directories to watch, "
+                "raise fs.inotify.max_user_watches to watch them all!"
+            )
+            return False
+
+        # Otherwise it vanished since being listed, which its parent records
+
+    return True
+
+
+def __remove_watches(descriptor: int, directory_path: str, watches: dict) -> None:
+    """
+    Stops watching a directory, and every directory beneath it
+
+    Parameters
+    ----------
+    descriptor : int
+        The inotify instance
+    directory_path : str
+        Top directory to stop watching
+    watches : dict
+        Path of each watched directory, keyed by watch descriptor
+    """
+    prefix = directory_path + "/"
+    for watch_id, watched_path in list(watches.items()):
+        if watched_path == directory_path or watched_path.startswith(prefix):
+            __inotify["remove_watch"](descriptor, watch_id)
+            del watches[watch_id]
+
+
+def __read_events(
+    descriptor: int, folder_path: str, watches: dict, dirty: dict
+) -> bool:
+    """
+    Reads waiting events, marking the paths they name as dirty
+
+    Parameters
+    ----------
+    descriptor : int
+        The inotify instance
+    folder_path : str
+        The folder being watched
+    watches : dict
+        Path of each watched directory, keyed by watch descriptor
+    dirty : dict
+        Whether everything beneath each changed path may have changed too,
+        keyed by path
+
+    Returns
+    -------
+    bool
+        False if watching can no longer continue
+    """
+    data = os.read(descriptor, READ_SIZE)
+    offset = 0
+    while offset < len(data):
+        watch_id, mask, _, length = __EVENT.unpack_from(data, offset)
+        offset += __EVENT.size
+        name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+        offset += length
+
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped, so only walking everything finds the changes
+            dirty[folder_path] = True
+            continue
+        if mask & IN_IGNORED:
+            watches.pop(watch_id, None)
+            continue
+        if watch_id not in watches:
+            continue
+
+        changed_path = (
+            os_path.join(watches[watch_id], name) if name else watches[watch_id]
+        )
+        recursive = bool(mask & IN_ISDIR and mask & RECURSIVE_MASK)
+        dirty[changed_path] = dirty.get(changed_path, False) or recursive
+
+        if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+            __remove_watches(descriptor, changed_path, watches)
+        if (
+            mask & IN_ISDIR
+            and mask & (IN_CREATE | IN_MOVED_TO)
+            and not __add_watches(descriptor, changed_path, watches)
+        ):
+            return False
+
+    return True
+
+
+def watch(folder_path: str, stop=None) -> bool:
+    """
+    Journals every change under a folder, until interrupted
+    Changes made while not watching cannot be known,
+    so the whole folder is journaled as changed when watching starts
+
+    Parameters
+    ----------
+    folder_path : str
+        The folder to watch
+    stop : threading.Event
+        Optional event to stop watching once set
+
+    Returns
+    -------
+    bool
+        True if watching stopped as asked
+    """
+    if not __load_inotify():
+        print_error("Watching for changes needs Linux inotify!")
+        return False
+
+    descriptor = __inotify["init"](IN_CLOEXEC)
+    if descriptor < 0:
+        print_error(
+            "Failed to start watching: {0}".format(os.strerror(ctypes.get_errno()))
+        )
+        return False
+
+    watches = {}
+    dirty = {}
+    success = __add_watches(descriptor, folder_path, watches)
+    try:
+        db.add_dirty_paths({folder_path: True})
+        if success:
+            db.set_watched_folder(folder_path, os.getpid())
+
+        flushed = time.monotonic()
+        while success and watches and not (stop and stop.is_set()):
+            readable, _, _ = select.select([descriptor], [], [], FLUSH_INTERVAL)
+            if readable:
+                success = __read_events(descriptor, folder_path, watches, dirty)
+
+            if dirty and time.monotonic() - flushed >= FLUSH_INTERVAL:
+                db.add_dirty_paths(dirty)
+                dirty.clear()
+                flushed = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(descriptor)
+        if dirty:
+            db.add_dirty_paths(dirty)
+        # Updates check everything again until a watcher is restarted
+        db.set_watched_folder(folder_path)
+
+    return success
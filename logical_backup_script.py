@@ -1,7 +1,17 @@
 """
 Script to execute backup operations
 """
-from logical_backup.main import process
+import sys
+
+from logical_backup import client
 
 if __name__ == "__main__":
+    # A running daemon saves loading everything else
+    EXIT_CODE = client.send_command(sys.argv[1:])
+    if EXIT_CODE is not None:
+        sys.exit(EXIT_CODE)
+
+    # pylint: disable=import-outside-toplevel
+    from logical_backup.main import process
+
     process()
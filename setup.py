@@ -19,4 +19,6 @@ setuptools.setup(
     url="https://github.com/ammesonb/logical-backup",
     packages=setuptools.find_packages(),
     python_requires=">=3.6",
+    # Parity is coded in pure Python without it, only more slowly
+    extras_require={"parity": ["numpy"]},
 )
@@ -0,0 +1,17 @@
+"""
+Fixtures shared between test modules
+"""
+from pytest import fixture
+
+from logical_backup.utility import clear_security_names, set_testing, remove_testing
+
+
+@fixture(autouse=True)
+def auto_set_testing():
+    """
+    Will automatically set environment to testing
+    """
+    set_testing()
+    clear_security_names()
+    yield "test"
+    remove_testing()
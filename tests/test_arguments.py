@@ -16,7 +16,7 @@ import logical_backup.db as db
 
 # This is an auto-run fixture, so importing is sufficient
 # pylint: disable=unused-import
-from logical_backup.utility import auto_set_testing
+from tests.fixtures import auto_set_testing
 
 MOCK_FILE = "mock.test"
 
@@ -38,6 +38,28 @@ def make_arguments(action: str) -> dict:
         "all": False,
         "move_path": None,
         "from_device": None,
+        "pattern": None,
+        "match": "substring",
+        "min_size": None,
+        "max_size": None,
+        "owner": None,
+        "checksum": None,
+        "limit": None,
+        "strategy": "space",
+        "throttle": None,
+        "copies": 1,
+        "data_blocks": 4,
+        "parity_blocks": 1,
+        "changed_only": False,
+        "profile": None,
+        "profile_dir": ".",
+        "slow_threshold": None,
+        "slow_log": "slow_operations.log",
+        "output": "text",
+        "quiet": False,
+        "preserve_metadata": False,
+        "preload_names": False,
+        "io_mode": "cached",
     }
 
 
@@ -177,6 +199,16 @@ def test_add(monkeypatch):
         arguments
     ), "Irrelevant arguments should be ignored, and pass"
 
+    arguments["copies"] = 2
+    assert not __validate_arguments(arguments), "More copies than devices should fail"
+    monkeypatch.setattr(db, "get_devices", lambda: [device, device])
+    assert __validate_arguments(arguments), "A copy per device should pass"
+    arguments["copies"] = 0
+    assert not __validate_arguments(arguments), "No copies should fail"
+    arguments["copies"] = 2
+    arguments["action"] = "update"
+    assert not __validate_arguments(arguments), "Copies only apply when adding"
+
     remove_mock()
 
 
@@ -213,6 +245,15 @@ def test_update(monkeypatch):
     arguments["device"] = "/foo"
     make_mock_file()
     assert not __validate_arguments(arguments), "Device is not valid for update"
+
+    arguments["device"] = None
+    arguments["changed_only"] = True
+    assert not __validate_arguments(arguments), "Only folders have changes journaled"
+    arguments["file"] = None
+    arguments["folder"] = path.dirname(path.abspath(MOCK_FILE))
+    assert __validate_arguments(arguments), "Changed paths of a folder can be updated"
+    arguments["action"] = "add"
+    assert not __validate_arguments(arguments), "Changed paths are only updated"
     remove_mock()
 
 
@@ -306,3 +347,37 @@ def test_move(monkeypatch):
     assert __validate_arguments(arguments), "Mounted 'from' device path should pass"
 
     remove_mock()
+
+    arguments = make_arguments("move")
+    arguments["all"] = True
+    arguments["device"] = "/mnt"
+    assert not __validate_arguments(
+        arguments
+    ), "Moving all files requires a device to move from"
+    arguments["from_device"] = "/mnt2"
+    assert __validate_arguments(arguments), "Moving all files between devices passes"
+    arguments["device"] = None
+    assert not __validate_arguments(
+        arguments
+    ), "Moving all files requires a device to move to"
+
+
+def test_search(monkeypatch):
+    """
+    .
+    """
+    arguments = make_arguments("search")
+    monkeypatch.setattr(db, "get_devices", lambda: [])
+    assert not __validate_arguments(arguments), "Search needs something to find"
+
+    arguments["pattern"] = "photo"
+    assert __validate_arguments(arguments), "Search by pattern passes"
+
+    arguments["pattern"] = None
+    arguments["min_size"] = 0
+    assert __validate_arguments(arguments), "Search by size passes"
+
+    arguments["min_size"] = None
+    arguments["device"] = "/mnt"
+    monkeypatch.setattr(path, "ismount", lambda path: False)
+    assert __validate_arguments(arguments), "Search on unattached device passes"
@@ -0,0 +1,129 @@
+"""
+Tests for the benchmark harness
+"""
+import os.path as os_path
+import tempfile
+
+from benchmarks import cache_bypass
+from benchmarks import daemon_latency
+from benchmarks import harness
+from benchmarks import import_time
+from benchmarks import object_memory
+from benchmarks import parity_throughput
+from benchmarks import synthetic
+from logical_backup import utility
+
+
+def test_generate_tree():
+    """
+    Trees are reproducible, and match the requested shape
+    """
+    spec = synthetic.TreeSpec(50, 512, "lognormal", 2, 2, 7)
+    workspace = tempfile.mkdtemp()
+    tree = synthetic.generate_tree(os_path.join(workspace, "tree"), spec)
+
+    assert len(tree.files) == 50, "All files created"
+    assert len(tree.folders) == 6, "Two levels of two folders each created"
+    assert all(os_path.isfile(file_path) for file_path in tree.files), "Files exist"
+    assert tree.total_bytes == sum(
+        os_path.getsize(file_path) for file_path in tree.files
+    ), "Total bytes matches files on disk"
+    assert synthetic.get_file_sizes(spec) == synthetic.get_file_sizes(
+        spec
+    ), "Sizes are reproducible for a seed"
+
+    modified = synthetic.modify_files(tree, 0.1, 1)
+    assert len(modified) == 5, "Ten percent of files modified"
+
+    fixed = synthetic.TreeSpec(3, 100, "fixed", 1, 1, 1)
+    assert synthetic.get_file_sizes(fixed) == [100, 100, 100], "Fixed sizes match"
+
+
+def test_compare_to_baseline():
+    """
+    Only regressions beyond the tolerance are reported
+    """
+    baseline = {
+        "config": {},
+        "results": {
+            "verify_all": {
+                "files_per_second": 100,
+                "mb_per_second": 10,
+                "peak_rss_mib": 10,
+            }
+        },
+    }
+
+    steady = harness.BenchmarkResult("verify_all", 1, 95, 10 * 1024 * 1024, 10240)
+    assert not harness.compare_to_baseline(
+        [steady], baseline, 0.1
+    ), "Changes within tolerance are not regressions"
+
+    slower = harness.BenchmarkResult("verify_all", 2, 100, 10 * 1024 * 1024, 10240)
+    regressions = harness.compare_to_baseline([slower], baseline, 0.1)
+    assert len(regressions) == 2, "Halved rates are both regressions"
+
+    bigger = harness.BenchmarkResult("verify_all", 1, 100, 10 * 1024 * 1024, 20480)
+    regressions = harness.compare_to_baseline([bigger], baseline, 0.1)
+    assert len(regressions) == 1, "Doubled memory is a regression"
+    assert "peak_rss_mib" in regressions[0], "Memory regression is named"
+
+    unknown = harness.BenchmarkResult("other", 1, 1, 1, 1)
+    assert not harness.compare_to_baseline(
+        [unknown], baseline, 0.1
+    ), "Benchmarks missing from the baseline are skipped"
+
+
+def test_startup_imports():
+    """
+    Test-only and command-specific modules are not loaded at startup
+    """
+    imports = import_time.measure_imports()
+    assert import_time.ENTRY_MODULE in imports, "Entry point import is timed"
+    for module in import_time.DEFERRED_MODULES:
+        assert module not in imports, module + " should not load at startup"
+
+
+def test_object_memory():
+    """
+    Records are measured, and stay compact
+    """
+    for name, make_record in object_memory.RECORD_TYPES.items():
+        record = make_record(1, object_memory.make_device(0, None))
+        assert not hasattr(record, "__dict__"), name + " has no per-instance dict"
+        assert (
+            0 < object_memory.measure_record_bytes(make_record, 1000) < 128
+        ), name + " memory is measured"
+
+
+def test_parity_throughput():
+    """
+    Coding speed is measured for each group shape
+    """
+    for data_count, parity_count in [(2, 1), (3, 2)]:
+        encode_speed, decode_speed = parity_throughput.measure_throughput(
+            data_count, parity_count, 4096, 2
+        )
+        assert encode_speed > 0 and decode_speed > 0, "Speeds measured"
+
+
+def test_daemon_latency():
+    """
+    Commands are timed with and without the daemon
+    """
+    standalone_seconds, daemon_seconds = daemon_latency.measure_latency(1)
+    assert standalone_seconds > 0 and daemon_seconds > 0, "Both timed"
+
+
+def test_cache_bypass():
+    """
+    Every I/O mode is timed, and only the cached one leaves files cached
+    """
+    results = cache_bypass.measure_modes(4)
+    assert list(results) == utility.IO_MODES, "Every mode measured"
+    for mode, result in results.items():
+        assert result["hash_mib_per_second"] > 0, mode + " hashing timed"
+        assert result["copy_mib_per_second"] > 0, mode + " copying timed"
+        if mode != "cached":
+            assert result["source_cached"] < 0.5, mode + " drops the source"
+            assert result["copy_cached"] < 0.5, mode + " drops the copy"
@@ -4,12 +4,15 @@ Tests for the database files
 from os import remove
 from os.path import exists, join
 from pytest import fixture, raises
+import re
 import sqlite3
 
 from logical_backup.objects.device import Device
 from logical_backup.objects.file import File
 from logical_backup.objects.folder import Folder
 from logical_backup import db
+from logical_backup.device_profile import DeviceProfile
+from logical_backup.parity import ParityMember
 from logical_backup.db import SQLiteCursor
 
 from logical_backup.db import (
@@ -21,8 +24,9 @@ from logical_backup.db import (
 
 # This is an auto-run fixture, so importing is sufficient
 # pylint: disable=unused-import
-from logical_backup.utility import auto_set_testing
+from tests.fixtures import auto_set_testing
 
+from logical_backup.utility import DirectoryEntries
 from tests.test_utility import __compare_lists
 
 
@@ -199,7 +203,6 @@ def test_add_and_check_file():
     assert added == DatabaseError.FILE_EXISTS, "Can't add file twice"
 
     file_obj2.file_path = "/test2"
-    file_obj2.identifier = "not-real-2"
     added = db.add_file(file_obj2)
     assert added == DatabaseError.SUCCESS, "Second file added"
 
@@ -263,7 +266,6 @@ def test_remove_file():
     file_obj.device_name = "test"
     assert db.add_file(file_obj), "Adding file to remove should succeed"
     file_obj.file_path = "/test2"
-    file_obj.identifier = "not-real-2"
     assert db.add_file(file_obj), "Adding second file to remove should succeed"
 
     assert db.remove_file("/test"), "Deleting existing file succeeds"
@@ -290,15 +292,19 @@ def test_get_entries_for_folder():
 
     file1 = File()
     set_file_security(file1)
-    file1.set_properties("test", test_path + "foo", "abc")
+    file1.set_properties("test", join(test_path, "foo"), "abc")
     file2 = File()
     set_file_security(file2)
     file2.set_properties("test2", join(test_path, test_sub_path, "baz"), "def")
     file3 = File()
     set_file_security(file3)
     file3.set_properties("test3", join(other_path, "ipsum"), "ghi")
+    # Shares a prefix with the test path, without being inside it
+    file4 = File()
+    set_file_security(file4)
+    file4.set_properties("test4", test_path + "foo", "jkl")
 
-    for file_obj in [file1, file2, file3]:
+    for file_obj in [file1, file2, file3, file4]:
         file_obj.device_name = "test"
         assert db.add_file(file_obj), "Files should be added successfully"
 
@@ -320,6 +326,74 @@ def test_get_entries_for_folder():
         entries.folders, [folder1.folder_path, folder2.folder_path]
     ), "Selected and subfolder should be returned"
 
+    entries = db.get_entries_for_folder(join(test_path, test_sub_path))
+    assert entries.files == [file2.file_path], "Subfolder files returned"
+    assert entries.folders == [folder2.folder_path], "Subfolder itself returned"
+
+    entries = db.get_entries_for_folder("/nonexistent")
+    assert entries == DirectoryEntries([], []), "Unknown folder has no entries"
+
+
+def test_directory_tree_migration():
+    """
+    Catalogs from before the directory tree are linked into it
+    """
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE tblFile ("
+            "  FileID          INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  FileName        TEXT NOT NULL,"
+            "  FilePath        TEXT NOT NULL UNIQUE,"
+            "  FilePermissions TEXT NOT NULL,"
+            "  FileOwnerName   TEXT NOT NULL,"
+            "  FileGroupName   TEXT NOT NULL,"
+            "  FileChecksum    TEXT NOT NULL,"
+            "  FileDeviceID    INT  NOT NULL"
+            ");"
+        )
+        cursor.execute(
+            "CREATE TABLE tblFolder ("
+            "  FolderID          INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  FolderPath        TEXT NOT NULL UNIQUE,"
+            "  FolderPermissions TEXT NOT NULL,"
+            "  FolderOwnerName   TEXT NOT NULL,"
+            "  FolderGroupName   TEXT NOT NULL"
+            ");"
+        )
+        cursor.execute(
+            "INSERT INTO tblFile (FileName, FilePath, FilePermissions, "
+            "FileOwnerName, FileGroupName, FileChecksum, FileDeviceID) "
+            "VALUES ('a', '/old/a/file', '644', 'test', 'test', 'abc', 1), "
+            "       ('b', '/old/b', '644', 'test', 'test', 'def', 1), "
+            "       ('c', '/older/c', '644', 'test', 'test', 'ghi', 1)"
+        )
+        cursor.execute(
+            "INSERT INTO tblFolder (FolderPath, FolderPermissions, "
+            "FolderOwnerName, FolderGroupName) "
+            "VALUES ('/old', '755', 'test', 'test'), "
+            "       ('/old/a', '755', 'test', 'test')"
+        )
+
+    initialize_database()
+    # Running again must not disturb the already-linked rows
+    initialize_database()
+
+    entries = db.get_entries_for_folder("/old")
+    assert __compare_lists(
+        entries.files, ["/old/a/file", "/old/b"]
+    ), "Existing files linked to their directories"
+    assert __compare_lists(
+        entries.folders, ["/old", "/old/a"]
+    ), "Existing folders linked to their directories"
+
+    with SQLiteCursor() as cursor:
+        cursor.execute(
+            "SELECT FilePath FROM tblFileSearch WHERE tblFileSearch MATCH 'older'"
+        )
+        assert cursor.fetchall() == [
+            ("/older/c",)
+        ], "Existing files are indexed for searching"
+
 
 def test_remove_folder():
     """
@@ -416,6 +490,69 @@ def test_update_file_path():
     ), "File update persists"
 
 
+def test_move_folder_path():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test device", "/mnt/device", "Device Serial", "ABCDEF123", 1)
+    db.add_device(device)
+
+    for folder_path in ["/src", "/src/sub", "/src-other", "/dest", "/dest/src"]:
+        folder = Folder()
+        folder.set(folder_path, "755", "owner", "group")
+        assert db.add_folder(folder), "Folder should be added"
+
+    for file_path in ["/src/a", "/src/sub/b", "/src-other/c", "/taken/sub/b"]:
+        file_obj = File()
+        file_obj.set_properties(file_path, file_path, "abc123")
+        file_obj.set_security("644", "owner", "group")
+        file_obj.device_name = "test device"
+        assert db.add_file(file_obj), "File should be added"
+
+    assert (
+        db.move_folder_path("/missing", "/elsewhere")
+        == DatabaseError.NONEXISTENT_FOLDER
+    ), "Cannot move nonexistent folder"
+    assert (
+        db.move_folder_path("/src", "/taken") == DatabaseError.FILE_EXISTS
+    ), "Colliding file is detected"
+    assert (
+        db.move_folder_path("/src", "/dest") == DatabaseError.FOLDER_EXISTS
+    ), "Colliding folder is detected"
+    assert __compare_lists(
+        [file_obj.file_path for file_obj in db.get_files()],
+        ["/src/a", "/src/sub/b", "/src-other/c", "/taken/sub/b"],
+    ), "Nothing changed after a collision"
+
+    assert (
+        db.move_folder_path("/src", "/dest/src/moved") == DatabaseError.SUCCESS
+    ), "Folder moves into an existing directory"
+    assert __compare_lists(
+        [file_obj.file_path for file_obj in db.get_files()],
+        ["/dest/src/moved/a", "/dest/src/moved/sub/b", "/src-other/c", "/taken/sub/b"],
+    ), "Files under the folder moved, and siblings did not"
+    assert __compare_lists(
+        [folder.folder_path for folder in db.get_folders()],
+        ["/dest/src/moved", "/dest/src/moved/sub", "/src-other", "/dest", "/dest/src"],
+    ), "Folders under the folder moved, and siblings did not"
+
+    entries = db.get_entries_for_folder("/dest")
+    assert __compare_lists(
+        entries.files, ["/dest/src/moved/a", "/dest/src/moved/sub/b"]
+    ), "Moved files are in the directory tree"
+    assert db.get_entries_for_folder("/src").files == [], "Old tree is empty"
+
+    # The directory node already exists from a file under it, so the trees merge
+    assert (
+        db.move_folder_path("/src-other", "/taken") == DatabaseError.SUCCESS
+    ), "Folder moves onto an existing directory node"
+    assert __compare_lists(
+        db.get_entries_for_folder("/taken").files, ["/taken/c", "/taken/sub/b"]
+    ), "Merged directory contains files from both trees"
+
+
 def test_update_file_device():
     """
     .
@@ -442,3 +579,444 @@ def test_update_file_device():
     assert (
         db.update_file_device("/test/foo", "/bar") == DatabaseError.SUCCESS
     ), "File device updates"
+
+
+def test_update_file_devices():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+    device.set("test2", "/bar", "Device Serial", "bar", 1)
+    assert db.add_device(device), "Second device should be added successfully"
+
+    for file_path in ["/test/foo", "/test/sub/bar", "/test-other/baz"]:
+        file_obj = File()
+        file_obj.set_properties("test", file_path, "abc123")
+        file_obj.set_security("644", "test", "test")
+        file_obj.device_name = "test"
+        assert db.add_file(file_obj), "File should be added successfully"
+
+    assert __compare_lists(
+        [file_obj.file_path for file_obj in db.get_files_by_location("/test")],
+        ["/test/foo", "/test/sub/bar"],
+    ), "Files under folder found, excluding sibling prefixes"
+    assert not db.get_files_by_location(
+        device_path="/bar"
+    ), "No files on second device"
+
+    assert (
+        db.update_file_devices(["/test/foo", "/test/sub/bar"], "/nonexistent") == []
+    ), "Nothing updated for nonexistent device"
+    assert db.update_file_devices(
+        ["/test/foo", "/nonexistent", "/test/sub/bar"], "/bar"
+    ) == ["/test/foo", "/test/sub/bar"], "Existing files are updated"
+
+    assert __compare_lists(
+        [
+            file_obj.file_path
+            for file_obj in db.get_files_by_location(device_path="/bar")
+        ],
+        ["/test/foo", "/test/sub/bar"],
+    ), "Files found on new device"
+    assert __compare_lists(
+        [
+            file_obj.file_path
+            for file_obj in db.get_files_by_location("/test", device_path="/foo")
+        ],
+        [],
+    ), "Folder and device filters combine"
+
+
+def test_device_profiles():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+
+    assert db.get_device_profiles() == {}, "No devices profiled"
+    assert (
+        db.save_device_profile("/bar", DeviceProfile(1, 2, 3))
+        == DatabaseError.NONEXISTENT_DEVICE
+    ), "Cannot profile nonexistent device"
+    assert db.save_device_profile(
+        "/foo", DeviceProfile(1, 2, 3)
+    ), "Device profile saved"
+    assert db.save_device_profile(
+        "/foo", DeviceProfile(4, 5, 6)
+    ), "Device profile replaced"
+    assert db.get_device_profiles() == {
+        "/foo": DeviceProfile(4, 5, 6)
+    }, "Latest profile kept"
+
+
+def test_search_files():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+    device.set("test2", "/bar", "Device Serial", "bar", 1)
+    assert db.add_device(device), "Second device should be added successfully"
+
+    for file_path, size, owner, device_name in [
+        ("/photos/2019/IMG_0001.jpg", 2000, "alice", "test"),
+        ("/photos/2019/IMG_0002.JPG", 3000, "alice", "test2"),
+        ("/docs/photo-list.txt", 10, "bob", "test"),
+        ("/docs/a.b", None, "bob", "test2"),
+    ]:
+        file_obj = File()
+        file_obj.set_properties("name", file_path, file_path[-5:])
+        file_obj.set_security("644", owner, owner)
+        file_obj.device_name = device_name
+        file_obj.size = size
+        assert db.add_file(file_obj), "File should be added successfully"
+
+    def search(*args, **kwargs) -> list:
+        """
+        Paths found for a search
+        """
+        return sorted(
+            file_obj.file_path for file_obj in db.search_files(*args, **kwargs)
+        )
+
+    assert search("PHOTO") == [
+        "/docs/photo-list.txt",
+        "/photos/2019/IMG_0001.jpg",
+        "/photos/2019/IMG_0002.JPG",
+    ], "Substrings match regardless of case"
+    assert search("a.") == ["/docs/a.b"], "Short substrings match"
+    assert search("*.jpg", "glob") == [
+        "/photos/2019/IMG_0001.jpg"
+    ], "Globs match whole path, with case"
+    assert search(r"IMG_\d{4}\.(jpg|JPG)$", "regex") == [
+        "/photos/2019/IMG_0001.jpg",
+        "/photos/2019/IMG_0002.JPG",
+    ], "Regular expressions match"
+    assert search(r"^/docs/[ap]", "regex") == [
+        "/docs/a.b",
+        "/docs/photo-list.txt",
+    ], "Regular expressions without enough text to index match"
+    with raises(re.error):
+        db.search_files("(", "regex")
+
+    assert search("photo", min_size=2500) == [
+        "/photos/2019/IMG_0002.JPG"
+    ], "Minimum size filters"
+    assert search(max_size=2000) == [
+        "/docs/photo-list.txt",
+        "/photos/2019/IMG_0001.jpg",
+    ], "Maximum size filters, excluding unknown sizes"
+    assert search(owner="bob", device_path="/bar") == [
+        "/docs/a.b"
+    ], "Owner and device filter"
+    assert search(checksum="1.jpg") == [
+        "/photos/2019/IMG_0001.jpg"
+    ], "Checksum filters"
+    assert len(db.search_files("photo", limit=2)) == 2, "Results are limited"
+    assert db.search_files("photo", max_size=10)[0].size == 10, "Size is returned"
+
+    assert db.move_folder_path("/photos", "/pictures"), "Folder moved"
+    assert db.remove_file("/docs/photo-list.txt"), "File removed"
+    assert search("photo") == [], "Index follows moves and removals"
+    assert search("pictures") == [
+        "/pictures/2019/IMG_0001.jpg",
+        "/pictures/2019/IMG_0002.JPG",
+    ], "Moved files found at their new path"
+
+
+def test_iter_files():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+
+    for index in range(5):
+        file_obj = File()
+        file_obj.set_properties("name" + str(index), "/test/" + str(index), "abc")
+        file_obj.set_security("644", "test", "test")
+        file_obj.device_name = "test"
+        file_obj.size = index
+        assert db.add_file(file_obj), "File should be added successfully"
+
+    files = list(db.iter_files(batch_size=2))
+    assert __compare_lists(files, db.get_files()), "All files streamed, in batches"
+    assert all(
+        file_obj.device is files[0].device for file_obj in files
+    ), "Device shared between files on it"
+    assert files[0].device.device_path == "/foo", "Device loaded"
+    assert files[0].device == device, "Device identifier loaded"
+
+    files = list(db.iter_files(columns=["file_path", "size"]))
+    assert [file_obj.file_path for file_obj in files] == [
+        "/test/" + str(index) for index in range(5)
+    ], "Projected column loaded"
+    assert files[3].size == 3, "Second projected column loaded"
+    assert files[0].checksum is None, "Other columns not loaded"
+    assert files[0].device is None, "Device not loaded"
+
+    files = list(db.iter_files("/test/1", columns=["file_name", "device"]))
+    assert len(files) == 1 and files[0].file_name == "name1", "Single file streamed"
+    assert files[0].device_name == "test", "Device loaded when projected"
+
+    with raises(ValueError):
+        list(db.iter_files(columns=["foo"]))
+
+
+def test_get_security_names():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+
+    for file_path, owner, group in [
+        ("/test/a", "alice", "staff"),
+        ("/test/b", "alice", "users"),
+        ("/other/c", "bob", "bob"),
+    ]:
+        file_obj = File()
+        file_obj.set_properties(file_path[1:], file_path, "abc")
+        file_obj.set_security("644", owner, group)
+        file_obj.device_name = "test"
+        assert db.add_file(file_obj), "File should be added successfully"
+
+    folder = Folder()
+    folder.set("/test", "755", "root", "root")
+    assert db.add_folder(folder), "Folder should be added successfully"
+
+    assert db.get_security_names() == (
+        {"alice", "bob", "root"},
+        {"staff", "users", "bob", "root"},
+    ), "Names of all files and folders"
+    assert db.get_security_names("/test") == (
+        {"alice", "root"},
+        {"staff", "users", "root"},
+    ), "Names of the folder and files under it"
+    assert db.get_security_names("/missing") == (set(), set()), "Nothing found"
+
+
+def test_get_file_totals():
+    """
+    .
+    """
+    initialize_database()
+    assert db.get_file_totals() == {}, "Nothing backed up"
+
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+    device.set("test2", "/bar", "Device Serial", "bar", 1)
+    assert db.add_device(device), "Second device should be added successfully"
+
+    for index, (device_name, size) in enumerate(
+        [("test", 10), ("test", None), ("test2", 5)]
+    ):
+        file_obj = File()
+        file_obj.set_properties(str(index), "/test/" + str(index), "abc")
+        file_obj.set_security("644", "test", "test")
+        file_obj.device_name = device_name
+        file_obj.size = size
+        assert db.add_file(file_obj), "File should be added successfully"
+
+    assert db.get_file_totals() == {
+        "/foo": (2, 10),
+        "/bar": (1, 5),
+    }, "Files and bytes counted per device"
+
+
+def test_file_replicas():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+    device.set("test2", "/bar", "Device Serial", "bar", 1)
+    assert db.add_device(device), "Second device should be added successfully"
+    device.set("test3", "/baz", "Device Serial", "baz", 1)
+    assert db.add_device(device), "Third device should be added successfully"
+
+    file_obj = File()
+    file_obj.set_properties("abc", "/test/file", "abc")
+    file_obj.set_security("644", "test", "test")
+    file_obj.device_name = "test"
+    assert db.add_file(file_obj), "File should be added successfully"
+    assert db.get_file_replicas("/test/file") == [], "No copies yet"
+
+    assert (
+        db.add_file_replicas("/test/missing", ["/bar"])
+        == DatabaseError.NONEXISTENT_FILE
+    ), "Unknown file"
+    assert (
+        db.add_file_replicas("/test/file", ["/bar", "/missing"])
+        == DatabaseError.NONEXISTENT_DEVICE
+    ), "Unknown device"
+    assert db.get_file_replicas("/test/file") == [], "Nothing recorded on failure"
+    assert (
+        db.add_file_replicas("/test/file", ["/foo"])
+        == DatabaseError.NONEXISTENT_DEVICE
+    ), "File's own device is not a copy"
+
+    assert db.add_file_replicas("/test/file", ["/bar", "/baz"]), "Copies recorded"
+    assert db.get_file_replicas("/test/file") == ["/bar", "/baz"], "Copies listed"
+    assert (
+        db.add_file_replicas("/test/file", ["/bar"]) == DatabaseError.FILE_EXISTS
+    ), "Copy already recorded"
+
+    assert db.update_file_device("/test/file", "/bar"), "File moved to a copy"
+    assert db.get_file_replicas("/test/file") == ["/baz"], "Copy is now the file"
+    assert db.update_file_devices(["/test/file"], "/baz") == [
+        "/test/file"
+    ], "File moved in a batch"
+    assert db.get_file_replicas("/test/file") == [], "Batch moves update copies too"
+
+    assert db.add_file_replicas("/test/file", ["/foo"]), "Copy recorded"
+    assert db.remove_file("/test/file"), "File removed"
+    with SQLiteCursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM tblFileReplica")
+        assert cursor.fetchone()[0] == 0, "Copies removed with the file"
+
+
+def test_parity_groups():
+    """
+    .
+    """
+    initialize_database()
+    for name in ["foo", "bar", "baz"]:
+        device = Device()
+        device.set(name, "/" + name, "Device Serial", name, 1)
+        assert db.add_device(device), "Device should be added successfully"
+
+    for index, device_name in enumerate(["foo", "bar", "bar"]):
+        file_obj = File()
+        file_obj.set_properties("blob" + str(index), "/test/" + str(index), "abc")
+        file_obj.set_security("644", "test", "test")
+        file_obj.device_name = device_name
+        assert db.add_file(file_obj), "File should be added successfully"
+    assert db.add_file_replicas("/test/2", ["/baz"]), "Copy recorded"
+
+    assert [file_obj.file_path for file_obj in db.get_unprotected_files()] == [
+        "/test/0",
+        "/test/1",
+    ], "Files with copies are already protected"
+    assert db.get_parity_group("/test/0") is None, "Not in a group"
+
+    parity_member = ParityMember("/baz", "parity", "def", 20)
+    assert (
+        db.add_parity_group(["/test/0", "/test/missing"], [10, 20], [parity_member])
+        == DatabaseError.NONEXISTENT_DEVICE
+    ), "Unknown file"
+    assert (
+        db.add_parity_group(
+            ["/test/0", "/test/1"], [10, 20], [ParityMember("/nope", "p", "d", 20)]
+        )
+        == DatabaseError.NONEXISTENT_DEVICE
+    ), "Unknown device"
+    assert db.get_parity_group("/test/0") is None, "Nothing recorded on failure"
+
+    assert db.add_parity_group(
+        ["/test/0", "/test/1"], [10, 20], [parity_member]
+    ), "Group recorded"
+    group = db.get_parity_group("/test/1")
+    assert group.data_count == 2, "Files in the group"
+    assert group.members == [
+        ParityMember("/foo", "blob0", "abc", 10),
+        ParityMember("/bar", "blob1", "abc", 20),
+        parity_member,
+    ], "Members in order"
+    assert db.get_parity_group("/test/0") == group, "Same group for every file"
+    assert db.get_unprotected_files() == [], "Grouped files are protected"
+
+    assert db.update_file_device("/test/0", "/baz"), "File moved"
+    assert db.get_parity_group("/test/1").members[0].device_path == "/baz", "Moved"
+
+    assert db.remove_file("/test/0"), "File removed"
+    assert db.get_parity_group("/test/1") is None, "Group dissolved"
+    with SQLiteCursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM tblParityMember")
+        assert cursor.fetchone()[0] == 0, "Members removed with the group"
+
+
+def test_dirty_paths():
+    """
+    .
+    """
+    initialize_database()
+    assert db.get_dirty_paths("/foo") == (None, {}), "Nothing journaled"
+
+    db.add_dirty_paths({"/foo/bar": False, "/foo/baz": True, "/foobar": True})
+    db.add_dirty_paths({"/foo/bar": True, "/foo": False})
+    last_id, dirty = db.get_dirty_paths("/foo")
+    assert dirty == {
+        "/foo": False,
+        "/foo/bar": True,
+        "/foo/baz": True,
+    }, "Paths in the folder, recursive if ever journaled so"
+
+    db.add_dirty_paths({"/foo/new": False})
+    db.clear_dirty_paths("/foo", last_id)
+    assert db.get_dirty_paths("/foo")[1] == {
+        "/foo/new": False
+    }, "Paths journaled since reading are kept"
+    assert db.get_dirty_paths("/foobar")[1] == {
+        "/foobar": True
+    }, "Other folders are kept"
+
+    # A watched folder journals itself when watching starts, or events are lost
+    db.add_dirty_paths({"/foo": True})
+    last_id, dirty = db.get_dirty_paths("/foo/bar/baz")
+    assert last_id is not None, "Journal entries read"
+    assert dirty == {"/foo/bar/baz": True}, "Subfolder of a recursive folder"
+    db.clear_dirty_paths("/foo/bar/baz", last_id)
+    assert db.get_dirty_paths("/foo")[1] == {
+        "/foo": True,
+        "/foo/new": False,
+    }, "Containing folder kept, for its own update"
+
+    db.set_watched_folder("/foo", 123)
+    db.set_watched_folder("/bar", 456)
+    db.set_watched_folder("/foo", 789)
+    assert db.get_watched_folders() == {"/foo": 789, "/bar": 456}, "Latest watcher"
+    db.set_watched_folder("/foo")
+    assert db.get_watched_folders() == {"/bar": 456}, "Stopped watcher removed"
+
+
+def test_bulk_add_files():
+    """
+    .
+    """
+    initialize_database()
+    device = Device()
+    device.set("test", "/foo", "Device Serial", "foo", 1)
+    assert db.add_device(device), "Device should be added successfully"
+
+    files = []
+    for index, device_name in enumerate(["test", "test", "missing"]):
+        file_obj = File()
+        file_obj.set_properties(str(index), "/test/dir/" + str(index), "abc")
+        file_obj.set_security("644", "test", "test")
+        file_obj.device_name = device_name
+        file_obj.size = index
+        files.append(file_obj)
+
+    assert db.bulk_add_files(files) == 2, "Files on unknown devices skipped"
+    assert db.bulk_add_files(files[:1]) == 0, "Files already added skipped"
+    assert __compare_lists(db.get_files(), files[:2]), "Files added"
+    assert db.get_entries_for_folder("/test").files == [
+        "/test/dir/0",
+        "/test/dir/1",
+    ], "Files linked into the directory tree"
@@ -0,0 +1,42 @@
+"""
+Tests for measuring device throughput
+"""
+from os import listdir
+import tempfile
+
+from logical_backup import device_profile
+from logical_backup.device_profile import DeviceProfile
+
+
+def test_profile_device():
+    """
+    .
+    """
+    mount_point = tempfile.mkdtemp()
+    profile = device_profile.profile_device(mount_point, 1 << 20, 10, 512)
+
+    assert profile.read_bytes_per_second > 0, "Read throughput measured"
+    assert profile.write_bytes_per_second > 0, "Write throughput measured"
+    assert profile.files_per_second > 0, "Small file throughput measured"
+    assert not listdir(mount_point), "Test files removed"
+
+
+def test_estimate_seconds():
+    """
+    .
+    """
+    profiles = {
+        "/mnt1": DeviceProfile(100, 50, 10),
+        "/mnt2": DeviceProfile(200, 100, 10),
+    }
+
+    assert (
+        device_profile.estimate_seconds({"/mnt1": 1000, "/mnt2": 1000}, profiles, False)
+        == 15
+    ), "Reads estimated from read speed of each device"
+    assert (
+        device_profile.estimate_seconds({"/mnt1": 1000}, profiles, True) == 20
+    ), "Writes estimated from write speed"
+    assert (
+        device_profile.estimate_seconds({"/mnt3": 1000}, profiles, False) is None
+    ), "No estimate for unprofiled devices"
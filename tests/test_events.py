@@ -0,0 +1,135 @@
+"""
+Tests for machine-readable events
+"""
+from io import StringIO
+import json
+
+from pytest import fixture
+
+from logical_backup import events
+from logical_backup import library
+from logical_backup import main
+from logical_backup import profiling
+from logical_backup.db import DatabaseError
+from logical_backup.pretty_print import (
+    PrettyStatusPrinter,
+    ProgressDisplay,
+    print_error,
+    record_progress,
+)
+
+# This is an auto-run fixture, so importing is sufficient
+# pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
+from tests.test_db import auto_clear_db
+
+
+@fixture
+def stream():
+    """
+    Writes events to a buffer, turning them off again after
+    """
+    output = StringIO()
+    events.configure("ndjson", output)
+    yield output
+    events.configure("text")
+
+
+def read_events(output: StringIO) -> list:
+    """
+    Parses every event written so far
+    """
+    events.flush()
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_emit(monkeypatch, stream):
+    """
+    .
+    """
+    monkeypatch.setattr(events, "BUFFER_SIZE", 2)
+    events.emit("add", path="/foo", size=10, result=True, extra="detail")
+    assert stream.getvalue() == "", "Events are buffered"
+
+    events.emit("add", path="/bar", error=DatabaseError.FILE_EXISTS)
+    assert len(stream.getvalue().splitlines()) == 2, "Full buffer is written"
+
+    first, second = read_events(stream)
+    assert first["path"] == "/foo" and first["bytes"] == 10, "Fields written"
+    assert first["extra"] == "detail", "Extra fields written"
+    assert first["device"] is None, "Missing fields are null"
+    assert second["error"] == "FILE_EXISTS", "Error codes written by name"
+
+    events.configure("text")
+    events.emit("add", path="/baz")
+    assert len(read_events(stream)) == 2, "Nothing written once disabled"
+
+
+def test_operation(stream):
+    """
+    .
+    """
+
+    @events.operation("restore")
+    def restore(file_path: str, fail: bool = False):
+        """
+        Restores a file, or fails trying
+        """
+        record_progress("/mnt/device", 100)
+        if fail:
+            print_error("Checksum mismatch")
+            return DatabaseError.NONEXISTENT_FILE
+        PrettyStatusPrinter("Restoring").print_message()
+        return True
+
+    assert restore("/foo"), "Operation result returned"
+    assert not restore("/bar", True), "Failed operation result returned"
+    print_error("Outside any operation")
+
+    restored, failed, error = read_events(stream)
+    assert restored["event"] == "restore", "Event named after the operation"
+    assert restored["path"] == "/foo", "Path is the first argument"
+    assert restored["device"] == "/mnt/device", "Device recorded"
+    assert restored["bytes"] == 100, "Bytes recorded"
+    assert restored["result"] and restored["error"] is None, "Succeeded"
+    assert restored["duration"] >= 0, "Duration recorded"
+    assert not failed["result"], "Failed"
+    assert failed["error"] == "NONEXISTENT_FILE", "Database error code given"
+    assert failed["message"] == "Checksum mismatch", "Error message kept"
+    assert error["event"] == "error", "Other errors are events of their own"
+    assert "Restoring" not in stream.getvalue(), "No text output"
+
+
+def test_phases_and_summary(stream):
+    """
+    .
+    """
+    with ProgressDisplay("Copying", 1) as progress:
+        with profiling.timed("copy", "/foo"):
+            pass
+        progress.file_done()
+
+    phase, summary = read_events(stream)
+    assert phase["event"] == "phase" and phase["phase"] == "copy", "Phase event"
+    assert phase["path"] == "/foo", "Phase path"
+    assert summary["event"] == "summary", "Summary event"
+    assert summary["files"] == 1 and summary["failures"] == 0, "Summary counts"
+
+
+def test_output_argument(monkeypatch, capsys):
+    """
+    .
+    """
+    monkeypatch.setattr(main, "__dispatch_command", lambda arguments: "search")
+    monkeypatch.setattr(main, "__check_devices", lambda arguments: None)
+    monkeypatch.setattr(library, "replicate_catalog", lambda: True)
+    try:
+        main.process(["search", "--pattern", "foo", "--output", "ndjson"])
+        assert events.is_enabled(), "Events enabled"
+        print_error("Something broke")
+        events.flush()
+    finally:
+        events.configure("text")
+
+    error = json.loads(capsys.readouterr().out)
+    assert error["message"] == "Something broke", "Events written to output"
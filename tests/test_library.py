@@ -4,13 +4,22 @@ Test less-complex library functions
 import grp
 import hashlib
 import os
-from os import path, urandom, remove, getuid, getegid
+from os import path, urandom, remove, getuid, getegid, listdir
 import pwd
+import re
 import shutil
+import subprocess
 import tempfile
+import threading
+
+from pytest import raises
 
 from logical_backup.main import __dispatch_command
 from logical_backup import library
+from logical_backup import device_profile
+from logical_backup import manifest
+from logical_backup import replication
+from logical_backup.device_profile import DeviceProfile
 from logical_backup.objects.device import Device
 from logical_backup.objects.file import File
 from logical_backup.objects.folder import Folder
@@ -19,7 +28,8 @@ from logical_backup import db
 
 # This is an auto-run fixture, so importing is sufficient
 # pylint: disable=unused-import
-from logical_backup.utility import auto_set_testing, DirectoryEntries
+from logical_backup.utility import DirectoryEntries
+from tests.fixtures import auto_set_testing
 from logical_backup import utility
 from tests.test_utility import patch_input
 
@@ -336,7 +346,10 @@ def test_add_file_success(monkeypatch, capsys):
     monkeypatch.setattr(
         library,
         "__get_device_with_space",
-        lambda size, mount=None, checked=False: ("test-device-1", test_mount_1),
+        lambda size, mount=None, checked=False, reserved=None: (
+            "test-device-1",
+            test_mount_1,
+        ),
     )
 
     test_file, test_checksum = __make_temp_file()
@@ -402,7 +415,9 @@ def test_add_file_failures(monkeypatch, capsys):
     monkeypatch.setattr(utility, "checksum_file", lambda path: "unimportant")
     monkeypatch.setattr(utility, "get_file_security", lambda path: "unimportant")
     monkeypatch.setattr(
-        library, "__get_device_with_space", lambda size, mount, checked: (None, None)
+        library,
+        "__get_device_with_space",
+        lambda size, mount, checked, reserved: (None, None),
     )
 
     added = library.add_file(test_file, test_mount_1)
@@ -419,7 +434,7 @@ def test_add_file_failures(monkeypatch, capsys):
     monkeypatch.setattr(
         library,
         "__get_device_with_space",
-        lambda size, mount, checked: ("test-device-1", test_mount_1),
+        lambda size, mount, checked, reserved: ("test-device-1", test_mount_1),
     )
     monkeypatch.setattr(
         utility, "create_backup_name", lambda file_path: path.basename(test_file)
@@ -485,7 +500,9 @@ def test_add_directory(monkeypatch, capsys):
     )
     monkeypatch.setattr(utility, "sum_file_size", lambda files: 5)
     monkeypatch.setattr(library, "__get_total_device_space", lambda: 10)
-    monkeypatch.setattr(library, "add_file", lambda file_path, mount_point=None: True)
+    monkeypatch.setattr(
+        library, "__add_files", lambda files, mount_point, copies, progress: True
+    )
     monkeypatch.setattr(
         utility,
         "get_file_security",
@@ -571,6 +588,105 @@ def test_add_directory(monkeypatch, capsys):
     ), "Insufficient device space message should print"
 
 
+def test_add_directory_pipelined(monkeypatch):
+    """
+    .
+    """
+    db.initialize_database()
+    mounts = [__make_temp_directory() for _ in range(2)]
+    for index, mount_point in enumerate(mounts):
+        device = Device()
+        device.set("device" + str(index), mount_point, "User Specified", str(index))
+        db.add_device(device)
+    monkeypatch.setattr(path, "ismount", lambda file_path: file_path in mounts)
+    # Room for two files on each device, counting only what is written so far
+    monkeypatch.setattr(
+        utility,
+        "get_device_space",
+        lambda mount_point: 2500
+        - sum(
+            path.getsize(path.join(mount_point, name))
+            for name in listdir(mount_point)
+        ),
+    )
+
+    folder_path = __make_temp_directory()
+    checksums = dict(__make_temp_file(1000, folder_path) for _ in range(4))
+    assert library.add_directory(folder_path), "Every file added"
+
+    files = db.get_files()
+    assert {file_obj.file_path: file_obj.checksum for file_obj in files} == checksums
+    for mount_point in mounts:
+        assert len(listdir(mount_point)) == 2, "Copies in flight reserve space"
+    for file_obj in files:
+        backup_path = path.join(file_obj.device.device_path, file_obj.file_name)
+        assert utility.checksum_file(backup_path) == file_obj.checksum, "Copied"
+
+
+def test_copy_addition_releases_reserved(monkeypatch):
+    """
+    .
+    """
+    monkeypatch.setattr(utility, "copy_file", lambda source, destination: None)
+    monkeypatch.setattr(utility, "copy_file_metadata", lambda source, target: None)
+    reserved = {"/mnt1": 0, "/mnt2": 0}
+
+    def place_and_copy(index: int) -> None:
+        """
+        .
+        """
+        addition = {
+            "file_path": "/file" + str(index),
+            "size": index,
+            "device_paths": ["/mnt1"],
+            "backup_paths": ["/mnt1/file" + str(index)],
+        }
+        with library.__reserving:
+            reserved["/mnt1"] += index
+        library.__copy_addition(addition, reserved)
+
+    threads = [
+        threading.Thread(target=place_and_copy, args=(index,))
+        for index in range(1, 50)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert reserved == {"/mnt1": 0, "/mnt2": 0}, "Every copy released its space"
+
+
+def test_copy_addition_failure(monkeypatch):
+    """
+    .
+    """
+    mounts = [__make_temp_directory() for _ in range(2)]
+    file_path, _ = __make_temp_file()
+    addition = {
+        "file_path": file_path,
+        "size": 1024,
+        "device_paths": mounts,
+        "backup_paths": [path.join(mount_point, "backup") for mount_point in mounts],
+    }
+    reserved = {mount_point: 1024 for mount_point in mounts}
+
+    def fail_second_copy(source: str, destinations: list) -> str:
+        """
+        Writes the first copy, then fails writing the second
+        """
+        shutil.copyfile(source, destinations[0])
+        with open(destinations[1], "wb") as destination_file:
+            destination_file.write(b"partial")
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(utility, "copy_to_all", fail_second_copy)
+    with raises(OSError):
+        library.__copy_addition(addition, reserved)
+    for backup_path in addition["backup_paths"]:
+        assert not path.exists(backup_path), "Partial copies removed"
+    assert reserved == {mount_point: 0 for mount_point in mounts}, "Space released"
+
+
 def test_get_total_device_space(monkeypatch):
     """
     .
@@ -594,10 +710,180 @@ def test_get_total_device_space(monkeypatch):
     assert library.__get_total_device_space() == 15, "Filters unmounted devices"
 
 
+def test_file_copies(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    mounts = [__make_temp_directory() for _ in range(3)]
+    for index, mount_point in enumerate(mounts):
+        device = Device()
+        device.set("device" + str(index), mount_point, "User Specified", str(index))
+        db.add_device(device)
+    monkeypatch.setattr(path, "ismount", lambda file_path: file_path in mounts)
+    monkeypatch.setattr(utility, "get_device_space", lambda mount_point: 1 << 20)
+
+    test_file, _ = __make_temp_file()
+    backup_name = path.basename(test_file)
+    monkeypatch.setattr(utility, "create_backup_name", lambda file_path: backup_name)
+    assert not library.add_file(test_file, mounts[0], copies=4), "Too few devices"
+    assert "Only 3 devices with space for 4 copies" in capsys.readouterr().out
+
+    assert library.add_file(test_file, mounts[0], copies=2), "Added with a copy"
+    assert db.get_file_replicas(test_file) == [mounts[1]], "Copy recorded"
+    for mount_point in mounts[:2]:
+        assert path.isfile(path.join(mount_point, backup_name)), "Copies written"
+
+    checked = []
+    checksum_file = utility.checksum_file
+    monkeypatch.setattr(
+        utility,
+        "checksum_file",
+        lambda file_path: checked.append(path.dirname(file_path))
+        or checksum_file(file_path),
+    )
+    for _ in range(4):
+        assert library.verify_file(test_file, True), "Copies verify"
+    assert sorted(checked) == sorted(mounts[:2] * 2), "Reads spread across copies"
+
+    # An unattached device is never read
+    checked.clear()
+    monkeypatch.setattr(path, "ismount", lambda file_path: file_path == mounts[1])
+    assert library.verify_file(test_file, True), "Attached copy verifies"
+    assert checked == [mounts[1]], "Only the attached copy read"
+
+    # Moving onto the device with the other copy would overwrite it
+    assert not library.move_file_device(test_file, mounts[1]), "Copy kept"
+    assert "already holds another copy" in capsys.readouterr().out, "Error printed"
+    assert not library.move_device(mounts[0], mounts[1]), "Copy kept moving all"
+    assert "already holds another copy" in capsys.readouterr().out, "Error printed"
+    assert db.get_file_replicas(test_file) == [mounts[1]], "Still two copies"
+    file_obj = db.get_files(test_file)[0]
+    device_files = {mounts[0]: [file_obj], mounts[1]: [], mounts[2]: []}
+    free_space = {mounts[0]: 0, mounts[1]: 4 << 18, mounts[2]: 3 << 18}
+    plan = library.__plan_rebalance(device_files, free_space, "space")
+    assert plan == {mounts[1]: [file_obj]}, "Would go to the emptiest device"
+    plan = library.__plan_rebalance(
+        device_files, free_space, "space", None, {test_file: {mounts[1]}}
+    )
+    assert plan == {mounts[2]: [file_obj]}, "Rebalanced around the other copy"
+
+    # A corrupt copy falls back to the other, whichever is read first
+    monkeypatch.setattr(path, "ismount", lambda file_path: file_path in mounts)
+    with open(path.join(mounts[0], backup_name), "r+b") as corrupt:
+        corrupt.write(b"corrupt")
+    for _ in range(2):
+        assert library.verify_file(test_file, True), "Intact copy verifies"
+    checksum = checksum_file(test_file)
+    remove(test_file)
+    for _ in range(2):
+        assert library.restore_file(test_file), "Restored from the intact copy"
+        assert checksum_file(test_file) == checksum, "Restored intact"
+        remove(test_file)
+    remove(path.join(mounts[1], backup_name))
+    assert not library.verify_file(test_file, True), "No intact copy"
+    assert not library.restore_file(test_file), "Nothing to restore from"
+    assert "mismatched checksum" in capsys.readouterr().out, "Error printed"
+
+    assert library.remove_file(test_file), "File removed"
+    for mount_point in mounts[:2]:
+        assert not path.exists(path.join(mount_point, backup_name)), "Copies removed"
+
+
+def test_protect(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    mounts = [__make_temp_directory() for _ in range(4)]
+    for index, mount_point in enumerate(mounts):
+        device = Device()
+        device.set("device" + str(index), mount_point, "User Specified", str(index))
+        db.add_device(device)
+    monkeypatch.setattr(path, "ismount", lambda file_path: file_path in mounts)
+    monkeypatch.setattr(utility, "get_device_space", lambda mount_point: 1 << 30)
+
+    files = {}
+    for index, device_index in enumerate([0, 0, 1, 1, 2]):
+        file_path, checksum = __make_temp_file(1000 + index)
+        shutil.copyfile(file_path, path.join(mounts[device_index], str(index)))
+        file_obj = File()
+        file_obj.set_properties(str(index), file_path, checksum)
+        file_obj.set_security(
+            "600", pwd.getpwuid(getuid()).pw_name, grp.getgrgid(getegid()).gr_name
+        )
+        file_obj.device_name = "device" + str(device_index)
+        file_obj.size = 1000 + index
+        db.add_file(file_obj)
+        files[file_path] = file_obj
+
+    assert not library.protect(2, 3), "Too few devices"
+    assert "Need 5 attached devices" in capsys.readouterr().out, "Error printed"
+
+    assert library.protect(2, 1), "Files protected"
+    assert "1 files left unprotected" in capsys.readouterr().out, "Leftover shown"
+    groups = [db.get_parity_group(file_path) for file_path in files]
+    assert groups[4] is None, "No other device with a file to group with"
+    assert groups[0] == groups[2] and groups[1] == groups[3], "Largest together"
+    assert [member.name for member in groups[1].members[:2]] == ["1", "3"], "Order"
+    assert groups[1].members[2].device_path == mounts[2], "Parity on another device"
+
+    # Moving a file next to another of its group loses the group's tolerance
+    paths = list(files)
+    for device_path in mounts[1:3]:
+        assert not library.move_file_device(paths[0], device_path), "Not moved"
+        assert "or parity group member" in capsys.readouterr().out, "Error printed"
+    grouped = [db.get_files(paths[index])[0] for index in [0, 2]]
+    assert not library.__move_files_to_device(grouped, mounts[3]), "Not together"
+    assert "or parity group member" in capsys.readouterr().out, "Error printed"
+    assert not listdir(mounts[3]), "Nothing moved"
+    device_files = {mounts[0]: grouped[:1], mounts[1]: grouped[1:], mounts[3]: []}
+    free_space = {mounts[0]: 0, mounts[1]: 0, mounts[3]: 1 << 20}
+    plan = library.__plan_rebalance(device_files, free_space, "space")
+    assert plan == {mounts[3]: grouped}, "Would move both"
+    plan = library.__plan_rebalance(
+        device_files, free_space, "space", None, library.__excluded_devices()
+    )
+    assert plan == {mounts[3]: grouped[:1]}, "Only one of the group moves there"
+
+    # Corrupt copies are repaired while verifying
+    file_path, file_obj = list(files.items())[1]
+    with open(path.join(mounts[0], "1"), "r+b") as corrupt:
+        corrupt.write(b"corrupt")
+    assert library.verify_file(file_path, True), "Repaired from parity"
+    assert "Rebuilding {0} from parity".format(file_path) in capsys.readouterr().out
+    assert (
+        utility.checksum_file(path.join(mounts[0], "1")) == file_obj.checksum
+    ), "Repaired in place"
+
+    # Files on a lost device are rebuilt straight into place,
+    # even with its empty mount point left behind
+    file_path, file_obj = list(files.items())[3]
+    original_data = open(file_path, "rb").read()
+    remove(file_path)
+    for name in listdir(mounts[1]):
+        remove(path.join(mounts[1], name))
+    monkeypatch.setattr(
+        path, "ismount", lambda file_path: file_path in mounts[:1] + mounts[2:]
+    )
+    assert not library.verify_file(file_path, True, mounts[1]), "Not repaired"
+    assert not listdir(mounts[1]), "Nothing written to the bare mount point"
+    assert library.restore_file(file_path), "Restored from parity"
+    assert open(file_path, "rb").read() == original_data, "Rebuilt data restored"
+    assert not listdir(mounts[1]), "Nothing written to the bare mount point"
+
+    file_path = list(files)[0]
+    parity_path = path.join(mounts[2], groups[0].members[2].name)
+    assert path.isfile(parity_path), "Parity written"
+    assert library.remove_file(file_path), "File removed"
+    assert not path.exists(parity_path), "Parity of its group removed"
+
+
 def test_remove_file(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     # No file returned
     monkeypatch.setattr(db, "get_files", lambda path=None: [])
 
@@ -713,6 +999,7 @@ def test_verify_file(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     device = Device()
     device.set("device", "/dev", "Device Serial", "ABCDEF", 1)
 
@@ -765,11 +1052,131 @@ def test_verify_folder(monkeypatch):
     assert library.verify_folder("/foo", True), "Folder verification succeeds"
 
 
+def test_rebuild_catalog(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    device_path = __make_temp_directory()
+    monkeypatch.setattr(utility, "get_mount_points", lambda: ["/", device_path])
+    assert not library.rebuild_catalog(), "Nothing to rebuild from"
+    assert "No device manifests found" in capsys.readouterr().out, "Error printed"
+
+    device = Device()
+    device.set("test", device_path, "User Specified", "test-id")
+    manifest.record_device(device)
+    file_obj = File()
+    file_obj.set_properties("foo-blob", "/test/foo", "abc")
+    file_obj.set_security("644", "user", "group")
+    manifest.record_added(device_path, file_obj)
+    manifest.flush()
+
+    assert library.rebuild_catalog(), "Catalog rebuilt from attached devices"
+    devices = db.get_devices()
+    assert len(devices) == 1 and devices[0] == {
+        "device_name": "test",
+        "device_path": device_path,
+        "identifier_type": "User Specified",
+        "identifier": "test-id",
+    }, "Device added back"
+    file_obj.device_name = "test"
+    assert db.get_files() == [file_obj], "File added back, on the device"
+
+    assert not library.rebuild_catalog(device_path), "Existing catalog kept"
+    assert "Catalog already has devices" in capsys.readouterr().out, "Error printed"
+
+
+def test_rebuild_catalog_copies(monkeypatch):
+    """
+    .
+    """
+    db.initialize_database()
+    mounts = [__make_temp_directory() for _ in range(3)]
+    for index, mount_point in enumerate(mounts):
+        device = Device()
+        device.set("device" + str(index), mount_point, "User Specified", str(index))
+        db.add_device(device)
+        manifest.record_device(device)
+    monkeypatch.setattr(path, "ismount", lambda file_path: file_path in mounts)
+    monkeypatch.setattr(utility, "get_mount_points", lambda: mounts)
+    monkeypatch.setattr(utility, "get_device_space", lambda mount_point: 1 << 20)
+
+    test_file, _ = __make_temp_file()
+    assert library.add_file(test_file, mounts[0], copies=2), "Added with a copy"
+    manifest.flush()
+    devices = {
+        file_obj.device.device_path for file_obj in db.get_files(test_file)
+    } | set(db.get_file_replicas(test_file))
+
+    remove(db.DEV_FILE)
+    db.initialize_database()
+    assert library.rebuild_catalog(), "Catalog rebuilt"
+    rebuilt = {
+        file_obj.device.device_path for file_obj in db.get_files(test_file)
+    } | set(db.get_file_replicas(test_file))
+    assert len(db.get_file_replicas(test_file)) == 1, "Copy rebuilt"
+    assert rebuilt == devices, "On the same devices"
+
+
+def test_rebuild_catalog_unnamed(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    device_path = __make_temp_directory()
+    monkeypatch.setattr(utility, "get_mount_points", lambda: ["/", device_path])
+    file_obj = File()
+    file_obj.set_properties("foo-blob", "/test/foo", "abc")
+    file_obj.set_security("644", "user", "group")
+    manifest.record_added(device_path, file_obj)
+    manifest.flush()
+
+    assert not library.rebuild_catalog(), "Files with no device fail the rebuild"
+    assert "does not say which device" in capsys.readouterr().out, "Error printed"
+    assert not db.get_devices() and not db.get_files(), "Nothing half rebuilt"
+
+
+def test_replicate_catalog(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    mounted = Device()
+    mounted.set("mounted", __make_temp_directory(), "User Specified", "mounted-id")
+    missing = Device()
+    missing.set("missing", "/nonexistent/device", "User Specified", "missing-id")
+    db.add_device(mounted)
+    db.add_device(missing)
+    monkeypatch.setattr(
+        path, "ismount", lambda file_path: file_path != "/nonexistent/device"
+    )
+
+    assert library.replicate_catalog(), "Mounted devices replicated"
+    assert path.isfile(
+        path.join(mounted.device_path, replication.REPLICA_NAME)
+    ), "Catalog copied"
+    output = capsys.readouterr().out
+    assert "Replicated catalog to mounted" in output, "Pages written reported"
+    assert "catalog to missing" not in output, "Skipped"
+
+    assert library.replicate_catalog(), "Still replicated"
+    assert not capsys.readouterr().out, "Nothing printed when up to date"
+
+    monkeypatch.setattr(path, "ismount", lambda file_path: True)
+    assert not library.replicate_catalog(), "Failure reported"
+    assert "Failed to replicate catalog to missing" in capsys.readouterr().out
+
+
 def test_verify_all(monkeypatch):
     """
     .
     """
-    monkeypatch.setattr(db, "get_files", lambda: ["/foo/test", "/foo/test2"])
+    file1 = File()
+    file1.file_path = "/foo/test"
+    file2 = File()
+    file2.file_path = "/foo/test2"
+    monkeypatch.setattr(db, "iter_files", lambda columns: iter([file1, file2]))
+    monkeypatch.setattr(db, "get_file_totals", lambda: {"/dev": (2, 100)})
 
     monkeypatch.setattr(
         library, "verify_file", lambda file_path, for_restore: file_path == "/foo/test"
@@ -784,12 +1191,13 @@ def test_update_file(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     # Test unregistered file, successfully
     monkeypatch.setattr(db, "get_files", lambda file_path: [])
-    monkeypatch.setattr(library, "add_file", lambda file_path: True)
+    monkeypatch.setattr(library, "add_file", lambda file_path, copies=1: True)
     assert library.update_file("/test"), "New file added via update successfully"
     # Fail this time
-    monkeypatch.setattr(library, "add_file", lambda file_path: False)
+    monkeypatch.setattr(library, "add_file", lambda file_path, copies=1: False)
     assert not library.update_file("/test"), "New file fails to add via update"
     out = capsys.readouterr()
     assert (
@@ -806,16 +1214,16 @@ def test_update_file(monkeypatch, capsys):
     monkeypatch.setattr(utility, "checksum_file", lambda file_path: file_checksum)
     # Force these to fail, so if they are called the execution will fail
     monkeypatch.setattr(library, "remove_file", lambda file_path: False)
-    monkeypatch.setattr(library, "add_file", lambda file_path: False)
+    monkeypatch.setattr(library, "add_file", lambda file_path, copies=1: False)
     assert library.update_file("/test"), "Updating file with matching checksum succeeds"
 
     # Checksum mismatch cases work as expected - removal success/fail, add success/fail
     monkeypatch.setattr(utility, "checksum_file", lambda file_path: "mismatch")
     monkeypatch.setattr(library, "remove_file", lambda file_path: True)
-    monkeypatch.setattr(library, "add_file", lambda file_path: True)
+    monkeypatch.setattr(library, "add_file", lambda file_path, copies=1: True)
     assert library.update_file("/test"), "Updating file works"
 
-    monkeypatch.setattr(library, "add_file", lambda file_path: False)
+    monkeypatch.setattr(library, "add_file", lambda file_path, copies=1: False)
     assert not library.update_file("/test"), "Fails to add updated file"
     out = capsys.readouterr()
     assert (
@@ -979,10 +1387,86 @@ def test_update_folder(monkeypatch, capsys):
     assert library.update_folder(folder_path), "Folder updating should succeed"
 
 
+def test_update_folder_changed_only(monkeypatch, capsys):
+    """
+    .
+    """
+    initialize_database()
+    folder_path = tempfile.mkdtemp()
+    os.mkdir(path.join(folder_path, "sub"))
+    for file_name in ["foo", "bar", "sub/baz"]:
+        with open(path.join(folder_path, file_name), "w") as test_file:
+            test_file.write(file_name)
+
+    updated = []
+    removal_checked = []
+    monkeypatch.setattr(
+        library, "update_file", lambda file_path: updated.append(file_path) or True
+    )
+    monkeypatch.setattr(
+        library,
+        "__remove_missing_database_entries",
+        lambda entries: removal_checked.append(entries) or True,
+    )
+
+    assert library.update_folder(folder_path, True), "Updated without a watcher"
+    assert "No watcher running" in capsys.readouterr().out, "Full walk reported"
+    assert len(updated) == 3, "Every file checked without a watcher"
+
+    # Stopped without clearing its record
+    process = subprocess.Popen(["true"])
+    process.wait()
+    db.set_watched_folder(folder_path, process.pid)
+    db.add_dirty_paths({path.join(folder_path, "foo"): False})
+    updated.clear()
+    assert library.update_folder(path.join(folder_path, "sub"), True), "Updated"
+    assert updated == [path.join(folder_path, "sub/baz")], "Whole subfolder checked"
+
+    db.set_watched_folder(folder_path, os.getpid())
+    db.add_dirty_paths(
+        {
+            path.join(folder_path, "foo"): False,
+            path.join(folder_path, "gone"): False,
+            path.join(folder_path, "sub"): True,
+            path.join(folder_path, "sub/baz"): False,
+        }
+    )
+    updated.clear()
+    removal_checked.clear()
+    monkeypatch.setattr(db, "file_exists", lambda file_path: file_path.endswith("gone"))
+    assert library.update_folder(folder_path, True), "Changed paths updated"
+    assert sorted(updated) == [
+        path.join(folder_path, "foo"),
+        path.join(folder_path, "sub/baz"),
+    ], "Only changed files checked, once each"
+    assert removal_checked[0].files == [
+        path.join(folder_path, "gone")
+    ], "Deleted files checked for removal"
+    assert db.get_dirty_paths(folder_path) == (None, {}), "Journal cleared"
+
+    # Watching journals the watched folder as recursive when it starts
+    db.add_dirty_paths({folder_path: True})
+    updated.clear()
+    assert library.update_folder(path.join(folder_path, "sub"), True), "Updated"
+    assert updated == [
+        path.join(folder_path, "sub/baz")
+    ], "Subfolder of a recursive folder checked"
+    assert db.get_dirty_paths(folder_path)[1] == {
+        folder_path: True
+    }, "Watched folder still journaled"
+    db.clear_dirty_paths(folder_path, db.get_dirty_paths(folder_path)[0])
+
+    db.add_dirty_paths({path.join(folder_path, "foo"): False})
+    monkeypatch.setattr(library, "update_file", lambda file_path: False)
+    assert not library.update_folder(folder_path, True), "Failed update fails"
+    assert db.get_dirty_paths(folder_path)[1], "Failed paths stay journaled"
+
+
 def test_move_file_local(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     # Test error cases
     monkeypatch.setattr(
         db, "update_file_path", lambda current, new: DatabaseError.NONEXISTENT_FILE
@@ -1024,15 +1508,10 @@ def test_move_directory_local(monkeypatch, capsys):
     """
     .
     """
-    monkeypatch.setattr(
-        db,
-        "get_entries_for_folder",
-        lambda folder: DirectoryEntries(["/test/foo"], ["/test/foo"]),
-    )
+    db.initialize_database()
     # Test error cases
-    monkeypatch.setattr(library, "move_file_local", lambda current, new: True)
     monkeypatch.setattr(
-        db, "update_folder_path", lambda current, new: DatabaseError.NONEXISTENT_FOLDER
+        db, "move_folder_path", lambda current, new: DatabaseError.NONEXISTENT_FOLDER
     )
     assert not library.move_directory_local(
         "/test/foo", "/test2"
@@ -1045,7 +1524,7 @@ def test_move_directory_local(monkeypatch, capsys):
     # This ensures that it accepts a directory as output, as well as a specific folder
     monkeypatch.setattr(
         db,
-        "update_folder_path",
+        "move_folder_path",
         lambda current, new: DatabaseError.SUCCESS
         if new == "/test2/foo"
         else DatabaseError.FOLDER_EXISTS,
@@ -1058,35 +1537,55 @@ def test_move_directory_local(monkeypatch, capsys):
         "Folder already backed up at path" in out.out
     ), "Backed up to duplicate folder message prints"
 
+    monkeypatch.setattr(
+        db, "move_folder_path", lambda current, new: DatabaseError.FILE_EXISTS
+    )
+    assert not library.move_directory_local(
+        "/test/foo", "/failure"
+    ), "Backed up to duplicate file should fail"
+    out = capsys.readouterr()
+    assert (
+        "File already backed up under path" in out.out
+    ), "Backed up to duplicate file message prints"
+
     # Success cases
+    monkeypatch.setattr(
+        db,
+        "move_folder_path",
+        lambda current, new: DatabaseError.SUCCESS
+        if new == "/test2/foo"
+        else DatabaseError.FOLDER_EXISTS,
+    )
     monkeypatch.setattr(path, "isdir", lambda directory: True)
     assert library.move_directory_local(
         "/test/foo", "/test2"
     ), "Change to backed up folder should work with directory destination"
 
-    # If file, don't back up
+    # Cannot move inside itself
     monkeypatch.setattr(path, "isdir", lambda directory: False)
+    assert not library.move_directory_local(
+        "/test/foo", "/test/foo/bar"
+    ), "Folder moved into itself should fail"
+    assert not library.move_directory_local("/", "/bar"), "Root cannot be moved"
+    out = capsys.readouterr()
+    assert "Cannot move folder into itself" in out.out, "Move into self message prints"
+
+    # If file, don't back up
     monkeypatch.setattr(path, "isfile", lambda directory: True)
     assert not library.move_directory_local(
         "/test/foo", "/test2/foo"
     ), "Folder back up to file location should fail"
     out = capsys.readouterr()
     assert (
-        "Cannot move folder over existing file"
+        "Cannot move folder over existing file" in out.out
     ), "Folder back up to file message prints"
 
-    # If file fails, should fail move
-    monkeypatch.setattr(library, "move_file_local", lambda current, new: False)
-    monkeypatch.setattr(path, "isfile", lambda directory: False)
-    assert not library.move_directory_local(
-        "/test/foo", "/test2/foo"
-    ), "File move failure should fail"
-
 
 def test_move_file_device(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     dev1 = __make_temp_directory()
     dev2 = __make_temp_directory()
 
@@ -1190,43 +1689,376 @@ def test_move_file_device(monkeypatch, capsys):
     ), "Checksum still matches"
 
 
+def __make_backed_up_files(device: Device, count: int) -> list:
+    """
+    Makes backed-up files on a device
+
+    Parameters
+    ----------
+    device : Device
+        The device to back files up onto
+    count : int
+        Number of files to make
+
+    Returns
+    -------
+    list
+        Of File objects
+    """
+    files = []
+    for _ in range(count):
+        backup_file, checksum = __make_temp_file(directory=device.device_path)
+        file_obj = File()
+        file_obj.set_properties(
+            path.basename(backup_file), "/test/" + path.basename(backup_file), checksum
+        )
+        file_obj.set_security("644", "test", "test")
+        file_obj.device = device
+        files.append(file_obj)
+
+    return files
+
+
 def test_move_directory_device(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
+    device1 = Device()
+    device1.set("dev1", __make_temp_directory(), "Device Serial", "ABC123", 1)
+    dev2 = __make_temp_directory()
+
     monkeypatch.setattr(
-        db,
-        "get_entries_for_folder",
-        lambda folder: DirectoryEntries(["abc", "def"], ["ghi"]),
+        db, "get_files_by_location", lambda folder_path=None, device_path=None: []
     )
-    monkeypatch.setattr(utility, "sum_file_size", lambda files: 1)
-    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 0)
+    assert not library.move_directory_device(
+        "/test", dev2
+    ), "Un backed-up folder should fail"
+    out = capsys.readouterr()
+    assert (
+        "Specified folder not backed up" in out.out
+    ), "Un backed-up folder message prints"
 
+    files = __make_backed_up_files(device1, 3)
+    monkeypatch.setattr(
+        db, "get_files_by_location", lambda folder_path=None, device_path=None: files
+    )
+    monkeypatch.setattr(path, "ismount", lambda mount_path: False)
+    assert not library.move_directory_device("/test", dev2), "Missing mount fails"
+    out = capsys.readouterr()
+    assert (
+        "Device for backed-up files is not attached" in out.out
+    ), "Missing mount message prints"
+
+    monkeypatch.setattr(path, "ismount", lambda mount_path: True)
+    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 0)
     assert not library.move_directory_device(
-        "/test", "/dev"
+        "/test", dev2
     ), "Insufficient device space fails"
     out = capsys.readouterr()
     assert (
         "Selected device cannot fit all the requested files" in out.out
     ), "Insufficient device space message prints"
 
-    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 10)
+    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 100000)
+    files[0].checksum = "wrong"
     monkeypatch.setattr(
-        library, "move_file_device", lambda file_path, device: file_path == "abc"
+        db, "update_file_devices", lambda file_paths, device: file_paths[:1]
     )
-
+    monkeypatch.setattr(library, "MOVE_BATCH_SIZE", 1)
+    assert not library.move_directory_device("/test", dev2), "Partial failure fails"
+    out = capsys.readouterr()
+    assert "Checksum verification mismatch" in out.out, "Mismatch message prints"
+    assert path.isfile(
+        path.join(device1.device_path, files[0].file_name)
+    ), "Mismatched file left on old device"
+    assert not path.isfile(
+        path.join(dev2, files[0].file_name)
+    ), "Mismatched copy removed from new device"
+    assert sorted(listdir(dev2)) == sorted(
+        [file_obj.file_name for file_obj in files[1:]]
+    ), "Valid files copied to new device"
+    assert listdir(device1.device_path) == [
+        files[0].file_name
+    ], "Moved files removed from old device"
+
+    files = __make_backed_up_files(device1, 2)
+    monkeypatch.setattr(db, "update_file_devices", lambda file_paths, device: [])
+    monkeypatch.setattr(library, "MOVE_BATCH_SIZE", 100)
     assert not library.move_directory_device(
-        "/test", "/dev"
-    ), "Partial failures should fail"
+        "/test", dev2
+    ), "Database failure fails"
+    out = capsys.readouterr()
+    assert (
+        "Failed to update device for file in database" in out.out
+    ), "Database failure message prints"
+    for file_obj in files:
+        assert path.isfile(
+            path.join(device1.device_path, file_obj.file_name)
+        ), "Old copy kept if database not updated"
+        assert not path.isfile(
+            path.join(dev2, file_obj.file_name)
+        ), "New copy removed if database not updated"
+
+    monkeypatch.setattr(
+        db, "update_file_devices", lambda file_paths, device: file_paths
+    )
+    assert library.move_directory_device("/test", dev2), "All success should succeed"
+    for file_obj in files:
+        assert path.isfile(path.join(dev2, file_obj.file_name)), "File moved"
+
+
+def test_move_device(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    device1 = Device()
+    device1.set("dev1", __make_temp_directory(), "Device Serial", "ABC123", 1)
+    dev2 = __make_temp_directory()
+
+    assert not library.move_device(
+        device1.device_path, device1.device_path
+    ), "Moving onto the same device fails"
+    out = capsys.readouterr()
+    assert "already on" in out.out, "Same device message prints"
+
+    files = __make_backed_up_files(device1, 2)
+    requested = {}
+
+    def get_files_by_location(folder_path=None, device_path=None):
+        """
+        .
+        """
+        requested["device_path"] = device_path
+        return files
+
+    monkeypatch.setattr(db, "get_files_by_location", get_files_by_location)
+    monkeypatch.setattr(path, "ismount", lambda mount_path: True)
+    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 100000)
+    monkeypatch.setattr(
+        db, "update_file_devices", lambda file_paths, device: file_paths
+    )
+    assert library.move_device(device1.device_path, dev2), "Device emptied"
+    assert requested["device_path"] == device1.device_path, "Files on device used"
+    assert not listdir(device1.device_path), "Old device is empty"
+    assert len(listdir(dev2)) == 2, "New device has all files"
+
+
+def test_rebalance(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    device1 = Device()
+    device1.set("dev1", __make_temp_directory(), "Device Serial", "ABC123", 1)
+    device2 = Device()
+    device2.set("dev2", __make_temp_directory(), "Device Serial", "DEF456", 1)
+
+    files = []
+    for size in [1000, 500, 100]:
+        backup_file, checksum = __make_temp_file(size, device1.device_path)
+        file_obj = File()
+        file_obj.set_properties(
+            path.basename(backup_file), "/test/" + str(size), checksum
+        )
+        file_obj.set_security("644", "test", "test")
+        file_obj.device = device1
+        files.append(file_obj)
+
+    device_files = {device1.device_path: files, device2.device_path: []}
+    free_space = {device1.device_path: 1000, device2.device_path: 3000}
+    plan = library.__plan_rebalance(device_files, free_space, "space")
+    assert plan == {
+        device2.device_path: [files[0]]
+    }, "Only the excess free space is moved, using the fewest files"
+
+    plan = library.__plan_rebalance(device_files, free_space, "count")
+    assert plan == {
+        device2.device_path: [files[2]]
+    }, "Only the excess files are moved, using the fewest bytes"
+
+    free_space = {device1.device_path: 3000, device2.device_path: 1000}
+    plan = library.__plan_rebalance(device_files, free_space, "space")
+    assert plan == {}, "Device with files but more space is not drained"
+
+    free_space[device2.device_path] = 50
+    plan = library.__plan_rebalance(device_files, free_space, "count")
+    assert plan == {}, "Files are not moved to a device without room"
+
+    free_space[device2.device_path] = 3000
+    profiles = {
+        device1.device_path: DeviceProfile(100, 100, 10),
+        device2.device_path: DeviceProfile(300, 300, 10),
+    }
+    plan = library.__plan_rebalance(device_files, free_space, "throughput", profiles)
+    assert plan == {
+        device2.device_path: [files[0], files[2]]
+    }, "Faster device takes a share of bytes matching its speed"
+
+    monkeypatch.setattr(db, "get_devices", lambda: [device1, device2])
+    monkeypatch.setattr(path, "ismount", lambda mount_path: mount_path != "/")
+    monkeypatch.setattr(
+        db,
+        "get_files_by_location",
+        lambda folder_path=None, device_path=None: device_files[device_path],
+    )
+    monkeypatch.setattr(
+        utility,
+        "get_device_space",
+        lambda device_path: 1000 if device_path == device1.device_path else 3000,
+    )
+    monkeypatch.setattr(
+        db, "update_file_devices", lambda file_paths, device: file_paths
+    )
+    assert library.rebalance("space"), "Rebalancing succeeds"
+    assert listdir(device2.device_path) == [
+        files[0].file_name
+    ], "Largest file moved to emptier device"
+    capsys.readouterr()
+
+    device_files = {device1.device_path: files[1:], device2.device_path: files[:1]}
+    monkeypatch.setattr(
+        utility, "get_device_space", lambda device_path: 2000,
+    )
+    assert library.rebalance("space"), "Balanced devices succeed"
+    out = capsys.readouterr()
+    assert "Devices are already balanced" in out.out, "Balanced message prints"
+
+    monkeypatch.setattr(
+        path, "ismount", lambda mount_path: mount_path == device1.device_path
+    )
+    assert not library.rebalance("space"), "A single device cannot be rebalanced"
+    out = capsys.readouterr()
+    assert "Skipping device that is not attached" in out.out, "Missing device prints"
+    assert "At least two attached devices" in out.out, "Too few devices prints"
+
+    monkeypatch.setattr(path, "ismount", lambda mount_path: True)
+    assert not library.rebalance("throughput"), "Unprofiled devices fail"
+    out = capsys.readouterr()
+    assert "must be profiled first" in out.out, "Unprofiled devices message prints"
+
+    slept = []
+    monkeypatch.setattr(library.time, "sleep", slept.append)
+    _, new_path, valid = library.__copy_backup(files[1], device2.device_path, 100)
+    assert valid and path.isfile(new_path), "Throttled copy is valid"
+    assert 4 < slept[0] <= 5, "Throttled copy waits for the rate limit"
+
+    # A bad write is caught by reading the copy back, not the source
+    copy_and_checksum = utility.copy_and_checksum
+
+    def corrupt_copy(source: str, destination: str) -> str:
+        """
+        Copies a file, then overwrites the start of the copy after hashing
+        """
+        checksum = copy_and_checksum(source, destination)
+        with open(destination, "r+b") as destination_file:
+            destination_file.write(b"corrupt")
+        return checksum
+
+    monkeypatch.setattr(utility, "copy_and_checksum", corrupt_copy)
+    os.remove(new_path)
+    _, new_path, valid = library.__copy_backup(files[1], device2.device_path)
+    assert not valid, "Corrupt copy is not valid"
+
+
+def test_profile_devices(monkeypatch, capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    device1 = Device()
+    device1.set("dev1", __make_temp_directory(), "Device Serial", "ABC123", 1)
+    device2 = Device()
+    device2.set("dev2", __make_temp_directory(), "Device Serial", "DEF456", 1)
+    db.add_device(device1)
+    db.add_device(device2)
+
+    monkeypatch.setattr(path, "ismount", lambda mount_path: False)
+    assert not library.profile_devices(), "No attached devices fails"
+    out = capsys.readouterr()
+    assert "No attached devices" in out.out, "No attached devices message prints"
+
+    monkeypatch.setattr(path, "ismount", lambda mount_path: True)
+    monkeypatch.setattr(
+        device_profile,
+        "profile_device",
+        lambda mount_point: DeviceProfile(1024, 2048, 10)
+        if mount_point == device1.device_path
+        else DeviceProfile(4096, 8192, 20),
+    )
+    assert library.profile_devices(), "Devices profiled"
+    out = capsys.readouterr()
+    assert "read 1.0KiB/s, write 2.0KiB/s" in out.out, "Profile results print"
+    assert db.get_device_profiles()[device2.device_path] == DeviceProfile(
+        4096, 8192, 20
+    ), "Profiles saved"
+
+    # Fastest device is preferred when auto-selecting
+    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 100)
+    name, _ = library.__get_device_with_space(1)
+    assert name == "dev2", "Faster device selected"
+
+    # Estimates are printed for moves between profiled devices
+    monkeypatch.setattr(utility, "get_device_space", lambda device_path: 100000)
+    backup_file, checksum = __make_temp_file(1024, device1.device_path)
+    file_obj = File()
+    file_obj.set_properties(path.basename(backup_file), "/test/file", checksum)
+    file_obj.set_security("644", "test", "test")
+    file_obj.device = device1
+    monkeypatch.setattr(
+        db,
+        "get_files_by_location",
+        lambda folder_path=None, device_path=None: [file_obj],
+    )
+    monkeypatch.setattr(
+        db, "update_file_devices", lambda file_paths, device: file_paths
+    )
+    assert library.move_device(device1.device_path, device2.device_path), "Moved"
+    out = capsys.readouterr()
+    assert "Estimated time: 0:00:01" in out.out, "Estimate printed"
+
 
-    monkeypatch.setattr(library, "move_file_device", lambda file_path, device: True)
-    assert library.move_directory_device("/test", "/dev"), "All success should succeed"
+def test_search(monkeypatch, capsys):
+    """
+    .
+    """
+    file_obj = File()
+    file_obj.set_properties("backup", "/photos/IMG_0001.jpg", "abc123")
+    file_obj.device_name = "dev1"
+    file_obj.size = 2048
+    requested = []
+
+    def search_files(*args):
+        """
+        .
+        """
+        requested.append(args)
+        if args[1] == "regex":
+            re.compile(args[0])
+        return [file_obj]
+
+    monkeypatch.setattr(db, "search_files", search_files)
+    assert library.search("IMG", "substring", owner="test") == [
+        file_obj
+    ], "Matching files returned"
+    assert requested == [
+        ("IMG", "substring", None, None, "test", None, None, None)
+    ], "Filters passed through"
+    out = capsys.readouterr()
+    assert "/photos/IMG_0001.jpg\tdev1\t2.0KiB" in out.out, "Match prints"
+    assert "Found 1 file" in out.out, "Count prints"
+
+    assert library.search("(", "regex") == [], "Invalid regex finds nothing"
+    out = capsys.readouterr()
+    assert "Invalid regular expression" in out.out, "Invalid regex prints"
 
 
 def test_restore_file(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     original_file, original_checksum = __make_temp_file()
     dev_folder = __make_temp_directory()
 
@@ -1244,16 +2076,6 @@ def test_restore_file(monkeypatch, capsys):
     ), "File already exists message prints"
     remove(original_file)
 
-    monkeypatch.setattr(library, "verify_file", lambda file_path, for_restore: False)
-    assert not library.restore_file(
-        original_file
-    ), "Restore fails if back up of file has invalid checksum"
-    out = capsys.readouterr()
-    assert (
-        "Backed-up file has mismatched checksum" in out.out
-    ), "Invalid back-up checksum message prints"
-
-    monkeypatch.setattr(library, "verify_file", lambda file_path, for_restore: True)
     monkeypatch.setattr(db, "get_files", lambda file_path: [])
     assert not library.restore_file(
         original_file
@@ -1273,8 +2095,24 @@ def test_restore_file(monkeypatch, capsys):
     file_obj.device = device
 
     monkeypatch.setattr(db, "get_files", lambda file_path: [file_obj])
-    checksum_func = utility.checksum_file
-    monkeypatch.setattr(utility, "checksum_file", lambda file_path: "bad-checksum")
+    monkeypatch.setattr(
+        library, "verify_file", lambda file_path, for_restore, device_path: False
+    )
+    assert not library.restore_file(
+        original_file
+    ), "Restore fails if back up of file has invalid checksum"
+    out = capsys.readouterr()
+    assert (
+        "Backed-up file has mismatched checksum" in out.out
+    ), "Invalid back-up checksum message prints"
+
+    monkeypatch.setattr(
+        library, "verify_file", lambda file_path, for_restore, device_path: True
+    )
+    checksum_func = utility.checksum_copy
+    monkeypatch.setattr(
+        utility, "checksum_copy", lambda source, destination: "bad-checksum"
+    )
 
     assert not library.restore_file(
         original_file
@@ -1287,13 +2125,9 @@ def test_restore_file(monkeypatch, capsys):
         original_file
     ), "Restored file should be deleted after checksum failure"
 
-    monkeypatch.setattr(utility, "checksum_file", checksum_func)
-    security_func = utility.get_file_security
-    monkeypatch.setattr(
-        utility,
-        "get_file_security",
-        lambda file_path: {"permissions": "bad", "owner": "wrong", "group": "wrong"},
-    )
+    monkeypatch.setattr(utility, "checksum_copy", checksum_func)
+    fchmod_func = os.fchmod
+    monkeypatch.setattr(os, "fchmod", lambda descriptor, mode: None)
     assert not library.restore_file(
         original_file
     ), "Fails permission verification after copy files"
@@ -1324,7 +2158,7 @@ def test_restore_file(monkeypatch, capsys):
         original_file
     ), "Restored file should NOT be deleted after permission set failure"
 
-    monkeypatch.setattr(utility, "get_file_security", security_func)
+    monkeypatch.setattr(os, "fchmod", fchmod_func)
     monkeypatch.setattr(os, "remove", remove_func)
     os.remove(original_file)
 
@@ -1333,12 +2167,24 @@ def test_restore_file(monkeypatch, capsys):
     assert original_checksum == utility.checksum_file(
         original_file
     ), "Restored file matches original checksum"
+    assert (
+        utility.get_file_security(original_file)["permissions"] == "600"
+    ), "Restored file permissions set"
+
+    os.remove(original_file)
+    backup_path = path.join(dev_folder, path.basename(original_file))
+    os.utime(backup_path, ns=(1000000000, 2000000000))
+    assert library.restore_file(original_file, True), "Restoring with metadata"
+    assert (
+        os.stat(original_file).st_mtime_ns == 2000000000
+    ), "Modified time restored from the backed up copy"
 
 
 def test_restore_folder(monkeypatch, capsys):
     """
     .
     """
+    db.initialize_database()
     monkeypatch.setattr(
         db, "get_entries_for_folder", lambda folder: DirectoryEntries([], [])
     )
@@ -1368,7 +2214,9 @@ def test_restore_folder(monkeypatch, capsys):
     assert not path.isdir(folder1), "Folders should not be created yet"
 
     monkeypatch.setattr(os, "makedirs", makedirs_func)
-    monkeypatch.setattr(library, "restore_file", lambda file_path: False)
+    monkeypatch.setattr(
+        library, "restore_file", lambda file_path, preserve_metadata: False
+    )
     assert not library.restore_folder(
         folder1
     ), "Should fail due to file restoration failure"
@@ -1382,13 +2230,11 @@ def test_restore_folder(monkeypatch, capsys):
     folder = Folder()
     folder.set("unnecessary", "700", user_name, group_name)
     monkeypatch.setattr(db, "get_folders", lambda folder_path: [folder])
-    monkeypatch.setattr(library, "restore_file", lambda file_path: True)
-    security_func = utility.get_file_security
     monkeypatch.setattr(
-        utility,
-        "get_file_security",
-        lambda folder_path: {"permissions": "bad", "owner": "wrong", "group": "wrong"},
+        library, "restore_file", lambda file_path, preserve_metadata: True
     )
+    fchmod_func = os.fchmod
+    monkeypatch.setattr(os, "fchmod", lambda descriptor, mode: None)
     assert not library.restore_folder(folder1), "Should fail due to permission mismatch"
     out = capsys.readouterr()
     assert (
@@ -1401,7 +2247,7 @@ def test_restore_folder(monkeypatch, capsys):
     os.removedirs(folder2)
     assert not path.isdir(folder1), "Verify parent directory removed"
 
-    monkeypatch.setattr(utility, "get_file_security", security_func)
+    monkeypatch.setattr(os, "fchmod", fchmod_func)
     assert library.restore_folder(folder1), "Folder restoration should succeed"
     assert path.isdir(folder1), "Folder one created"
     assert path.isdir(folder2), "Folder two created"
@@ -1437,6 +2283,25 @@ def test_get_unique_folders(monkeypatch):
         "/f",
     ], "Reduced folder set returned"
 
+    # Sharing a prefix, without being nested, does not deduplicate
+    folder6 = Folder()
+    folder6.folder_path = "/foo-bar"
+    folder7 = Folder()
+    folder7.folder_path = "/foo-bar/baz"
+    folder8 = Folder()
+    folder8.folder_path = "/bar/baz"
+    monkeypatch.setattr(
+        db,
+        "get_folders",
+        lambda: [folder7, folder1, folder6, folder8, folder2, folder4, folder5],
+    )
+    assert library.__get_unique_folders() == [
+        "/foo",
+        "/foo-bar",
+        "/bar/baz",
+        "/f",
+    ], "Prefixes which are not parents are kept, in order"
+
     root_folder = Folder()
     root_folder.folder_path = "/"
     monkeypatch.setattr(
@@ -1460,7 +2325,7 @@ def test_get_external_files(monkeypatch):
     file3.file_path = "/home.txt"
 
     monkeypatch.setattr(library, "__get_unique_folders", lambda: ["/foo", "/home"])
-    monkeypatch.setattr(db, "get_files", lambda: [file1, file2, file3])
+    monkeypatch.setattr(db, "iter_files", lambda columns: iter([file1, file2, file3]))
     assert library.__get_files_outside_directories() == ["/home.txt"], "One returned"
 
     monkeypatch.setattr(library, "__get_unique_folders", lambda: ["/foo/bar", "/home"])
@@ -1469,29 +2334,83 @@ def test_get_external_files(monkeypatch):
         "/home.txt",
     ], "Two returned"
 
+    file4 = File()
+    file4.file_path = "/foo-bar/test"
+    monkeypatch.setattr(library, "__get_unique_folders", lambda: ["/foo"])
+    monkeypatch.setattr(db, "iter_files", lambda columns: iter([file1, file4, file2]))
+    assert library.__get_files_outside_directories() == [
+        "/foo-bar/test"
+    ], "Sharing a prefix with a folder is not being inside it"
+
+    monkeypatch.setattr(db, "iter_files", lambda columns: iter([file1, file2, file3]))
     monkeypatch.setattr(
         library, "__get_unique_folders", lambda: ["/foo/bar", "/home", "/"]
     )
     assert library.__get_files_outside_directories() == [], "Root returns no files"
 
 
+def test_restore_unknown_security_names(monkeypatch, capsys):
+    """
+    .
+    """
+    monkeypatch.setattr(utility, "get_user_id", lambda name: None)
+    monkeypatch.setattr(
+        db,
+        "get_security_names",
+        lambda folder_path=None: ({"ghost", "phantom"}, {"users"}),
+    )
+    monkeypatch.setattr(
+        db, "get_entries_for_folder", lambda folder: DirectoryEntries(["/a"], [])
+    )
+    restored = []
+    monkeypatch.setattr(
+        library, "restore_file", lambda *arguments: restored.append(arguments)
+    )
+
+    assert not library.restore_folder("/test"), "Folder restore fails"
+    out = capsys.readouterr()
+    assert (
+        "Unknown owners on this system: ghost, phantom" in out.out
+    ), "Missing owners listed"
+    assert "Unknown groups" not in out.out, "Existing groups not listed"
+
+    monkeypatch.setattr(
+        library, "restore_folder", lambda *arguments: restored.append(arguments)
+    )
+    assert not library.restore_all(), "Restoring everything fails"
+    assert restored == [], "Nothing restored once names are known missing"
+
+
 def test_restore_all(monkeypatch):
     """
     .
     """
+    db.initialize_database()
     monkeypatch.setattr(library, "__get_unique_folders", lambda: ["/foo", "/bar"])
     monkeypatch.setattr(
         library, "__get_files_outside_directories", lambda: ["/ipsum", "/lorem"]
     )
 
-    monkeypatch.setattr(library, "restore_folder", lambda folder_path: False)
-    monkeypatch.setattr(library, "restore_file", lambda file_path: True)
+    monkeypatch.setattr(
+        library, "restore_folder", lambda folder_path, preserve_metadata: False
+    )
+    monkeypatch.setattr(
+        library, "restore_file", lambda file_path, preserve_metadata: True
+    )
     assert not library.restore_all(), "Folder restoration failure, fails"
 
-    monkeypatch.setattr(library, "restore_folder", lambda folder_path: True)
-    monkeypatch.setattr(library, "restore_file", lambda file_path: False)
+    monkeypatch.setattr(
+        library, "restore_folder", lambda folder_path, preserve_metadata: True
+    )
+    monkeypatch.setattr(
+        library, "restore_file", lambda file_path, preserve_metadata: False
+    )
     assert not library.restore_all(), "File restoration failure, fails"
 
-    monkeypatch.setattr(library, "restore_folder", lambda folder_path: True)
-    monkeypatch.setattr(library, "restore_file", lambda file_path: True)
+    monkeypatch.setattr(
+        library, "restore_folder", lambda folder_path, preserve_metadata: True
+    )
+    monkeypatch.setattr(
+        library, "restore_file", lambda file_path, preserve_metadata: True
+    )
     assert library.restore_all(), "Success case"
@@ -1,13 +1,15 @@
 """
 Test main script entry point
 """
+import io
 import os.path
+import sys
+import tempfile
+import threading
 from types import FunctionType
 from pytest import raises
 
-# This is an auto-run fixture, so importing is sufficient
-# pylint: disable=unused-import
-from logical_backup.utility import run_command, auto_set_testing
+from logical_backup.utility import run_command
 from logical_backup import main  # for input mocking
 from logical_backup import library  # for input mocking
 from logical_backup.main import __check_devices
@@ -23,6 +25,7 @@ from tests.mock_db import mock_devices
 
 # This is an auto-run fixture, so importing is sufficient
 # pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
 from tests.test_db import auto_clear_db
 from tests.test_utility import patch_input
 
@@ -201,7 +204,7 @@ def test_command_run(monkeypatch, capsys):
     """
     library_attrs = library.__dict__.keys()
     for attr in library_attrs:
-        if type(getattr(library, attr) is FunctionType):
+        if type(getattr(library, attr)) is FunctionType:
             monkeypatch.setattr(library, attr, lambda *args, **kwargs: None)
 
     # Pretend everything is valid, because it should be for this test
@@ -269,5 +272,153 @@ def test_command_run(monkeypatch, capsys):
     arguments = ["move", "--folder", "foo", "--move-path", "/home/user/"]
     assert main.process(arguments) == "move-folder", "Move folder"
 
+    arguments = ["move", "--all", "--from-device", "/mnt", "--device", "/mnt2"]
+    assert main.process(arguments) == "move-all-to-device", "Move all to device"
+
+    arguments = ["rebalance", "--strategy", "count", "--throttle", "10"]
+    assert main.process(arguments) == "rebalance", "Rebalance"
+
+    arguments = ["profile-devices"]
+    assert main.process(arguments) == "profile-devices", "Profile devices"
+
+    arguments = ["search", "--pattern", "photo", "--match", "glob"]
+    assert main.process(arguments) == "search", "Search"
+
     arguments = ["list-devices"]
     assert main.process(arguments) == "list-devices", "List devices"
+
+    arguments = ["protect"]
+    assert main.process(arguments) == "protect", "Protect"
+
+    arguments = ["watch", "--folder", "foo"]
+    assert main.process(arguments) == "watch", "Watch"
+
+    arguments = ["serve"]
+    assert main.process(arguments) == "serve", "Serve"
+
+    arguments = ["update", "--folder", "foo", "--changed-only"]
+    assert main.process(arguments) == "update-folder", "Update changed paths"
+
+    monkeypatch.setattr(main, "__run_batch", lambda arguments: True)
+    arguments = ["batch"]
+    assert main.process(arguments) == "batch", "Batch"
+
+
+def test_batch(monkeypatch, capsys):
+    """
+    .
+    """
+    folder_path = tempfile.mkdtemp()
+    first, second = os.path.join(folder_path, "a"), os.path.join(folder_path, "b")
+    for file_path in [first, second]:
+        with open(file_path, "w") as test_file:
+            test_file.write(file_path)
+
+    calls = []
+    threads = set()
+
+    def verify(file_path, for_restore):
+        threads.add(threading.get_ident())
+        calls.append(("verify", file_path))
+        return file_path == first
+
+    monkeypatch.setattr(
+        library,
+        "add_file",
+        lambda file_path, mount_point=None, copies=1: calls.append(("add", file_path))
+        or True,
+    )
+    monkeypatch.setattr(library, "verify_file", verify)
+    monkeypatch.setattr(library, "replicate_catalog", lambda: True)
+    monkeypatch.setattr(main, "__check_devices", lambda args: True)
+
+    batch_path = os.path.join(folder_path, "operations")
+    with open(batch_path, "w") as batch_file:
+        batch_file.write(
+            "\n".join(
+                [
+                    "# Added by the nightly script",
+                    "add --file " + first,
+                    "",
+                    "add --file " + first,
+                    "verify --file " + first,
+                    "verify --file " + second,
+                    "add --file " + first,
+                    "list-devices",
+                    "add --file",
+                    "add --folder 'unclosed",
+                ]
+            )
+        )
+
+    assert main.process(["batch", "--file", batch_path]) == "batch", "Batch run"
+    assert calls[0] == ("add", first) and calls[-1] == ("add", first), "In order"
+    assert sorted(calls[1:3]) == [
+        ("verify", first),
+        ("verify", second),
+    ], "Verified between the adds"
+    assert len(calls) == 4, "Repeat dropped, unless the path was used in between"
+    assert threading.get_ident() not in threads, "Verified in the worker pool"
+
+    out = capsys.readouterr().out
+    assert "add-file: 2 succeeded, 0 failed" in out, "Adds reported"
+    assert "verify-file: 1 succeeded, 1 failed" in out, "Verifies reported"
+    assert "Line 6 failed" in out, "Failed line reported"
+    assert "Line 8 invalid" in out and "Cannot be batched" in out, "Not batchable"
+    assert "Line 9 invalid" in out and "expected one argument" in out, "Unparsed"
+    assert "Line 10 invalid" in out and "No closing quotation" in out, "Unquoted"
+    assert (
+        "Ran 4 operations, skipping 1 repeats and 3 invalid lines" in out
+    ), "Summary reported"
+
+    calls.clear()
+    monkeypatch.setattr(sys, "stdin", io.StringIO("verify --file " + first + "\n"))
+    assert main.process(["batch"]) == "batch", "Batch read from standard input"
+    assert calls == [("verify", first)], "Operation run"
+    assert "verify-file: 1 succeeded" in capsys.readouterr().out, "Reported"
+
+    # Options for the whole process would otherwise be silently ignored
+    calls.clear()
+    monkeypatch.setattr(
+        sys,
+        "stdin",
+        io.StringIO(
+            "verify --file {0}\nverify --file {1} --io-mode direct --output ndjson\n"
+            "verify --file {1} --quiet\n".format(first, second)
+        ),
+    )
+    assert main.process(["batch"]) == "batch", "Batch run"
+    assert calls == [("verify", first)], "Only the line without them run"
+    out = capsys.readouterr().out
+    assert "Line 2 invalid" in out and "--io-mode, --output" in out, "Rejected"
+    assert "Line 3 invalid" in out and "--quiet" in out, "Rejected"
+
+    # Operations are validated once those before them have run
+    restored = os.path.join(folder_path, "restored")
+    monkeypatch.setattr(
+        library,
+        "restore_file",
+        lambda file_path, preserve_metadata: open(file_path, "w").close() or True,
+    )
+    monkeypatch.setattr(
+        library,
+        "remove_file",
+        lambda file_path: calls.append(("remove", file_path)) or True,
+    )
+    monkeypatch.setattr(
+        sys,
+        "stdin",
+        io.StringIO(
+            "remove --file {0}\nrestore --file {0}\nremove --file {0}\n".format(
+                restored
+            )
+        ),
+    )
+    calls.clear()
+    assert main.process(["batch"]) == "batch", "Batch run"
+    assert calls == [("remove", restored)], "Removed once restored"
+    out = capsys.readouterr().out
+    assert "Line 1 invalid" in out and "Line 3 invalid" not in out, "Checked in turn"
+    assert (
+        "Ran 2 operations, skipping 0 repeats and 1 invalid lines" in out
+    ), "Summary reported"
@@ -0,0 +1,171 @@
+"""
+Tests for device manifests
+"""
+import os.path as os_path
+import tempfile
+
+from logical_backup import db
+from logical_backup import manifest
+from logical_backup.objects.device import Device
+from logical_backup.objects.file import File
+
+# pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
+from tests.test_db import auto_clear_db
+
+
+def make_file(file_path: str, checksum: str = "abc") -> File:
+    """
+    Makes a backed up file
+    """
+    file_obj = File()
+    file_obj.set_properties(file_path.replace("/", "_"), file_path, checksum)
+    file_obj.set_security("644", "user", "group")
+    file_obj.size = 10
+    return file_obj
+
+
+def make_device(name: str) -> Device:
+    """
+    Makes a device, mounted in a new directory
+    """
+    device = Device()
+    device.set(name, tempfile.mkdtemp(), "User Specified", name + "-id")
+    return device
+
+
+def test_read_manifest(monkeypatch):
+    """
+    .
+    """
+    db.initialize_database()
+    monkeypatch.setattr(manifest, "BATCH_SIZE", 2)
+    device = make_device("first")
+    manifest_path = os_path.join(device.device_path, manifest.MANIFEST_NAME)
+    manifest.record_device(device)
+
+    manifest.record_added(device.device_path, make_file("/foo"))
+    with open(manifest_path) as manifest_file:
+        assert len(manifest_file.readlines()) == 1, "Records wait for a full batch"
+
+    manifest.record_added(device.device_path, make_file("/bar"))
+    manifest.record_removed(device.device_path, "_foo")
+    manifest.record_added(device.device_path, make_file("/baz", "def"))
+    manifest.flush()
+    with open(manifest_path, "a") as manifest_file:
+        manifest_file.write('["+","torn')
+
+    read_device, files = manifest.read_manifest(device.device_path)
+    assert read_device == device, "Device read back"
+    assert read_device.device_path == device.device_path, "Device at mount point"
+    assert sorted(files) == ["_bar", "_baz"], "Removed and torn records skipped"
+    file_obj = files["_baz"][1]
+    assert file_obj.file_path == "/baz", "Path read back"
+    assert file_obj.checksum == "def", "Checksum read back"
+    assert file_obj.size == 10, "Size read back"
+    assert file_obj.owner == "user", "Security read back"
+
+
+def test_batch_seconds(monkeypatch):
+    """
+    .
+    """
+    db.initialize_database()
+    device = make_device("first")
+    manifest_path = os_path.join(device.device_path, manifest.MANIFEST_NAME)
+    now = [100.0]
+    monkeypatch.setattr(manifest.time, "monotonic", lambda: now[0])
+
+    manifest.record_added(device.device_path, make_file("/foo"))
+    now[0] += manifest.BATCH_SECONDS - 1
+    manifest.record_added(device.device_path, make_file("/bar"))
+    assert not os_path.exists(manifest_path), "Batch still young"
+
+    now[0] += 1
+    manifest.record_added(device.device_path, make_file("/baz"))
+    with open(manifest_path) as manifest_file:
+        assert len(manifest_file.readlines()) == 3, "Old batch written"
+
+    now[0] += manifest.BATCH_SECONDS
+    manifest.record_added(device.device_path, make_file("/qux"))
+    with open(manifest_path) as manifest_file:
+        assert len(manifest_file.readlines()) == 3, "New batch timed from its start"
+    manifest.flush()
+
+
+def test_read_manifests():
+    """
+    .
+    """
+    db.initialize_database()
+    first = make_device("first")
+    second = make_device("second")
+    third = make_device("third")
+    unnamed = tempfile.mkdtemp()
+    for device in [first, second, third]:
+        manifest.record_device(device)
+
+    manifest.record_added(first.device_path, make_file("/foo"))
+    manifest.record_added(first.device_path, make_file("/bar"))
+    manifest.record_added(unnamed, make_file("/baz"))
+    # Moved across, but the removal from the first device was never written
+    manifest.record_added(second.device_path, make_file("/foo", "new"))
+    # Kept on two devices
+    manifest.record_added(third.device_path, make_file("/foo", "new"))
+    manifest.flush()
+
+    devices, files, replicas, unnamed_paths = manifest.read_manifests(
+        [first.device_path, second.device_path, third.device_path, unnamed]
+    )
+    assert devices == [first, second, third], "Manifests without a device skipped"
+    assert unnamed_paths == [unnamed], "But reported"
+    files = {file_obj.file_path: file_obj for file_obj in files}
+    assert sorted(files) == ["/bar", "/foo"], "Each path once"
+    assert files["/foo"].checksum == "new", "Latest record wins"
+    assert len(replicas) == 1 and replicas[0][0] == "/foo", "Other copy kept"
+    mount_points = {device.device_name: device.device_path for device in devices}
+    assert {mount_points[files["/foo"].device_name], replicas[0][1]} == {
+        second.device_path,
+        third.device_path,
+    }, "On the devices of the new copies"
+    assert files["/bar"].device_name == "first", "Other files keep their device"
+
+
+def test_missing_header():
+    """
+    .
+    """
+    db.initialize_database()
+    new = make_device("new")
+    old = make_device("old")
+    unregistered = tempfile.mkdtemp()
+    db.add_device(new)
+    db.add_device(old)
+    old_path = os_path.join(old.device_path, manifest.MANIFEST_NAME)
+    with open(old_path, "w", encoding="utf-8") as manifest_file:
+        manifest_file.write('["-","_foo",1]\n')
+
+    for device_path in [new.device_path, old.device_path, unregistered]:
+        manifest.record_added(device_path, make_file("/bar"))
+    manifest.flush()
+    manifest.record_added(old.device_path, make_file("/baz"))
+    manifest.flush()
+
+    assert manifest.read_manifest(new.device_path)[0] == new, "Header from catalog"
+    read_device, files = manifest.read_manifest(old.device_path)
+    assert read_device == old, "Header put before earlier records"
+    assert sorted(files) == ["_bar", "_baz"], "Records kept"
+    with open(old_path, encoding="utf-8") as manifest_file:
+        lines = manifest_file.readlines()
+    assert len(lines) == 4 and lines[0].startswith('["device"'), "One header"
+    assert manifest.read_manifest(unregistered)[0] is None, "Unknown device"
+
+
+def test_write_failure(capsys):
+    """
+    .
+    """
+    db.initialize_database()
+    manifest.record_added("/nonexistent/device", make_file("/foo"))
+    manifest.flush()
+    assert "Failed to write manifest" in capsys.readouterr().out, "Failure reported"
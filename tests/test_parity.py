@@ -0,0 +1,139 @@
+"""
+Tests for erasure coding files across devices
+"""
+from itertools import combinations
+import hashlib
+import os
+import os.path as os_path
+import tempfile
+
+from pytest import fixture, raises
+
+from logical_backup import parity
+
+
+@fixture(params=parity.BACKENDS)
+def backend(request):
+    """
+    Runs a test with each backend installed, going back to the default after
+    """
+    try:
+        parity.set_backend(request.param)
+    except ImportError:
+        parity.set_backend()
+        # pylint: disable=import-outside-toplevel
+        from pytest import skip
+
+        skip(request.param + " is not installed")
+
+    yield request.param
+    parity.set_backend()
+
+
+def test_encode_decode(backend):
+    """
+    .
+    """
+    for data_count, parity_count in [(1, 1), (3, 1), (4, 2), (5, 3)]:
+        blocks = [os.urandom(1000) for _ in range(data_count)]
+        members = dict(enumerate(blocks + parity.encode(blocks, parity_count)))
+
+        xor = 0
+        for block in blocks:
+            xor ^= int.from_bytes(block, "little")
+        assert members[data_count] == xor.to_bytes(1000, "little"), "First is XOR"
+
+        for lost in combinations(members, parity_count):
+            available = {
+                index: block for index, block in members.items() if index not in lost
+            }
+            for index in lost:
+                if index < data_count:
+                    assert (
+                        parity.decode(available, data_count, parity_count, index)
+                        == blocks[index]
+                    ), "Any {0} lost blocks rebuilt".format(parity_count)
+
+    with raises(ValueError):
+        parity.coding_matrix(200, 57)
+
+
+def test_backends_agree():
+    """
+    .
+    """
+    blocks = [os.urandom(4096) for _ in range(4)]
+    expected = parity.encode(blocks, 3)
+    for backend in parity.BACKENDS:
+        try:
+            parity.set_backend(backend)
+        except ImportError:
+            continue
+        assert parity.encode(blocks, 3) == expected, backend + " codes the same"
+    parity.set_backend()
+
+
+def make_member(directory: str, name: str, data: bytes) -> parity.ParityMember:
+    """
+    Writes a member of a group, describing it
+    """
+    with open(os_path.join(directory, name), "wb") as member_file:
+        member_file.write(data)
+
+    return parity.ParityMember(
+        directory, name, hashlib.md5(data).hexdigest(), len(data)
+    )
+
+
+def test_write_and_rebuild(backend):
+    """
+    .
+    """
+    devices = [tempfile.mkdtemp() for _ in range(5)]
+    data = [os.urandom(size) for size in [3000, 2500, 0]]
+    members = [
+        make_member(device, "file" + str(index), content)
+        for index, (device, content) in enumerate(zip(devices, data))
+    ]
+    parity_paths = [os_path.join(device, "parity") for device in devices[3:]]
+
+    checksums = parity.write_parity(
+        [os_path.join(member.device_path, member.name) for member in members],
+        [members[0].checksum, members[1].checksum, "wrong"],
+        parity_paths,
+        1024,
+    )
+    assert checksums is None, "Corrupt file not coded"
+    assert not any(os_path.exists(path) for path in parity_paths), "Nothing written"
+
+    checksums = parity.write_parity(
+        [os_path.join(member.device_path, member.name) for member in members],
+        [member.checksum for member in members],
+        parity_paths,
+        1024,
+    )
+    assert all(os_path.getsize(path) == 3000 for path in parity_paths), "Padded"
+    group = parity.ParityGroup(
+        1,
+        3,
+        members
+        + [
+            parity.ParityMember(device, "parity", checksum, 3000)
+            for device, checksum in zip(devices[3:], checksums)
+        ],
+    )
+
+    os.remove(os_path.join(devices[0], "file0"))
+    with open(os_path.join(devices[1], "file1"), "r+b") as corrupt:
+        corrupt.write(b"corrupt")
+    with tempfile.TemporaryFile() as rebuilt:
+        assert (
+            parity.rebuild(group, 0, rebuilt, 1024) == members[0].checksum
+        ), "Rebuilt around the corrupt file"
+        rebuilt.seek(0)
+        assert rebuilt.read() == data[0], "Rebuilt data written"
+
+    with open(os_path.join(devices[3], "parity"), "r+b") as corrupt:
+        corrupt.write(b"corrupt")
+    with tempfile.TemporaryFile() as rebuilt:
+        assert parity.rebuild(group, 0, rebuilt, 1024) is None, "Too few intact"
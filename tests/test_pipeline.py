@@ -0,0 +1,102 @@
+"""
+Tests for running work as a pipeline of stages
+"""
+import threading
+import time
+
+from logical_backup import pipeline
+
+
+def test_run(capsys):
+    """
+    .
+    """
+    finished = []
+    stages = [
+        pipeline.Stage("double", lambda item: item * 2, 3),
+        pipeline.Stage("check", lambda item: item if item != 6 else None, 2),
+        pipeline.Stage("divide", lambda item: item // (item - 8), 1),
+    ]
+    assert not pipeline.run(
+        range(1, 6), stages, lambda item, done: finished.append((item, done))
+    ), "Any failure fails the run"
+    assert sorted(finished) == [
+        (-1, True),
+        (-1, True),
+        (5, True),
+        (6, False),
+        (8, False),
+    ], "Failures finish with the item the stage was given"
+    assert (
+        "Failed to divide 8: integer division" in capsys.readouterr().out
+    ), "Exceptions print"
+
+    finished.clear()
+    assert pipeline.run(
+        range(20),
+        [pipeline.Stage("double", lambda item: item * 2, 4)],
+        lambda item, done: finished.append(item),
+    ), "Every item made it through"
+    assert sorted(finished) == list(range(0, 40, 2)), "Each item finished once"
+
+    assert pipeline.run([], stages), "Nothing to run succeeds"
+
+
+def test_run_stop_on_failure():
+    """
+    .
+    """
+    started = []
+
+    def work(item: int) -> int:
+        """
+        .
+        """
+        started.append(item)
+        return None if item == 2 else item
+
+    assert not pipeline.run(
+        range(pipeline.QUEUE_SIZE * 4),
+        [pipeline.Stage("work", work, 1)],
+        stop_on_failure=True,
+    ), "Run fails"
+    assert 2 in started, "Failing item ran"
+    assert len(started) <= pipeline.QUEUE_SIZE + 4, "New items stopped"
+
+
+def test_run_overlaps_stages():
+    """
+    .
+    """
+    threads = {}
+    lock = threading.Lock()
+
+    def stage_function(name: str):
+        """
+        .
+        """
+
+        def work(item: int) -> int:
+            """
+            .
+            """
+            with lock:
+                threads.setdefault(name, set()).add(threading.get_ident())
+            time.sleep(0.05)
+            return item
+
+        return work
+
+    start = time.perf_counter()
+    assert pipeline.run(
+        range(8),
+        [
+            pipeline.Stage("first", stage_function("first"), 2),
+            pipeline.Stage("second", stage_function("second"), 2),
+            pipeline.Stage("third", stage_function("third"), 1),
+        ],
+    ), "Every item made it through"
+    # One at a time would be 8 items times 3 stages of 0.05s
+    assert time.perf_counter() - start < 0.9, "Stages ran at once"
+    assert len(threads["first"]) == 2, "Stages have their own workers"
+    assert len(threads["third"]) == 1, "Single worker stage"
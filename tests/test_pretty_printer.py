@@ -1,9 +1,15 @@
 """
 Tests printing of status messages
 """
+import sys
 
+from logical_backup import pretty_print
 from logical_backup.pretty_print import (
     PrettyStatusPrinter,
+    ProgressDisplay,
+    print_error,
+    record_progress,
+    set_quiet,
     CHECK_UNICODE,
     CROSS_UNICODE,
     Color,
@@ -193,3 +199,74 @@ def test_custom_result(capsys):
     assert "testing thing...Random number" in out.out, "Custom result message prints"
     assert CHECK_UNICODE in out.out, "Success check prints"
     assert Color.WHITE.value in out.out, "Custom result color is printed"
+
+
+def test_quiet(capsys):
+    """
+    .
+    """
+    set_quiet(True)
+    try:
+        PrettyStatusPrinter("status").print_start().print_complete()
+        print_error("broken")
+        PrettyStatusPrinter("summary").with_always_shown().print_message()
+    finally:
+        set_quiet(False)
+
+    out = capsys.readouterr()
+    assert "status" not in out.out, "Status is not printed when quiet"
+    assert "broken" in out.out, "Errors are printed when quiet"
+    assert "summary" in out.out, "Messages always shown are printed when quiet"
+
+
+def test_progress_summary(capsys):
+    """
+    .
+    """
+    with ProgressDisplay("Copying", 3, 300, {"/a": 200}) as progress:
+        PrettyStatusPrinter("per-file status").print_message()
+        with ProgressDisplay("Nested", 1) as nested:
+            assert nested is progress, "Nested displays hand over to the outer one"
+        record_progress("/a", 200)
+        progress.file_done()
+        progress.file_done(False)
+        progress.add_bytes("/b", 50)
+        progress.file_done()
+
+        lines = progress.lines()
+        assert lines[0].startswith(
+            "Copying: 3/3 files, 250.0B/300.0B"
+        ), "Overall progress shown"
+        assert lines[1].startswith("  /a: 200.0B") and "ETA 0:00:00" in lines[1], (
+            "Device with a known total shows ETA"
+        )
+        assert lines[2].startswith("  /b: 50.0B") and "ETA" not in lines[2], (
+            "Device without a known total has no ETA"
+        )
+
+    record_progress("/a", 100)
+    out = capsys.readouterr()
+    assert "per-file status" not in out.out, "Status hidden while showing progress"
+    assert "Copying: 3 files (1 failed), 250.0B in" in out.out, "Summary printed"
+    assert "\033[" + "1F" not in out.out, "Progress not redrawn without a terminal"
+    assert not ProgressDisplay.is_active(), "Progress finished"
+
+
+def test_progress_redraw(monkeypatch, capsys):
+    """
+    .
+    """
+    monkeypatch.setattr(sys.stdout, "isatty", lambda: True)
+    now = [0.0]
+    monkeypatch.setattr(pretty_print.time, "monotonic", lambda: now[0])
+
+    with ProgressDisplay("Copying", 10) as progress:
+        for _ in range(10):
+            progress.file_done()
+            now[0] += 0.1
+
+        print_error("broken")
+
+    out = capsys.readouterr().out
+    assert out.count("/10 files") == 4, "Redrawn at most four times a second"
+    assert "\033[1F\033[J" + Color.ERROR.value in out, "Progress erased for errors"
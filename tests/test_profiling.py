@@ -0,0 +1,94 @@
+"""
+Tests for profiling hooks
+"""
+from os import path
+import pstats
+import tempfile
+
+from logical_backup import library
+from logical_backup import main
+from logical_backup import profiling
+
+# This is an auto-run fixture, so importing is sufficient
+# pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
+from tests.test_db import auto_clear_db
+
+
+def test_timed():
+    """
+    Slow operations are logged only when over the threshold
+    """
+    log_path = path.join(tempfile.mkdtemp(), "slow.log")
+
+    profiling.configure_slow_log(None, log_path)
+    with profiling.timed("hash", "/foo"):
+        pass
+    assert not path.exists(log_path), "Nothing logged when disabled"
+
+    profiling.configure_slow_log(60, log_path)
+    with profiling.timed("hash", "/foo"):
+        pass
+    assert not path.exists(log_path), "Fast operations are not logged"
+
+    profiling.configure_slow_log(0, log_path)
+    with profiling.timed("copy", "/foo/bar"):
+        pass
+    with open(log_path) as log_file:
+        lines = log_file.readlines()
+    assert len(lines) == 1, "Slow operation logged"
+    assert lines[0].split("\t")[1] == "copy", "Phase is logged"
+    assert lines[0].strip().endswith("/foo/bar"), "Path is logged"
+
+    profiling.configure_slow_log(None, None)
+
+
+def test_run_profiled():
+    """
+    Profiles are written for the command that ran
+    """
+    output_dir = tempfile.mkdtemp()
+
+    def command():
+        """
+        Allocates something worth tracking
+        """
+        return "verify-all" if [0] * 100000 else None
+
+    assert (
+        profiling.run_profiled(command, "cpu", output_dir) == "verify-all"
+    ), "Command name is passed through"
+    assert path.isfile(path.join(output_dir, "verify-all.pstats")), "CPU profile saved"
+    assert not path.isfile(
+        path.join(output_dir, "verify-all.tracemalloc.txt")
+    ), "Memory not profiled for CPU mode"
+    stats = pstats.Stats(path.join(output_dir, "verify-all.pstats"))
+    assert stats.total_calls > 0, "CPU profile is readable"
+
+    profiling.run_profiled(command, "both", output_dir)
+    with open(path.join(output_dir, "verify-all.tracemalloc.txt")) as snapshot:
+        contents = snapshot.read()
+    assert "peak" in contents, "Memory snapshot includes peak usage"
+    assert "Top 25 allocation sites" in contents, "Memory snapshot lists sites"
+
+
+def test_process_profile(monkeypatch):
+    """
+    The command line option profiles the dispatched command
+    """
+    output_dir = tempfile.mkdtemp()
+    monkeypatch.setattr(library, "verify_all", lambda for_restore: True)
+    monkeypatch.setattr(library, "replicate_catalog", lambda: True)
+    monkeypatch.setattr(main, "__validate_arguments", lambda args: True)
+    monkeypatch.setattr(main, "__check_devices", lambda args: True)
+
+    command = main.process(
+        ["verify", "--all", "--profile", "mem", "--profile-dir", output_dir]
+    )
+    assert command == "verify-all", "Profiled command still runs"
+    assert path.isfile(
+        path.join(output_dir, "verify-all.tracemalloc.txt")
+    ), "Memory snapshot written"
+    assert not path.isfile(
+        path.join(output_dir, "verify-all.pstats")
+    ), "CPU not profiled for memory mode"
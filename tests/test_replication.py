@@ -0,0 +1,56 @@
+"""
+Tests for the catalog copies kept on devices
+"""
+import os
+import os.path as os_path
+import sqlite3
+import tempfile
+
+from logical_backup import db
+from logical_backup import replication
+from logical_backup.objects.device import Device
+
+# This is an auto-run fixture, so importing is sufficient
+# pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
+from tests.test_db import auto_clear_db
+
+
+def read_bytes(file_path: str) -> bytes:
+    """
+    Reads a whole file
+    """
+    with open(file_path, "rb") as read_file:
+        return read_file.read()
+
+
+def test_replicate_catalog():
+    """
+    .
+    """
+    db.initialize_database()
+    mount_point = tempfile.mkdtemp()
+    replica_path = os_path.join(mount_point, replication.REPLICA_NAME)
+    with sqlite3.connect(db.DEV_FILE) as connection:
+        (catalog_pages,) = connection.execute("PRAGMA page_count").fetchone()
+
+    assert replication.replicate_catalog(mount_point) == catalog_pages, "All copied"
+    assert read_bytes(replica_path) == read_bytes(db.DEV_FILE), "Replica matches"
+    assert replication.replicate_catalog(mount_point) == 0, "Nothing changed"
+
+    device = Device()
+    device.set("test", "/mnt", "User Specified", "test-id")
+    db.add_device(device)
+    written = replication.replicate_catalog(mount_point)
+    assert 0 < written < catalog_pages, "Only changed pages copied"
+    assert read_bytes(replica_path) == read_bytes(db.DEV_FILE), "Replica updated"
+    with sqlite3.connect(replica_path) as connection:
+        names = connection.execute("SELECT DeviceName FROM tblDevice").fetchall()
+    assert names == [("test",)], "Replica usable as a catalog"
+
+    # As if interrupted before the digests were written
+    os.remove(replica_path + replication.DIGEST_SUFFIX)
+    with open(replica_path, "r+b") as replica:
+        replica.write(b"torn")
+    assert replication.replicate_catalog(mount_point) == catalog_pages, "Rewritten"
+    assert read_bytes(replica_path) == read_bytes(db.DEV_FILE), "Replica repaired"
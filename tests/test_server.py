@@ -0,0 +1,95 @@
+"""
+Tests for the command daemon and its client
+"""
+import io
+import os
+import os.path as os_path
+import pwd
+import sys
+import tempfile
+import threading
+
+from logical_backup import client
+from logical_backup import db
+from logical_backup import server
+from logical_backup import utility
+from logical_backup.objects.device import Device
+
+# This is an auto-run fixture, so importing is sufficient
+# pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
+from tests.test_db import auto_clear_db
+
+
+def test_send_command(monkeypatch, capsys):
+    """
+    .
+    """
+    socket_path = os_path.join(tempfile.mkdtemp(), "daemon.sock")
+    assert client.send_command(["list-devices"], socket_path) is None, "No daemon"
+
+    db.initialize_database()
+    command_server = server.create_server(socket_path)
+    assert oct(os.stat(socket_path).st_mode & 0o777) == "0o600", "Owner only"
+    assert server.create_server(socket_path) is None, "Already listening"
+    assert "already listening" in capsys.readouterr().out, "Second daemon refused"
+
+    db.open_shared_connection()
+    thread = threading.Thread(target=command_server.serve_forever)
+    thread.start()
+    try:
+        assert client.send_command(["serve"], socket_path) is None, "Runs locally"
+
+        assert client.send_command(["list-devices"], socket_path) == 0, "Ran"
+        assert "None found, but OK" in capsys.readouterr().out, "Output relayed"
+
+        device = Device()
+        device.set("test", "/nonexistent", "Device Serial", "foo", 1)
+        assert db.add_device(device), "Missing device added"
+        monkeypatch.setattr(sys, "stdin", io.StringIO("n\n"))
+        assert client.send_command(["list-devices"], socket_path) == 3, "Declined"
+        assert "Proceed?" in capsys.readouterr().out, "Prompt relayed"
+
+        # Users created while the daemon runs are found by later commands
+        utility.clear_security_names()
+        monkeypatch.setattr(pwd, "getpwnam", lambda name: {}[name])
+        assert utility.get_user_id("created") is None, "User not found yet"
+        monkeypatch.setattr(
+            pwd,
+            "getpwnam",
+            lambda name: pwd.struct_passwd((name, "x", 1234, 0, "", "/", "/bin/sh")),
+        )
+        monkeypatch.setattr(sys, "stdin", io.StringIO("y\n"))
+        client.send_command(["list-devices"], socket_path)
+        assert utility.get_user_id("created") == 1234, "Miss forgotten"
+        utility.clear_security_names()
+
+        previous_directory = os.getcwd()
+        assert client.send_command(["add"], socket_path) == 1, "Invalid arguments"
+        assert "not valid" in capsys.readouterr().out, "Error relayed"
+        assert os.getcwd() == previous_directory, "Directory restored"
+    finally:
+        command_server.shutdown()
+        command_server.server_close()
+        thread.join()
+        db.close_shared_connection()
+
+    # Left behind, as when a daemon is killed
+    assert os_path.exists(socket_path), "Socket file remains"
+    command_server = server.create_server(socket_path)
+    assert command_server, "Stale socket replaced"
+    command_server.server_close()
+    os.remove(socket_path)
+
+
+def test_client_stream_readline():
+    """
+    .
+    """
+    socket_stream = io.BufferedRWPair(
+        io.BytesIO(b'{"input": "yes\\n"}\n'), io.BytesIO()
+    )
+    stream = server.ClientStream(socket_stream, False)
+    assert stream.readline(1) == "y", "Only as much as asked for"
+    assert stream.readline() == "es\n", "Rest of the line, without asking again"
+    assert stream.readline() == "", "Client gone"
@@ -2,6 +2,7 @@
 Tests for utility functions
 """
 from collections import namedtuple
+import errno
 import hashlib
 import os
 import os.path as os_path
@@ -233,6 +234,119 @@ def test_get_checksum(monkeypatch):
     assert output == "abc123", "Faux checksum should match"
 
 
+def test_copy_and_checksum():
+    """
+    .
+    """
+    directory = tempfile.mkdtemp()
+    source = os_path.join(directory, "source")
+    data = os.urandom(3000)
+    with open(source, "wb") as source_file:
+        source_file.write(data)
+
+    destination = os_path.join(directory, "destination")
+    checksum = utility.copy_and_checksum(source, destination, 1024)
+    assert checksum == hashlib.md5(data).hexdigest(), "Checksum matches source data"
+    with open(destination, "rb") as destination_file:
+        assert destination_file.read() == data, "Copy matches source data"
+
+
+def test_copy_to_all():
+    """
+    .
+    """
+    directory = tempfile.mkdtemp()
+    source = os_path.join(directory, "source")
+    data = os.urandom(10000)
+    with open(source, "wb") as source_file:
+        source_file.write(data)
+
+    destinations = [os_path.join(directory, name) for name in ["first", "second"]]
+    checksum = utility.copy_to_all(source, destinations, 4096)
+    assert checksum == hashlib.md5(data).hexdigest(), "Checksum of the data"
+    for destination in destinations:
+        with open(destination, "rb") as destination_file:
+            assert destination_file.read() == data, "Every destination copied"
+
+
+def test_io_modes(monkeypatch):
+    """
+    .
+    """
+    # Small enough for a few syncs, and a partial direct block at the end
+    monkeypatch.setattr(utility, "SYNC_SIZE", 4 * utility.DIRECT_ALIGNMENT)
+    directory = tempfile.mkdtemp()
+    source = os_path.join(directory, "source")
+    data = os.urandom(10 * utility.DIRECT_ALIGNMENT + 123)
+    with open(source, "wb") as source_file:
+        source_file.write(data)
+
+    try:
+        for mode in utility.IO_MODES:
+            assert utility.set_io_mode(mode) == mode, "Supported on Linux"
+            assert utility.checksum_file(source) == hashlib.md5(data).hexdigest()
+
+            copy = os_path.join(directory, mode)
+            utility.copy_file(source, copy)
+            assert (
+                utility.copy_and_checksum(source, copy + ".hashed")
+                == hashlib.md5(data).hexdigest()
+            ), "Checksum of the data"
+            utility.copy_to_all(source, [copy + ".first", copy + ".second"], 5000)
+            for suffix in ["", ".hashed", ".first", ".second"]:
+                with open(copy + suffix, "rb") as copy_file:
+                    assert copy_file.read() == data, mode + " copies match"
+
+            with utility.open_file(source) as source_file:
+                assert source_file.read(100) == data[:100], "Reads what is asked"
+                assert source_file.read(5000) == data[100:5100], "Reads on from it"
+
+        assert utility.checksum_file(os_path.join(directory, "missing")) is None
+    finally:
+        utility.set_io_mode("cached")
+        shutil.rmtree(directory)
+
+    monkeypatch.delattr(os, "O_DIRECT")
+    assert utility.set_io_mode("direct") == "fadvise", "Falls back without O_DIRECT"
+    monkeypatch.delattr(os, "posix_fadvise")
+    assert utility.set_io_mode("fadvise") == "cached", "Falls back without fadvise"
+    utility.set_io_mode("cached")
+
+
+def test_copy_file_metadata(monkeypatch):
+    """
+    .
+    """
+    directory = tempfile.mkdtemp()
+    source = os_path.join(directory, "source")
+    destination = os_path.join(directory, "destination")
+    Path(source).touch()
+    Path(destination).touch()
+    os.utime(source, ns=(1000000000, 2000000000))
+    os.setxattr(source, "user.test", b"value")
+
+    utility.copy_file_metadata(source, destination, False)
+    assert os.stat(destination).st_atime_ns == 1000000000, "Access time copied"
+    assert os.stat(destination).st_mtime_ns == 2000000000, "Modified time copied"
+    assert os.listxattr(destination) == [], "Attributes only copied if asked"
+
+    with open(source, "rb") as source_file, open(destination, "rb") as copy_file:
+        utility.copy_file_metadata(source_file.fileno(), copy_file.fileno())
+    assert os.getxattr(destination, "user.test") == b"value", "Attributes copied"
+    assert os.stat(destination).st_mtime_ns == 2000000000, "Copied by descriptor"
+
+    def refuse(*arguments):
+        """
+        Refuses to set an attribute, as for privileged namespaces
+        """
+        raise PermissionError(errno.EPERM, "Not permitted")
+
+    os.removexattr(destination, "user.test")
+    monkeypatch.setattr(os, "setxattr", refuse)
+    utility.copy_file_metadata(source, destination)
+    assert os.listxattr(destination) == [], "Attributes we cannot set are skipped"
+
+
 def test_create_backup_name(monkeypatch):
     """
     .
@@ -283,6 +397,7 @@ def test_get_file_security(monkeypatch, capsys):
         ),
     )
 
+    utility.clear_security_names()
     user = PwUID("/home/user", "user,,,,", 1000, "user", "x", "/usr/zsh", 1000)
     group = GrID("group", "x", 1000, [])
     monkeypatch.setattr(pwd, "getpwuid", lambda uid: user)
@@ -300,6 +415,55 @@ def test_get_file_security(monkeypatch, capsys):
     ), "Expected text was printed"
 
 
+def test_security_names(monkeypatch):
+    """
+    .
+    """
+    utility.clear_security_names()
+    user = PwUID("/home/user", "user,,,,", 1000, "user", "x", "/usr/zsh", 1000)
+    group = GrID("group", "x", 1000, [])
+    lookups = []
+
+    def lookup(found, key):
+        """
+        Records the lookup, finding only the known user or group
+        """
+        lookups.append(key)
+        if key not in (1000, "user", "group"):
+            raise KeyError(key)
+        return found
+
+    monkeypatch.setattr(pwd, "getpwuid", lambda uid: lookup(user, uid))
+    monkeypatch.setattr(pwd, "getpwnam", lambda name: lookup(user, name))
+    monkeypatch.setattr(grp, "getgrgid", lambda gid: lookup(group, gid))
+    monkeypatch.setattr(grp, "getgrnam", lambda name: lookup(group, name))
+
+    for _ in range(2):
+        assert utility.get_user_name(1000) == "user", "User name found"
+        assert utility.get_group_name(1000) == "group", "Group name found"
+        assert utility.get_user_id("user") == 1000, "User ID found"
+        assert utility.get_group_id("group") == 1000, "Group ID found"
+        assert utility.get_user_name(1001) is None, "Missing user not found"
+        assert utility.get_group_id("nobody") is None, "Missing group not found"
+        assert utility.get_user_id("1002") == 1002, "ID without a name kept"
+    assert len(lookups) == 7, "Each lookup made once, even if not found"
+
+    utility.clear_security_names(True)
+    assert utility.get_user_name(1000) == "user", "User name kept"
+    assert utility.get_user_name(1001) is None, "Missing user looked up again"
+    assert lookups[7:] == [1001], "Only misses forgotten"
+
+    utility.clear_security_names()
+    monkeypatch.setattr(pwd, "getpwall", lambda: [user])
+    monkeypatch.setattr(grp, "getgrall", lambda: [group])
+    utility.preload_security_names()
+    assert utility.get_user_name(1000) == "user", "Preloaded user name"
+    assert utility.get_user_id("user") == 1000, "Preloaded user ID"
+    assert utility.get_group_name(1000) == "group", "Preloaded group name"
+    assert utility.get_group_id("group") == 1000, "Preloaded group ID"
+    assert len(lookups) == 8, "No single lookups after preloading"
+
+
 def test_list_files():
     """
     .
@@ -0,0 +1,88 @@
+"""
+Tests for journaling changes with inotify
+"""
+import os
+import os.path as os_path
+import tempfile
+import threading
+import time
+
+from logical_backup import db
+from logical_backup import watcher
+
+# This is an auto-run fixture, so importing is sufficient
+# pylint: disable=unused-import
+from tests.fixtures import auto_set_testing
+from tests.test_db import auto_clear_db
+
+
+def wait_for(condition) -> bool:
+    """
+    Waits a few seconds for a condition to hold
+    """
+    deadline = time.monotonic() + 5
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+
+    return True
+
+
+def test_watch(monkeypatch):
+    """
+    .
+    """
+    monkeypatch.setattr(watcher, "FLUSH_INTERVAL", 0.05)
+    db.initialize_database()
+    folder_path = tempfile.mkdtemp()
+    os.mkdir(os_path.join(folder_path, "old"))
+    with open(os_path.join(folder_path, "kept"), "w") as kept_file:
+        kept_file.write("kept")
+
+    stop = threading.Event()
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(watcher.watch(folder_path, stop))
+    )
+    thread.start()
+    try:
+        assert wait_for(
+            lambda: folder_path in db.get_watched_folders()
+        ), "Watcher registered"
+        assert db.get_dirty_paths(folder_path)[1] == {
+            folder_path: True
+        }, "Everything is dirty when watching starts"
+        last_id = db.get_dirty_paths(folder_path)[0]
+        db.clear_dirty_paths(folder_path, last_id)
+
+        with open(os_path.join(folder_path, "new"), "w") as new_file:
+            new_file.write("new")
+        os.remove(os_path.join(folder_path, "kept"))
+        os.mkdir(os_path.join(folder_path, "sub"))
+        # Written after the new directory is watched, as any later change would be
+        assert wait_for(
+            lambda: os_path.join(folder_path, "sub")
+            in db.get_dirty_paths(folder_path)[1]
+        ), "New directory journaled"
+        with open(os_path.join(folder_path, "sub", "inner"), "w") as inner_file:
+            inner_file.write("inner")
+        os.rename(os_path.join(folder_path, "old"), os_path.join(folder_path, "moved"))
+
+        expected = {
+            os_path.join(folder_path, "new"): False,
+            os_path.join(folder_path, "kept"): False,
+            os_path.join(folder_path, "sub"): True,
+            os_path.join(folder_path, "sub", "inner"): False,
+            os_path.join(folder_path, "old"): True,
+            os_path.join(folder_path, "moved"): True,
+        }
+        assert wait_for(
+            lambda: db.get_dirty_paths(folder_path)[1] == expected
+        ), "Every change journaled"
+    finally:
+        stop.set()
+        thread.join()
+
+    assert results == [True], "Stopped as asked"
+    assert db.get_watched_folders() == {}, "Watcher record removed"